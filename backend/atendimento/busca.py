@@ -0,0 +1,66 @@
+"""
+Busca de mensagens - full-text no PostgreSQL, icontains no SQLite
+
+PostgreSQL:
+    mensagem        → tsvector 'portuguese' (coluna busca_vetor mantida por trigger, índice GIN)
+    nome/telefone   → fragmentos via pg_trgm (índices gin_trgm_ops no contato)
+    resultados anotados com 'rank' (SearchRank) para ?ordem=relevancia
+
+SQLite (testes/dev): mesmo comportamento do SearchFilter do DRF sobre search_fields.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework import filters
+
+CONFIG_BUSCA = 'portuguese'
+MIN_DIGITOS_TELEFONE = 3
+
+
+def busca_full_text_disponivel(queryset) -> bool:
+    return connections[queryset.db].vendor == 'postgresql'
+
+
+def _conversas_por_contato(termo: str):
+    """Conversas cujo contato casa com o fragmento de nome ou telefone (trigram)"""
+    from contato.models import Contato
+    from .models import Conversa
+
+    filtro = Q(nome__icontains=termo) | Q(nome__trigram_word_similar=termo)
+    digitos = re.sub(r'\D', '', termo)
+    if len(digitos) >= MIN_DIGITOS_TELEFONE:
+        filtro |= Q(telefone__contains=digitos)
+
+    return Conversa.objects.filter(contato__in=Contato.objects.filter(filtro)).values('pk')
+
+
+def buscar_interacoes(queryset, termo: str):
+    """
+    Filtra Interações pelo termo (full-text na mensagem + nome/telefone do contato)
+    e anota 'rank'. Só PostgreSQL.
+    """
+    query = SearchQuery(termo, config=CONFIG_BUSCA, search_type='websearch')
+    return queryset.filter(
+        Q(busca_vetor=query) | Q(conversa_id__in=_conversas_por_contato(termo))
+    ).annotate(
+        rank=SearchRank(F('busca_vetor'), query)
+    )
+
+
+class BuscaMensagensFilter(filters.SearchFilter):
+    """
+    SearchFilter com backend full-text no PostgreSQL
+    Mesmo parâmetro (?search=); fora do PostgreSQL cai no SearchFilter padrão
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if not busca_full_text_disponivel(queryset):
+            return super().filter_queryset(request, queryset, view)
+
+        termo = ' '.join(self.get_search_terms(request))
+        if not termo:
+            return queryset
+
+        return buscar_interacoes(queryset, termo)
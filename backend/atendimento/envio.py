@@ -0,0 +1,283 @@
+"""
+Despachante de envio para a Evolution API - um ponto de saída para todo envio
+
+Todo POST para a Evolution (painel, router do Message Translator, tarefas
+dos gatilhos, WhatsAppMediaSender) passa por requisitar():
+
+    - Conexões keep-alive: uma requests.Session com pool por processo.
+    - Token bucket por instância no Redis (script Lua atômico): no máximo
+      ENVIO_RAJADA mensagens seguidas e ENVIO_TAXA_POR_SEGUNDO sustentadas,
+      somando todos os workers - o número não é bloqueado pelo WhatsApp.
+    - Prioridade: envios automáticos só levam um token se sobrarem
+      ENVIO_RESERVA_OPERADOR no balde; a reserva fica para o operador, que
+      responde na frente mesmo com uma campanha de gatilhos em andamento.
+
+Quem chama de forma síncrona (view do operador) espera o token até
+ENVIO_ESPERA_MAX_SEGUNDOS; as tarefas Celery pedem bloquear=False e se
+reagendam com o tempo devolvido em EnvioAdiado, sem prender o worker.
+
+Redis fora do ar: cai para um balde local por processo (mesma taxa) e tenta
+o Redis de novo depois de PAUSA_FALHA_SEGUNDOS.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PRIORIDADE_OPERADOR = 'operador'
+PRIORIDADE_AUTOMATICA = 'automatica'
+PAUSA_FALHA_SEGUNDOS = 30
+
+# KEYS: balde | ARGV: taxa (tokens/s), rajada, reserva
+# Retorna 0 se consumiu um token, senão os ms até haver token acima da reserva
+LUA_TOKEN_BUCKET = """
+local agora = redis.call('TIME')
+local ms = tonumber(agora[1]) * 1000 + math.floor(tonumber(agora[2]) / 1000)
+local taxa = tonumber(ARGV[1])
+local rajada = tonumber(ARGV[2])
+local minimo = tonumber(ARGV[3]) + 1
+local estado = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(estado[1]) or rajada
+local ts = tonumber(estado[2]) or ms
+tokens = math.min(rajada, tokens + math.max(0, ms - ts) * taxa / 1000)
+local espera = 0
+if tokens >= minimo then
+    tokens = tokens - 1
+else
+    espera = math.ceil((minimo - tokens) * 1000 / taxa)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', ms)
+redis.call('PEXPIRE', KEYS[1], math.ceil(rajada * 1000 / taxa) + 1000)
+return espera
+"""
+
+_lock = threading.Lock()
+_recursos = {'pid': None, 'sessao': None, 'script': None, 'pausa_ate': 0.0, 'baldes': {}}
+
+
+class EnvioAdiado(Exception):
+    """Sem token para a instância agora; espera = segundos até o próximo"""
+
+    def __init__(self, instancia: str, espera: float):
+        super().__init__(f"Limite de envio da instância {instancia}: tentar em {espera:.1f}s")
+        self.instancia = instancia
+        self.espera = espera
+
+
+def _recursos_do_processo() -> Dict:
+    """Sessão HTTP e cliente Redis por processo (workers fazem fork depois do import)"""
+    pid = os.getpid()
+    if _recursos['pid'] != pid:
+        with _lock:
+            if _recursos['pid'] != pid:
+                sessao = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=settings.ENVIO_POOL_CONEXOES,
+                    pool_maxsize=settings.ENVIO_POOL_CONEXOES,
+                )
+                sessao.mount('http://', adapter)
+                sessao.mount('https://', adapter)
+
+                cliente = redis.Redis.from_url(
+                    settings.ENVIO_REDIS_URL, socket_timeout=1, socket_connect_timeout=1
+                )
+                _recursos['sessao'] = sessao
+                _recursos['script'] = cliente.register_script(LUA_TOKEN_BUCKET)
+                _recursos['pausa_ate'] = 0.0
+                _recursos['baldes'] = {}
+                _recursos['pid'] = pid
+    return _recursos
+
+
+def get_sessao() -> requests.Session:
+    """Sessão HTTP compartilhada com a Evolution (conexões keep-alive reaproveitadas)"""
+    return _recursos_do_processo()['sessao']
+
+
+# ===== TOKEN BUCKET =====
+
+def _reserva(prioridade: str) -> int:
+    return 0 if prioridade == PRIORIDADE_OPERADOR else settings.ENVIO_RESERVA_OPERADOR
+
+
+def _consumir_local(instancia: str, reserva: int) -> float:
+    """Mesmo algoritmo do script Lua, em memória (Redis indisponível)"""
+    taxa = settings.ENVIO_TAXA_POR_SEGUNDO
+    rajada = settings.ENVIO_RAJADA
+    agora = time.monotonic()
+    with _lock:
+        tokens, ts = _recursos['baldes'].get(instancia, (rajada, agora))
+        tokens = min(rajada, tokens + (agora - ts) * taxa)
+        espera = 0.0
+        if tokens >= reserva + 1:
+            tokens -= 1
+        else:
+            espera = (reserva + 1 - tokens) / taxa
+        _recursos['baldes'][instancia] = (tokens, agora)
+    return espera
+
+
+def consumir_token(instancia: str, prioridade: str = PRIORIDADE_OPERADOR) -> float:
+    """
+    Tenta tirar um token do balde da instância
+
+    Returns:
+        float: 0 se pode enviar agora, senão segundos até haver token
+    """
+    recursos = _recursos_do_processo()
+    reserva = _reserva(prioridade)
+    if time.monotonic() >= recursos['pausa_ate']:
+        try:
+            espera_ms = recursos['script'](
+                keys=[f"envio:balde:{instancia}"],
+                args=[settings.ENVIO_TAXA_POR_SEGUNDO, settings.ENVIO_RAJADA, reserva],
+            )
+            return int(espera_ms) / 1000
+        except redis.RedisError as e:
+            recursos['pausa_ate'] = time.monotonic() + PAUSA_FALHA_SEGUNDOS
+            logger.warning(f"⚠️ [Envio] Redis indisponível, limite local por {PAUSA_FALHA_SEGUNDOS}s: {e}")
+    return _consumir_local(instancia, reserva)
+
+
+def aguardar_token(instancia: str, prioridade: str = PRIORIDADE_OPERADOR, bloquear: bool = True):
+    """
+    Garante um token antes do envio
+
+    bloquear=True espera (dormindo) até ENVIO_ESPERA_MAX_SEGUNDOS no total;
+    passou disso, ou bloquear=False, levanta EnvioAdiado com o tempo restante.
+    """
+    limite = time.monotonic() + settings.ENVIO_ESPERA_MAX_SEGUNDOS
+    while True:
+        espera = consumir_token(instancia, prioridade)
+        if espera <= 0:
+            return
+        if not bloquear or time.monotonic() + espera > limite:
+            raise EnvioAdiado(instancia, espera)
+        time.sleep(espera)
+
+
+# ===== REQUISIÇÃO =====
+
+def requisitar(config: Dict, caminho: str, payload: Optional[Dict] = None, prioridade: str = PRIORIDADE_OPERADOR,
+               timeout: float = 15, bloquear: bool = True, corpo=None, content_type: str = 'application/json') -> requests.Response:
+    """
+    POST {url}{caminho}/{instance_name} na Evolution, respeitando o limite da instância
+
+    Args:
+        config: url, api_key e instance_name (formato de get_instance_config)
+        caminho: endpoint sem a instância, ex. '/message/sendText'
+        payload: corpo JSON
+        prioridade: PRIORIDADE_OPERADOR ou PRIORIDADE_AUTOMATICA
+        corpo: corpo já serializado no lugar do payload (bytes ou iterável com
+               __len__, enviado em streaming com Content-Length - ver media_sender)
+        content_type: Content-Type do corpo
+
+    Raises:
+        EnvioAdiado: sem token dentro do tempo de espera permitido
+        requests.RequestException: falha de rede (status HTTP fica a cargo de quem chama)
+    """
+    instancia = config['instance_name']
+    aguardar_token(instancia, prioridade, bloquear)
+
+    url = f"{config['url'].rstrip('/')}{caminho}/{instancia}"
+    headers = {
+        'apikey': config['api_key'],
+        'Content-Type': content_type
+    }
+    if corpo is not None:
+        return get_sessao().post(url, data=corpo, headers=headers, timeout=timeout)
+    return get_sessao().post(url, json=payload, headers=headers, timeout=timeout)
+
+
+def config_do_canal(canal) -> Optional[Dict]:
+    """Credenciais de um CanalConfig Evolution no formato de requisitar() (None se incompletas)"""
+    credenciais = canal.credenciais or {}
+    config = {
+        'url': credenciais.get('base_url'),
+        'api_key': credenciais.get('api_key'),
+        'instance_name': credenciais.get('instance'),
+    }
+    return config if all(config.values()) else None
+
+
+# ===== STATUS DE ENTREGA =====
+
+# Status da Evolution/Baileys (nome no v2, número no v1) → Interacao.status_entrega
+STATUS_EVOLUTION = {
+    'ERROR': 'falhou', 0: 'falhou',
+    'PENDING': 'pendente', 1: 'pendente',
+    'SERVER_ACK': 'enviada', 2: 'enviada',
+    'DELIVERY_ACK': 'entregue', 3: 'entregue',
+    'READ': 'lida', 4: 'lida',
+    'PLAYED': 'lida', 5: 'lida',
+}
+ORDEM_ENTREGA = ['pendente', 'enviada', 'entregue', 'lida']
+
+
+def extrair_status_evolution(data) -> list:
+    """
+    Pares (whatsapp_id, status_entrega) de um evento messages.update
+
+    Aceita o formato do v2 ({"keyId", "status": "READ"}) e o do v1
+    ({"key": {"id"}, "update": {"status": 4}}), avulso ou em lista.
+    """
+    itens = data if isinstance(data, list) else [data or {}]
+    pares = []
+    for item in itens:
+        whatsapp_id = item.get('keyId') or (item.get('key') or {}).get('id')
+        status_bruto = item.get('status', (item.get('update') or {}).get('status'))
+        status = STATUS_EVOLUTION.get(status_bruto)
+        if whatsapp_id and status:
+            pares.append((whatsapp_id, status))
+    return pares
+
+
+def registrar_status_entrega(whatsapp_id: str, status: str) -> int:
+    """
+    Grava o status de entrega das Interações com esse whatsapp_id
+
+    O status só avança (confirmações chegam fora de ordem: 'lida' antes de
+    'entregue' não regride); 'falhou' só vale antes da entrega. Cada Interação
+    atualizada vira um evento 'entrega' no inbox em tempo real.
+
+    Returns:
+        int: Interações atualizadas
+    """
+    from django.db.models import Q
+    from django.utils import timezone
+    from .models import Interacao
+    from .tempo_real import publicar_apos_commit
+
+    if status == 'falhou':
+        anteriores = ORDEM_ENTREGA[:2]
+    else:
+        anteriores = ORDEM_ENTREGA[:ORDEM_ENTREGA.index(status)]
+
+    # Sem status: mensagem enviada pelo celular (eco fromMe); as do cliente nunca recebem
+    atualizaveis = Interacao.objects.filter(whatsapp_id=whatsapp_id).filter(
+        Q(status_entrega__in=anteriores) | (Q(status_entrega__isnull=True) & ~Q(remetente='cliente'))
+    )
+    alvos = list(atualizaveis.values_list('pk', 'conversa_id'))
+    if not alvos:
+        return 0
+
+    agora = timezone.now()
+    atualizadas = atualizaveis.filter(pk__in=[pk for pk, _ in alvos]).update(
+        status_entrega=status, status_entrega_em=agora
+    )
+    for pk, conversa_id in alvos:
+        publicar_apos_commit(conversa_id, 'entrega', {
+            'conversa_id': conversa_id,
+            'interacao_id': pk,
+            'status_entrega': status,
+            'status_entrega_em': agora,
+        })
+    return atualizadas
@@ -14,6 +14,7 @@ from django.utils import timezone
 from django.conf import settings
 from core.ffmpeg_service import FFmpegService
 from core.whatsapp_decrypt import WhatsAppDecryption
+from . import media_store
 
 logger = logging.getLogger(__name__)
 
@@ -67,18 +68,25 @@ class WhatsAppMediaProcessor:
             logger.info(f"🔄 Processando {tipo_mensagem} - URL: {'SIM' if media_url else 'NÃO'}, "
                        f"MediaKey: {'SIM' if media_key else 'NÃO'}, Base64: {'SIM' if base64_data else 'NÃO'}")
             
+            # ♻️ Mesmo arquivo já recebido antes (encaminhamentos, figurinhas):
+            # nada de download, descriptografia ou conversão
+            chave = media_store.chave_criptografado(file_enc_sha256)
+            existente = media_store.buscar(chave)
+            if existente:
+                return existente
+            
             # Estratégia 1: Processar de URL (preferencial para arquivos criptografados)
             if media_url:
                 result = WhatsAppMediaProcessor._process_from_url(
                     media_url, tipo_mensagem, media_key, file_enc_sha256, mimetype
                 )
                 if result['success']:
-                    return result
+                    return media_store.registrar(chave, tipo_mensagem, result)
             
             # Estratégia 2: Processar de base64 (fallback)
             if base64_data:
                 result = WhatsAppMediaProcessor._process_from_base64(
-                    base64_data, tipo_mensagem, media_key, mimetype
+                    base64_data, tipo_mensagem, media_key, mimetype, chave
                 )
                 if result['success']:
                     return result
@@ -136,8 +144,8 @@ class WhatsAppMediaProcessor:
             return result
     
     @staticmethod
-    def _process_from_base64(base64_data, tipo_mensagem, media_key, mimetype):
-        """Processa mídia a partir de dados base64"""
+    def _process_from_base64(base64_data, tipo_mensagem, media_key, mimetype, chave=None):
+        """Processa mídia a partir de dados base64 (chave: índice do media_store)"""
         result = {
             'success': False,
             'media_local_path': None,
@@ -154,18 +162,24 @@ class WhatsAppMediaProcessor:
             
             logger.info(f"📦 Dados base64 decodificados: {len(file_data)} bytes")
             
+            # Sem fileEncSha256: indexar pelo conteúdo recebido
+            if not chave:
+                chave = media_store.chave_conteudo(file_data)
+                existente = media_store.buscar(chave)
+                if existente:
+                    return existente
+            
             # Verificar se precisa descriptografar
             if media_key and WhatsAppMediaProcessor._is_encrypted_data(file_data, tipo_mensagem):
                 logger.info("🔓 Aplicando descriptografia aos dados base64...")
                 
                 media_type = 'audio' if tipo_mensagem == 'audio' else 'image'
-                decrypted_data = WhatsAppDecryption.decrypt_media(file_data, str(media_key), media_type)
-                
-                if decrypted_data:
-                    file_data = decrypted_data
+                try:
+                    # MAC conferido antes: dados que não estavam criptografados não viram lixo
+                    file_data = WhatsAppDecryption.verificar_e_descriptografar(file_data, str(media_key), media_type)
                     logger.info(f"✅ Dados descriptografados: {len(file_data)} bytes")
-                else:
-                    logger.warning("⚠️ Descriptografia falhou, usando dados originais")
+                except ValueError as e:
+                    logger.warning(f"⚠️ Descriptografia falhou ({e}), usando dados originais")
             
             # Para áudios, aplicar conversão FFmpeg
             if tipo_mensagem == 'audio':
@@ -179,6 +193,7 @@ class WhatsAppMediaProcessor:
             
             if save_result['success']:
                 result.update(save_result)
+                result = media_store.registrar(chave, tipo_mensagem, result)
             else:
                 result['error'] = save_result['error']
             
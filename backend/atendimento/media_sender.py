@@ -1,18 +1,112 @@
 """
 Serviço para envio de mídias via WhatsApp
 Base estrutural para futuro desenvolvimento
+
+Modos de envio (MIDIA_ENVIO_MODO), sem carregar o arquivo inteiro na memória:
+    - 'url': link assinado de vida curta (MIDIA_URL_ASSINADA_SEGUNDOS) que a
+      própria Evolution baixa; o arquivo sai pelo FileResponse (sendfile).
+      Precisa de MIDIA_URL_PUBLICA e de arquivo no storage ('/media/...').
+    - 'multipart': o arquivo vai em streaming no corpo multipart/form-data.
+    - 'base64': o JSON é gerado em blocos, com o base64 codificado
+      incrementalmente sobre um mmap do arquivo.
+Sem URL pública o modo 'url' vira 'multipart'; Evolution que não aceita
+multipart (v1) responde 400/404/415 e o envio é refeito em base64.
 """
 
+import io
+import json
+import mmap
 import os
 import mimetypes
 import base64
+import uuid
 from django.conf import settings
+from django.core import signing
 from django.core.files.storage import default_storage
-import requests
+from django.urls import reverse
 import logging
 
+from .envio import PRIORIDADE_OPERADOR, requisitar
+
 logger = logging.getLogger(__name__)
 
+SALT_URL_ASSINADA = 'atendimento.midia-envio'
+# Múltiplo de 3: cada bloco vira base64 sem padding no meio do corpo
+TAMANHO_BLOCO = 3 * 64 * 1024
+STATUS_SEM_MULTIPART = (400, 404, 415)
+
+
+def url_assinada(nome_storage):
+    """URL absoluta e temporária para a Evolution baixar um arquivo do storage"""
+    token = signing.dumps(nome_storage, salt=SALT_URL_ASSINADA)
+    return f"{settings.MIDIA_URL_PUBLICA.rstrip('/')}{reverse('contatos:midia_assinada', args=[token])}"
+
+
+def nome_da_url_assinada(token):
+    """Nome do arquivo no storage, ou None se a assinatura é inválida ou expirou"""
+    try:
+        return signing.loads(token, salt=SALT_URL_ASSINADA, max_age=settings.MIDIA_URL_ASSINADA_SEGUNDOS)
+    except signing.BadSignature:
+        return None
+
+
+class _CorpoStream:
+    """
+    Corpo de requisição gerado em blocos: prefixo, miolo (gerador) e sufixo
+    Com __len__ o requests manda Content-Length (sem chunked) e itera os blocos.
+    """
+
+    def __init__(self, prefixo, gerar_miolo, tamanho_miolo, sufixo):
+        self.prefixo = prefixo
+        self.gerar_miolo = gerar_miolo
+        self.tamanho_miolo = tamanho_miolo
+        self.sufixo = sufixo
+
+    def __len__(self):
+        return len(self.prefixo) + self.tamanho_miolo + len(self.sufixo)
+
+    def __iter__(self):
+        yield self.prefixo
+        yield from self.gerar_miolo()
+        yield self.sufixo
+
+
+def _blocos_arquivo(arquivo):
+    arquivo.seek(0)
+    while True:
+        bloco = arquivo.read(TAMANHO_BLOCO)
+        if not bloco:
+            return
+        yield bloco
+
+
+def _blocos_base64(arquivo, tamanho):
+    """base64 incremental: um bloco por vez, lido direto do mmap quando o arquivo é local"""
+    try:
+        fileno = arquivo.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        fileno = None
+
+    if fileno is not None:
+        with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapa, memoryview(mapa) as visao:
+            for inicio in range(0, tamanho, TAMANHO_BLOCO):
+                yield base64.b64encode(visao[inicio:inicio + TAMANHO_BLOCO])
+        return
+
+    # Storage sem arquivo local: read() pode devolver menos que o pedido, guarda a sobra
+    resto = b''
+    for bloco in _blocos_arquivo(arquivo):
+        bloco = resto + bloco
+        corte = len(bloco) - len(bloco) % 3
+        yield base64.b64encode(bloco[:corte])
+        resto = bloco[corte:]
+    if resto:
+        yield base64.b64encode(resto)
+
+
+def _tamanho_base64(tamanho):
+    return 4 * ((tamanho + 2) // 3)
+
 class WhatsAppMediaSender:
     """
     Serviço para envio de mídias via API do WhatsApp.
@@ -26,7 +120,7 @@ class WhatsAppMediaSender:
         from atendimento.utils import get_instance_config
         self.config = get_instance_config()
         self.api_key = self.config.get('api_key')
-        self.base_url = self.config.get('base_url', '').rstrip('/')
+        self.base_url = (self.config.get('url') or '').rstrip('/')
         
     def send_text_message(self, phone_number, message_text):
         """
@@ -100,33 +194,35 @@ class WhatsAppMediaSender:
                     'error': 'Arquivo de mídia não encontrado'
                 }
             
-            # Preparar dados da mídia
+            # Metadados da mídia (o conteúdo só é lido durante o envio)
             media_data = self._prepare_media_data(media_path, media_type)
             if not media_data['success']:
                 return media_data
             
-            # Definir endpoint baseado no tipo
-            endpoint_map = {
-                'imagem': '/message/sendMedia',
-                'audio': '/message/sendMedia', 
-                'documento': '/message/sendMedia'
-            }
-            
-            endpoint = endpoint_map.get(media_type, '/message/sendMedia')
-            
-            # Preparar payload
-            payload = {
+            # Campos comuns aos três modos
+            campos = {
                 "number": phone_number,
                 "mediatype": self._convert_media_type(media_type),
-                "media": media_data['base64'],
+                "mimetype": media_data['mimetype'],
                 "fileName": media_data['filename']
             }
             
             if caption and media_type in ['imagem', 'documento']:
-                payload['caption'] = caption
+                campos['caption'] = caption
+            
+            modo = settings.MIDIA_ENVIO_MODO
+            if modo == 'url' and not (settings.MIDIA_URL_PUBLICA and media_data['nome_storage']):
+                modo = 'multipart'
+            logger.info(f"📦 {media_data['filename']} ({media_data['size']} bytes) - modo {modo}")
             
             # Fazer requisição
-            response = self._make_api_request(endpoint, payload)
+            if modo == 'url':
+                payload = dict(campos, media=url_assinada(media_data['nome_storage']))
+                response = self._make_api_request('/message/sendMedia', payload)
+            elif modo == 'multipart':
+                response = self._send_multipart(media_path, media_data, campos)
+            else:
+                response = self._send_base64(media_path, media_data, campos)
             
             if response and response.get('key'):
                 logger.info(f"✅ {media_type.capitalize()} enviado com sucesso")
@@ -149,6 +245,46 @@ class WhatsAppMediaSender:
                 'error': str(e)
             }
     
+    def _send_multipart(self, media_path, media_data, campos):
+        """Arquivo em streaming no corpo multipart; Evolution sem suporte → base64"""
+        fronteira = uuid.uuid4().hex
+        prefixo = ''.join(
+            f'--{fronteira}\r\nContent-Disposition: form-data; name="{nome}"\r\n\r\n{valor}\r\n'
+            for nome, valor in campos.items()
+        )
+        nome_arquivo = media_data['filename'].replace('"', '%22')
+        prefixo += (
+            f'--{fronteira}\r\nContent-Disposition: form-data; name="file"; filename="{nome_arquivo}"\r\n'
+            f'Content-Type: {media_data["mimetype"]}\r\n\r\n'
+        )
+        sufixo = f'\r\n--{fronteira}--\r\n'.encode()
+        
+        with self._open_media(media_path) as arquivo:
+            corpo = _CorpoStream(prefixo.encode(), lambda: _blocos_arquivo(arquivo), media_data['size'], sufixo)
+            try:
+                response = self._post('/message/sendMedia', corpo=corpo,
+                                      content_type=f'multipart/form-data; boundary={fronteira}')
+            except Exception as e:
+                logger.error(f"❌ Erro na requisição: {e}")
+                return None
+        
+        if response.status_code in STATUS_SEM_MULTIPART:
+            logger.warning(f"⚠️ Multipart recusado (HTTP {response.status_code}), reenviando em base64")
+            return self._send_base64(media_path, media_data, campos)
+        return self._parse_response(response)
+    
+    def _send_base64(self, media_path, media_data, campos):
+        """JSON com a mídia em base64, gerado em blocos (nunca a string inteira na memória)"""
+        prefixo = json.dumps(campos)[:-1] + ', "media": "'
+        with self._open_media(media_path) as arquivo:
+            corpo = _CorpoStream(
+                prefixo.encode(),
+                lambda: _blocos_base64(arquivo, media_data['size']),
+                _tamanho_base64(media_data['size']),
+                b'"}',
+            )
+            return self._make_api_request('/message/sendMedia', corpo=corpo)
+    
     def _media_file_exists(self, media_path):
         """Verifica se o arquivo de mídia existe"""
         try:
@@ -162,32 +298,39 @@ class WhatsAppMediaSender:
         except:
             return False
     
+    def _open_media(self, media_path):
+        """Arquivo binário da mídia (storage do Django para '/media/...', senão caminho absoluto)"""
+        if media_path.startswith('/media/'):
+            return default_storage.open(media_path.replace('/media/', ''), 'rb')
+        return open(media_path, 'rb')
+    
     def _prepare_media_data(self, media_path, media_type):
-        """Prepara dados de mídia para envio"""
+        """Metadados da mídia para envio (sem ler o conteúdo)"""
         try:
-            # Ler arquivo
             if media_path.startswith('/media/'):
-                file_path = media_path.replace('/media/', '')
-                with default_storage.open(file_path, 'rb') as f:
-                    file_data = f.read()
-                filename = os.path.basename(file_path)
+                nome_storage = media_path.replace('/media/', '')
+                size = default_storage.size(nome_storage)
             else:
-                with open(media_path, 'rb') as f:
-                    file_data = f.read()
-                filename = os.path.basename(media_path)
+                nome_storage = None
+                size = os.path.getsize(media_path)
+            
+            if not size:
+                return {
+                    'success': False,
+                    'error': 'Arquivo de mídia vazio'
+                }
             
-            # Converter para base64
-            base64_data = base64.b64encode(file_data).decode('utf-8')
+            filename = os.path.basename(media_path)
             
             # Verificar mimetype
             mimetype, _ = mimetypes.guess_type(filename)
             
             return {
                 'success': True,
-                'base64': base64_data,
+                'nome_storage': nome_storage,
                 'filename': filename,
-                'mimetype': mimetype,
-                'size': len(file_data)
+                'mimetype': mimetype or 'application/octet-stream',
+                'size': size
             }
             
         except Exception as e:
@@ -206,28 +349,25 @@ class WhatsAppMediaSender:
         }
         return type_map.get(media_type, media_type)
     
-    def _make_api_request(self, endpoint, payload):
+    def _post(self, endpoint, payload=None, prioridade=PRIORIDADE_OPERADOR, **kwargs):
+        """POST pelo despachante atendimento.envio (limite por instância e keep-alive)"""
+        if not self.api_key or not self.base_url:
+            raise ValueError("Configuração da API não disponível")
+        
+        logger.info(f"🌐 Fazendo requisição para: {self.base_url}{endpoint}")
+        
+        return requisitar(self.config, endpoint, payload, prioridade, timeout=30, **kwargs)
+    
+    def _parse_response(self, response):
+        if response.status_code in (200, 201):
+            return response.json()
+        logger.error(f"❌ Erro HTTP {response.status_code}: {response.text}")
+        return None
+    
+    def _make_api_request(self, endpoint, payload=None, prioridade=PRIORIDADE_OPERADOR, **kwargs):
         """Faz requisição para a API do WhatsApp"""
         try:
-            if not self.api_key or not self.base_url:
-                raise ValueError("Configuração da API não disponível")
-            
-            url = f"{self.base_url}{endpoint}"
-            headers = {
-                'apikey': self.api_key,
-                'Content-Type': 'application/json'
-            }
-            
-            logger.info(f"🌐 Fazendo requisição para: {url}")
-            
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                logger.error(f"❌ Erro HTTP {response.status_code}: {response.text}")
-                return None
-                
+            return self._parse_response(self._post(endpoint, payload, prioridade, **kwargs))
         except Exception as e:
             logger.error(f"❌ Erro na requisição: {e}")
             return None
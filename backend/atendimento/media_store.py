@@ -0,0 +1,207 @@
+"""
+Store content-addressed das mídias do WhatsApp (ver MidiaArmazenada)
+
+buscar() devolve um resultado no mesmo formato do WhatsAppMediaProcessor
+quando o conteúdo já foi salvo antes; registrar() indexa um arquivo novo.
+Cada uso incrementa MidiaArmazenada.referencias e a exclusão de uma
+Interação decrementa (signals.py); limpar_midias_orfas remove o resto.
+
+Base64 inline aguardando o worker de mídia: o payload da Evolution pode
+trazer a mídia inteira em base64. Ela fica no storage (não vai pelo broker)
+até a fila 'media' processar; limpar_pendentes_antigos remove o que sobrou
+de tarefas que nunca rodaram.
+"""
+import base64
+import binascii
+import hashlib
+import logging
+from datetime import timedelta
+from typing import Dict, Optional
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Interacao, MidiaArmazenada
+
+logger = logging.getLogger(__name__)
+
+
+def chave_criptografado(file_enc_sha256) -> Optional[str]:
+    """Chave a partir do fileEncSha256 do payload (base64 ou hex)"""
+    if not file_enc_sha256 or not isinstance(file_enc_sha256, str):
+        return None
+
+    valor = file_enc_sha256.strip()
+    if len(valor) == 64:
+        try:
+            int(valor, 16)
+            return f"enc:{valor.lower()}"
+        except ValueError:
+            pass
+
+    try:
+        digest = base64.b64decode(valor, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
+    if len(digest) != 32:
+        return None
+    return f"enc:{digest.hex()}"
+
+
+def chave_conteudo(dados: bytes) -> str:
+    """Chave a partir do conteúdo já descriptografado"""
+    return f"raw:{hashlib.sha256(dados).hexdigest()}"
+
+
+def _nome_no_storage(media_url: str) -> str:
+    return unquote(media_url[len(settings.MEDIA_URL):] if media_url.startswith(settings.MEDIA_URL) else media_url)
+
+
+def _resultado(midia: MidiaArmazenada) -> Dict:
+    return {
+        'success': True,
+        'media_local_path': midia.media_url,
+        'filename': midia.filename,
+        'size': midia.tamanho,
+        'duration': None,
+        'error': None,
+        'conversion_applied': False,
+        'reaproveitada': True,
+    }
+
+
+def buscar(chave: Optional[str]) -> Optional[Dict]:
+    """
+    Resultado pronto se o conteúdo já está no store (conta uma referência)
+    """
+    if not chave:
+        return None
+
+    midia = MidiaArmazenada.objects.filter(chave=chave).first()
+    if not midia:
+        return None
+
+    # Arquivo sumiu do storage: esquecer o índice e processar de novo
+    if not default_storage.exists(_nome_no_storage(midia.media_url)):
+        logger.warning(f"⚠️ [MediaStore] Arquivo de {chave} não existe mais, reprocessando")
+        midia.delete()
+        return None
+
+    MidiaArmazenada.objects.filter(pk=midia.pk).update(referencias=F('referencias') + 1)
+    logger.info(f"♻️ [MediaStore] Mídia reaproveitada: {midia.filename} ({chave[:16]}...)")
+
+    return _resultado(midia)
+
+
+def registrar(chave: Optional[str], tipo: str, result: Dict) -> Dict:
+    """
+    Indexa um arquivo recém-processado
+
+    Se outro worker registrou o mesmo conteúdo ao mesmo tempo, o arquivo
+    duplicado é apagado e o resultado passa a apontar para o existente.
+    """
+    if not chave or not result.get('success') or not result.get('media_local_path'):
+        return result
+
+    midia, criada = MidiaArmazenada.objects.get_or_create(
+        chave=chave,
+        defaults={
+            'tipo': tipo,
+            'media_url': result['media_local_path'],
+            'filename': result.get('filename') or '',
+            'tamanho': result.get('size'),
+            'referencias': 1,
+        }
+    )
+
+    if criada:
+        return result
+
+    if midia.media_url != result['media_local_path']:
+        try:
+            default_storage.delete(_nome_no_storage(result['media_local_path']))
+        except Exception as e:
+            logger.warning(f"⚠️ [MediaStore] Erro ao apagar duplicata: {e}")
+
+    MidiaArmazenada.objects.filter(pk=midia.pk).update(referencias=F('referencias') + 1)
+    return _resultado(midia)
+
+
+def liberar(media_url: Optional[str]):
+    """Uma Interação deixou de apontar para o arquivo"""
+    if not media_url:
+        return
+    MidiaArmazenada.objects.filter(media_url=media_url, referencias__gt=0).update(
+        referencias=F('referencias') - 1
+    )
+
+
+def limpar_midias_orfas() -> int:
+    """
+    Remove arquivos sem referências (com folga de MIDIA_GC_IDADE_HORAS para
+    mídias que ainda vão ganhar a Interação)
+    """
+    limite = timezone.now() - timedelta(hours=settings.MIDIA_GC_IDADE_HORAS)
+    removidas = 0
+
+    for midia in MidiaArmazenada.objects.filter(referencias=0, criado_em__lt=limite).iterator():
+        # Contador é só um atalho: nunca apagar arquivo ainda usado
+        if Interacao.objects.filter(media_url=midia.media_url).exists():
+            continue
+        try:
+            default_storage.delete(_nome_no_storage(midia.media_url))
+        except Exception as e:
+            logger.warning(f"⚠️ [MediaStore] Erro ao apagar {midia.media_url}: {e}")
+            continue
+        midia.delete()
+        removidas += 1
+
+    return removidas
+
+
+# ===== BASE64 INLINE AGUARDANDO O WORKER DE MÍDIA =====
+
+PENDENTES_DIR = 'whatsapp_media/pendentes'
+
+
+def guardar_base64_pendente(interacao_id, base64_data: str) -> str:
+    """Base64 que veio no payload, guardado como está até a fila 'media' processar (não vai pelo broker)"""
+    return default_storage.save(f"{PENDENTES_DIR}/{interacao_id}.b64", ContentFile(base64_data.encode('ascii')))
+
+
+def ler_base64_pendente(nome: str) -> str:
+    with default_storage.open(nome, 'rb') as arquivo:
+        return arquivo.read().decode('ascii')
+
+
+def apagar_pendente(nome: Optional[str]):
+    if not nome:
+        return
+    try:
+        default_storage.delete(nome)
+    except Exception as e:
+        logger.warning(f"⚠️ [MediaStore] Erro ao apagar {nome}: {e}")
+
+
+def limpar_pendentes_antigos(limite) -> int:
+    """Base64 pendente gravado antes de `limite` cuja tarefa nunca rodou"""
+    try:
+        _, arquivos = default_storage.listdir(PENDENTES_DIR)
+    except (FileNotFoundError, NotImplementedError):
+        return 0
+
+    removidos = 0
+    for arquivo in arquivos:
+        nome = f"{PENDENTES_DIR}/{arquivo}"
+        try:
+            if default_storage.get_modified_time(nome) < limite:
+                default_storage.delete(nome)
+                removidos += 1
+        except Exception as e:
+            logger.warning(f"⚠️ [MediaStore] Erro ao limpar {nome}: {e}")
+    return removidos
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atendimento', '0008_conversa_atendimento_humano_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='interacao',
+            name='media_status',
+            field=models.CharField(blank=True, choices=[('pendente', 'Pendente'), ('processada', 'Processada'), ('erro', 'Erro')], help_text='Processamento da mídia no worker (vazio = síncrono)', max_length=15, null=True),
+        ),
+    ]
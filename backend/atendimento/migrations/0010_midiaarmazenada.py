@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atendimento', '0009_interacao_media_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MidiaArmazenada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave', models.CharField(help_text='enc:<sha256 criptografado> ou raw:<sha256 do conteúdo>', max_length=80, unique=True)),
+                ('tipo', models.CharField(max_length=20)),
+                ('media_url', models.CharField(db_index=True, help_text='URL local do arquivo (mesmo valor de Interacao.media_url)', max_length=500)),
+                ('filename', models.CharField(max_length=255)),
+                ('tamanho', models.PositiveIntegerField(blank=True, help_text='Tamanho em bytes', null=True)),
+                ('referencias', models.PositiveIntegerField(default=0, help_text='Interações apontando para este arquivo')),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Mídia Armazenada',
+                'verbose_name_plural': 'Mídias Armazenadas',
+                'ordering': ['-criado_em'],
+            },
+        ),
+    ]
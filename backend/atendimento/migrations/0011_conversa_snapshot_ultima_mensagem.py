@@ -0,0 +1,69 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def preencher_snapshot(apps, schema_editor):
+    """Snapshot das conversas existentes a partir da última Interação de cada uma"""
+    Conversa = apps.get_model('atendimento', 'Conversa')
+    Interacao = apps.get_model('atendimento', 'Interacao')
+
+    ultimas = (
+        Interacao.objects.order_by('conversa_id', '-id')
+        .values('conversa_id', 'id', 'mensagem', 'tipo', 'remetente', 'criado_em')
+    )
+
+    conversa_atual = None
+    for interacao in ultimas.iterator():
+        if interacao['conversa_id'] == conversa_atual:
+            continue
+        conversa_atual = interacao['conversa_id']
+        Conversa.objects.filter(pk=conversa_atual).update(
+            ultima_interacao_id=interacao['id'],
+            ultima_mensagem_texto=(interacao['mensagem'] or '')[:255],
+            ultima_mensagem_tipo=interacao['tipo'],
+            ultima_mensagem_remetente=interacao['remetente'],
+            ultima_mensagem_em=interacao['criado_em'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atendimento', '0010_midiaarmazenada'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversa',
+            name='nao_lidas',
+            field=models.PositiveIntegerField(default=0, help_text='Mensagens do cliente desde a última resposta/leitura'),
+        ),
+        migrations.AddField(
+            model_name='conversa',
+            name='ultima_interacao',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='atendimento.interacao'),
+        ),
+        migrations.AddField(
+            model_name='conversa',
+            name='ultima_mensagem_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversa',
+            name='ultima_mensagem_remetente',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='conversa',
+            name='ultima_mensagem_texto',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='conversa',
+            name='ultima_mensagem_tipo',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.RunPython(preencher_snapshot, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:08
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Só PostgreSQL: trigger que mantém o tsvector, índice GIN e índices trigram
+# para fragmentos de nome/telefone do contato. No SQLite a busca usa icontains.
+SQL_BUSCA = [
+    """
+    CREATE TRIGGER atendimento_interacao_busca_vetor
+    BEFORE INSERT OR UPDATE OF mensagem ON atendimento_interacao
+    FOR EACH ROW EXECUTE FUNCTION
+    tsvector_update_trigger(busca_vetor, 'pg_catalog.portuguese', mensagem)
+    """,
+    "UPDATE atendimento_interacao SET busca_vetor = to_tsvector('pg_catalog.portuguese', coalesce(mensagem, ''))",
+    "CREATE INDEX atendimento_interacao_busca_gin ON atendimento_interacao USING gin (busca_vetor)",
+    "CREATE INDEX contato_contato_nome_trgm ON contato_contato USING gin (nome gin_trgm_ops)",
+    "CREATE INDEX contato_contato_telefone_trgm ON contato_contato USING gin (telefone gin_trgm_ops)",
+]
+
+SQL_BUSCA_REVERSO = [
+    "DROP INDEX IF EXISTS contato_contato_telefone_trgm",
+    "DROP INDEX IF EXISTS contato_contato_nome_trgm",
+    "DROP INDEX IF EXISTS atendimento_interacao_busca_gin",
+    "DROP TRIGGER IF EXISTS atendimento_interacao_busca_vetor ON atendimento_interacao",
+]
+
+
+def criar_busca(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in SQL_BUSCA:
+        schema_editor.execute(sql)
+
+
+def remover_busca(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in SQL_BUSCA_REVERSO:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atendimento', '0011_conversa_snapshot_ultima_mensagem'),
+        ('contato', '0004_contato_unique_contato_por_usuario'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='interacao',
+            name='busca_vetor',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(criar_busca, remover_busca),
+    ]
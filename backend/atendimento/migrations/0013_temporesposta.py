@@ -0,0 +1,70 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def preencher_tempos_resposta(apps, schema_editor):
+    """Tempos das respostas já existentes: uma passada por conversa, em ordem cronológica"""
+    Interacao = apps.get_model('atendimento', 'Interacao')
+    TempoResposta = apps.get_model('atendimento', 'TempoResposta')
+
+    interacoes = (
+        Interacao.objects.order_by('conversa_id', 'criado_em', 'id')
+        .values('id', 'conversa_id', 'operador_id', 'criado_em')
+    )
+
+    lote = []
+    conversa_atual = None
+    aguardando_desde = None
+    for interacao in interacoes.iterator():
+        if interacao['conversa_id'] != conversa_atual:
+            conversa_atual = interacao['conversa_id']
+            aguardando_desde = None
+
+        if interacao['operador_id'] is None:
+            aguardando_desde = interacao['criado_em']
+        elif aguardando_desde is not None and aguardando_desde < interacao['criado_em']:
+            lote.append(TempoResposta(
+                interacao_id=interacao['id'],
+                conversa_id=conversa_atual,
+                operador_id=interacao['operador_id'],
+                aguardando_desde=aguardando_desde,
+                respondida_em=interacao['criado_em'],
+                segundos=(interacao['criado_em'] - aguardando_desde).total_seconds()
+            ))
+
+        if len(lote) >= 1000:
+            TempoResposta.objects.bulk_create(lote)
+            lote = []
+
+    TempoResposta.objects.bulk_create(lote)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atendimento', '0012_interacao_busca_full_text'),
+        ('contato', '0004_contato_unique_contato_por_usuario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TempoResposta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('aguardando_desde', models.DateTimeField(help_text='Mensagem anterior do cliente')),
+                ('respondida_em', models.DateTimeField()),
+                ('segundos', models.FloatField()),
+                ('conversa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tempos_resposta', to='atendimento.conversa')),
+                ('interacao', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='tempo_resposta', to='atendimento.interacao')),
+                ('operador', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tempos_resposta', to='contato.operador')),
+            ],
+            options={
+                'verbose_name': 'Tempo de Resposta',
+                'verbose_name_plural': 'Tempos de Resposta',
+                'ordering': ['-respondida_em'],
+            },
+        ),
+        migrations.RunPython(preencher_tempos_resposta, migrations.RunPython.noop),
+    ]
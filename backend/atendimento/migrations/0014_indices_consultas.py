@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atendimento', '0013_temporesposta'),
+        ('contato', '0005_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversa',
+            index=models.Index(fields=['-atualizado_em'], name='conversa_atualizado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversa',
+            index=models.Index(fields=['status', '-atualizado_em'], name='conversa_status_atualiz_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversa',
+            index=models.Index(condition=models.Q(('status__in', ('entrada', 'atendimento'))), fields=['contato'], name='conversa_ativa_contato_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='interacao',
+            index=models.Index(fields=['conversa', 'criado_em', 'id'], name='interacao_conversa_criado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='interacao',
+            index=models.Index(fields=['criado_em', 'remetente'], name='interacao_criado_remet_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='interacao',
+            index=models.Index(condition=models.Q(('whatsapp_id__isnull', False)), fields=['whatsapp_id'], name='interacao_whatsapp_id_idx'),
+        ),
+        # Só depois do composto existir: o índice simples do FK fica redundante
+        migrations.AlterField(
+            model_name='interacao',
+            name='conversa',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='interacoes', to='atendimento.conversa'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:26
+
+from django.db import migrations, models
+from django.db.models import Count
+
+STATUS_ATIVOS = ('entrada', 'atendimento')
+
+
+def resolver_duplicadas(apps, schema_editor):
+    """Contato com mais de uma conversa em aberto: mantém a mais recente, as outras vão para 'pendente'"""
+    Conversa = apps.get_model('atendimento', 'Conversa')
+    ativas = Conversa.objects.filter(status__in=STATUS_ATIVOS)
+
+    contatos = ativas.values('contato').annotate(total=Count('id')).filter(total__gt=1).values_list('contato', flat=True)
+    for contato_id in list(contatos):
+        manter = ativas.filter(contato_id=contato_id).order_by('-atualizado_em', '-pk').values_list('pk', flat=True)[0]
+        ativas.filter(contato_id=contato_id).exclude(pk=manter).update(status='pendente')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atendimento', '0014_indices_consultas'),
+        ('contato', '0006_contato_telefone_normalizado'),
+    ]
+
+    operations = [
+        migrations.RunPython(resolver_duplicadas, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='conversa',
+            name='conversa_ativa_contato_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='conversa',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ('entrada', 'atendimento'))), fields=('contato',), name='conversa_ativa_unica_contato'),
+        ),
+    ]
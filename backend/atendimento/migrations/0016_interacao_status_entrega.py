@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atendimento', '0015_conversa_ativa_unica'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='interacao',
+            name='status_entrega',
+            field=models.CharField(blank=True, choices=[('falhou', 'Falhou'), ('pendente', 'Pendente'), ('enviada', 'Enviada'), ('entregue', 'Entregue'), ('lida', 'Lida')], help_text='Mensagens enviadas: confirmação do WhatsApp (vazio = recebida)', max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='interacao',
+            name='status_entrega_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
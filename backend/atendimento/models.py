@@ -1,8 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.contrib.postgres.search import SearchVectorField
 from django.utils import timezone
 
+from core.rastreamento import CamposRastreadosMixin
+from core.upsert import inserir_se_ausente
 
-class Conversa(models.Model):
+# Conversas em aberto (busca da conversa ativa de um contato)
+STATUS_CONVERSA_ATIVOS = ('entrada', 'atendimento')
+
+
+class Conversa(CamposRastreadosMixin, models.Model):
     STATUS_CHOICES = [
         ('entrada', 'Entrada'),
         ('atendimento', 'Em Atendimento'),
@@ -43,26 +50,104 @@ class Conversa(models.Model):
     atualizado_em = models.DateTimeField(auto_now=True)
     finalizada_em = models.DateTimeField(null=True, blank=True)
 
+    # 📨 Snapshot da última mensagem + não lidas (lista de conversas sem carregar o histórico)
+    # Mantido por Interacao.save(), na mesma transação da mensagem
+    ultima_interacao = models.ForeignKey('Interacao', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    ultima_mensagem_texto = models.CharField(max_length=255, blank=True, default='')
+    ultima_mensagem_tipo = models.CharField(max_length=20, blank=True, default='')
+    ultima_mensagem_remetente = models.CharField(max_length=20, blank=True, default='')
+    ultima_mensagem_em = models.DateTimeField(null=True, blank=True)
+    nao_lidas = models.PositiveIntegerField(default=0, help_text="Mensagens do cliente desde a última resposta/leitura")
+
+    CAMPOS_SNAPSHOT = (
+        'ultima_interacao', 'ultima_mensagem_texto', 'ultima_mensagem_tipo',
+        'ultima_mensagem_remetente', 'ultima_mensagem_em', 'nao_lidas',
+    )
+
     # TODO: criado_por aqui tb
 
+    # Valores lidos do banco, para os signals saberem o que mudou sem outro SELECT
+    CAMPOS_RASTREADOS = ('status', 'atendimento_humano')
+
+    @classmethod
+    def obter_ou_criar_aberta(cls, contato, reaproveitar=False, **defaults):
+        """
+        Conversa em aberto do contato, segura com webhooks concorrentes
+
+        Sem conversa em aberto: com reaproveitar, a mais recente (quem chama
+        reabre se finalizada); senão uma nova via INSERT ... ON CONFLICT DO
+        NOTHING contra conversa_ativa_unica_contato, e quem perde a corrida
+        lê a vencedora.
+        Returns: (conversa, criada)
+        """
+        conversas = cls.objects.filter(contato=contato)
+        conversa = conversas.filter(status__in=STATUS_CONVERSA_ATIVOS).first()
+        if conversa is None and reaproveitar:
+            conversa = conversas.order_by('-criado_em', '-pk').first()
+        if conversa:
+            return conversa, False
+
+        defaults.setdefault('status', 'entrada')
+        conversa = cls(contato=contato, **defaults)
+        if inserir_se_ausente(conversa):
+            return conversa, True
+        return conversas.get(status__in=STATUS_CONVERSA_ATIVOS), False
+
+    def bloqueia_reabertura(self, status):
+        """
+        True se passar esta conversa para o status violaria conversa_ativa_unica_contato
+        (status em aberto e o contato já tem outra conversa em aberto)
+        """
+        if status not in STATUS_CONVERSA_ATIVOS:
+            return False
+        return Conversa.objects.filter(
+            contato_id=self.contato_id, status__in=STATUS_CONVERSA_ATIVOS
+        ).exclude(pk=self.pk).exists()
+
     def __str__(self):
         return f"Conversa com {self.contato.nome} - {self.get_status_display()}"
 
+    def save(self, *args, **kwargs):
+        # O snapshot só é escrito com update() atômico (Interacao.save / leitura);
+        # um save() com a instância carregada antes da mensagem não pode sobrescrevê-lo
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.CAMPOS_SNAPSHOT
+            ]
+        super().save(*args, **kwargs)
+
     @property
     def total_mensagens(self):
         return self.interacoes.count()
 
-    @property
-    def ultima_interacao(self):
-        return self.interacoes.order_by('-criado_em').first()
-
     class Meta:
         verbose_name = "Conversa"
         verbose_name_plural = "Conversas"
         ordering = ['-atualizado_em']
+        indexes = [
+            # Lista de conversas (ordem padrão, com e sem filtro de status)
+            models.Index(fields=['-atualizado_em'], name='conversa_atualizado_idx'),
+            models.Index(fields=['status', '-atualizado_em'], name='conversa_status_atualiz_idx'),
+        ]
+        constraints = [
+            # Uma conversa em aberto por contato; índice parcial também serve
+            # à busca da conversa ativa e arbitra o upsert dos webhooks
+            models.UniqueConstraint(
+                fields=['contato'],
+                condition=models.Q(status__in=STATUS_CONVERSA_ATIVOS),
+                name='conversa_ativa_unica_contato'
+            ),
+        ]
 
 
 class Interacao(models.Model):
+    MEDIA_STATUS_CHOICES = [
+        ('pendente', 'Pendente'),
+        ('processada', 'Processada'),
+        ('erro', 'Erro'),
+    ]
+    
     TIPO_CHOICES = [
         ('texto', 'Texto'),
         ('imagem', 'Imagem'),
@@ -75,7 +160,17 @@ class Interacao(models.Model):
         ('outros', 'Outros'),
     ]
     
-    conversa = models.ForeignKey(Conversa, on_delete=models.CASCADE, related_name='interacoes')
+    # Ordem importa: o status de entrega só avança (ver atendimento.envio.registrar_status_entrega)
+    STATUS_ENTREGA_CHOICES = [
+        ('falhou', 'Falhou'),
+        ('pendente', 'Pendente'),
+        ('enviada', 'Enviada'),
+        ('entregue', 'Entregue'),
+        ('lida', 'Lida'),
+    ]
+    
+    # Sem índice próprio: coberto pelo índice (conversa, criado_em, id)
+    conversa = models.ForeignKey(Conversa, on_delete=models.CASCADE, related_name='interacoes', db_index=False)
     mensagem = models.TextField()
     remetente = models.CharField(max_length=20)
     tipo = models.CharField(max_length=20, choices=TIPO_CHOICES, default='texto')
@@ -88,14 +183,140 @@ class Interacao(models.Model):
     media_size = models.PositiveIntegerField(blank=True, null=True, help_text="Tamanho em bytes")
     media_mimetype = models.CharField(max_length=100, blank=True, null=True)
     media_duration = models.PositiveIntegerField(blank=True, null=True, help_text="Duração em segundos para áudio/vídeo")
+    media_status = models.CharField(max_length=15, choices=MEDIA_STATUS_CHOICES, blank=True, null=True, help_text="Processamento da mídia no worker (vazio = síncrono)")
+    status_entrega = models.CharField(max_length=10, choices=STATUS_ENTREGA_CHOICES, blank=True, null=True, help_text="Mensagens enviadas: confirmação do WhatsApp (vazio = recebida)")
+    status_entrega_em = models.DateTimeField(blank=True, null=True)
+    # Mantido por trigger no PostgreSQL (to_tsvector('portuguese', mensagem)); vazio no SQLite
+    busca_vetor = SearchVectorField(null=True, editable=False)
     
     def __str__(self):
         return f"{self.remetente}: {self.mensagem[:50]}... ({self.tipo})"
     
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._atualizar_snapshot_conversa()
+            if self.operador_id:
+                TempoResposta.registrar(self)
+    
+    def _atualizar_snapshot_conversa(self):
+        """Última mensagem e contador de não lidas da conversa (update atômico, sem SELECT)"""
+        snapshot = {
+            'ultima_interacao_id': self.pk,
+            'ultima_mensagem_texto': (self.mensagem or '')[:255],
+            'ultima_mensagem_tipo': self.tipo,
+            'ultima_mensagem_remetente': self.remetente,
+            'ultima_mensagem_em': self.criado_em,
+        }
+        
+        # Mensagens concorrentes: só a de maior ID vira a "última"
+        Conversa.objects.filter(pk=self.conversa_id).filter(
+            models.Q(ultima_interacao__isnull=True) | models.Q(ultima_interacao_id__lt=self.pk)
+        ).update(**snapshot)
+        
+        if self.remetente == 'cliente':
+            Conversa.objects.filter(pk=self.conversa_id).update(nao_lidas=models.F('nao_lidas') + 1)
+        elif self.remetente == 'operador':
+            Conversa.objects.filter(pk=self.conversa_id, nao_lidas__gt=0).update(nao_lidas=0)
+        
+        # Manter a instância em memória coerente (se já carregada)
+        if Interacao.conversa.is_cached(self):
+            for campo, valor in snapshot.items():
+                setattr(self.conversa, campo, valor)
+            if self.remetente == 'cliente':
+                self.conversa.nao_lidas += 1
+            elif self.remetente == 'operador':
+                self.conversa.nao_lidas = 0
+    
     class Meta:
         verbose_name = "Interação"
         verbose_name_plural = "Interações"
         ordering = ['criado_em']
+        indexes = [
+            # Histórico da conversa e paginação por cursor (criado_em, id)
+            models.Index(fields=['conversa', 'criado_em', 'id'], name='interacao_conversa_criado_idx'),
+            # Dashboards e consolidação: faixa do dia por remetente
+            models.Index(fields=['criado_em', 'remetente'], name='interacao_criado_remet_idx'),
+            # Dedup/status por ID do WhatsApp: parcial, a maioria é nula
+            models.Index(
+                fields=['whatsapp_id'],
+                condition=models.Q(whatsapp_id__isnull=False),
+                name='interacao_whatsapp_id_idx'
+            ),
+        ]
+
+
+class MidiaArmazenada(models.Model):
+    """
+    Índice content-addressed das mídias recebidas do WhatsApp
+
+    Mídias encaminhadas/figurinhas chegam várias vezes com o mesmo conteúdo:
+    a chave é o SHA-256 do arquivo criptografado (fileEncSha256) ou, sem ele,
+    do conteúdo. Repetições reaproveitam o arquivo já salvo (sem download,
+    descriptografia ou conversão) e só incrementam as referências.
+    """
+    chave = models.CharField(max_length=80, unique=True, help_text="enc:<sha256 criptografado> ou raw:<sha256 do conteúdo>")
+    tipo = models.CharField(max_length=20)
+    media_url = models.CharField(max_length=500, db_index=True, help_text="URL local do arquivo (mesmo valor de Interacao.media_url)")
+    filename = models.CharField(max_length=255)
+    tamanho = models.PositiveIntegerField(blank=True, null=True, help_text="Tamanho em bytes")
+    referencias = models.PositiveIntegerField(default=0, help_text="Interações apontando para este arquivo")
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.chave[:20]}... ({self.tipo}, {self.referencias} ref.)"
+
+    class Meta:
+        verbose_name = "Mídia Armazenada"
+        verbose_name_plural = "Mídias Armazenadas"
+        ordering = ['-criado_em']
+
+
+class TempoResposta(models.Model):
+    """
+    Tempo de resposta de cada mensagem de operador (pré-calculado na gravação)
+
+    Espera = última mensagem sem operador (cliente/bot) anterior à resposta.
+    Respostas sem mensagem anterior do cliente não geram registro.
+    """
+    interacao = models.OneToOneField(Interacao, on_delete=models.CASCADE, related_name='tempo_resposta')
+    conversa = models.ForeignKey(Conversa, on_delete=models.CASCADE, related_name='tempos_resposta')
+    operador = models.ForeignKey('contato.Operador', on_delete=models.CASCADE, related_name='tempos_resposta')
+    aguardando_desde = models.DateTimeField(help_text="Mensagem anterior do cliente")
+    respondida_em = models.DateTimeField()
+    segundos = models.FloatField()
+
+    @classmethod
+    def registrar(cls, interacao):
+        """Chamado pelo Interacao.save() ao criar uma resposta de operador"""
+        aguardando_desde = Interacao.objects.filter(
+            conversa_id=interacao.conversa_id,
+            operador__isnull=True,
+            criado_em__lt=interacao.criado_em
+        ).aggregate(ultima=models.Max('criado_em'))['ultima']
+
+        if aguardando_desde is None:
+            return None
+
+        return cls.objects.create(
+            interacao=interacao,
+            conversa_id=interacao.conversa_id,
+            operador_id=interacao.operador_id,
+            aguardando_desde=aguardando_desde,
+            respondida_em=interacao.criado_em,
+            segundos=(interacao.criado_em - aguardando_desde).total_seconds()
+        )
+
+    def __str__(self):
+        return f"{self.operador_id} respondeu em {self.segundos:.0f}s (conversa {self.conversa_id})"
+
+    class Meta:
+        verbose_name = "Tempo de Resposta"
+        verbose_name_plural = "Tempos de Resposta"
+        ordering = ['-respondida_em']
 
 
 class RespostasRapidas(models.Model):
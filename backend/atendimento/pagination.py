@@ -0,0 +1,145 @@
+"""
+Paginação por cursor (keyset) das mensagens - ordenação estável por (criado_em, id)
+
+Em vez de OFFSET, cada página continua a partir da última mensagem vista,
+então o custo não cresce com o tamanho do histórico e mensagens novas
+não deslocam as páginas.
+
+Modos (query params):
+    (nenhum)          página mais recente
+    ?antes=<cursor>   "carregar anteriores": mensagens mais antigas que o cursor
+    ?depois=<cursor>  "desde o cursor": mensagens novas (polling)
+"""
+import base64
+import binascii
+from collections import OrderedDict
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+
+
+def codificar_cursor(interacao) -> str:
+    valor = f"{interacao.criado_em.isoformat()}|{interacao.pk}"
+    return base64.urlsafe_b64encode(valor.encode()).decode()
+
+
+def decodificar_cursor(cursor: str):
+    try:
+        criado_em, pk = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        return datetime.fromisoformat(criado_em), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise NotFound("Cursor inválido")
+
+
+def _mais_antigas(queryset, cursor):
+    criado_em, pk = decodificar_cursor(cursor)
+    return queryset.filter(Q(criado_em__lt=criado_em) | Q(criado_em=criado_em, pk__lt=pk))
+
+
+def _mais_novas(queryset, cursor):
+    criado_em, pk = decodificar_cursor(cursor)
+    return queryset.filter(Q(criado_em__gt=criado_em) | Q(criado_em=criado_em, pk__gt=pk))
+
+
+def paginar_mensagens(queryset, tamanho, antes=None, depois=None, cronologica=True):
+    """
+    Motor do keyset usado pela paginação da API e pelo ConversaDetailSerializer
+
+    Returns:
+        dict: itens (lista), tem_mais (há mais na direção buscada),
+              cursor_anterior (para ?antes=), cursor_posterior (para ?depois=)
+    """
+    if depois:
+        itens = list(_mais_novas(queryset, depois).order_by('criado_em', 'id')[:tamanho + 1])
+        tem_mais = len(itens) > tamanho
+        itens = itens[:tamanho]
+        if not cronologica:
+            itens.reverse()
+    else:
+        if antes:
+            queryset = _mais_antigas(queryset, antes)
+        itens = list(queryset.order_by('-criado_em', '-id')[:tamanho + 1])
+        tem_mais = len(itens) > tamanho
+        itens = itens[:tamanho]
+        if cronologica:
+            itens.reverse()
+
+    if itens:
+        mais_antiga = itens[0] if cronologica else itens[-1]
+        mais_nova = itens[-1] if cronologica else itens[0]
+        cursor_anterior = codificar_cursor(mais_antiga)
+        cursor_posterior = codificar_cursor(mais_nova)
+    else:
+        # Página vazia: manter os cursores recebidos para o cliente continuar de onde está
+        cursor_anterior = antes
+        cursor_posterior = depois
+
+    return {
+        'itens': itens,
+        'tem_mais': tem_mais,
+        'cursor_anterior': cursor_anterior,
+        'cursor_posterior': cursor_posterior,
+    }
+
+
+class InteracaoCursorPagination(BasePagination):
+    """
+    Paginação por cursor para listas de Interacao
+
+    cronologica=True devolve cada página da mais antiga para a mais nova
+    (histórico de chat); False devolve da mais nova para a mais antiga (busca)
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cronologica = True
+
+    def get_page_size(self, request):
+        try:
+            tamanho = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            tamanho = self.page_size
+        return max(1, min(tamanho, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.pagina = paginar_mensagens(
+            queryset,
+            self.get_page_size(request),
+            antes=request.query_params.get('antes'),
+            depois=request.query_params.get('depois'),
+            cronologica=self.cronologica,
+        )
+        return self.pagina['itens']
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('tem_mais', self.pagina['tem_mais']),
+            ('cursor_anterior', self.pagina['cursor_anterior']),
+            ('cursor_posterior', self.pagina['cursor_posterior']),
+            ('results', data),
+        ]))
+
+
+class BuscaCursorPagination(InteracaoCursorPagination):
+    """Resultados de busca: mais recentes primeiro"""
+    cronologica = False
+
+
+class BuscaRelevanciaPagination(PageNumberPagination):
+    """
+    Busca com ?ordem=relevancia: ordena pelo rank do full-text (PostgreSQL)
+    Rank não é contínuo como (criado_em, id), então aqui a paginação é por página
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if 'rank' in queryset.query.annotations:
+            queryset = queryset.order_by('-rank', '-criado_em', '-id')
+        else:
+            queryset = queryset.order_by('-criado_em', '-id')
+        return super().paginate_queryset(queryset, request, view)
@@ -2,11 +2,15 @@
 
 from rest_framework import serializers
 from .models import Interacao, Conversa, RespostasRapidas, AnexoNota, NotaAtendimento, TarefaAtendimento
+from .pagination import InteracaoCursorPagination, paginar_mensagens
 from contato.serializers import OperadorSerializer, ContatoSerializer
 from contato.models import Contato, Operador
 from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 
+ERRO_OUTRA_ABERTA = "O contato já tem outra conversa em aberto."
+
 class InteracaoSerializer(serializers.ModelSerializer):
     media_url_completa = serializers.SerializerMethodField()
     operador_nome = serializers.SerializerMethodField()
@@ -17,7 +21,7 @@ class InteracaoSerializer(serializers.ModelSerializer):
             'id', 'mensagem', 'remetente', 'tipo', 'criado_em',
             'whatsapp_id', 'media_url', 'media_url_completa',
             'media_filename', 'media_size', 'media_duration', 'media_mimetype',
-            'operador', 'operador_nome'
+            'media_status', 'operador', 'operador_nome'
         ]
     
     def get_media_url_completa(self, obj):
@@ -61,6 +65,7 @@ class ConversaDetailSerializer(serializers.ModelSerializer):
     contato = ContatoSerializer(read_only=True)  # ✅ EXPANDIR dados completos do contato
     operador = OperadorSerializer(read_only=True)  # ✅ EXPANDIR dados do operador
     interacoes = serializers.SerializerMethodField()
+    interacoes_paginacao = serializers.SerializerMethodField()
     contato_nome = serializers.CharField(source='contato.nome', read_only=True)
     contato_telefone = serializers.CharField(source='contato.telefone', read_only=True)
     operador_atual = serializers.SerializerMethodField()
@@ -72,21 +77,38 @@ class ConversaDetailSerializer(serializers.ModelSerializer):
             'status', 'criado_em', 'atualizado_em', 'operador', 'operador_atual',
             'tags', 'assunto', 'origem', 'prioridade', 'finalizada_em',
             'atendimento_humano', 'atendimento_humano_ate',  # 🤖 Novos campos
-            'interacoes'
+            'interacoes', 'interacoes_paginacao'
         ]
     
+    def _pagina_interacoes(self, obj):
+        """Só a página mais recente do histórico (o resto via /conversas/<id>/mensagens/?antes=)"""
+        paginas = self.__dict__.setdefault('_paginas_interacoes', {})
+        if obj.pk not in paginas:
+            paginas[obj.pk] = paginar_mensagens(
+                obj.interacoes.select_related('operador__user'),
+                InteracaoCursorPagination.page_size
+            )
+        return paginas[obj.pk]
+    
     def get_interacoes(self, obj):
         """
         ✅ GARANTIR que interações tenham URLs locais
         """
-        interacoes = obj.interacoes.all().order_by('criado_em')
         # ✅ PASSAR context para garantir URLs completas
         return InteracaoSerializer(
-            interacoes, 
+            self._pagina_interacoes(obj)['itens'], 
             many=True, 
             context=self.context  # ✅ IMPORTANTE: passar context!
         ).data
     
+    def get_interacoes_paginacao(self, obj):
+        pagina = self._pagina_interacoes(obj)
+        return {
+            'tem_mais': pagina['tem_mais'],
+            'cursor_anterior': pagina['cursor_anterior'],
+            'cursor_posterior': pagina['cursor_posterior'],
+        }
+    
     def get_operador_atual(self, obj):
         if obj.operador and obj.operador.user:
             return {
@@ -108,7 +130,7 @@ class ConversaListSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'contato', 'contato_nome', 'contato_telefone',
             'status', 'criado_em', 'atualizado_em',
-            'operador', 'operador_nome', 'ultima_mensagem',
+            'operador', 'operador_nome', 'ultima_mensagem', 'nao_lidas',
             'tags', 'assunto', 'origem', 'prioridade'
         ]
     
@@ -119,16 +141,17 @@ class ConversaListSerializer(serializers.ModelSerializer):
     
     def get_ultima_mensagem(self, obj):
         """
-        ✅ ÚLTIMA mensagem com URL local se for mídia
+        ✅ ÚLTIMA mensagem a partir do snapshot da conversa (sem query por conversa)
         """
-        ultima = obj.interacoes.last()
-        if ultima:
-            # ✅ USAR serializer com context para URLs locais
-            return InteracaoSerializer(
-                ultima, 
-                context=self.context  # ✅ IMPORTANTE!
-            ).data
-        return None
+        if not obj.ultima_interacao_id:
+            return None
+        return {
+            'id': obj.ultima_interacao_id,
+            'mensagem': obj.ultima_mensagem_texto,
+            'tipo': obj.ultima_mensagem_tipo,
+            'remetente': obj.ultima_mensagem_remetente,
+            'criado_em': serializers.DateTimeField().to_representation(obj.ultima_mensagem_em) if obj.ultima_mensagem_em else None,
+        }
     
     def get_operador_nome(self, obj):
         if obj.operador and obj.operador.user:
@@ -282,6 +305,9 @@ class ConversaUpdateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 f"Status inválido. Opções: {', '.join(valid_statuses)}"
             )
+        # Uma conversa em aberto por contato (conversa_ativa_unica_contato)
+        if self.instance is not None and self.instance.bloqueia_reabertura(value):
+            raise serializers.ValidationError(ERRO_OUTRA_ABERTA)
         return value
     
     def update(self, instance, validated_data):
@@ -291,5 +317,10 @@ class ConversaUpdateSerializer(serializers.ModelSerializer):
             validated_data['finalizada_em'] = timezone.now()
         elif validated_data.get('status') != 'finalizada':
             validated_data['finalizada_em'] = None
-            
-        return super().update(instance, validated_data)
\ No newline at end of file
+        
+        # Outra conversa aberta entre a validação e o UPDATE: a constraint decide, vira 400
+        try:
+            with transaction.atomic():
+                return super().update(instance, validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError({'status': [ERRO_OUTRA_ABERTA]})
\ No newline at end of file
@@ -0,0 +1,50 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from atendimento.models import Conversa, Interacao
+from atendimento import media_store, tempo_real
+from atendimento.pagination import codificar_cursor
+
+
+@receiver(post_delete, sender=Interacao)
+def liberar_midia_interacao(sender, instance, **kwargs):
+    media_store.liberar(instance.media_url)
+
+
+# ===== INBOX EM TEMPO REAL =====
+
+@receiver(post_save, sender=Interacao)
+def publicar_interacao(sender, instance, created, **kwargs):
+    if not created:
+        return
+    tempo_real.publicar_apos_commit(instance.conversa_id, 'interacao', {
+        'id': instance.pk,
+        'conversa_id': instance.conversa_id,
+        'remetente': instance.remetente,
+        'tipo': instance.tipo,
+        'mensagem': instance.mensagem,
+        'criado_em': instance.criado_em,
+        # GET /conversas/<id>/mensagens/?depois=<cursor> traz o que vier depois desta
+        'cursor': codificar_cursor(instance),
+    })
+
+
+@receiver(post_save, sender=Conversa)
+def publicar_conversa(sender, instance, created, update_fields=None, **kwargs):
+    alterados = set() if created else instance.campos_alterados(update_fields)
+
+    if created or 'status' in alterados:
+        tempo_real.publicar_apos_commit(instance.pk, 'conversa', {
+            'id': instance.pk,
+            'contato_id': instance.contato_id,
+            'status': instance.status,
+            'status_anterior': None if created else instance.valor_anterior('status'),
+            'operador_id': instance.operador_id,
+            'atualizado_em': instance.atualizado_em,
+        })
+
+    if 'atendimento_humano' in alterados:
+        tempo_real.publicar_apos_commit(instance.pk, 'atendimento_humano', {
+            'id': instance.pk,
+            'atendimento_humano': instance.atendimento_humano,
+            'atendimento_humano_ate': instance.atendimento_humano_ate,
+        })
@@ -0,0 +1,13 @@
+from celery import shared_task
+
+from .media_store import limpar_midias_orfas
+
+
+@shared_task
+def limpar_midias_orfas_task():
+    """
+    Remove do storage mídias do WhatsApp sem nenhuma Interação apontando
+    """
+    removidas = limpar_midias_orfas()
+
+    return f"{removidas} mídias órfãs removidas"
@@ -0,0 +1,312 @@
+"""
+Inbox em tempo real (Server-Sent Events) - eventos por tenant via Redis
+
+Publicação (signals, depois do commit): um script Lua grava o evento no
+stream do tenant (XADD limitado a INBOX_STREAM_MAXLEN) e publica o mesmo
+evento, com o id do stream, no canal do tenant - um round-trip, na ordem.
+
+Assinatura (inbox_eventos, ASGI): uma conexão pub/sub por processo
+multiplexa todos os clientes (_Hub). Cada cliente recebe o canal do seu
+tenant e o das conversas sem dono (contatos criados pelos webhooks), que
+a lista de conversas mostra para todos.
+
+Retomada: cada evento leva no 'id:' o cursor (último id de cada stream);
+na reconexão o navegador manda Last-Event-ID e o que ficou para trás é
+relido do stream. Cursor fora do stream (aparado ou expirado) ou atraso
+maior que INBOX_REPLAY_MAX → evento 'reset' (o cliente recarrega pela API).
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+SEM_DONO = 'sem-dono'
+FILA_MAX = 256
+PAUSA_FALHA_SEGUNDOS = 30
+
+# KEYS: stream, canal | ARGV: maxlen, ttl (ms), evento
+LUA_PUBLICAR = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'e', ARGV[3])
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+redis.call('PUBLISH', KEYS[2], id .. ' ' .. ARGV[3])
+return id
+"""
+
+_lock = threading.Lock()
+_recursos = {'pid': None, 'script': None, 'pausa_ate': 0.0}
+
+
+def canal(tenant_id) -> str:
+    return f"inbox:{tenant_id or SEM_DONO}"
+
+
+def chave_stream(tenant_id) -> str:
+    return f"inbox:stream:{tenant_id or SEM_DONO}"
+
+
+# ===== PUBLICAÇÃO (síncrona: signals, views, Celery) =====
+
+def _script():
+    """Cliente Redis e script por processo (workers fazem fork depois do import)"""
+    pid = os.getpid()
+    if _recursos['pid'] != pid:
+        with _lock:
+            if _recursos['pid'] != pid:
+                cliente = redis.Redis.from_url(
+                    settings.INBOX_REDIS_URL, socket_timeout=1, socket_connect_timeout=1
+                )
+                _recursos['script'] = cliente.register_script(LUA_PUBLICAR)
+                _recursos['pausa_ate'] = 0.0
+                _recursos['pid'] = pid
+    return _recursos['script']
+
+
+def publicar(tenant_id, tipo: str, dados: Dict) -> Optional[str]:
+    """
+    Publica o evento para o tenant (None = conversas sem dono)
+    Falha no Redis nunca quebra quem publica: loga e pausa por PAUSA_FALHA_SEGUNDOS.
+
+    Returns:
+        str: id do evento no stream, ou None se não publicou
+    """
+    if not settings.INBOX_PUSH_ATIVO:
+        return None
+    script = _script()
+    if time.monotonic() < _recursos['pausa_ate']:
+        return None
+
+    evento = json.dumps({'tipo': tipo, 'dados': dados}, cls=DjangoJSONEncoder)
+    try:
+        id_evento = script(
+            keys=[chave_stream(tenant_id), canal(tenant_id)],
+            args=[settings.INBOX_STREAM_MAXLEN, settings.INBOX_STREAM_TTL * 1000, evento],
+        )
+    except redis.RedisError as e:
+        _recursos['pausa_ate'] = time.monotonic() + PAUSA_FALHA_SEGUNDOS
+        logger.warning(f"⚠️ [Inbox] Redis indisponível, push pausado por {PAUSA_FALHA_SEGUNDOS}s: {e}")
+        return None
+    return id_evento.decode() if isinstance(id_evento, bytes) else id_evento
+
+
+def publicar_da_conversa(conversa_id, tipo: str, dados: Dict):
+    """Publica para o tenant do dono do contato da conversa (chamar depois do commit)"""
+    from core.utils import tenant_do_usuario
+    from .models import Conversa
+
+    dono_id = Conversa.objects.filter(pk=conversa_id).values_list('contato__criado_por_id', flat=True).first()
+    publicar(tenant_do_usuario(dono_id) if dono_id else None, tipo, dados)
+
+
+def publicar_apos_commit(conversa_id, tipo: str, dados: Dict):
+    transaction.on_commit(lambda: publicar_da_conversa(conversa_id, tipo, dados))
+
+
+# ===== CURSOR =====
+
+def _id(valor: str):
+    """'1700000000000-3' → (1700000000000, 3), comparável"""
+    ms, _, seq = valor.partition('-')
+    return int(ms), int(seq or 0)
+
+
+def codificar_cursor(ids: List[str]) -> str:
+    return ','.join(ids)
+
+
+def decodificar_cursor(cursor: Optional[str], total: int) -> Optional[List[str]]:
+    """Cursor inválido ou de outra combinação de streams → None (começa do agora)"""
+    if not cursor:
+        return None
+    ids = cursor.split(',')
+    if len(ids) != total:
+        return None
+    try:
+        for valor in ids:
+            _id(valor)
+    except ValueError:
+        return None
+    return ids
+
+
+# ===== ASSINATURA (assíncrona: ASGI) =====
+
+class _Assinatura:
+    """Fila de um cliente; atrasada=True quando encheu e eventos foram descartados"""
+
+    def __init__(self):
+        self.fila = asyncio.Queue(maxsize=FILA_MAX)
+        self.atrasada = False
+
+
+class _Hub:
+    """Uma conexão pub/sub por event loop, repassando cada mensagem às filas dos clientes do canal"""
+
+    def __init__(self):
+        self.redis = aioredis.Redis.from_url(settings.INBOX_REDIS_URL)
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.assinaturas = defaultdict(set)
+        self.tarefa = None
+
+    async def assinar(self, canais: List[str]) -> _Assinatura:
+        assinatura = _Assinatura()
+        novos = [nome for nome in canais if not self.assinaturas[nome]]
+        for nome in canais:
+            self.assinaturas[nome].add(assinatura)
+        if novos:
+            await self.pubsub.subscribe(*novos)
+        if self.tarefa is None or self.tarefa.done():
+            self.tarefa = asyncio.create_task(self._repassar())
+        return assinatura
+
+    async def cancelar(self, canais: List[str], assinatura: _Assinatura):
+        vazios = []
+        for nome in canais:
+            self.assinaturas[nome].discard(assinatura)
+            if not self.assinaturas[nome]:
+                del self.assinaturas[nome]
+                vazios.append(nome)
+        if vazios:
+            try:
+                await self.pubsub.unsubscribe(*vazios)
+            except redis.RedisError:
+                pass
+
+    async def _repassar(self):
+        while self.assinaturas:
+            try:
+                mensagem = await self.pubsub.get_message(timeout=1.0)
+            except redis.RedisError as e:
+                # Na reconexão o pub/sub refaz as assinaturas; o que passou é relido do stream
+                logger.warning(f"⚠️ [Inbox] Pub/sub desconectado: {e}")
+                for assinaturas in self.assinaturas.values():
+                    for assinatura in assinaturas:
+                        assinatura.atrasada = True
+                await asyncio.sleep(1)
+                continue
+            if mensagem is None or mensagem['type'] != 'message':
+                continue
+
+            nome = mensagem['channel'].decode()
+            id_evento, _, evento = mensagem['data'].decode().partition(' ')
+            for assinatura in list(self.assinaturas.get(nome, ())):
+                try:
+                    assinatura.fila.put_nowait((nome, id_evento, evento))
+                except asyncio.QueueFull:
+                    assinatura.atrasada = True
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def _hub() -> _Hub:
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = _Hub()
+    return hub
+
+
+def _sse(tipo: str, dados: str, cursor: Optional[str] = None) -> str:
+    linhas = []
+    if cursor:
+        linhas.append(f"id: {cursor}")
+    linhas.append(f"event: {tipo}")
+    linhas.append(f"data: {dados}")
+    return '\n'.join(linhas) + '\n\n'
+
+
+async def _ultimos_ids(cliente, streams: List[str]) -> List[str]:
+    ids = []
+    for stream in streams:
+        ultimo = await cliente.xrevrange(stream, count=1)
+        ids.append(ultimo[0][0].decode() if ultimo else '0-0')
+    return ids
+
+
+async def _pendentes(cliente, streams: List[str], ids: List[str]):
+    """
+    Eventos depois do cursor, em ordem, ou None se não dá para retomar
+    (cursor aparado/expirado ou atraso maior que INBOX_REPLAY_MAX)
+    """
+    eventos = []
+    for indice, (stream, ultimo) in enumerate(zip(streams, ids)):
+        if ultimo == '0-0':
+            # Stream vazio quando o cursor foi criado: tudo que entrou depois
+            inicio = '-'
+        else:
+            primeiro = await cliente.xrange(stream, count=1)
+            if not primeiro or _id(primeiro[0][0].decode()) > _id(ultimo):
+                return None
+            inicio = f"({ultimo}"
+        lidos = await cliente.xrange(stream, min=inicio, count=settings.INBOX_REPLAY_MAX + 1)
+        if len(lidos) > settings.INBOX_REPLAY_MAX:
+            return None
+        eventos.extend((indice, id_evento.decode(), campos[b'e'].decode()) for id_evento, campos in lidos)
+    eventos.sort(key=lambda evento: _id(evento[1]))
+    return eventos
+
+
+async def eventos_inbox(tenant_id, cursor: Optional[str] = None):
+    """Gerador assíncrono do corpo SSE para um operador do tenant"""
+    tenants = [tenant_id, None]
+    canais = [canal(tenant) for tenant in tenants]
+    streams = [chave_stream(tenant) for tenant in tenants]
+
+    hub = _hub()
+    # Assina antes de ler o stream: nada publicado entre as duas etapas se perde
+    assinatura = await hub.assinar(canais)
+    try:
+        yield f"retry: {settings.INBOX_RETRY_MS}\n\n"
+
+        ids = decodificar_cursor(cursor, len(streams))
+        while True:
+            # O que está na fila também está no stream, depois do ponto lido abaixo
+            assinatura.atrasada = False
+            while not assinatura.fila.empty():
+                assinatura.fila.get_nowait()
+
+            if ids is None:
+                ids = await _ultimos_ids(hub.redis, streams)
+                yield _sse('conectado', '{}', codificar_cursor(ids))
+            else:
+                pendentes = await _pendentes(hub.redis, streams, ids)
+                if pendentes is None:
+                    ids = None
+                    yield _sse('reset', '{}')
+                    continue
+                for indice, id_evento, evento in pendentes:
+                    ids[indice] = id_evento
+                    dados = json.loads(evento)
+                    yield _sse(dados['tipo'], json.dumps(dados['dados']), codificar_cursor(ids))
+
+            # Ao vivo até o cliente sair ou a fila transbordar (aí relê do stream)
+            while not assinatura.atrasada:
+                try:
+                    nome, id_evento, evento = await asyncio.wait_for(
+                        assinatura.fila.get(), timeout=settings.INBOX_KEEPALIVE_SEGUNDOS
+                    )
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+
+                indice = canais.index(nome)
+                if _id(id_evento) <= _id(ids[indice]):
+                    continue  # já entregue pela releitura do stream
+                ids[indice] = id_evento
+                dados = json.loads(evento)
+                yield _sse(dados['tipo'], json.dumps(dados['dados']), codificar_cursor(ids))
+    finally:
+        await hub.cancelar(canais, assinatura)
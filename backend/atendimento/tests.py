@@ -1,3 +1,1001 @@
-from django.test import TestCase
+import asyncio
+import base64
+import importlib
+import io
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import redis
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from contato.models import Contato, Operador
+from core import contadores
+from core.upsert import inserir_se_ausente
+from . import envio, media_store, tempo_real
+from .media_processor import WhatsAppMediaProcessor
+from .media_sender import TAMANHO_BLOCO, WhatsAppMediaSender, _blocos_base64, url_assinada
+from .pagination import codificar_cursor
+from .models import Conversa, Interacao, MidiaArmazenada, TempoResposta
+
+JPEG = b'\xff\xd8\xff\xe0' + b'imagem' * 100
+FILE_ENC_SHA256 = base64.b64encode(bytes(range(32))).decode()
+
+
+class MediaRootTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        configuracao = override_settings(MEDIA_ROOT=media_root)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+
+class MediaStoreTests(MediaRootTestCase):
+    def baixar_da_url(self, *args, **kwargs):
+        """_process_from_url simulado: salva um arquivo novo a cada download"""
+        nome = default_storage.save('whatsapp_media/imagem/foto.jpg', ContentFile(JPEG))
+        return {'success': True, 'media_local_path': default_storage.url(nome), 'filename': nome.rsplit('/', 1)[-1], 'size': len(JPEG)}
+
+    def processar_url(self):
+        message_data = {'url': 'https://mmg.whatsapp.net/foto.enc', 'mediaKey': 'Y2hhdmU=', 'fileEncSha256': FILE_ENC_SHA256}
+        return WhatsAppMediaProcessor.process_media(message_data, 'imagem')
+
+    def test_mesmo_file_enc_sha256_nao_baixa_de_novo(self):
+        with mock.patch.object(WhatsAppMediaProcessor, '_process_from_url', side_effect=self.baixar_da_url) as download:
+            primeiro = self.processar_url()
+            segundo = self.processar_url()
+
+        self.assertEqual(download.call_count, 1)
+        self.assertTrue(segundo['reaproveitada'])
+        self.assertEqual(segundo['media_local_path'], primeiro['media_local_path'])
+        self.assertEqual(MidiaArmazenada.objects.get().referencias, 2)
+
+    def test_chave_hex_e_base64_do_mesmo_hash_coincidem(self):
+        self.assertEqual(media_store.chave_criptografado(FILE_ENC_SHA256), media_store.chave_criptografado(bytes(range(32)).hex()))
+        self.assertIsNone(media_store.chave_criptografado('curto'))
+
+    def test_base64_sem_hash_indexa_pelo_conteudo(self):
+        dados = base64.b64encode(JPEG).decode()
+
+        primeiro = WhatsAppMediaProcessor.process_media({'mimetype': 'image/jpeg'}, 'imagem', base64_data=dados)
+        with mock.patch.object(WhatsAppMediaProcessor, '_save_media_file') as salvar:
+            segundo = WhatsAppMediaProcessor.process_media({'mimetype': 'image/jpeg'}, 'imagem', base64_data=dados)
+
+        salvar.assert_not_called()
+        self.assertEqual(segundo['media_local_path'], primeiro['media_local_path'])
+        self.assertEqual(MidiaArmazenada.objects.get().chave, media_store.chave_conteudo(JPEG))
+
+    def test_arquivo_apagado_do_storage_e_processado_de_novo(self):
+        with mock.patch.object(WhatsAppMediaProcessor, '_process_from_url', side_effect=self.baixar_da_url) as download:
+            primeiro = self.processar_url()
+            default_storage.delete(media_store._nome_no_storage(primeiro['media_local_path']))
+            segundo = self.processar_url()
+
+        self.assertEqual(download.call_count, 2)
+        self.assertNotIn('reaproveitada', segundo)
+        self.assertEqual(MidiaArmazenada.objects.get().media_url, segundo['media_local_path'])
+
+    def test_registro_concorrente_apaga_a_copia_e_usa_o_existente(self):
+        existente = self.baixar_da_url()
+        media_store.registrar('enc:abc', 'imagem', existente)
+        copia = self.baixar_da_url()
+
+        resultado = media_store.registrar('enc:abc', 'imagem', copia)
+
+        self.assertEqual(resultado['media_local_path'], existente['media_local_path'])
+        self.assertFalse(default_storage.exists(media_store._nome_no_storage(copia['media_local_path'])))
+        self.assertEqual(MidiaArmazenada.objects.get().referencias, 2)
+
+
+class LimpezaMidiasTests(MediaRootTestCase):
+    def setUp(self):
+        super().setUp()
+        contato = Contato.objects.create(nome='Fulano', telefone='5511999999999')
+        self.conversa = Conversa.objects.create(contato=contato)
+
+    def armazenar(self, chave, referencias, horas_atras):
+        nome = default_storage.save(f'whatsapp_media/imagem/{chave}.jpg', ContentFile(JPEG))
+        midia = MidiaArmazenada.objects.create(
+            chave=chave, tipo='imagem', media_url=default_storage.url(nome), filename=nome, referencias=referencias
+        )
+        MidiaArmazenada.objects.filter(pk=midia.pk).update(criado_em=timezone.now() - timedelta(hours=horas_atras))
+        return midia
+
+    def test_excluir_interacao_libera_a_referencia(self):
+        midia = self.armazenar('enc:a', referencias=1, horas_atras=48)
+        interacao = Interacao.objects.create(conversa=self.conversa, mensagem='foto', tipo='imagem', media_url=midia.media_url)
+
+        interacao.delete()
+
+        midia.refresh_from_db()
+        self.assertEqual(midia.referencias, 0)
+        self.assertEqual(media_store.limpar_midias_orfas(), 1)
+        self.assertFalse(default_storage.exists(media_store._nome_no_storage(midia.media_url)))
+
+    @override_settings(MIDIA_GC_IDADE_HORAS=24)
+    def test_limpeza_respeita_a_folga_e_as_interacoes_existentes(self):
+        recente = self.armazenar('enc:recente', referencias=0, horas_atras=1)
+        ainda_usada = self.armazenar('enc:usada', referencias=0, horas_atras=48)
+        Interacao.objects.create(conversa=self.conversa, mensagem='foto', tipo='imagem', media_url=ainda_usada.media_url)
+
+        self.assertEqual(media_store.limpar_midias_orfas(), 0)
+        self.assertEqual(MidiaArmazenada.objects.filter(pk__in=[recente.pk, ainda_usada.pk]).count(), 2)
+
+
+class SnapshotUltimaMensagemTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('operador', password='x')
+        self.operador = Operador.objects.create(user=self.usuario)
+        self.contato = Contato.objects.create(nome='Fulano', telefone='11999999999', criado_por=self.usuario)
+        self.conversa = Conversa.objects.create(contato=self.contato)
+
+    def api(self):
+        api = APIClient()
+        api.force_authenticate(self.usuario)
+        return api
+
+    def test_mensagem_do_cliente_atualiza_snapshot_e_nao_lidas(self):
+        Interacao.objects.create(conversa=self.conversa, mensagem='oi', remetente='cliente')
+        ultima = Interacao.objects.create(conversa=self.conversa, mensagem='tudo bem?', remetente='cliente')
+
+        self.conversa.refresh_from_db()
+        self.assertEqual(self.conversa.ultima_interacao_id, ultima.pk)
+        self.assertEqual(self.conversa.ultima_mensagem_texto, 'tudo bem?')
+        self.assertEqual(self.conversa.ultima_mensagem_remetente, 'cliente')
+        self.assertEqual(self.conversa.ultima_mensagem_em, ultima.criado_em)
+        self.assertEqual(self.conversa.nao_lidas, 2)
+
+    def test_resposta_do_operador_zera_nao_lidas(self):
+        Interacao.objects.create(conversa=self.conversa, mensagem='oi', remetente='cliente')
+        Interacao.objects.create(conversa=self.conversa, mensagem='olá', remetente='operador', operador=self.operador)
+
+        self.conversa.refresh_from_db()
+        self.assertEqual(self.conversa.nao_lidas, 0)
+        self.assertEqual(self.conversa.ultima_mensagem_remetente, 'operador')
+
+    def test_texto_longo_e_truncado(self):
+        Interacao.objects.create(conversa=self.conversa, mensagem='x' * 1000, remetente='cliente')
+
+        self.conversa.refresh_from_db()
+        self.assertEqual(len(self.conversa.ultima_mensagem_texto), 255)
+
+    def test_save_com_instancia_antiga_nao_apaga_o_snapshot(self):
+        antiga = Conversa.objects.get(pk=self.conversa.pk)
+        interacao = Interacao.objects.create(conversa=self.conversa, mensagem='oi', remetente='cliente')
+
+        antiga.prioridade = 'alta'
+        antiga.save()
+
+        self.conversa.refresh_from_db()
+        self.assertEqual(self.conversa.prioridade, 'alta')
+        self.assertEqual(self.conversa.ultima_interacao_id, interacao.pk)
+        self.assertEqual(self.conversa.nao_lidas, 1)
+
+    def test_snapshot_so_avanca(self):
+        primeira = Interacao.objects.create(conversa=self.conversa, mensagem='primeira', remetente='cliente')
+        segunda = Interacao.objects.create(conversa=self.conversa, mensagem='segunda', remetente='cliente')
+
+        # Commit da primeira chegando depois (mensagens concorrentes)
+        primeira._atualizar_snapshot_conversa()
+
+        self.conversa.refresh_from_db()
+        self.assertEqual(self.conversa.ultima_interacao_id, segunda.pk)
+
+    def test_instancia_carregada_fica_coerente(self):
+        Interacao.objects.create(conversa=self.conversa, mensagem='oi', remetente='cliente')
+
+        self.assertEqual(self.conversa.ultima_mensagem_texto, 'oi')
+        self.assertEqual(self.conversa.nao_lidas, 1)
+
+    def test_abrir_a_conversa_zera_nao_lidas(self):
+        Interacao.objects.create(conversa=self.conversa, mensagem='oi', remetente='cliente')
+
+        resposta = self.api().get(reverse('contatos:conversa_detail', args=[self.conversa.pk]), HTTP_HOST='localhost')
+
+        self.assertEqual(resposta.status_code, 200)
+        self.conversa.refresh_from_db()
+        self.assertEqual(self.conversa.nao_lidas, 0)
+
+    def test_listagem_nao_depende_do_tamanho_do_historico(self):
+        Interacao.objects.create(conversa=self.conversa, mensagem='oi', remetente='cliente')
+        url = reverse('contatos:conversa_list')
+        with CaptureQueriesContext(connection) as curto:
+            self.api().get(url, HTTP_HOST='localhost')
+
+        for i in range(20):
+            Interacao.objects.create(conversa=self.conversa, mensagem=f'msg {i}', remetente='cliente')
+        with CaptureQueriesContext(connection) as longo:
+            resposta = self.api().get(url, HTTP_HOST='localhost')
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(len(longo), len(curto))
+        self.assertEqual(resposta.json()['results'][0]['nao_lidas'], 21)
+
+
+class PaginacaoCursorMensagensTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('operador', password='x')
+        contato = Contato.objects.create(nome='Fulano', telefone='11999999999', criado_por=self.usuario)
+        self.conversa = Conversa.objects.create(contato=contato)
+        self.ids = [
+            Interacao.objects.create(conversa=self.conversa, mensagem=f'msg {i}', remetente='cliente').pk
+            for i in range(7)
+        ]
+        # Mesmo criado_em em todas: o desempate pelo id tem que manter a ordem
+        Interacao.objects.update(criado_em=timezone.now())
+        self.api = APIClient()
+        self.api.force_authenticate(self.usuario)
+        self.url = reverse('contatos:conversa_mensagens', args=[self.conversa.pk])
+
+    def get(self, url, **params):
+        resposta = self.api.get(url, params, HTTP_HOST='localhost')
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.json()
+
+    def test_carregar_anteriores_percorre_o_historico_sem_repetir(self):
+        pagina = self.get(self.url, page_size=3)
+        self.assertEqual([m['id'] for m in pagina['results']], self.ids[4:])
+
+        vistos = [m['id'] for m in pagina['results']]
+        while pagina['tem_mais']:
+            pagina = self.get(self.url, page_size=3, antes=pagina['cursor_anterior'])
+            vistos = [m['id'] for m in pagina['results']] + vistos
+
+        self.assertEqual(vistos, self.ids)
+
+    def test_pagina_exata_nao_anuncia_mais(self):
+        pagina = self.get(self.url, page_size=7)
+
+        self.assertEqual(len(pagina['results']), 7)
+        self.assertFalse(pagina['tem_mais'])
+
+        primeira = self.get(self.url, page_size=6)
+        resto = self.get(self.url, page_size=6, antes=primeira['cursor_anterior'])
+        self.assertTrue(primeira['tem_mais'])
+        self.assertEqual([m['id'] for m in resto['results']], self.ids[:1])
+        self.assertFalse(resto['tem_mais'])
+
+    def test_depois_traz_so_as_novas(self):
+        pagina = self.get(self.url, page_size=3)
+        nova = Interacao.objects.create(conversa=self.conversa, mensagem='nova', remetente='cliente')
+
+        novas = self.get(self.url, depois=pagina['cursor_posterior'])
+
+        self.assertEqual([m['id'] for m in novas['results']], [nova.pk])
+        self.assertFalse(novas['tem_mais'])
+
+    def test_depois_com_mais_novas_que_a_pagina(self):
+        antiga = self.get(self.url, page_size=1, antes=self.get(self.url, page_size=6)['cursor_anterior'])
+
+        novas = self.get(self.url, page_size=4, depois=antiga['cursor_posterior'])
+
+        self.assertEqual([m['id'] for m in novas['results']], self.ids[1:5])
+        self.assertTrue(novas['tem_mais'])
+
+    def test_pagina_vazia_mantem_o_cursor(self):
+        pagina = self.get(self.url)
+
+        vazia = self.get(self.url, depois=pagina['cursor_posterior'])
+
+        self.assertEqual(vazia['results'], [])
+        self.assertEqual(vazia['cursor_posterior'], pagina['cursor_posterior'])
+
+    def test_page_size_fora_dos_limites(self):
+        self.assertEqual(len(self.get(self.url, page_size=0)['results']), 1)
+        self.assertEqual(len(self.get(self.url, page_size='abc')['results']), 7)
+        self.assertEqual(len(self.get(self.url, page_size=10000)['results']), 7)
+
+    def test_cursor_invalido(self):
+        resposta = self.api.get(self.url, {'antes': 'nao-e-cursor'}, HTTP_HOST='localhost')
+
+        self.assertEqual(resposta.status_code, 404)
+
+    def test_busca_vem_das_mais_recentes(self):
+        url = reverse('contatos:buscar-mensagens')
+
+        pagina = self.get(url, conversa=self.conversa.pk, page_size=4)
+        seguinte = self.get(url, conversa=self.conversa.pk, page_size=4, antes=pagina['cursor_anterior'])
+
+        self.assertEqual(
+            [m['id'] for m in pagina['results'] + seguinte['results']],
+            list(reversed(self.ids))
+        )
+
+
+class BuscaMensagensTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('operador', password='x')
+        maria = Contato.objects.create(nome='Maria Aparecida', telefone='5511988887777', criado_por=self.usuario)
+        joao = Contato.objects.create(nome='João', telefone='5521911112222', criado_por=self.usuario)
+        self.conversa_maria = Conversa.objects.create(contato=maria)
+        self.conversa_joao = Conversa.objects.create(contato=joao)
+        self.boleto = Interacao.objects.create(conversa=self.conversa_joao, mensagem='Preciso da segunda via dos boletos', remetente='cliente')
+        self.oi = Interacao.objects.create(conversa=self.conversa_maria, mensagem='oi', remetente='cliente')
+        self.api = APIClient()
+        self.api.force_authenticate(self.usuario)
+        self.url = reverse('contatos:buscar-mensagens')
+
+    def buscar(self, **params):
+        resposta = self.api.get(self.url, params, HTTP_HOST='localhost')
+        self.assertEqual(resposta.status_code, 200)
+        return [m['id'] for m in resposta.json()['results']]
+
+    def test_busca_pela_mensagem(self):
+        self.assertEqual(self.buscar(search='boleto'), [self.boleto.pk])
+
+    def test_busca_por_fragmento_de_nome_e_telefone_do_contato(self):
+        self.assertEqual(self.buscar(search='Apareci'), [self.oi.pk])
+        self.assertEqual(self.buscar(search='88887'), [self.oi.pk])
+
+    def test_ordem_relevancia_pagina_por_numero(self):
+        resposta = self.api.get(self.url, {'ordem': 'relevancia', 'page_size': 1}, HTTP_HOST='localhost')
+
+        self.assertEqual(resposta.status_code, 200)
+        corpo = resposta.json()
+        self.assertEqual(corpo['count'], 2)
+        self.assertEqual([m['id'] for m in corpo['results']], [self.oi.pk])
+
+    @skipUnless(connection.vendor == 'postgresql', 'trigger de busca só existe no PostgreSQL')
+    def test_trigger_mantem_o_vetor_de_busca(self):
+        self.boleto.refresh_from_db()
+        self.assertIn('bolet', self.boleto.busca_vetor)
+
+        Interacao.objects.filter(pk=self.boleto.pk).update(mensagem='pagamento confirmado')
+
+        self.boleto.refresh_from_db()
+        self.assertNotIn('bolet', self.boleto.busca_vetor)
+        self.assertEqual(self.buscar(search='pagamentos'), [self.boleto.pk])
+
+    @skipUnless(connection.vendor == 'postgresql', 'rank do full-text só existe no PostgreSQL')
+    def test_relevancia_ordena_pelo_rank(self):
+        forte = Interacao.objects.create(conversa=self.conversa_maria, mensagem='boleto boleto vencido, boleto', remetente='cliente')
+
+        self.assertEqual(self.buscar(search='boleto', ordem='relevancia'), [forte.pk, self.boleto.pk])
+
+
+class TempoRespostaTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('operador', password='x', first_name='Ana')
+        self.operador = Operador.objects.create(user=self.usuario)
+        contato = Contato.objects.create(nome='Fulano', telefone='11999999999', criado_por=self.usuario)
+        self.conversa = Conversa.objects.create(contato=contato)
+        self.inicio = timezone.now() - timedelta(hours=1)
+        cache.clear()
+
+    def mensagem(self, minutos, operador=None):
+        """Interação criada 'minutos' depois do início do teste"""
+        with mock.patch('django.utils.timezone.now', return_value=self.inicio + timedelta(minutes=minutos)):
+            return Interacao.objects.create(
+                conversa=self.conversa, mensagem='msg', remetente='operador' if operador else 'cliente', operador=operador
+            )
+
+    def test_resposta_registra_a_espera_desde_a_ultima_mensagem_do_cliente(self):
+        self.mensagem(0)
+        ultima_do_cliente = self.mensagem(2)
+        resposta = self.mensagem(5, self.operador)
+
+        tempo = TempoResposta.objects.get()
+        self.assertEqual(tempo.interacao, resposta)
+        self.assertEqual(tempo.operador, self.operador)
+        self.assertEqual(tempo.aguardando_desde, ultima_do_cliente.criado_em)
+        self.assertEqual(tempo.segundos, 180)
+
+    def test_resposta_sem_mensagem_do_cliente_nao_gera_registro(self):
+        self.mensagem(0, self.operador)
+
+        self.assertFalse(TempoResposta.objects.exists())
+
+    def test_respostas_seguidas_contam_da_mesma_mensagem(self):
+        self.mensagem(0)
+        self.mensagem(1, self.operador)
+        self.mensagem(4, self.operador)
+
+        self.assertEqual(sorted(TempoResposta.objects.values_list('segundos', flat=True)), [60, 240])
+
+    def test_migracao_preenche_o_historico_igual_a_gravacao(self):
+        self.mensagem(0, self.operador)
+        self.mensagem(1)
+        self.mensagem(3, self.operador)
+        self.mensagem(10)
+        self.mensagem(12, self.operador)
+        esperado = list(TempoResposta.objects.order_by('interacao_id').values_list('interacao_id', 'aguardando_desde', 'segundos'))
+        TempoResposta.objects.all().delete()
+
+        migracao = importlib.import_module('atendimento.migrations.0013_temporesposta')
+        migracao.preencher_tempos_resposta(apps, None)
+
+        self.assertEqual(
+            list(TempoResposta.objects.order_by('interacao_id').values_list('interacao_id', 'aguardando_desde', 'segundos')),
+            esperado
+        )
+
+    def test_estatisticas_usam_os_tempos_registrados(self):
+        self.mensagem(0)
+        self.mensagem(2, self.operador)
+        self.mensagem(10)
+        self.mensagem(16, self.operador)
+        api = APIClient()
+        api.force_authenticate(self.usuario)
+        url = reverse('contatos:atendimento_stats')
+
+        resposta = api.get(url, HTTP_HOST='localhost')
+        cache.clear()
+        with CaptureQueriesContext(connection) as antes:
+            api.get(url, HTTP_HOST='localhost')
+        for minuto in range(20, 40, 2):
+            self.mensagem(minuto)
+            self.mensagem(minuto + 1, self.operador)
+        cache.clear()  # Resposta fica em cache por DASHBOARD_CACHE_SEGUNDOS
+        with CaptureQueriesContext(connection) as depois:
+            api.get(url, HTTP_HOST='localhost')
+
+        self.assertEqual(resposta.status_code, 200)
+        [desempenho] = resposta.json()['operadores_performance']
+        self.assertEqual(desempenho['tempo_medio_min'], 4.0)
+        self.assertEqual(resposta.json()['tempo_resposta_medio_min'], 2.0)
+        self.assertEqual(len(depois), len(antes))
+
+
+class IndicesConsultasTests(TestCase):
+    def indices(self, tabela):
+        with connection.cursor() as cursor:
+            restricoes = connection.introspection.get_constraints(cursor, tabela)
+        return {nome: info['columns'] for nome, info in restricoes.items() if info['index']}
+
+    def test_indices_compostos_e_parciais_existem(self):
+        interacao = self.indices(Interacao._meta.db_table)
+        conversa = self.indices(Conversa._meta.db_table)
+
+        self.assertEqual(interacao['interacao_conversa_criado_idx'], ['conversa_id', 'criado_em', 'id'])
+        self.assertEqual(interacao['interacao_criado_remet_idx'], ['criado_em', 'remetente'])
+        self.assertEqual(interacao['interacao_whatsapp_id_idx'], ['whatsapp_id'])
+        self.assertEqual(conversa['conversa_status_atualiz_idx'], ['status', 'atualizado_em'])
+        self.assertEqual(conversa['conversa_ativa_unica_contato'], ['contato_id'])
+        self.assertEqual(self.indices(Contato._meta.db_table)['contato_telefone_idx'], ['telefone', 'criado_por_id'])
+
+    def test_indice_simples_do_fk_da_conversa_foi_removido(self):
+        so_conversa = [nome for nome, colunas in self.indices(Interacao._meta.db_table).items() if colunas == ['conversa_id']]
+
+        self.assertEqual(so_conversa, [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'formato do EXPLAIN do SQLite')
+    def test_historico_usa_o_indice_composto(self):
+        plano = Interacao.objects.filter(conversa_id=1).order_by('criado_em', 'id').explain()
+
+        self.assertIn('interacao_conversa_criado_idx', plano)
+        self.assertNotIn('TEMP B-TREE', plano)
+
+    def test_benchmark_desfaz_a_massa(self):
+        saida = io.StringIO()
+
+        call_command('benchmark_indices', contatos=5, mensagens=2, repeticoes=1, stdout=saida)
+
+        self.assertIn('interacao_conversa_criado_idx', self.indices(Interacao._meta.db_table))
+        self.assertFalse(Contato.objects.exists())
+        self.assertFalse(Interacao.objects.exists())
+
+
+class ConversaAbertaUnicaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('operador', password='x')
+        self.contato = Contato.objects.create(nome='Fulano', telefone='11999999999', criado_por=self.usuario)
+        self.api = APIClient()
+        self.api.force_authenticate(self.usuario)
+
+    def test_reaproveita_a_conversa_aberta(self):
+        conversa, criada = Conversa.obter_ou_criar_aberta(self.contato)
+        mesma, criada_de_novo = Conversa.obter_ou_criar_aberta(self.contato)
+
+        self.assertTrue(criada)
+        self.assertFalse(criada_de_novo)
+        self.assertEqual(mesma, conversa)
+
+    def test_reaproveitar_devolve_a_mais_recente_finalizada(self):
+        finalizada = Conversa.objects.create(contato=self.contato, status='finalizada')
+
+        conversa, criada = Conversa.obter_ou_criar_aberta(self.contato, reaproveitar=True)
+
+        self.assertFalse(criada)
+        self.assertEqual(conversa, finalizada)
+
+    def test_segunda_conversa_aberta_perde_no_insert(self):
+        Conversa.objects.create(contato=self.contato, status='atendimento')
+
+        self.assertFalse(inserir_se_ausente(Conversa(contato=self.contato, status='entrada')))
+        self.assertTrue(inserir_se_ausente(Conversa(contato=self.contato, status='finalizada')))
+
+    def test_perdedor_da_corrida_le_a_vencedora(self):
+        vencedora = []
+
+        def outro_worker_insere_antes(conversa):
+            # O INSERT concorrente commitou entre o SELECT e o nosso INSERT
+            vencedora.append(Conversa.objects.create(contato=self.contato, status='entrada'))
+            return inserir_se_ausente(conversa)
+
+        with mock.patch('atendimento.models.inserir_se_ausente', side_effect=outro_worker_insere_antes):
+            conversa, criada = Conversa.obter_ou_criar_aberta(self.contato)
+
+        self.assertFalse(criada)
+        self.assertEqual(conversa, vencedora[0])
+        self.assertEqual(Conversa.objects.filter(contato=self.contato).count(), 1)
+
+    def test_conversa_do_upsert_entra_nos_contadores(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Conversa.obter_ou_criar_aberta(self.contato)
+
+        valores = contadores.obter([self.usuario.id])
+        self.assertEqual(valores[contadores.CONVERSAS_TOTAL], 1)
+        self.assertEqual(contadores.por_prefixo(valores, contadores.CONVERSAS_STATUS), {'entrada': 1})
+
+    def patch_status(self, conversa, status):
+        return self.api.patch(
+            reverse('contatos:conversa_detail', args=[conversa.pk]), {'status': status}, format='json', HTTP_HOST='localhost'
+        )
+
+    def test_reabrir_com_outra_aberta_e_400(self):
+        Conversa.objects.create(contato=self.contato, status='entrada')
+        finalizada = Conversa.objects.create(contato=self.contato, status='finalizada')
+
+        resposta = self.patch_status(finalizada, 'atendimento')
+
+        self.assertEqual(resposta.status_code, 400)
+        self.assertIn('status', resposta.json())
+
+    def test_corrida_na_reabertura_vira_400(self):
+        Conversa.objects.create(contato=self.contato, status='entrada')
+        finalizada = Conversa.objects.create(contato=self.contato, status='finalizada')
+
+        # Outra conversa aberta entre a validação e o UPDATE: só a constraint pega
+        with mock.patch.object(Conversa, 'bloqueia_reabertura', return_value=False):
+            resposta = self.patch_status(finalizada, 'atendimento')
+
+        self.assertEqual(resposta.status_code, 400)
+        finalizada.refresh_from_db()
+        self.assertEqual(finalizada.status, 'finalizada')
+
+
+class PublicacaoInboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.chefe = User.objects.create_user('chefe', password='x')
+        self.membro = User.objects.create_user('membro', password='x')
+        perfil = self.membro.perfil_usuario.get()
+        perfil.criado_por = self.chefe
+        perfil.save()
+        contato = Contato.objects.create(nome='Fulano', telefone='11999999999', criado_por=self.membro)
+        self.conversa = Conversa.objects.create(contato=contato)
+        publicar = mock.patch.object(tempo_real, 'publicar')
+        self.publicar = publicar.start()
+        self.addCleanup(publicar.stop)
+
+    def eventos(self):
+        return [(chamada.args[0], chamada.args[1], chamada.args[2]) for chamada in self.publicar.call_args_list]
+
+    def test_nova_interacao_vai_para_o_tenant_do_dono(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            interacao = Interacao.objects.create(conversa=self.conversa, mensagem='oi', remetente='cliente')
+
+        [(tenant, tipo, dados)] = self.eventos()
+        self.assertEqual((tenant, tipo), (self.chefe.id, 'interacao'))
+        self.assertEqual(dados['id'], interacao.pk)
+        self.assertEqual(dados['cursor'], codificar_cursor(interacao))
+
+    def test_conversa_sem_dono_vai_para_o_canal_sem_dono(self):
+        sem_dono = Conversa.objects.create(contato=Contato.objects.create(nome='Webhook', telefone='11988887777'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Interacao.objects.create(conversa=sem_dono, mensagem='oi', remetente='cliente')
+
+        self.assertEqual(self.eventos()[0][0], None)
+
+    def test_troca_de_status_publica_o_anterior(self):
+        conversa = Conversa.objects.get(pk=self.conversa.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            conversa.status = 'atendimento'
+            conversa.save()
+            conversa.prioridade = 'alta'
+            conversa.save()
+
+        [(_, tipo, dados)] = self.eventos()
+        self.assertEqual(tipo, 'conversa')
+        self.assertEqual((dados['status_anterior'], dados['status']), ('entrada', 'atendimento'))
+
+    def test_update_fields_sem_status_nao_publica_troca(self):
+        conversa = Conversa.objects.get(pk=self.conversa.pk)
+        conversa.status = 'atendimento'
+
+        with self.captureOnCommitCallbacks(execute=True):
+            conversa.save(update_fields=['prioridade'])
+        self.assertEqual(self.eventos(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            conversa.save(update_fields=['status'])
+        self.assertEqual([tipo for _, tipo, _ in self.eventos()], ['conversa'])
+
+    def test_atendimento_humano(self):
+        conversa = Conversa.objects.get(pk=self.conversa.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            conversa.atendimento_humano = True
+            conversa.save()
+
+        self.assertEqual([tipo for _, tipo, _ in self.eventos()], ['atendimento_humano'])
+
+    def test_rollback_nao_publica(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            Interacao.objects.create(conversa=self.conversa, mensagem='oi', remetente='cliente')
+
+        self.publicar.assert_not_called()
+
+
+class PublicarRedisTests(TestCase):
+    def setUp(self):
+        self.addCleanup(tempo_real._recursos.update, {'pausa_ate': 0.0})
+        tempo_real._recursos['pausa_ate'] = 0.0
+
+    def test_publica_no_stream_e_no_canal_do_tenant(self):
+        script = mock.Mock(return_value=b'1700000000000-0')
+
+        with mock.patch.object(tempo_real, '_script', return_value=script):
+            id_evento = tempo_real.publicar(7, 'interacao', {'id': 1})
+
+        self.assertEqual(id_evento, '1700000000000-0')
+        self.assertEqual(script.call_args.kwargs['keys'], ['inbox:stream:7', 'inbox:7'])
+
+    def test_redis_fora_nao_quebra_e_pausa(self):
+        script = mock.Mock(side_effect=redis.ConnectionError('fora'))
+
+        with mock.patch.object(tempo_real, '_script', return_value=script):
+            self.assertIsNone(tempo_real.publicar(None, 'interacao', {}))
+            self.assertIsNone(tempo_real.publicar(None, 'interacao', {}))
+
+        self.assertEqual(script.call_count, 1)
+
+    @override_settings(INBOX_PUSH_ATIVO=False)
+    def test_desativado(self):
+        with mock.patch.object(tempo_real, '_script') as script:
+            self.assertIsNone(tempo_real.publicar(7, 'interacao', {}))
+
+        script.assert_not_called()
+
+    @override_settings(INBOX_PUSH_ATIVO=False)
+    def test_endpoint_desativado(self):
+        self.assertEqual(self.client.get(reverse('contatos:inbox_eventos'), HTTP_HOST='localhost').status_code, 503)
+
+    def test_endpoint_sem_credenciais(self):
+        resposta = self.client.get(reverse('contatos:inbox_eventos'), {'token': 'invalido'}, HTTP_HOST='localhost')
+
+        self.assertEqual(resposta.status_code, 401)
+
+
+class StreamFalso:
+    """xrange/xrevrange de um Redis em memória (ids 'ms-seq')"""
+
+    def __init__(self, **streams):
+        self.streams = {nome: [(i.encode(), {b'e': e.encode()}) for i, e in itens] for nome, itens in streams.items()}
+
+    async def xrange(self, stream, min='-', count=None):
+        itens = self.streams.get(stream, [])
+        if min.startswith('('):
+            itens = [item for item in itens if tempo_real._id(item[0].decode()) > tempo_real._id(min[1:])]
+        return itens[:count]
+
+    async def xrevrange(self, stream, count=None):
+        return list(reversed(self.streams.get(stream, [])))[:count]
+
+
+class RetomadaInboxTests(TestCase):
+    STREAMS = ['inbox:stream:7', 'inbox:stream:sem-dono']
+
+    def evento(self, n):
+        return json.dumps({'tipo': 'interacao', 'dados': {'n': n}})
+
+    def pendentes(self, cliente, ids):
+        return asyncio.run(tempo_real._pendentes(cliente, self.STREAMS, ids))
+
+    def test_cursor_invalido_comeca_do_agora(self):
+        self.assertIsNone(tempo_real.decodificar_cursor('abc', 2))
+        self.assertIsNone(tempo_real.decodificar_cursor('1-0', 2))
+        self.assertEqual(tempo_real.decodificar_cursor('1-0,0-0', 2), ['1-0', '0-0'])
+
+    def test_reenvia_o_que_passou_dos_dois_streams_em_ordem(self):
+        cliente = StreamFalso(**{
+            'inbox:stream:7': [('1-0', self.evento(1)), ('3-0', self.evento(3))],
+            'inbox:stream:sem-dono': [('2-0', self.evento(2))],
+        })
+
+        pendentes = self.pendentes(cliente, ['1-0', '0-0'])
+
+        self.assertEqual([(indice, id_evento) for indice, id_evento, _ in pendentes], [(1, '2-0'), (0, '3-0')])
+
+    def test_cursor_aparado_pede_reset(self):
+        cliente = StreamFalso(**{'inbox:stream:7': [('5-0', self.evento(5))], 'inbox:stream:sem-dono': []})
+
+        self.assertIsNone(self.pendentes(cliente, ['2-0', '0-0']))
+
+    @override_settings(INBOX_REPLAY_MAX=2)
+    def test_atraso_grande_demais_pede_reset(self):
+        cliente = StreamFalso(**{
+            'inbox:stream:7': [(f'{n}-0', self.evento(n)) for n in range(1, 6)],
+            'inbox:stream:sem-dono': [],
+        })
+
+        self.assertIsNone(self.pendentes(cliente, ['1-0', '0-0']))
+        self.assertEqual(len(self.pendentes(cliente, ['3-0', '0-0'])), 2)
+
+
+@override_settings(ENVIO_TAXA_POR_SEGUNDO=2, ENVIO_RAJADA=3, ENVIO_RESERVA_OPERADOR=1, ENVIO_ESPERA_MAX_SEGUNDOS=1)
+class TokenBucketEnvioTests(TestCase):
+    def setUp(self):
+        self.agora = 1000.0
+        self.script = mock.Mock(side_effect=redis.ConnectionError('fora do ar'))
+        recursos = mock.patch.dict(envio._recursos, {'script': self.script, 'pausa_ate': 0.0, 'baldes': {}})
+        recursos.start()
+        self.addCleanup(recursos.stop)
+        processo = mock.patch.object(envio, '_recursos_do_processo', return_value=envio._recursos)
+        processo.start()
+        self.addCleanup(processo.stop)
+        relogio = mock.patch.object(envio.time, 'monotonic', side_effect=lambda: self.agora)
+        relogio.start()
+        self.addCleanup(relogio.stop)
+
+    def consumir(self, vezes, instancia='inst1', prioridade=envio.PRIORIDADE_OPERADOR):
+        return [envio.consumir_token(instancia, prioridade) for _ in range(vezes)]
+
+    def test_operador_usa_a_rajada_inteira(self):
+        self.assertEqual(self.consumir(4), [0, 0, 0, 0.5])
+
+    def test_automatico_deixa_a_reserva_do_operador(self):
+        self.assertEqual(self.consumir(3, prioridade=envio.PRIORIDADE_AUTOMATICA), [0, 0, 0.5])
+        self.assertEqual(self.consumir(1), [0])
+
+    def test_balde_reabastece_com_o_tempo(self):
+        self.consumir(3)
+        self.agora += 0.5
+
+        self.assertEqual(self.consumir(2), [0, 0.5])
+
+    def test_balde_por_instancia(self):
+        self.consumir(3, instancia='inst1')
+
+        self.assertEqual(self.consumir(1, instancia='inst2'), [0])
+
+    def test_redis_responde_em_milissegundos(self):
+        self.script.side_effect = None
+        self.script.return_value = 250
+
+        self.assertEqual(self.consumir(1, prioridade=envio.PRIORIDADE_AUTOMATICA), [0.25])
+        self.script.assert_called_once_with(keys=['envio:balde:inst1'], args=[2, 3, 1])
+
+    def test_redis_fora_do_ar_cai_no_balde_local_e_pausa(self):
+        self.assertEqual(self.consumir(4), [0, 0, 0, 0.5])
+
+        self.script.assert_called_once()
+        self.assertEqual(envio._recursos['pausa_ate'], self.agora + envio.PAUSA_FALHA_SEGUNDOS)
+
+    def test_sem_bloquear_levanta_envio_adiado(self):
+        self.consumir(3)
+
+        with self.assertRaises(envio.EnvioAdiado) as erro:
+            envio.aguardar_token('inst1', bloquear=False)
+        self.assertEqual((erro.exception.instancia, erro.exception.espera), ('inst1', 0.5))
+
+    def test_bloqueando_dorme_ate_o_token(self):
+        self.consumir(3)
+
+        def dormir(segundos):
+            self.agora += segundos
+
+        with mock.patch.object(envio.time, 'sleep', side_effect=dormir) as sleep:
+            envio.aguardar_token('inst1')
+        sleep.assert_called_once_with(0.5)
+
+    @override_settings(ENVIO_RESERVA_OPERADOR=2)
+    def test_espera_acima_do_limite_nao_dorme(self):
+        self.consumir(3)
+
+        with mock.patch.object(envio.time, 'sleep') as sleep:
+            with self.assertRaises(envio.EnvioAdiado) as erro:
+                envio.aguardar_token('inst1', prioridade=envio.PRIORIDADE_AUTOMATICA)
+        self.assertEqual(erro.exception.espera, 1.5)
+        sleep.assert_not_called()
+
+
+class StatusEntregaTests(TestCase):
+    def setUp(self):
+        contato = Contato.objects.create(nome='Fulano', telefone='11999999999')
+        self.conversa = Conversa.objects.create(contato=contato)
+        publicar = mock.patch.object(tempo_real, 'publicar')
+        self.publicar = publicar.start()
+        self.addCleanup(publicar.stop)
+
+    def enviada(self, status='enviada', remetente='operador', whatsapp_id='W1'):
+        return Interacao.objects.create(
+            conversa=self.conversa, mensagem='oi', remetente=remetente,
+            whatsapp_id=whatsapp_id, status_entrega=status,
+        )
+
+    def status(self, interacao):
+        return Interacao.objects.values_list('status_entrega', flat=True).get(pk=interacao.pk)
+
+    def test_extrai_formatos_v1_e_v2(self):
+        data = [
+            {'keyId': 'W1', 'status': 'READ'},
+            {'key': {'id': 'W2'}, 'update': {'status': 3}},
+            {'keyId': 'W3', 'status': 'DESCONHECIDO'},
+            {'status': 'READ'},
+        ]
+
+        self.assertEqual(envio.extrair_status_evolution(data), [('W1', 'lida'), ('W2', 'entregue')])
+        self.assertEqual(envio.extrair_status_evolution({'keyId': 'W1', 'status': 'ERROR'}), [('W1', 'falhou')])
+        self.assertEqual(envio.extrair_status_evolution(None), [])
+
+    def test_status_so_avanca(self):
+        interacao = self.enviada()
+
+        self.assertEqual(envio.registrar_status_entrega('W1', 'lida'), 1)
+        self.assertEqual(envio.registrar_status_entrega('W1', 'entregue'), 0)
+        self.assertEqual(self.status(interacao), 'lida')
+
+    def test_falhou_so_antes_da_entrega(self):
+        entregue = self.enviada(status='entregue')
+        pendente = self.enviada(status='pendente', whatsapp_id='W2')
+
+        self.assertEqual(envio.registrar_status_entrega('W1', 'falhou'), 0)
+        self.assertEqual(envio.registrar_status_entrega('W2', 'falhou'), 1)
+        self.assertEqual((self.status(entregue), self.status(pendente)), ('entregue', 'falhou'))
+
+    def test_eco_do_celular_sem_status_recebe(self):
+        eco = self.enviada(status=None)
+
+        self.assertEqual(envio.registrar_status_entrega('W1', 'entregue'), 1)
+        self.assertEqual(self.status(eco), 'entregue')
+
+    def test_mensagem_do_cliente_nao_recebe_status(self):
+        recebida = self.enviada(status=None, remetente='cliente')
+
+        self.assertEqual(envio.registrar_status_entrega('W1', 'lida'), 0)
+        self.assertIsNone(self.status(recebida))
+
+    def test_publica_evento_de_entrega_apos_commit(self):
+        interacao = self.enviada()
+        self.publicar.reset_mock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            envio.registrar_status_entrega('W1', 'entregue')
+
+        [chamada] = self.publicar.call_args_list
+        tenant, tipo, dados = chamada.args
+        self.assertEqual((tenant, tipo), (None, 'entrega'))
+        self.assertEqual((dados['interacao_id'], dados['status_entrega']), (interacao.pk, 'entregue'))
+
+
+class LeituraCurta(io.BytesIO):
+    """Arquivo de storage remoto: sem fileno e read() devolvendo menos que o pedido"""
+
+    def read(self, tamanho=-1):
+        return super().read(min(tamanho, 1000) if tamanho and tamanho > 0 else tamanho)
+
+
+@override_settings(MIDIA_URL_PUBLICA='http://backend:8000', MIDIA_URL_ASSINADA_SEGUNDOS=300)
+class EnvioMidiaTests(MediaRootTestCase):
+    # Maior que um bloco e fora do múltiplo de 3: exercita o base64 incremental
+    CONTEUDO = bytes(range(256)) * (TAMANHO_BLOCO // 256 + 5) + b'xy'
+
+    def setUp(self):
+        super().setUp()
+        self.nome = default_storage.save('whatsapp_media/documento/contrato.pdf', ContentFile(self.CONTEUDO))
+        config = {'url': 'http://evolution:8080', 'api_key': 'chave', 'instance_name': 'inst1'}
+        with mock.patch('atendimento.utils.get_instance_config', return_value=config):
+            self.sender = WhatsAppMediaSender()
+        self.corpos = []
+        self.status = [201]
+        requisitar = mock.patch('atendimento.media_sender.requisitar', side_effect=self.requisitar)
+        self.requisitar_mock = requisitar.start()
+        self.addCleanup(requisitar.stop)
+
+    def requisitar(self, config, caminho, payload=None, prioridade=None, timeout=None, corpo=None,
+                   content_type='application/json'):
+        # O corpo só pode ser lido enquanto o arquivo está aberto: consome aqui
+        if corpo is not None:
+            dados = b''.join(corpo)
+            self.assertEqual(len(dados), len(corpo))
+            self.corpos.append((content_type, dados))
+        resposta = mock.Mock(status_code=self.status.pop(0) if self.status else 201)
+        resposta.json.return_value = {'key': {'id': 'MSG1'}}
+        return resposta
+
+    def enviar(self):
+        return self.sender.send_media_message('5511999999999', f'/media/{self.nome}', 'documento', caption='segue')
+
+    def baixar(self, url):
+        return self.client.get(url.replace(settings.MIDIA_URL_PUBLICA, ''), HTTP_HOST='localhost')
+
+    def test_modo_url_manda_link_assinado_que_serve_o_arquivo(self):
+        resultado = self.enviar()
+
+        self.assertEqual(resultado['message_id'], 'MSG1')
+        payload = self.requisitar_mock.call_args.args[2]
+        self.assertEqual((payload['mimetype'], payload['caption']), ('application/pdf', 'segue'))
+        self.assertTrue(payload['media'].startswith('http://backend:8000/'))
+        resposta = self.baixar(payload['media'])
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(b''.join(resposta.streaming_content), self.CONTEUDO)
+
+    def test_link_expirado_responde_404(self):
+        url = url_assinada(self.nome)
+
+        depois = signing.time.time() + 301
+        with mock.patch.object(signing.time, 'time', return_value=depois):
+            self.assertEqual(self.baixar(url).status_code, 404)
+
+    def test_link_adulterado_responde_404(self):
+        url = url_assinada(self.nome)
+        token = url.rstrip('/').rsplit('/', 1)[-1]
+        adulterado = token[:-1] + ('A' if token[-1] != 'A' else 'B')
+
+        self.assertEqual(self.baixar(url.replace(token, adulterado)).status_code, 404)
+        self.assertEqual(self.baixar(url.replace(token, signing.dumps(self.nome))).status_code, 404)
+
+    @override_settings(MIDIA_URL_PUBLICA='')
+    def test_sem_url_publica_envia_multipart_em_streaming(self):
+        self.enviar()
+
+        [(content_type, dados)] = self.corpos
+        fronteira = content_type.split('boundary=')[1]
+        self.assertIn(b'name="caption"\r\n\r\nsegue\r\n', dados)
+        inicio = dados.index(b'Content-Type: application/pdf\r\n\r\n') + len(b'Content-Type: application/pdf\r\n\r\n')
+        self.assertEqual(dados[inicio:], self.CONTEUDO + f'\r\n--{fronteira}--\r\n'.encode())
+
+    @override_settings(MIDIA_URL_PUBLICA='')
+    def test_multipart_recusado_reenvia_em_base64(self):
+        self.status = [415, 201]
+
+        resultado = self.enviar()
+
+        self.assertTrue(resultado['success'])
+        content_type, dados = self.corpos[1]
+        self.assertEqual(content_type, 'application/json')
+        self.assertEqual(base64.b64decode(json.loads(dados)['media']), self.CONTEUDO)
+
+    @override_settings(MIDIA_ENVIO_MODO='base64')
+    def test_base64_de_caminho_absoluto_usa_mmap(self):
+        caminho = default_storage.path(self.nome)
+
+        self.sender.send_media_message('5511999999999', caminho, 'documento')
+
+        [(_, dados)] = self.corpos
+        self.assertEqual(base64.b64decode(json.loads(dados)['media']), self.CONTEUDO)
+
+    def test_base64_sem_arquivo_local_guarda_a_sobra_entre_leituras(self):
+        blocos = list(_blocos_base64(LeituraCurta(self.CONTEUDO), len(self.CONTEUDO)))
+
+        self.assertGreater(len(blocos), 1)
+        self.assertEqual(b''.join(blocos), base64.b64encode(self.CONTEUDO))
+
+    def test_arquivo_vazio_nao_e_enviado(self):
+        vazio = default_storage.save('whatsapp_media/documento/vazio.pdf', ContentFile(b''))
+
+        resultado = self.sender.send_media_message('5511999999999', f'/media/{vazio}', 'documento')
+
+        self.assertEqual(resultado, {'success': False, 'error': 'Arquivo de mídia vazio'})
+        self.requisitar_mock.assert_not_called()
@@ -3,9 +3,12 @@
 import requests
 import os
 import uuid
+import base64
+import hashlib
+import tempfile
 import traceback
 from django.utils import timezone
-from django.core.files.base import ContentFile
+from django.core.files.base import File
 from django.core.files.storage import default_storage
 from django.conf import settings
 import logging
@@ -43,6 +46,52 @@ def get_instance_config():
 # ==============================================================================
 # FUNÇÃO DE DOWNLOAD QUE USA A CONFIGURAÇÃO ACIMA
 # ==============================================================================
+# Tipo da Interacao -> tipo usado na derivação da chave (HKDF) do WhatsApp
+MEDIA_TYPES_WHATSAPP = {
+    'audio': 'audio',
+    'imagem': 'image',
+    'video': 'video',
+    'documento': 'document',
+}
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def _salvar_stream(response, path, decryptor=None, file_enc_sha256=None):
+    """
+    Grava o corpo da resposta no default_storage pedaço a pedaço,
+    descriptografando durante o download quando houver decryptor.
+
+    O arquivo nunca fica inteiro em memória: os pedaços passam por um
+    SpooledTemporaryFile (vai para disco acima de FILE_UPLOAD_MAX_MEMORY_SIZE)
+    e o storage copia dele em blocos.
+
+    Returns:
+        Tuple[caminho salvo, bytes baixados]
+    """
+    sha256 = hashlib.sha256() if file_enc_sha256 else None
+    tamanho = 0
+
+    with tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE) as tmp:
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            if not chunk:
+                continue
+            tamanho += len(chunk)
+            if sha256:
+                sha256.update(chunk)
+            tmp.write(decryptor.update(chunk) if decryptor else chunk)
+
+        if decryptor:
+            tmp.write(decryptor.finalize())
+
+        if sha256 and base64.b64encode(sha256.digest()).decode() != str(file_enc_sha256):
+            logger.warning("⚠️ fileEncSha256 não confere - arquivo pode estar corrompido")
+
+        tmp.seek(0)
+        saved_path = default_storage.save(path, File(tmp, name=os.path.basename(path)))
+
+    return saved_path, tamanho
+
 def baixar_e_salvar_media(media_url, tipo_mensagem, nome_original, media_key=None, file_enc_sha256=None):
     """
     Baixa a mídia da URL fornecida pela Evolution API e salva localmente.
@@ -71,9 +120,6 @@ def baixar_e_salvar_media(media_url, tipo_mensagem, nome_original, media_key=Non
         print(f"📊 Status da Resposta HTTP: {response.status_code}")
 
         if response.status_code == 200:
-            file_data = response.content
-            print(f"✅ Download bem-sucedido. Tamanho do arquivo: {len(file_data)} bytes.")
-
             # Definir nome do arquivo inicial
             subfolder = f"whatsapp_media/{tipo_mensagem}/{timezone.now().year}/{timezone.now().month:02d}"
             filename = nome_original or f"{tipo_mensagem}_{uuid.uuid4().hex}"
@@ -93,41 +139,38 @@ def baixar_e_salvar_media(media_url, tipo_mensagem, nome_original, media_key=Non
             # URLs do mmg.whatsapp.net são sempre criptografadas, mesmo sem .enc
             is_encrypted = ('mmg.whatsapp.net' in media_url or '.enc' in media_url) and media_key is not None
             
-            if is_encrypted and tipo_mensagem in ['audio', 'imagem']:
-                print(f"🔐 Detectado arquivo WhatsApp criptografado - iniciando descriptografia...")
-                print(f"🔑 MediaKey disponível: {'SIM' if media_key else 'NÃO'}")
+            decryptor = None
+            if is_encrypted and tipo_mensagem in MEDIA_TYPES_WHATSAPP:
+                print(f"🔐 Detectado arquivo WhatsApp criptografado - descriptografando durante o download...")
                 
                 try:
-                    from core.whatsapp_decrypt import WhatsAppDecryption
-                    # Usar o tipo correto para a descriptografia
-                    media_type = 'audio' if tipo_mensagem == 'audio' else 'image'
-                    decrypted_data = WhatsAppDecryption.decrypt_media(file_data, str(media_key), media_type)
+                    from core.whatsapp_decrypt import WhatsAppStreamDecryptor
+                    decryptor = WhatsAppStreamDecryptor(
+                        base64.b64decode(str(media_key)),
+                        MEDIA_TYPES_WHATSAPP[tipo_mensagem]
+                    )
                     
-                    if decrypted_data:
-                        print(f"✅ Arquivo descriptografado com sucesso: {len(decrypted_data)} bytes")
-                        file_data = decrypted_data
-                        
-                        # Mudar extensão apropriada já que foi descriptografado
-                        if filename.endswith('.enc'):
-                            if tipo_mensagem == 'audio':
-                                filename = filename.replace('.enc', '.ogg')
-                            elif tipo_mensagem == 'imagem':
-                                filename = filename.replace('.enc', '.jpg')
-                        elif tipo_mensagem == 'audio' and '.ogg' not in filename:
-                            filename = filename + '.ogg'
-                        elif tipo_mensagem == 'imagem' and not any(ext in filename.lower() for ext in ['.jpg', '.jpeg', '.png']):
-                            filename = filename + '.jpg'
-                        
-                    else:
-                        print("❌ Descriptografia falhou - salvando arquivo original criptografado")
+                    # Mudar extensão apropriada já que será descriptografado
+                    if filename.endswith('.enc'):
+                        if tipo_mensagem == 'audio':
+                            filename = filename.replace('.enc', '.ogg')
+                        elif tipo_mensagem == 'imagem':
+                            filename = filename.replace('.enc', '.jpg')
+                    elif tipo_mensagem == 'audio' and '.ogg' not in filename:
+                        filename = filename + '.ogg'
+                    elif tipo_mensagem == 'imagem' and not any(ext in filename.lower() for ext in ['.jpg', '.jpeg', '.png']):
+                        filename = filename + '.jpg'
                         
                 except Exception as e:
-                    print(f"❌ Erro na descriptografia: {e}")
+                    print(f"❌ Erro ao preparar descriptografia: {e}")
                     print("⚠️ Salvando arquivo original criptografado como fallback")
+                    decryptor = None
+            
             path = os.path.join(subfolder, filename)
             
             print(f"💾 Salvando arquivo em: {path}")
-            saved_path = default_storage.save(path, ContentFile(file_data))
+            saved_path, tamanho_download = _salvar_stream(response, path, decryptor, file_enc_sha256)
+            print(f"✅ Download bem-sucedido. Tamanho baixado: {tamanho_download} bytes.")
             
             print("--- FIM DO DOWNLOAD (SUCESSO) ---\n")
             return {
@@ -7,13 +7,17 @@ import os
 import time
 import traceback
 import uuid
-from core.utils import get_ids_visiveis
+from asgiref.sync import sync_to_async
+from core.utils import get_ids_visiveis, get_tenant_id
+from core import contadores
 import requests
 from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
-from django.db.models import Q, F, Avg, Count, Min, Max
+from django.db.models import Q, F, Avg, Count, Min, Max, DurationField, ExpressionWrapper
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
+from django.views.decorators.http import require_GET
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics, filters, status
@@ -23,17 +27,23 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.authtoken.models import Token
 from core.models import ConfiguracaoSistema
 from core.utils import get_user_operador
 from core.ffmpeg_service import FFmpegService
 from contato.models import Contato, Operador
 from .utils import baixar_e_salvar_media, get_instance_config
+from . import tempo_real
+from .envio import PRIORIDADE_OPERADOR, EnvioAdiado, requisitar
+from .media_sender import nome_da_url_assinada
 from .models import (
     Conversa,
     Interacao,
     NotaAtendimento,
     RespostasRapidas,
     TarefaAtendimento,
+    TempoResposta,
+    STATUS_CONVERSA_ATIVOS,
 )
 from .serializers import (
     ConversaDetailSerializer,
@@ -44,29 +54,34 @@ from .serializers import (
     TarefaAtendimentoSerializer,
     TarefaCreateSerializer,
 )
+from .busca import BuscaMensagensFilter
+from .pagination import BuscaCursorPagination, BuscaRelevanciaPagination, InteracaoCursorPagination
 from .utils import baixar_e_salvar_media
 
 logger = logging.getLogger(__name__)
 
 
-def enviar_mensagem_whatsapp(numero, mensagem, instance_name=None, evolution_api_url=None, api_key=None):
-    """Envia mensagem via Evolution API - VERSÃO FINAL VPS"""
-    config = get_instance_config()
+def enviar_mensagem_whatsapp(numero, mensagem, instance_name=None, evolution_api_url=None, api_key=None,
+                             prioridade=PRIORIDADE_OPERADOR, bloquear=True):
+    """
+    Envia mensagem via Evolution API (pelo despachante: limite por instância e conexões reaproveitadas)
 
-    url = f"{evolution_api_url or config['url']}/message/sendText/{instance_name or config['instance_name']}"
+    Sem token dentro da espera permitida retorna success=False e 'adiado' (segundos até o próximo).
+    """
+    config = get_instance_config()
+    config = {
+        'url': evolution_api_url or config['url'],
+        'api_key': api_key or config['api_key'],
+        'instance_name': instance_name or config['instance_name'],
+    }
 
     payload = {
         "number": numero,
         "text": mensagem
     }
 
-    headers = {
-        'apikey': api_key or config['api_key'],
-        'Content-Type': 'application/json'
-    }
-
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = requisitar(config, '/message/sendText', payload, prioridade, timeout=10, bloquear=bloquear)
 
         if response.status_code in [200, 201]:
             response_data = response.json()
@@ -99,6 +114,9 @@ def enviar_mensagem_whatsapp(numero, mensagem, instance_name=None, evolution_api
                 "details": response.text[:200]
             }
 
+    except EnvioAdiado as e:
+        logger.warning(f"⏳ {e}")
+        return {"success": False, "error": str(e), "adiado": e.espera}
     except Exception as e:
         logger.error(f"💥 Erro ao enviar mensagem: {str(e)}")
         return {"success": False, "error": str(e)}
@@ -362,9 +380,8 @@ class ConversaListView(generics.ListAPIView):
     ordering = ['-atualizado_em']
     
     def get_queryset(self):
-        return Conversa.objects.select_related('contato', 'operador__user').prefetch_related(
-            'interacoes'
-        )
+        # Última mensagem vem do snapshot da Conversa: nada de carregar o histórico
+        return Conversa.objects.select_related('contato', 'operador__user')
     
     def get_serializer_context(self):
         """✅ GARANTIR request context para URLs completas"""
@@ -415,7 +432,6 @@ class ConversaCreateView(generics.CreateAPIView):
     
     def create(self, request, *args, **kwargs):
         """Sobrescrever create para lidar com conversas existentes"""
-        import re
         operador = get_user_operador(request.user)
         contato_id = request.data.get('contato')
         
@@ -425,7 +441,6 @@ class ConversaCreateView(generics.CreateAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Buscar contato para normalizar telefone
         from contato.models import Contato
         try:
             contato = Contato.objects.get(id=contato_id)
@@ -435,40 +450,12 @@ class ConversaCreateView(generics.CreateAPIView):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Normalizar telefone do contato (remover tudo que não é número)
-        telefone_normalizado = re.sub(r'\D', '', contato.telefone) if contato.telefone else ''
-        
-        # Buscar conversa existente por telefone normalizado OU por contato_id
-        # Isso evita duplicatas quando o telefone varia (999152039 vs 99152039)
-        conversa_existente = None
-        if telefone_normalizado:
-            # Buscar todos os contatos com telefone similar
-            contatos_similares = Contato.objects.filter(
-                criado_por=contato.criado_por
-            ).exclude(telefone__isnull=True).exclude(telefone='')
-            
-            # Filtrar por telefone normalizado
-            for c in contatos_similares:
-                telefone_c = re.sub(r'\D', '', c.telefone) if c.telefone else ''
-                # Comparar últimos 10 ou 11 dígitos (ignora código do país)
-                if telefone_c and telefone_normalizado:
-                    tel_curto = telefone_normalizado[-11:]
-                    tel_c_curto = telefone_c[-11:]
-                    if tel_curto == tel_c_curto or tel_curto[-10:] == tel_c_curto[-10:]:
-                        # Encontrou contato com telefone similar, buscar conversa ativa
-                        conversa_existente = Conversa.objects.filter(
-                            contato=c,
-                            status__in=['entrada', 'atendimento']
-                        ).first()
-                        if conversa_existente:
-                            break
-        
-        # Se não encontrou por telefone, buscar por contato_id direto
-        if not conversa_existente:
-            conversa_existente = Conversa.objects.filter(
-                contato_id=contato_id,
-                status__in=['entrada', 'atendimento']
-            ).first()
+        # Telefone variando (999152039 vs 99152039) já cai na mesma chave E.164,
+        # única por dono: a conversa ativa do próprio contato basta
+        conversa_existente = Conversa.objects.filter(
+            contato=contato,
+            status__in=STATUS_CONVERSA_ATIVOS
+        ).first()
         
         if conversa_existente:
             # Atualizar operador se necessário
@@ -518,9 +505,8 @@ class ConversaDetailView(generics.RetrieveUpdateAPIView):
     """
     ✅ API: Detalha conversa com URLs locais nas interações
     """
-    queryset = Conversa.objects.all().prefetch_related(
-        'interacoes__operador__user'
-    ).select_related('contato', 'operador__user')  # ✅ Otimizar queries
+    # Interações vêm paginadas pelo serializer (só a página mais recente)
+    queryset = Conversa.objects.all().select_related('contato', 'operador__user')  # ✅ Otimizar queries
     permission_classes = [IsAuthenticated]
     
     def get_serializer_class(self):
@@ -536,6 +522,12 @@ class ConversaDetailView(generics.RetrieveUpdateAPIView):
         context['request'] = self.request
         return context
     
+    def retrieve(self, request, *args, **kwargs):
+        """Abrir a conversa zera o contador de não lidas"""
+        response = super().retrieve(request, *args, **kwargs)
+        Conversa.objects.filter(pk=kwargs.get('pk'), nao_lidas__gt=0).update(nao_lidas=0)
+        return response
+    
     def update(self, request, *args, **kwargs):
         """
         ✅ Sobrescrever update para retornar dados completos após PATCH/PUT
@@ -622,17 +614,73 @@ def toggle_atendimento_humano(request, conversa_id):
         }, status=500)
 
 
+async def _autenticar_inbox(request):
+    """Token no header ou em ?token= (EventSource não envia headers), senão a sessão"""
+    cabecalho = request.headers.get('Authorization', '')
+    chave = cabecalho[len('Token '):] if cabecalho.startswith('Token ') else request.GET.get('token')
+    if chave:
+        token = await Token.objects.select_related('user').filter(key=chave, user__is_active=True).afirst()
+        return token.user if token else None
+
+    usuario = await request.auser()
+    return usuario if usuario.is_authenticated else None
+
+
+@require_GET
+async def inbox_eventos(request):
+    """
+    📡 Inbox em tempo real (Server-Sent Events) - substitui o polling das listas
+
+    GET /inbox/eventos/?token=<token>
+    Eventos: conectado, interacao, conversa, atendimento_humano e reset
+    (cursor perdido: recarregar conversas/mensagens pela API).
+    Reconexão: o navegador reenvia Last-Event-ID sozinho; ?cursor= faz o mesmo.
+
+    Servido pelo processo ASGI (serviço realtime): no gunicorn/WSGI cada aba
+    aberta prenderia um worker.
+    """
+    if not settings.INBOX_PUSH_ATIVO:
+        return JsonResponse({'detail': 'Inbox em tempo real desativado.'}, status=503)
+
+    usuario = await _autenticar_inbox(request)
+    if usuario is None:
+        return JsonResponse({'detail': 'As credenciais de autenticação não foram fornecidas.'}, status=401)
+
+    tenant_id = await sync_to_async(get_tenant_id)(usuario)
+    cursor = request.headers.get('Last-Event-ID') or request.GET.get('cursor')
+
+    resposta = StreamingHttpResponse(
+        tempo_real.eventos_inbox(tenant_id, cursor), content_type='text/event-stream'
+    )
+    resposta['Cache-Control'] = 'no-cache'
+    resposta['X-Accel-Buffering'] = 'no'
+    return resposta
+
+
+@require_GET
+def midia_assinada(request, token):
+    """
+    📎 Arquivo do storage por link assinado de vida curta (WhatsAppMediaSender, modo 'url')
+
+    GET /midia/assinada/<token>/ - sem autenticação: quem tem o link é a Evolution
+    FileResponse entrega o arquivo pelo wsgi.file_wrapper (sendfile), sem passar pela memória.
+    """
+    nome = nome_da_url_assinada(token)
+    if not nome or not default_storage.exists(nome):
+        raise Http404
+    return FileResponse(default_storage.open(nome, 'rb'), filename=os.path.basename(nome))
+
+
 class InteracaoListView(generics.ListAPIView):
     """
     ✅ API: Lista interações com URLs locais
     """
     serializer_class = InteracaoSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = BuscaCursorPagination  # Cursor (criado_em, id), mais recentes primeiro
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_fields = ['remetente', 'tipo', 'conversa']
     search_fields = ['mensagem']
-    ordering_fields = ['criado_em']
-    ordering = ['-criado_em']
     
     def get_queryset(self):
         return Interacao.objects.select_related(
@@ -646,21 +694,53 @@ class InteracaoListView(generics.ListAPIView):
         context['request'] = self.request
         return context
     
+class ConversaMensagensView(generics.ListAPIView):
+    """
+    API: Histórico de mensagens de uma conversa, paginado por cursor
+    GET /conversas/<pk>/mensagens/                 página mais recente
+    GET /conversas/<pk>/mensagens/?antes=<cursor>  carregar anteriores
+    GET /conversas/<pk>/mensagens/?depois=<cursor> mensagens novas desde o cursor
+    """
+    serializer_class = InteracaoSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = InteracaoCursorPagination
+    
+    def get_queryset(self):
+        return Interacao.objects.filter(conversa_id=self.kwargs['pk']).select_related('operador__user')
+    
+    def get_serializer_context(self):
+        """✅ GARANTIR request context para URLs completas"""
+        context = super().get_serializer_context()
+        context['request'] = self.request
+        return context
+
+
 class BuscarMensagensView(generics.ListAPIView):
     """
     ✅ API: Busca mensagens com URLs locais
     """
     serializer_class = InteracaoSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
+    pagination_class = BuscaCursorPagination  # Cursor (criado_em, id), mais recentes primeiro
+    filter_backends = [BuscaMensagensFilter, DjangoFilterBackend]  # Full-text no PostgreSQL
     search_fields = ['mensagem', 'conversa__contato__nome', 'conversa__contato__telefone']
     filterset_fields = ['tipo', 'remetente']
     
+    @property
+    def paginator(self):
+        """?ordem=relevancia: resultados pelo rank da busca em vez do cursor por data"""
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('ordem') == 'relevancia':
+                self._paginator = BuscaRelevanciaPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+    
     def get_queryset(self):
         queryset = Interacao.objects.select_related(
             'conversa__contato',
             'operador__user'
-        ).order_by('-criado_em')
+        )
         
         # ✅ FILTROS adicionais
         conversa_id = self.request.query_params.get('conversa', None)
@@ -1030,6 +1110,18 @@ def update_task_status(request, task_id):
 
 # ===== VIEWS WHATSAPP AVANÇADAS =====
 
+def _estatisticas_whatsapp(user):
+    valores = contadores.obter(get_ids_visiveis(user))
+    return {
+        'mensagens_enviadas_hoje': int(valores[contadores.MENSAGENS_ENVIADAS]),
+        'mensagens_recebidas_hoje': int(valores[contadores.MENSAGENS_RECEBIDAS]),
+        'total_conversas_ativas': int(
+            valores[f"{contadores.CONVERSAS_STATUS}entrada"] + valores[f"{contadores.CONVERSAS_STATUS}atendimento"]
+        ),
+        'ultima_atualizacao': timezone.now().isoformat()
+    }
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def whatsapp_dashboard(request):
@@ -1037,17 +1129,10 @@ def whatsapp_dashboard(request):
     try:
         status_result = verificar_status_instancia()
 
-        # Estatísticas de mensagens hoje
-        hoje = timezone.now().date()
-        mensagens_enviadas = Interacao.objects.filter(
-            criado_em__date=hoje,
-            remetente='operador'
-        ).count()
-
-        mensagens_recebidas = Interacao.objects.filter(
-            criado_em__date=hoje,
-            remetente='cliente'
-        ).count()
+        # Estatísticas de mensagens hoje (contadores diários + cache curto)
+        estatisticas = contadores.em_cache(
+            'whatsapp', request.user.id, lambda: _estatisticas_whatsapp(request.user)
+        )
 
         return Response({
             'instancia': {
@@ -1056,14 +1141,7 @@ def whatsapp_dashboard(request):
                 'connected': status_result.get('connected', False),
                 'url_api': get_instance_config()['url']
             },
-            'estatisticas': {
-                'mensagens_enviadas_hoje': mensagens_enviadas,
-                'mensagens_recebidas_hoje': mensagens_recebidas,
-                'total_conversas_ativas': Conversa.objects.filter(
-                    status__in=['entrada', 'atendimento']
-                ).count(),
-                'ultima_atualizacao': timezone.now().isoformat()
-            }
+            'estatisticas': estatisticas
         })
 
     except Exception as e:
@@ -1385,7 +1463,10 @@ def enviar_mensagem_view(request):
                             mensagem=mensagem,
                             remetente='operador',
                             tipo='texto',
-                            operador=operador
+                            operador=operador,
+                            whatsapp_id=resultado.get('whatsapp_id'),
+                            status_entrega='enviada',
+                            status_entrega_em=timezone.now()
                         )
                         
                         conversa.atualizado_em = timezone.now()
@@ -1555,86 +1636,82 @@ def processar_mensagem_media(message_data):
 
 @api_view(['GET'])
 def atendimento_stats(request):
-    agora = timezone.now()
-    hoje = agora.date()
+    return Response(contadores.em_cache('atendimento', request.user.id, lambda: _calcular_atendimento_stats(request.user)))
 
-    total_conversas = Conversa.objects.count()
-    aguardando = Conversa.objects.filter(status='entrada').count()
-    em_andamento = Conversa.objects.filter(status='atendimento').count()
-    resolvidas_hoje = Conversa.objects.filter(finalizada_em__date=hoje).count()
 
+def _calcular_atendimento_stats(user):
+    ids_visiveis = get_ids_visiveis(user)
+    valores = contadores.obter(ids_visiveis)
+    por_status = contadores.por_prefixo(valores, contadores.CONVERSAS_STATUS)
+
+    total_conversas = int(valores[contadores.CONVERSAS_TOTAL])
+    aguardando = por_status.get('entrada', 0)
+    em_andamento = por_status.get('atendimento', 0)
+    resolvidas_hoje = int(valores[contadores.CONVERSAS_FINALIZADAS])
+
+    # Primeira resposta por conversa, agregada no banco (subquery) em vez de em Python
     primeiras = (
         Interacao.objects
+        .filter(Q(conversa__contato__criado_por__id__in=ids_visiveis) | Q(conversa__contato__criado_por__isnull=True))
         .values('conversa')
         .annotate(
             primeira_msg=Min('criado_em'),
             primeira_resposta=Min('criado_em', filter=Q(operador__isnull=False))
         )
+        .filter(primeira_resposta__isnull=False)
+        .annotate(espera=ExpressionWrapper(F('primeira_resposta') - F('primeira_msg'), output_field=DurationField()))
+        .aggregate(media=Avg('espera'), maxima=Max('espera'))
     )
 
-    tempos_resposta = []
-    for p in primeiras:
-        if p['primeira_msg'] and p['primeira_resposta']:
-            delta = (p['primeira_resposta'] - p['primeira_msg']).total_seconds() / 60
-            tempos_resposta.append(delta)
+    tempo_resposta_medio_min = round(primeiras['media'].total_seconds() / 60, 2) if primeiras['media'] else 0
+    tempo_espera_max_min = round(primeiras['maxima'].total_seconds() / 60, 2) if primeiras['maxima'] else 0
 
-    tempo_resposta_medio_min = round(sum(tempos_resposta) / len(tempos_resposta), 2) if tempos_resposta else 0
-    tempo_espera_max_min = round(max(tempos_resposta), 2) if tempos_resposta else 0
+    operadores = list(
+        Operador.objects.filter(user__id__in=ids_visiveis).select_related('user')
+    )
+    operadores_online = sum(1 for op in operadores if op.status == 'online') if hasattr(Operador, 'status') else 0
 
-    operadores = Operador.objects.filter(
-        user__id__in=get_ids_visiveis(request.user)
+    conversas_por_operador = {
+        c['operador']: c
+        for c in Conversa.objects.filter(operador__in=operadores).values('operador').annotate(
+            ativas=Count('id', filter=Q(status='atendimento')),
+            resolvidas=Count('id', filter=Q(status='finalizada')),
+        )
+    }
+    # Tempos pré-calculados na gravação de cada resposta (TempoResposta)
+    tempo_por_operador = dict(
+        TempoResposta.objects.filter(operador__in=operadores)
+        .values('operador')
+        .annotate(media=Avg('segundos'))
+        .values_list('operador', 'media')
     )
-    operadores_online = operadores.filter(status='online').count() if hasattr(Operador, 'status') else 0
 
     operadores_perf = []
     for op in operadores:
-        conversas_ativas = Conversa.objects.filter(operador=op, status='atendimento').count()
-        conversas_resolvidas = Conversa.objects.filter(operador=op, status='finalizada').count()
-
-        respostas = Interacao.objects.filter(operador=op)
-        medias = []
-        for r in respostas:
-            msg_anterior = (
-                Interacao.objects
-                .filter(conversa=r.conversa, criado_em__lt=r.criado_em, operador__isnull=True)
-                .order_by('-criado_em')
-                .first()
-            )
-            if msg_anterior:
-                diff = (r.criado_em - msg_anterior.criado_em).total_seconds() / 60
-                medias.append(diff)
-
-        tempo_medio_min = round(sum(medias) / len(medias), 2) if medias else 0
+        conversas = conversas_por_operador.get(op.id, {})
+        media = tempo_por_operador.get(op.id)
+        tempo_medio_min = round(media / 60, 2) if media else 0
 
         nome = f"{op.user.first_name} {op.user.last_name}"
 
         operadores_perf.append({
             "id": op.id,
             "nome": nome,
-            "conversas_ativas": conversas_ativas,
-            "conversas_resolvidas": conversas_resolvidas,
+            "conversas_ativas": conversas.get('ativas', 0),
+            "conversas_resolvidas": conversas.get('resolvidas', 0),
             "tempo_medio_min": tempo_medio_min,
             "status": getattr(op, "status", "online")
         })
 
-    distrib = Conversa.objects.values('status').annotate(total=Count('id'))
     distrib_status = {
-        'entrada': next((d['total'] for d in distrib if d['status'] == 'entrada'), 0),
-        'atendimento': next((d['total'] for d in distrib if d['status'] == 'atendimento'), 0),
-        'resolvida': next((d['total'] for d in distrib if d['status'] == 'finalizada'), 0),
+        'entrada': aguardando,
+        'atendimento': em_andamento,
+        'resolvida': por_status.get('finalizada', 0),
     }
 
-    interacoes = (
-        Interacao.objects
-        .filter(criado_em__date=hoje)
-        .annotate(hora=F('criado_em__hour'))
-        .values('hora')
-        .annotate(conversas=Count('id'))
-        .order_by('hora')
-    )
     atividade_por_hora = [
-        {"hora": f"{i['hora']:02d}:00", "conversas": i['conversas']}
-        for i in interacoes
+        {"hora": f"{hora}:00", "conversas": conversas}
+        for hora, conversas in sorted(contadores.por_prefixo(valores, contadores.INTERACOES_HORA).items())
     ]
 
     taxa_resolucao_percent = (
@@ -1658,4 +1735,4 @@ def atendimento_stats(request):
         "atividade_por_hora": atividade_por_hora,
     }
 
-    return Response(data)
\ No newline at end of file
+    return data
\ No newline at end of file
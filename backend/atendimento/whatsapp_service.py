@@ -4,22 +4,22 @@ WhatsApp Service - Serviços para integração com Evolution API
 import requests
 import logging
 from django.conf import settings
+from .envio import PRIORIDADE_OPERADOR, EnvioAdiado, requisitar
 from .utils import get_instance_config
 
 logger = logging.getLogger(__name__)
 
 
-def enviar_mensagem_whatsapp(numero, mensagem, instance_name=None, evolution_api_url=None, api_key=None):
+def enviar_mensagem_whatsapp(numero, mensagem, instance_name=None, evolution_api_url=None, api_key=None,
+                             prioridade=PRIORIDADE_OPERADOR, bloquear=True):
     """
-    Envia mensagem pelo WhatsApp usando Evolution API
+    Envia mensagem pelo WhatsApp usando Evolution API (via atendimento.envio)
     """
     config = get_instance_config()
-    
-    url = f"{evolution_api_url or config['url']}/message/sendText/{instance_name or config['instance_name']}"
-    
-    headers = {
-        'apikey': api_key or config['api_key'],
-        'Content-Type': 'application/json'
+    config = {
+        'url': evolution_api_url or config['url'],
+        'api_key': api_key or config['api_key'],
+        'instance_name': instance_name or config['instance_name'],
     }
     
     payload = {
@@ -28,9 +28,9 @@ def enviar_mensagem_whatsapp(numero, mensagem, instance_name=None, evolution_api
     }
     
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = requisitar(config, '/message/sendText', payload, prioridade, timeout=10, bloquear=bloquear)
         
-        if response.status_code == 201:
+        if response.status_code in [200, 201]:
             logger.info("MENSAGEM ENVIADA COM SUCESSO!")
             return {
                 "success": True, 
@@ -44,7 +44,15 @@ def enviar_mensagem_whatsapp(numero, mensagem, instance_name=None, evolution_api
                 "error": f"Status {response.status_code}: {response.text}",
                 "message": "Falha no envio da mensagem"
             }
-            
+    
+    except EnvioAdiado as e:
+        logger.warning(f"Envio adiado: {e}")
+        return {
+            "success": False,
+            "error": str(e),
+            "adiado": e.espera,
+            "message": "Limite de envio da instância atingido"
+        }
     except Exception as e:
         logger.error(f"Erro na requisição: {e}")
         return {
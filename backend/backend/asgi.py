@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Em produção roda no serviço "realtime" (uvicorn) para o inbox em tempo real
+(SSE em /inbox/eventos/, views assíncronas); a API continua no gunicorn (WSGI).
 """
 
 import os
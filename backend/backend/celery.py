@@ -17,4 +17,25 @@ app.conf.beat_schedule = {
         "task": "plano.tasks.cancelar_planos_expirados",
         "schedule": crontab(hour=0, minute=0),
     },
+    "limpar-mensagens-processadas-diariamente": {
+        "task": "message_translator.tasks.limpar_mensagens_processadas",
+        "schedule": crontab(hour=3, minute=0),
+    },
+    "limpar-midias-pendentes-diariamente": {
+        "task": "message_translator.tasks.limpar_midias_pendentes",
+        "schedule": crontab(hour=3, minute=30),
+    },
+    "limpar-midias-orfas-diariamente": {
+        "task": "atendimento.tasks.limpar_midias_orfas_task",
+        "schedule": crontab(hour=4, minute=0),
+    },
+    "reconciliar-contadores-dashboard": {
+        "task": "core.tasks.reconciliar_contadores_task",
+        "schedule": settings.DASHBOARD_RECONCILIACAO_SEGUNDOS,
+    },
+    "reconciliar-contadores-dia-anterior": {
+        "task": "core.tasks.reconciliar_contadores_task",
+        "schedule": crontab(hour=0, minute=15),
+        "args": (1,),
+    },
 }
\ No newline at end of file
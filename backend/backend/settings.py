@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 from decouple import config
 from celery.schedules import crontab
@@ -65,6 +66,7 @@ DJANGO_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # Busca full-text e trigram (atendimento.busca)
 ]
 
 THIRD_PARTY_APPS = [
@@ -220,6 +222,65 @@ APPEND_SLASH = True
 N8N_WEBHOOK_URL = config('N8N_WEBHOOK_URL', default=None)
 # Exemplo: https://seu-n8n.com/webhook/loomie-messages
 
+# Modo fila: webhooks de entrada respondem 202 e o processamento roda no Celery
+MESSAGE_TRANSLATOR_ASYNC = config('MESSAGE_TRANSLATOR_ASYNC', default=False, cast=bool)
+
+# Mídia recebida: Interação criada na hora, download/descriptografia/conversão na fila 'media'
+MEDIA_PROCESSING_ASYNC = config('MEDIA_PROCESSING_ASYNC', default=False, cast=bool)
+
+# Idempotência de mensagens de entrada: TTL da chave no Redis, da reserva em processamento (expira se o worker morrer) e retenção no banco
+MESSAGE_DEDUP_TTL = config('MESSAGE_DEDUP_TTL', default=60 * 60 * 24, cast=int)
+MESSAGE_DEDUP_PROCESSANDO_TTL = config('MESSAGE_DEDUP_PROCESSANDO_TTL', default=300, cast=int)
+MESSAGE_DEDUP_RETENCAO_DIAS = config('MESSAGE_DEDUP_RETENCAO_DIAS', default=7, cast=int)
+
+# Fan-out dos webhooks customizados: threads/conexões por processo e circuit breaker
+WEBHOOK_FANOUT_WORKERS = config('WEBHOOK_FANOUT_WORKERS', default=8, cast=int)
+WEBHOOK_CIRCUIT_FALHAS = config('WEBHOOK_CIRCUIT_FALHAS', default=5, cast=int)
+WEBHOOK_CIRCUIT_COOLDOWN = config('WEBHOOK_CIRCUIT_COOLDOWN', default=60, cast=int)
+
+# Mídias do WhatsApp sem referência há mais de N horas são removidas do storage
+MIDIA_GC_IDADE_HORAS = config('MIDIA_GC_IDADE_HORAS', default=24, cast=int)
+
+# Conversão de áudio: ffmpeg via stdin/stdout (arquivo temporário se o pipe falhar) e no máximo N ffmpeg simultâneos no host
+# As vagas são locks de arquivo em FFMPEG_VAGAS_DIR: monte o mesmo diretório nos containers de worker para o limite valer entre eles
+FFMPEG_USE_PIPES = config('FFMPEG_USE_PIPES', default=True, cast=bool)
+FFMPEG_MAX_PROCESSOS = config('FFMPEG_MAX_PROCESSOS', default=os.cpu_count() or 2, cast=int)
+FFMPEG_VAGAS_DIR = config('FFMPEG_VAGAS_DIR', default=os.path.join(tempfile.gettempdir(), 'ffmpeg-vagas'))
+FFMPEG_FILA_TIMEOUT = config('FFMPEG_FILA_TIMEOUT', default=120, cast=int)
+
+# MensagemLog em lote (write-behind): bulk_create a cada N registros ou T ms, fila limitada
+# Desligado por padrão: ligado, os logs ainda na fila podem ser perdidos se o processo morrer (SIGKILL/OOM)
+MESSAGE_LOG_WRITE_BEHIND = config('MESSAGE_LOG_WRITE_BEHIND', default=False, cast=bool)
+MESSAGE_LOG_BATCH_SIZE = config('MESSAGE_LOG_BATCH_SIZE', default=50, cast=int)
+MESSAGE_LOG_FLUSH_MS = config('MESSAGE_LOG_FLUSH_MS', default=500, cast=int)
+MESSAGE_LOG_BUFFER_MAX = config('MESSAGE_LOG_BUFFER_MAX', default=1000, cast=int)
+
+# Dashboards: contadores (core.ContadorDiario) mantidos pelos signals, reconciliados pelo beat a cada N s; respostas em cache por T s
+DASHBOARD_RECONCILIACAO_SEGUNDOS = config('DASHBOARD_RECONCILIACAO_SEGUNDOS', default=900, cast=int)
+DASHBOARD_CACHE_SEGUNDOS = config('DASHBOARD_CACHE_SEGUNDOS', default=15, cast=int)
+
+# Inbox em tempo real (SSE em /inbox/eventos/): pub/sub + stream por tenant no Redis para retomar do cursor
+INBOX_PUSH_ATIVO = config('INBOX_PUSH_ATIVO', default=True, cast=bool)
+INBOX_REDIS_URL = config('INBOX_REDIS_URL', default='redis://redis_crm:6379/2')
+INBOX_STREAM_MAXLEN = config('INBOX_STREAM_MAXLEN', default=1000, cast=int)
+INBOX_STREAM_TTL = config('INBOX_STREAM_TTL', default=60 * 60 * 24, cast=int)
+INBOX_REPLAY_MAX = config('INBOX_REPLAY_MAX', default=500, cast=int)
+INBOX_KEEPALIVE_SEGUNDOS = config('INBOX_KEEPALIVE_SEGUNDOS', default=15, cast=int)
+INBOX_RETRY_MS = config('INBOX_RETRY_MS', default=3000, cast=int)
+
+# Envio para a Evolution (atendimento.envio): token bucket por instância no Redis, reserva de tokens para o operador
+ENVIO_TAXA_POR_SEGUNDO = config('ENVIO_TAXA_POR_SEGUNDO', default=1.0, cast=float)
+ENVIO_RAJADA = config('ENVIO_RAJADA', default=6, cast=int)
+ENVIO_RESERVA_OPERADOR = config('ENVIO_RESERVA_OPERADOR', default=2, cast=int)
+ENVIO_ESPERA_MAX_SEGUNDOS = config('ENVIO_ESPERA_MAX_SEGUNDOS', default=10, cast=int)
+ENVIO_POOL_CONEXOES = config('ENVIO_POOL_CONEXOES', default=10, cast=int)
+ENVIO_REDIS_URL = config('ENVIO_REDIS_URL', default='redis://redis_crm:6379/3')
+
+# Envio de mídia (WhatsAppMediaSender): 'url' (link assinado baixado pela Evolution), 'multipart' ou 'base64'
+MIDIA_ENVIO_MODO = config('MIDIA_ENVIO_MODO', default='url')
+MIDIA_URL_PUBLICA = config('MIDIA_URL_PUBLICA', default='')  # ex.: http://backend:8000 (endereço visto pela Evolution)
+MIDIA_URL_ASSINADA_SEGUNDOS = config('MIDIA_URL_ASSINADA_SEGUNDOS', default=300, cast=int)
+
 # =========================
 # OAUTH2 PROVIDER
 # =========================
@@ -437,6 +498,10 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'America/Sao_Paulo'
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 CELERY_ENABLE_UTC = True
+CELERY_TASK_ROUTES = {
+    'message_translator.tasks.processar_midia_pendente_task': {'queue': 'media'},
+    'tarefas.tasks.enviar_whatsapp_task': {'queue': 'envio'},
+}
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
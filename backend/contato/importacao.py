@@ -0,0 +1,252 @@
+"""
+Importação e exportação de contatos em lote
+
+Importação (CSV ou JSON-lines): o arquivo é lido em streaming e processado
+em lotes de TAMANHO_LOTE linhas. Por lote: telefone e chave E.164
+(telefone_normalizado) com as mesmas regras do Contato.save, duplicatas descartadas (no arquivo e no banco, uma
+query por lote), limite do plano conferido uma vez e bulk_create.
+
+Exportação: gerador para StreamingHttpResponse sobre .iterator() (cursor
+do lado do servidor no PostgreSQL), em blocos de ~64 KiB.
+"""
+import csv
+import io
+import json
+import logging
+from datetime import date
+from itertools import islice
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from core import contadores
+from core.utils import get_tenant_id, usuarios_visiveis
+from usuario.models import PlanoUsuario
+from .models import Contato
+from .telefone import chave_contato
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_LOTE = 1000
+MAX_ERROS = 100
+BLOCO_EXPORTACAO = 64 * 1024
+
+CAMPOS_IMPORTACAO = [
+    'nome', 'telefone', 'email', 'whatsapp_id', 'empresa', 'cargo',
+    'endereco', 'cidade', 'estado', 'cep', 'data_nascimento', 'observacoes',
+]
+CAMPOS_EXPORTACAO = ['id'] + CAMPOS_IMPORTACAO + ['criado_em']
+
+FORMATOS = ('csv', 'jsonl')
+
+
+def detectar_formato(nome_arquivo: str, formato: str = None) -> str:
+    if formato:
+        return formato.lower()
+    if (nome_arquivo or '').lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+def _linhas(arquivo, formato):
+    """(número da linha, dict) em streaming - nunca carrega o arquivo inteiro"""
+    texto = io.TextIOWrapper(arquivo, encoding='utf-8-sig', newline='')
+
+    if formato == 'csv':
+        leitor = csv.DictReader(texto)
+        leitor.fieldnames = [(campo or '').strip().lower() for campo in leitor.fieldnames or []]
+        for numero, linha in enumerate(leitor, start=2):
+            yield numero, linha
+        return
+
+    for numero, linha in enumerate(texto, start=1):
+        if not linha.strip():
+            continue
+        try:
+            dados = json.loads(linha)
+        except json.JSONDecodeError:
+            yield numero, None
+            continue
+        yield numero, dados if isinstance(dados, dict) else None
+
+
+def _montar_contato(dados, usuario):
+    """Contato (não salvo) a partir da linha, ou ValueError com o motivo"""
+    if dados is None:
+        raise ValueError("Linha mal formatada")
+
+    valores = {}
+    for campo in CAMPOS_IMPORTACAO:
+        valor = dados.get(campo)
+        valor = str(valor).strip() if valor not in (None, '') else None
+        if valor is None:
+            continue
+
+        max_length = Contato._meta.get_field(campo).max_length
+        if max_length and len(valor) > max_length:
+            raise ValueError(f"{campo} maior que {max_length} caracteres")
+        valores[campo] = valor
+
+    if not valores.get('nome'):
+        raise ValueError("nome é obrigatório")
+
+    if 'telefone' in valores:
+        valores['telefone'] = Contato.normalizar_telefone(valores['telefone'])
+
+    if 'email' in valores:
+        try:
+            validate_email(valores['email'])
+        except DjangoValidationError:
+            raise ValueError(f"email inválido: {valores['email']}")
+
+    if 'data_nascimento' in valores:
+        try:
+            valores['data_nascimento'] = date.fromisoformat(valores['data_nascimento'])
+        except ValueError:
+            raise ValueError("data_nascimento deve estar em AAAA-MM-DD")
+
+    contato = Contato(criado_por=usuario, **valores)
+    # bulk_create não passa pelo save()
+    contato.telefone_normalizado = chave_contato(contato.telefone, contato.whatsapp_id)
+    return contato
+
+
+def _limite_contatos(usuario):
+    return PlanoUsuario.objects.select_related('plano').get(usuario_id=get_tenant_id(usuario)).plano.contatos_inclusos
+
+
+def _gravar_lote(lote):
+    """bulk_create do lote; conflito de unicidade (corrida) → grava um a um"""
+    try:
+        with transaction.atomic():
+            Contato.objects.bulk_create(lote)
+        return len(lote), 0
+    except IntegrityError:
+        criados = 0
+        for contato in lote:
+            contato.pk = None
+            try:
+                with transaction.atomic():
+                    contato.save()
+                criados += 1
+            except IntegrityError:
+                pass
+        return criados, len(lote) - criados
+
+
+def importar_contatos(arquivo, formato, usuario):
+    """
+    Importa contatos do arquivo para o usuário
+
+    Returns:
+        dict: criados, duplicados, invalidos, ignorados_limite, erros (até MAX_ERROS)
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato não suportado: {formato} (use {', '.join(FORMATOS)})")
+
+    limite = _limite_contatos(usuario)
+    visiveis = usuarios_visiveis(usuario)
+    resultado = {'criados': 0, 'duplicados': 0, 'invalidos': 0, 'ignorados_limite': 0, 'erros': []}
+    telefones_vistos = set()
+    whatsapp_ids_vistos = set()
+
+    linhas = _linhas(arquivo, formato)
+    while True:
+        bloco = list(islice(linhas, TAMANHO_LOTE))
+        if not bloco:
+            break
+
+        candidatos = []
+        for numero, dados in bloco:
+            try:
+                candidatos.append(_montar_contato(dados, usuario))
+            except ValueError as e:
+                resultado['invalidos'] += 1
+                if len(resultado['erros']) < MAX_ERROS:
+                    resultado['erros'].append({'linha': numero, 'erro': str(e)})
+
+        # Duplicatas já cadastradas: uma query por chave, para o lote todo
+        telefones = {c.telefone_normalizado for c in candidatos if c.telefone_normalizado}
+        whatsapp_ids = {c.whatsapp_id for c in candidatos if c.whatsapp_id}
+        telefones_existentes = set(
+            Contato.objects.filter(criado_por__in=visiveis, telefone_normalizado__in=telefones).values_list(
+                'telefone_normalizado', flat=True
+            )
+        ) if telefones else set()
+        # whatsapp_id é único na tabela toda
+        whatsapp_ids_existentes = set(
+            Contato.objects.filter(whatsapp_id__in=whatsapp_ids).values_list('whatsapp_id', flat=True)
+        ) if whatsapp_ids else set()
+
+        lote = []
+        for contato in candidatos:
+            if (
+                (contato.telefone_normalizado and (
+                    contato.telefone_normalizado in telefones_existentes
+                    or contato.telefone_normalizado in telefones_vistos
+                ))
+                or (contato.whatsapp_id and (contato.whatsapp_id in whatsapp_ids_existentes or contato.whatsapp_id in whatsapp_ids_vistos))
+            ):
+                resultado['duplicados'] += 1
+                continue
+            if contato.telefone_normalizado:
+                telefones_vistos.add(contato.telefone_normalizado)
+            if contato.whatsapp_id:
+                whatsapp_ids_vistos.add(contato.whatsapp_id)
+            lote.append(contato)
+
+        # Limite do plano: uma contagem por lote
+        vagas = max(0, limite - Contato.objects.filter(criado_por__in=visiveis).count())
+        if len(lote) > vagas:
+            resultado['ignorados_limite'] += len(lote) - vagas
+            lote = lote[:vagas]
+
+        if lote:
+            criados, duplicados = _gravar_lote(lote)
+            resultado['criados'] += criados
+            resultado['duplicados'] += duplicados
+            # bulk_create não dispara post_save: contador do dashboard na mão
+            contadores.incrementar(usuario.id, [contadores.CONTATOS_NOVOS], valor=criados)
+            contadores.incrementar(usuario.id, [contadores.CONTATOS_TOTAL], dia=contadores.DIA_SALDO, valor=criados)
+
+    logger.info(
+        f"📥 [Importação] {usuario.username}: {resultado['criados']} criados, "
+        f"{resultado['duplicados']} duplicados, {resultado['invalidos']} inválidos, "
+        f"{resultado['ignorados_limite']} acima do limite"
+    )
+    return resultado
+
+
+class _Eco:
+    """Buffer que só devolve o que recebe (csv.writer → string)"""
+
+    def write(self, valor):
+        return valor
+
+
+def exportar_contatos(queryset, formato):
+    """Gerador de blocos de texto do arquivo exportado (para StreamingHttpResponse)"""
+    linhas = queryset.order_by('id').values_list(*CAMPOS_EXPORTACAO).iterator(chunk_size=2000)
+
+    if formato == 'csv':
+        escritor = csv.writer(_Eco())
+        formatar = escritor.writerow
+        cabecalho = escritor.writerow(CAMPOS_EXPORTACAO)
+    else:
+        def formatar(linha):
+            return json.dumps(dict(zip(CAMPOS_EXPORTACAO, linha)), ensure_ascii=False, default=str) + '\n'
+        cabecalho = ''
+
+    bloco = [cabecalho]
+    tamanho = len(cabecalho)
+    for linha in linhas:
+        texto = formatar(linha)
+        bloco.append(texto)
+        tamanho += len(texto)
+        if tamanho >= BLOCO_EXPORTACAO:
+            yield ''.join(bloco)
+            bloco, tamanho = [], 0
+
+    if bloco:
+        yield ''.join(bloco)
@@ -0,0 +1,38 @@
+"""
+Preenche Contato.telefone_normalizado (chave E.164) dos contatos existentes
+
+    python manage.py backfill_telefone_normalizado
+    python manage.py backfill_telefone_normalizado --recalcular --lote 5000
+
+Sem --recalcular só processa contatos sem chave (idempotente, pode rodar de
+novo depois de mesclar duplicados). --recalcular refaz todas as chaves, para
+quando a regra do normalizador mudar.
+"""
+from django.core.management.base import BaseCommand
+
+from contato.models import Contato
+from contato.telefone import preencher_telefones_normalizados
+
+
+class Command(BaseCommand):
+    help = 'Grava a chave E.164 (telefone_normalizado) dos contatos e lista os duplicados'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000)
+        parser.add_argument('--recalcular', action='store_true', help='Refaz também as chaves já gravadas')
+
+    def handle(self, *args, **options):
+        resultado = preencher_telefones_normalizados(
+            Contato, tamanho_lote=options['lote'], recalcular=options['recalcular']
+        )
+
+        self.stdout.write(
+            f"{resultado['atualizados']} contatos atualizados, "
+            f"{resultado['sem_telefone']} sem telefone válido"
+        )
+        for contato_id, existente_id, chave in resultado['duplicados']:
+            self.stdout.write(self.style.WARNING(
+                f"  contato {contato_id} duplica o contato {existente_id} ({chave}) - mesclar e rodar de novo"
+            ))
+        if not resultado['duplicados']:
+            self.stdout.write(self.style.SUCCESS('Nenhum duplicado'))
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contato', '0004_contato_unique_contato_por_usuario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contato',
+            index=models.Index(fields=['telefone', 'criado_por'], name='contato_telefone_idx'),
+        ),
+    ]
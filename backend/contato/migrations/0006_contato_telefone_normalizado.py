@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+from contato.telefone import preencher_telefones_normalizados
+
+
+def preencher(apps, schema_editor):
+    # Antes das constraints: duplicados ficam sem chave (ver backfill_telefone_normalizado)
+    preencher_telefones_normalizados(apps.get_model('contato', 'Contato'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contato', '0005_indices_consultas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contato',
+            name='telefone_normalizado',
+            field=models.CharField(blank=True, editable=False, help_text='Telefone em E.164 (+5511987654321), chave de busca e deduplicação', max_length=16, null=True),
+        ),
+        migrations.RunPython(preencher, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='contato',
+            constraint=models.UniqueConstraint(fields=('telefone_normalizado', 'criado_por'), name='unique_telefone_por_usuario'),
+        ),
+        migrations.AddConstraint(
+            model_name='contato',
+            constraint=models.UniqueConstraint(condition=models.Q(('criado_por__isnull', True)), fields=('telefone_normalizado',), name='unique_telefone_sem_dono'),
+        ),
+    ]
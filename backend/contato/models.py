@@ -1,9 +1,15 @@
-from django.db import models
+from django.db import IntegrityError, models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from decimal import Decimal
+import logging
 import re
 
+from core.upsert import inserir_se_ausente
+from .telefone import chave_contato, normalizar_e164
+
+logger = logging.getLogger(__name__)
+
 class Operador(models.Model):
     NIVEL_CHOICES = [
         ('operador', 'Operador'),
@@ -49,27 +55,96 @@ class Contato(models.Model):
     criado_em = models.DateTimeField(auto_now_add=True)
     atualizado_em = models.DateTimeField(auto_now=True)
     criado_por = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True)
+    telefone_normalizado = models.CharField(
+        max_length=16,
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="Telefone em E.164 (+5511987654321), chave de busca e deduplicação"
+    )
+    
+    @staticmethod
+    def normalizar_telefone(telefone):
+        """
+        Regra única de normalização (save, criação pela API e importação em lote)
+        """
+        if not telefone:
+            return telefone
+        
+        # Telefone válido: a própria chave E.164 (contato/telefone.py), sem o "+"
+        chave = normalizar_e164(telefone)
+        if chave:
+            return chave[1:]
+        # Manter só os dígitos se não for válido (será rejeitado pela validação)
+        return re.sub(r'\D', '', telefone)
+    
+    @classmethod
+    def por_telefone(cls, telefone):
+        """
+        Contatos pela chave E.164 (índice unique_telefone_por_usuario)
+        Aceita qualquer formato: "(11) 98765-4321", "whatsapp:5511...", JID...
+        """
+        chave = normalizar_e164(telefone)
+        if chave is None:
+            return cls.objects.none()
+        return cls.objects.filter(telefone_normalizado=chave)
+    
+    @classmethod
+    def obter_ou_criar(cls, telefone, criado_por=None, **defaults):
+        """
+        get_or_create pelo telefone do dono, seguro com webhooks concorrentes
+        
+        INSERT ... ON CONFLICT DO NOTHING contra unique_telefone_por_usuario /
+        unique_telefone_sem_dono; quem perde a corrida lê o contato vencedor.
+        O conflito também pode vir do whatsapp_id (único em todo o sistema):
+        aí o vencedor é o contato dono desse whatsapp_id.
+        Returns: (contato, criado)
+        """
+        existentes = cls.por_telefone(telefone).filter(criado_por=criado_por)
+        contato = existentes.first()
+        if contato:
+            return contato, False
+        
+        contato = cls(telefone=cls.normalizar_telefone(telefone), criado_por=criado_por, **defaults)
+        contato.telefone_normalizado = chave_contato(contato.telefone, contato.whatsapp_id)
+        if contato.telefone_normalizado is None:
+            # Sem chave (ex.: grupo) não há constraint para arbitrar
+            return cls.objects.get_or_create(telefone=telefone, criado_por=criado_por, defaults=defaults)
+        
+        if inserir_se_ausente(contato):
+            return contato, True
+        
+        vencedor = existentes.first()
+        if vencedor is None and contato.whatsapp_id:
+            vencedor = cls.objects.filter(whatsapp_id=contato.whatsapp_id).first()
+        if vencedor is None:
+            raise IntegrityError(f"Contato {contato.telefone} em conflito sem linha vencedora (removida em seguida?)")
+        return vencedor, False
     
     def save(self, *args, **kwargs):
         """
         Normalizar telefone antes de salvar para evitar duplicatas
         """
         if self.telefone:
-            # Remover tudo que não é número
-            telefone_limpo = re.sub(r'\D', '', self.telefone)
-            
-            # Se começar com 55 e tiver 12 ou 13 dígitos, já tem código do país
-            if telefone_limpo.startswith('55') and len(telefone_limpo) in [12, 13]:
-                self.telefone = telefone_limpo
-            # Se não tem código do país (10 ou 11 dígitos), adicionar
-            elif len(telefone_limpo) in [10, 11]:
-                self.telefone = f"55{telefone_limpo}"
-            else:
-                # Manter como está se não for válido (será rejeitado pela validação)
-                self.telefone = telefone_limpo
+            self.telefone = self.normalizar_telefone(self.telefone)
+        chave = chave_contato(self.telefone, self.whatsapp_id)
+        if chave and not self.telefone_normalizado and not self._state.adding and self._chave_de_outro_contato(chave):
+            # Duplicado deixado sem chave pelo backfill: continua sem chave até ser mesclado
+            logger.warning(f"⚠️ [Telefone] Contato {self.pk} duplica {chave} - mantido sem chave")
+            chave = None
+        self.telefone_normalizado = chave
+        
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'telefone', 'whatsapp_id'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'telefone_normalizado'}
         
         super().save(*args, **kwargs)
     
+    def _chave_de_outro_contato(self, chave):
+        return Contato.objects.filter(
+            telefone_normalizado=chave, criado_por_id=self.criado_por_id
+        ).exclude(pk=self.pk).exists()
+    
     def __str__(self):
         return self.nome
     
@@ -81,5 +156,21 @@ class Contato(models.Model):
             models.UniqueConstraint(
                 fields=['criado_por', 'whatsapp_id'],
                 name='unique_contato_por_usuario'
-            )
+            ),
+            # Um contato por telefone por dono; chave primeiro para servir
+            # também às buscas só por telefone
+            models.UniqueConstraint(
+                fields=['telefone_normalizado', 'criado_por'],
+                name='unique_telefone_por_usuario'
+            ),
+            # NULL não colide em índice único: contatos sem dono (webhook) à parte
+            models.UniqueConstraint(
+                fields=['telefone_normalizado'],
+                condition=models.Q(criado_por__isnull=True),
+                name='unique_telefone_sem_dono'
+            ),
+        ]
+        indexes = [
+            # Busca por telefone (global e por dono)
+            models.Index(fields=['telefone', 'criado_por'], name='contato_telefone_idx'),
         ]
\ No newline at end of file
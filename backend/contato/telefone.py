@@ -0,0 +1,127 @@
+"""
+Chave canônica de telefone (E.164) - Contato.telefone_normalizado
+
+Um único normalizador para todas as entradas: webhooks ("whatsapp:5511...",
+"5511...@s.whatsapp.net"), formulários ("(11) 98765-4321"), importação e
+N8N. Com a chave gravada na coluna indexada, qualquer busca por telefone vira
+uma consulta de igualdade no índice único (telefone_normalizado, criado_por).
+
+Regras (Brasil como país padrão):
+    - prefixos de canal e sufixo do JID são descartados; grupos não são telefone
+    - 0 de tronco/DDI (0xx, 00) é removido
+    - 10 ou 11 dígitos → 55 na frente (mesmo com +, como Contato.normalizar_telefone)
+    - celular antigo de 8 dígitos (55 + DDD + [6-9]xxxxxxx) ganha o nono dígito,
+      como o WhatsApp ainda entrega em JIDs de contas antigas
+
+A regra é idempotente sobre a própria saída: Contato.telefone guarda a chave
+sem o "+", e recalcular a chave a partir dele dá sempre o mesmo valor.
+"""
+import logging
+import re
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PREFIXOS_CANAL = ('whatsapp:', 'evo:', 'telegram:', 'instagram:')
+DOMINIOS_TELEFONE = ('s.whatsapp.net', 'c.us')
+DDI_PADRAO = '55'
+MIN_DIGITOS = 8
+MAX_DIGITOS = 15  # limite do E.164
+
+
+def normalizar_e164(valor) -> Optional[str]:
+    """'+5511987654321' ou None quando o valor não é um telefone"""
+    if not valor:
+        return None
+    valor = str(valor).strip().lower()
+
+    for prefixo in PREFIXOS_CANAL:
+        if valor.startswith(prefixo):
+            valor = valor[len(prefixo):]
+            break
+
+    if '@' in valor:
+        usuario, dominio = valor.split('@', 1)
+        if dominio not in DOMINIOS_TELEFONE:
+            return None
+        # "5511987654321:12@s.whatsapp.net" → sufixo do aparelho
+        valor = usuario.split(':', 1)[0]
+
+    digitos = re.sub(r'\D', '', valor).lstrip('0')
+
+    if len(digitos) in (10, 11):
+        digitos = DDI_PADRAO + digitos
+
+    if digitos.startswith(DDI_PADRAO) and len(digitos) == 12 and digitos[4] in '6789':
+        digitos = f"{digitos[:4]}9{digitos[4:]}"
+
+    if not MIN_DIGITOS <= len(digitos) <= MAX_DIGITOS:
+        return None
+    return f"+{digitos}"
+
+
+def chave_contato(telefone, whatsapp_id=None) -> Optional[str]:
+    """Chave do contato: telefone, ou o número do whatsapp_id quando não há telefone"""
+    return normalizar_e164(telefone) or normalizar_e164(whatsapp_id)
+
+
+def preencher_telefones_normalizados(Contato, tamanho_lote=1000, recalcular=False):
+    """
+    Grava telefone_normalizado em lotes (migração e comando backfill_telefone_normalizado)
+
+    Recebe o model por parâmetro para funcionar com o model histórico da
+    migração. Contato cuja chave já pertence a outro contato do mesmo dono
+    fica sem chave e é reportado para mesclagem manual.
+
+    Returns:
+        dict: atualizados, sem_telefone, duplicados (lista de (id, id existente, chave))
+    """
+    resultado = {'atualizados': 0, 'sem_telefone': 0, 'duplicados': []}
+    pendentes = Contato.objects.all() if recalcular else Contato.objects.filter(telefone_normalizado__isnull=True)
+    ultimo_id = 0
+
+    while True:
+        lote = list(
+            pendentes.filter(pk__gt=ultimo_id).order_by('pk').only(
+                'pk', 'telefone', 'whatsapp_id', 'criado_por', 'telefone_normalizado'
+            )[:tamanho_lote]
+        )
+        if not lote:
+            break
+        ultimo_id = lote[-1].pk
+
+        chaves = {contato.pk: chave_contato(contato.telefone, contato.whatsapp_id) for contato in lote}
+        # Donos das chaves já gravadas, numa query por lote
+        ocupadas = {
+            (chave, criado_por): pk
+            for pk, chave, criado_por in Contato.objects.filter(
+                telefone_normalizado__in={chave for chave in chaves.values() if chave}
+            ).exclude(pk__in=chaves.keys()).values_list('pk', 'telefone_normalizado', 'criado_por')
+        }
+
+        alterados = []
+        for contato in lote:
+            chave = chaves[contato.pk]
+            if chave is None:
+                resultado['sem_telefone'] += 1
+            else:
+                dono = ocupadas.get((chave, contato.criado_por_id))
+                if dono is not None:
+                    resultado['duplicados'].append((contato.pk, dono, chave))
+                    chave = None
+                else:
+                    ocupadas[(chave, contato.criado_por_id)] = contato.pk
+
+            if contato.telefone_normalizado != chave:
+                contato.telefone_normalizado = chave
+                alterados.append(contato)
+
+        if alterados:
+            # Zera antes de gravar: troca de chaves entre contatos do lote não colide no índice
+            Contato.objects.filter(pk__in=[contato.pk for contato in alterados]).update(telefone_normalizado=None)
+            Contato.objects.bulk_update(alterados, ['telefone_normalizado'], batch_size=tamanho_lote)
+            resultado['atualizados'] += len(alterados)
+
+    if resultado['duplicados']:
+        logger.warning(f"⚠️ [Telefone] {len(resultado['duplicados'])} contatos duplicados ficaram sem chave")
+    return resultado
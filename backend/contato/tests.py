@@ -1,3 +1,347 @@
-from django.test import TestCase
+import io
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save, pre_save
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import contadores
+from core.upsert import inserir_se_ausente
+from . import importacao
+from .models import Contato
+from .telefone import chave_contato, normalizar_e164, preencher_telefones_normalizados
+
+
+class ImportacaoContatosTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('dono', password='x')  # plano Free: 10 contatos
+        self.api = APIClient()
+        self.api.force_authenticate(self.usuario)
+
+    def importar(self, conteudo, nome='contatos.csv', **dados):
+        arquivo = SimpleUploadedFile(nome, conteudo.encode())
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.api.post(reverse('contatos:contato_importar'), {'arquivo': arquivo, **dados}, HTTP_HOST='localhost')
+
+    def test_csv_normaliza_e_descarta_duplicatas(self):
+        Contato.objects.create(nome='Existente', telefone='5511911110000', criado_por=self.usuario)
+
+        resposta = self.importar(
+            'Nome,Telefone,Email\n'
+            'Ana,(11) 98888-7777,ana@exemplo.com\n'
+            'Ana de novo,11988887777,\n'
+            'Existente,11 91111-0000,\n'
+            ',11977776666,\n'
+            'Bia,11966665555,nao-e-email\n'
+        )
+
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(
+            {chave: resposta.data[chave] for chave in ('criados', 'duplicados', 'invalidos', 'ignorados_limite')},
+            {'criados': 1, 'duplicados': 2, 'invalidos': 2, 'ignorados_limite': 0}
+        )
+        self.assertEqual([erro['linha'] for erro in resposta.data['erros']], [5, 6])
+        self.assertEqual(Contato.objects.get(nome='Ana').telefone, '5511988887777')
+
+    def test_jsonl_com_linha_mal_formatada(self):
+        resposta = self.importar(
+            json.dumps({'nome': 'Caio', 'whatsapp_id': '5511955554444@s.whatsapp.net', 'data_nascimento': '1990-05-01'}) + '\n'
+            '{quebrado\n'
+            '\n'
+            + json.dumps({'nome': 'Duda', 'data_nascimento': '01/05/1990'}) + '\n',
+            nome='contatos.jsonl'
+        )
+
+        self.assertEqual(resposta.data['criados'], 1)
+        self.assertEqual(resposta.data['erros'], [
+            {'linha': 2, 'erro': 'Linha mal formatada'},
+            {'linha': 4, 'erro': 'data_nascimento deve estar em AAAA-MM-DD'},
+        ])
+
+    def test_formato_desconhecido(self):
+        resposta = self.importar('nome\nAna\n', formato='xml')
+
+        self.assertEqual(resposta.status_code, 400)
+
+    def test_duplicata_entre_lotes_e_limite_do_plano(self):
+        linhas = ''.join(f'Contato {i},119{i:08d}\n' for i in range(12))
+        with mock.patch.object(importacao, 'TAMANHO_LOTE', 3):
+            resposta = self.importar('nome,telefone\n' + linhas + 'Repetido,11900000001\n')
+
+        self.assertEqual(resposta.data['criados'], 10)
+        self.assertEqual(resposta.data['ignorados_limite'], 2)
+        self.assertEqual(resposta.data['duplicados'], 1)
+        self.assertEqual(Contato.objects.filter(criado_por=self.usuario).count(), 10)
+
+    def test_contadores_do_dashboard_acompanham_o_bulk_create(self):
+        self.importar('nome,telefone\nAna,11988887777\nBia,11977776666\n')
+
+        valores = contadores.obter([self.usuario.id])
+        self.assertEqual(valores[contadores.CONTATOS_NOVOS], 2)
+        self.assertEqual(valores[contadores.CONTATOS_TOTAL], 2)
+        self.assertEqual(contadores.reconciliar(self.usuario.id), 0)
+
+    def test_conflito_no_bulk_create_grava_um_a_um(self):
+        Contato.objects.create(nome='Existente', whatsapp_id='x@s.whatsapp.net')
+
+        criados, duplicados = importacao._gravar_lote([
+            Contato(nome='Conflito', whatsapp_id='x@s.whatsapp.net', criado_por=self.usuario),
+            Contato(nome='Novo', whatsapp_id='y@s.whatsapp.net', criado_por=self.usuario),
+        ])
+
+        self.assertEqual((criados, duplicados), (1, 1))
+        self.assertTrue(Contato.objects.filter(nome='Novo').exists())
+
+
+class ExportacaoContatosTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('dono', password='x')
+        Contato.objects.create(nome='Ana', telefone='11988887777', criado_por=self.usuario)
+        Contato.objects.create(nome='Outro tenant', criado_por=User.objects.create_user('outro', password='x'))
+        self.api = APIClient()
+        self.api.force_authenticate(self.usuario)
+
+    def exportar(self, formato):
+        resposta = self.api.get(reverse('contatos:contato_exportar'), {'formato': formato}, HTTP_HOST='localhost')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.streaming)
+        return b''.join(resposta.streaming_content).decode()
+
+    def test_csv_so_com_os_contatos_visiveis(self):
+        linhas = self.exportar('csv').splitlines()
+
+        self.assertEqual(linhas[0].split(',')[:3], ['id', 'nome', 'telefone'])
+        self.assertEqual(len(linhas), 2)
+        self.assertIn('5511988887777', linhas[1])
+
+    def test_jsonl_um_objeto_por_linha(self):
+        [linha] = self.exportar('jsonl').splitlines()
+
+        self.assertEqual(json.loads(linha)['nome'], 'Ana')
+
+    def test_blocos_limitados(self):
+        Contato.objects.bulk_create([Contato(nome=f'C{i}', criado_por=self.usuario) for i in range(50)])
+
+        with mock.patch.object(importacao, 'BLOCO_EXPORTACAO', 200):
+            blocos = list(importacao.exportar_contatos(Contato.objects.filter(criado_por=self.usuario), 'csv'))
+
+        self.assertGreater(len(blocos), 1)
+        self.assertEqual(len(''.join(blocos).splitlines()), 52)
+        self.assertTrue(all(len(bloco) < 400 for bloco in blocos))
+
+
+class NormalizarE164Tests(SimpleTestCase):
+    def test_formatos_de_entrada_viram_a_mesma_chave(self):
+        for valor in (
+            '+55 (11) 98765-4321',
+            '(11) 98765-4321',
+            '011 98765-4321',
+            '0055 11 98765-4321',
+            '5511987654321',
+            'whatsapp:5511987654321',
+            '5511987654321@s.whatsapp.net',
+            '5511987654321:12@s.whatsapp.net',
+            '5511987654321@c.us',
+        ):
+            with self.subTest(valor=valor):
+                self.assertEqual(normalizar_e164(valor), '+5511987654321')
+
+    def test_celular_antigo_ganha_o_nono_digito(self):
+        self.assertEqual(normalizar_e164('551187654321@s.whatsapp.net'), '+5511987654321')
+
+    def test_fixo_nao_ganha_nono_digito(self):
+        self.assertEqual(normalizar_e164('(11) 3456-7890'), '+551134567890')
+
+    def test_numero_estrangeiro_mantem_o_ddi(self):
+        self.assertEqual(normalizar_e164('+44 20 7946 0958'), '+442079460958')
+
+    def test_nao_telefones(self):
+        for valor in (None, '', 'abc', '123', '120363025246125888@g.us', '1' * 16):
+            with self.subTest(valor=valor):
+                self.assertIsNone(normalizar_e164(valor))
+
+    def test_idempotente_sobre_a_propria_saida(self):
+        chave = normalizar_e164('(11) 98765-4321')
+
+        self.assertEqual(normalizar_e164(chave), chave)
+        self.assertEqual(normalizar_e164(chave[1:]), chave)
+
+    def test_chave_do_contato_usa_o_whatsapp_id_sem_telefone(self):
+        self.assertEqual(chave_contato(None, '5511987654321@s.whatsapp.net'), '+5511987654321')
+        self.assertEqual(chave_contato('11 3456-7890', '5511987654321@s.whatsapp.net'), '+551134567890')
+
+
+class TelefoneUnicoContatoTests(TestCase):
+    def setUp(self):
+        self.dono = User.objects.create_user('dono', password='x')
+        self.outro = User.objects.create_user('outro', password='x')
+
+    def test_save_grava_a_chave(self):
+        contato = Contato.objects.create(nome='Fulano', telefone='(11) 98765-4321', criado_por=self.dono)
+
+        self.assertEqual(contato.telefone, '5511987654321')
+        self.assertEqual(contato.telefone_normalizado, '+5511987654321')
+        self.assertEqual(list(Contato.por_telefone('whatsapp:5511987654321')), [contato])
+
+    def test_update_fields_do_telefone_regrava_a_chave(self):
+        contato = Contato.objects.create(nome='Fulano', telefone='11 98765-4321', criado_por=self.dono)
+
+        contato.telefone = '11 91234-5678'
+        contato.save(update_fields=['telefone'])
+
+        contato.refresh_from_db()
+        self.assertEqual(contato.telefone_normalizado, '+5511912345678')
+
+    def test_mesmo_telefone_em_outro_formato_no_mesmo_dono(self):
+        Contato.objects.create(nome='Fulano', telefone='11 98765-4321', criado_por=self.dono)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Contato.objects.create(nome='Outro', telefone='+55 (11) 98765-4321', criado_por=self.dono)
+
+    def test_mesmo_telefone_em_donos_diferentes(self):
+        Contato.objects.create(nome='Fulano', telefone='11 98765-4321', criado_por=self.dono)
+        Contato.objects.create(nome='Fulano', telefone='11 98765-4321', criado_por=self.outro)
+
+        self.assertEqual(Contato.por_telefone('11987654321').count(), 2)
+
+    def test_mesmo_telefone_sem_dono(self):
+        Contato.objects.create(nome='Fulano', telefone='11 98765-4321')
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Contato.objects.create(nome='Fulano', telefone='5511987654321')
+
+
+class DuplicadosSemChaveTests(TestCase):
+    """Contatos repetidos de antes da chave: o backfill deixa o segundo sem telefone_normalizado"""
+
+    def setUp(self):
+        cache.clear()
+        self.dono = User.objects.create_user('dono', password='x')
+        self.original = Contato.objects.create(nome='Fulano', telefone='11 98765-4321', criado_por=self.dono)
+        self.duplicado = Contato.objects.create(nome='Fulano (2)', telefone='11 3456-7890', criado_por=self.dono)
+        # Estado de antes da migração: mesmo número em outro formato, nenhuma chave
+        Contato.objects.filter(pk=self.duplicado.pk).update(telefone='011987654321')
+        Contato.objects.update(telefone_normalizado=None)
+        self.resultado = preencher_telefones_normalizados(Contato)
+        self.api = APIClient()
+        self.api.force_authenticate(self.dono)
+
+    def patch(self, contato, **dados):
+        return self.api.patch(reverse('contatos:contato_detail', args=[contato.pk]), dados, format='json', HTTP_HOST='localhost')
+
+    def test_backfill_reporta_o_duplicado(self):
+        self.assertEqual(self.resultado['duplicados'], [(self.duplicado.pk, self.original.pk, '+5511987654321')])
+        self.duplicado.refresh_from_db()
+        self.assertIsNone(self.duplicado.telefone_normalizado)
+
+    def test_editar_so_o_nome_do_duplicado(self):
+        resposta = self.patch(self.duplicado, nome='Fulano da Silva')
+
+        self.assertEqual(resposta.status_code, 200)
+        self.duplicado.refresh_from_db()
+        self.assertEqual(self.duplicado.nome, 'Fulano da Silva')
+        self.assertIsNone(self.duplicado.telefone_normalizado)
+
+    def test_save_do_duplicado_fora_da_api(self):
+        duplicado = Contato.objects.get(pk=self.duplicado.pk)
+        duplicado.cidade = 'São Paulo'
+        duplicado.save()
+
+        duplicado.refresh_from_db()
+        self.assertIsNone(duplicado.telefone_normalizado)
+
+    def test_trocar_o_telefone_para_o_de_outro_contato(self):
+        outro = Contato.objects.create(nome='Beltrano', telefone='11 91234-5678', criado_por=self.dono)
+
+        resposta = self.patch(outro, telefone='(11) 98765-4321')
+
+        self.assertEqual(resposta.status_code, 400)
+
+    def test_trocar_o_telefone_do_duplicado_para_um_livre(self):
+        resposta = self.patch(self.duplicado, telefone='11 91234-5678')
+
+        self.assertEqual(resposta.status_code, 200)
+        self.duplicado.refresh_from_db()
+        self.assertEqual(self.duplicado.telefone_normalizado, '+5511912345678')
+
+    def test_depois_de_mesclar_o_comando_grava_a_chave(self):
+        self.original.delete()
+        saida = io.StringIO()
+
+        call_command('backfill_telefone_normalizado', stdout=saida)
+
+        self.duplicado.refresh_from_db()
+        self.assertEqual(self.duplicado.telefone_normalizado, '+5511987654321')
+        self.assertIn('Nenhum duplicado', saida.getvalue())
+
+
+class ObterOuCriarContatoTests(TestCase):
+    def setUp(self):
+        self.dono = User.objects.create_user('dono', password='x')
+        self.outro = User.objects.create_user('outro', password='x')
+
+    def test_cria_e_depois_encontra_em_qualquer_formato(self):
+        contato, criado = Contato.obter_ou_criar('5511987654321@s.whatsapp.net', criado_por=self.dono, nome='Fulano')
+        mesmo, criado_de_novo = Contato.obter_ou_criar('(11) 98765-4321', criado_por=self.dono, nome='Outro')
+
+        self.assertTrue(criado)
+        self.assertFalse(criado_de_novo)
+        self.assertEqual(mesmo, contato)
+        self.assertEqual(contato.telefone_normalizado, '+5511987654321')
+
+    def test_sem_dono_e_por_dono_sao_separados(self):
+        sem_dono, _ = Contato.obter_ou_criar('11 98765-4321', nome='Webhook')
+        do_dono, criado = Contato.obter_ou_criar('11 98765-4321', criado_por=self.dono, nome='Fulano')
+
+        self.assertTrue(criado)
+        self.assertNotEqual(sem_dono, do_dono)
+        self.assertEqual(Contato.obter_ou_criar('5511987654321', nome='x')[0], sem_dono)
+
+    def test_conflito_de_whatsapp_id_devolve_o_dono_do_whatsapp_id(self):
+        existente = Contato.objects.create(
+            nome='Fulano', telefone='11 98765-4321', whatsapp_id='5511987654321@s.whatsapp.net', criado_por=self.dono
+        )
+
+        contato, criado = Contato.obter_ou_criar(
+            '11 98765-4321', criado_por=self.outro, nome='Fulano', whatsapp_id='5511987654321@s.whatsapp.net'
+        )
+
+        self.assertFalse(criado)
+        self.assertEqual(contato, existente)
+
+    def test_inserir_se_ausente_nao_aborta_a_transacao(self):
+        Contato.objects.create(nome='Fulano', telefone='11 98765-4321', criado_por=self.dono)
+        repetido = Contato(nome='Outro', telefone='5511987654321', criado_por=self.dono, telefone_normalizado='+5511987654321')
+        recebidos = []
+        post_save.connect(lambda **kwargs: recebidos.append(kwargs['created']), sender=Contato, weak=False, dispatch_uid='teste_upsert')
+        self.addCleanup(post_save.disconnect, sender=Contato, dispatch_uid='teste_upsert')
+
+        with transaction.atomic():
+            self.assertFalse(inserir_se_ausente(repetido))
+            self.assertEqual(Contato.objects.count(), 1)
+
+        self.assertIsNone(repetido.pk)
+        self.assertEqual(recebidos, [])
+
+    def test_inserir_se_ausente_dispara_os_signals_da_criacao(self):
+        contato = Contato(nome='Fulano', telefone='5511987654321', criado_por=self.dono, telefone_normalizado='+5511987654321')
+        recebidos = []
+        pre_save.connect(lambda **kwargs: recebidos.append('pre_save'), sender=Contato, weak=False, dispatch_uid='teste_upsert')
+        post_save.connect(lambda **kwargs: recebidos.append(('post_save', kwargs['created'])), sender=Contato, weak=False, dispatch_uid='teste_upsert')
+        self.addCleanup(pre_save.disconnect, sender=Contato, dispatch_uid='teste_upsert')
+        self.addCleanup(post_save.disconnect, sender=Contato, dispatch_uid='teste_upsert')
+
+        self.assertTrue(inserir_se_ausente(contato))
+
+        self.assertIsNotNone(contato.pk)
+        self.assertFalse(contato._state.adding)
+        self.assertEqual(recebidos, ['pre_save', ('post_save', True)])
@@ -37,6 +37,8 @@ urlpatterns = [
     # ===== CONTATOS =====
     path('contatos/', contato_views.ContatoListCreateView.as_view(), name='contato_list_create'),
     path('contatos/<int:pk>/', contato_views.ContatoDetailView.as_view(), name='contato_detail'),
+    path('contatos/importar/', contato_views.ContatoImportarView.as_view(), name='contato_importar'),
+    path('contatos/exportar/', contato_views.exportar_contatos_view, name='contato_exportar'),
     path('contatos/telefone/', core_views.api_contato_por_telefone, name='contato_por_telefone'),
     
     # ===== OPERADORES =====
@@ -47,9 +49,12 @@ urlpatterns = [
     path('conversas/criar/', atendimento_views.ConversaCreateView.as_view(), name='conversa_create'),
     path('conversas/<int:pk>/', atendimento_views.ConversaDetailView.as_view(), name='conversa_detail'),
     path('conversas/<int:conversa_id>/atendimento-humano/', atendimento_views.toggle_atendimento_humano, name='toggle_atendimento_humano'),
+    path('inbox/eventos/', atendimento_views.inbox_eventos, name='inbox_eventos'),
+    path('midia/assinada/<str:token>/', atendimento_views.midia_assinada, name='midia_assinada'),
     
     # ===== INTERAÇÕES/MENSAGENS =====
     path('conversas/<int:conversa_pk>/interacoes/', atendimento_views.InteracaoCreateView.as_view(), name='interacao_create'),
+    path('conversas/<int:pk>/mensagens/', atendimento_views.ConversaMensagensView.as_view(), name='conversa_mensagens'),
     path('mensagens/buscar/', atendimento_views.BuscarMensagensView.as_view(), name='buscar-mensagens'),
     path('atendimento-stats/', atendimento_views.atendimento_stats, name='atendimento_stats'),
 
@@ -1,5 +1,5 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.core.paginator import Paginator
 from django.db import models
 from django.db.models import Count, Sum, Q
@@ -11,6 +11,7 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.authtoken.models import Token
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.parsers import MultiPartParser
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 import requests
@@ -26,6 +27,8 @@ if TYPE_CHECKING:
     from rest_framework.request import Request
 
 from .models import Contato, Operador
+from .telefone import chave_contato
+from .importacao import FORMATOS, detectar_formato, exportar_contatos, importar_contatos
 from atendimento.models import Conversa, Interacao, RespostasRapidas, NotaAtendimento, AnexoNota, TarefaAtendimento, LogAtividade
 from negocio.models import Negocio
 from kanban.models import Kanban, Estagio
@@ -40,7 +43,7 @@ from atendimento.serializers import (
 from kanban.serializers import EstagioSerializer, KanbanSerializer
 from negocio.serializers import NegocioSerializer
 from atendimento.utils import get_instance_config
-from core.utils import get_ids_visiveis
+from core.utils import usuarios_visiveis
 from usuario.models import PlanoUsuario, PerfilUsuario
 from rest_framework.exceptions import ValidationError
 
@@ -53,6 +56,25 @@ class ContatoPagination(PageNumberPagination):
 
 # ===== VIEWS DE API - CONTATOS =====
 
+def _validar_telefone_unico(serializer, dono, instancia=None):
+    """Telefone já cadastrado para o dono (unique_telefone_por_usuario) → 400 em vez de IntegrityError"""
+    dados = serializer.validated_data
+    if 'telefone' not in dados and 'whatsapp_id' not in dados:
+        return
+
+    chave = chave_contato(
+        dados.get('telefone', getattr(instancia, 'telefone', None)),
+        dados.get('whatsapp_id', getattr(instancia, 'whatsapp_id', None)),
+    )
+    if not chave:
+        return
+
+    duplicados = Contato.objects.filter(criado_por=dono, telefone_normalizado=chave)
+    if instancia is not None:
+        duplicados = duplicados.exclude(pk=instancia.pk)
+    if duplicados.exists():
+        raise ValidationError("Você já possui um contato com este telefone.")
+
 class ContatoListCreateView(generics.ListCreateAPIView):
     """API: Listar e criar contatos"""
     serializer_class = ContatoSerializer
@@ -64,10 +86,7 @@ class ContatoListCreateView(generics.ListCreateAPIView):
     ordering = ['nome']
 
     def get_queryset(self):
-        user = self.request.user
-        ids_visiveis = get_ids_visiveis(user)
-
-        return Contato.objects.filter(criado_por__id__in=ids_visiveis)
+        return Contato.objects.filter(criado_por__in=usuarios_visiveis(self.request.user))
 
     def perform_create(self, serializer):
         plano_chefe = None
@@ -80,29 +99,13 @@ class ContatoListCreateView(generics.ListCreateAPIView):
             plano_chefe = PlanoUsuario.objects.get(usuario=user_profile.criado_por).plano
 
         limite_contatos = plano_chefe.contatos_inclusos
-        contatos_inclusos = Contato.objects.filter(criado_por__id__in=get_ids_visiveis(self.request.user)).count()
+        contatos_inclusos = Contato.objects.filter(criado_por__in=usuarios_visiveis(self.request.user)).count()
 
         if contatos_inclusos >= limite_contatos:
             raise ValidationError(f"Limite de {limite_contatos} contatos atingido para este plano.")
 
-        # Verificar duplicata de telefone (normalizado)
-        telefone = serializer.validated_data.get('telefone')
-        if telefone:
-            import re
-            # Normalizar telefone para comparação
-            telefone_limpo = re.sub(r'\D', '', telefone)
-            
-            # Adicionar código do país se necessário (mesma lógica do modelo)
-            if telefone_limpo.startswith('55') and len(telefone_limpo) in [12, 13]:
-                telefone_normalizado = telefone_limpo
-            elif len(telefone_limpo) in [10, 11]:
-                telefone_normalizado = f"55{telefone_limpo}"
-            else:
-                telefone_normalizado = telefone_limpo
-            
-            # Buscar contato com telefone normalizado igual
-            if Contato.objects.filter(criado_por=self.request.user, telefone=telefone_normalizado).exists():
-                raise ValidationError("Você já possui um contato com este telefone.")
+        # Verificar duplicata de telefone (chave E.164, mesma regra do modelo)
+        _validar_telefone_unico(serializer, self.request.user)
         
         # Verificar duplicata de WhatsApp ID
         whatsapp_id = serializer.validated_data.get('whatsapp_id')
@@ -111,15 +114,60 @@ class ContatoListCreateView(generics.ListCreateAPIView):
 
         serializer.save(criado_por=self.request.user)
 
+class ContatoImportarView(APIView):
+    """
+    API: Importação em lote de contatos
+    POST /contatos/importar/  (multipart: arquivo=<.csv ou .jsonl>, formato=csv|jsonl opcional)
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        arquivo = request.FILES.get('arquivo')
+        if not arquivo:
+            return Response({"error": "Envie o arquivo no campo 'arquivo'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        formato = detectar_formato(arquivo.name, request.data.get('formato'))
+        try:
+            resultado = importar_contatos(arquivo.file, formato, request.user)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except PlanoUsuario.DoesNotExist:
+            return Response({"error": "Plano do usuário não encontrado"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(resultado, status=status.HTTP_201_CREATED if resultado['criados'] else status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def exportar_contatos_view(request):
+    """
+    API: Exportação de contatos em streaming
+    GET /contatos/exportar/?formato=csv|jsonl
+    """
+    formato = (request.GET.get('formato') or 'csv').lower()
+    if formato not in FORMATOS:
+        return Response({"error": f"Formato não suportado: {formato}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    queryset = Contato.objects.filter(criado_por__in=usuarios_visiveis(request.user))
+    content_type = 'text/csv; charset=utf-8' if formato == 'csv' else 'application/x-ndjson; charset=utf-8'
+
+    response = StreamingHttpResponse(exportar_contatos(queryset, formato), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="contatos.{formato}"'
+    return response
+
+
 class ContatoDetailView(generics.RetrieveUpdateDestroyAPIView):
     """API: Detalhar, atualizar e deletar contato"""
     serializer_class = ContatoSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        ids_visiveis = get_ids_visiveis(user)
-        return Contato.objects.filter(criado_por__id__in=ids_visiveis)
+        return Contato.objects.filter(criado_por__in=usuarios_visiveis(self.request.user))
+
+    def perform_update(self, serializer):
+        _validar_telefone_unico(serializer, serializer.instance.criado_por, serializer.instance)
+        serializer.save()
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -319,9 +367,7 @@ def buscar_contato_por_telefone(request):
     try:
         telefone = telefone.strip()
 
-        contatos = Contato.objects.filter(
-            Q(telefone=telefone) | Q(whatsapp_id=telefone)
-        )
+        contatos = Contato.por_telefone(telefone)
 
         if not contatos.exists():
             return Response([], status=status.HTTP_200_OK)
@@ -0,0 +1,218 @@
+"""
+Contadores materializados dos dashboards (core.ContadorDiario)
+
+- Os signals mantêm tudo incrementalmente, depois do commit:
+    - fluxos do dia (contatos/conversas novos, finalizadas, interações por
+      hora, enviadas/recebidas) na linha do dia;
+    - saldos (totais, conversas por status, funil de negócios) na linha fixa
+      dia=DIA_SALDO, com +1/-1 na criação, troca de status/estágio e exclusão.
+- reconciliar(usuario_id, dia) recalcula só um dono e um dia e corrige o que
+  os signals não enxergam (update() em massa, troca de dono, estágio
+  renomeado). Roda no Celery beat, nunca num request.
+- Os dashboards leem com obter() (uma query) e guardam a resposta por
+  DASHBOARD_CACHE_SEGUNDOS com em_cache().
+
+Tudo é por dono (Contato.criado_por). Contatos sem dono (webhook) e suas
+conversas/mensagens ficam no balde "sem dono" (usuario NULL), somado aos
+totais de todos os tenants - o inbox também os mostra para todos.
+"""
+import logging
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import ExtractHour
+from django.utils import timezone
+
+from .models import ContadorDiario
+
+logger = logging.getLogger(__name__)
+
+CONTATOS_TOTAL = 'contatos_total'
+CONTATOS_NOVOS = 'contatos_novos'
+CONVERSAS_TOTAL = 'conversas_total'
+CONVERSAS_NOVAS = 'conversas_novas'
+CONVERSAS_FINALIZADAS = 'conversas_finalizadas'
+CONVERSAS_STATUS = 'conversas_status:'
+INTERACOES = 'interacoes'
+INTERACOES_HORA = 'interacoes_hora:'
+MENSAGENS_ENVIADAS = 'mensagens_enviadas'
+MENSAGENS_RECEBIDAS = 'mensagens_recebidas'
+NEGOCIOS_ESTAGIO = 'negocios_estagio:'
+NEGOCIOS_VALOR = 'negocios_valor'
+
+# Saldos não pertencem a um dia: linha fixa por dono e métrica
+DIA_SALDO = date(1970, 1, 1)
+
+
+def _intervalo(dia):
+    """Início/fim do dia no fuso local (filtro por faixa usa o índice, __date não)"""
+    inicio = timezone.make_aware(datetime.combine(dia, time.min))
+    return inicio, inicio + timedelta(days=1)
+
+
+def metricas_interacao(remetente: str, hora: int) -> list:
+    metricas = [INTERACOES, f"{INTERACOES_HORA}{hora:02d}"]
+    if remetente == 'operador':
+        metricas.append(MENSAGENS_ENVIADAS)
+    elif remetente == 'cliente':
+        metricas.append(MENSAGENS_RECEBIDAS)
+    return metricas
+
+
+def incrementar(usuario_id, metricas: Iterable[str], dia=None, valor=1):
+    """
+    Soma valor às métricas do dono no dia (upsert; chamado pelos signals)
+    usuario_id None = balde sem dono; dia=DIA_SALDO para os saldos.
+    """
+    dia = dia or timezone.localdate()
+
+    for metrica in metricas:
+        filtro = ContadorDiario.objects.filter(usuario_id=usuario_id, dia=dia, metrica=metrica)
+        if filtro.update(valor=F('valor') + valor):
+            continue
+        try:
+            with transaction.atomic():
+                ContadorDiario.objects.create(usuario_id=usuario_id, dia=dia, metrica=metrica, valor=valor)
+        except IntegrityError:
+            # Outro processo criou a linha entre o update e o create
+            filtro.update(valor=F('valor') + valor)
+
+
+def _calcular(usuario_id, dia) -> Dict:
+    """Valores corretos de um dono: {(dia | DIA_SALDO, metrica): valor}"""
+    from atendimento.models import Conversa, Interacao
+    from contato.models import Contato
+    from negocio.models import Negocio
+
+    inicio, fim = _intervalo(dia)
+    do_dia = Q(criado_em__gte=inicio, criado_em__lt=fim)
+    valores = defaultdict(Decimal)
+
+    contatos = Contato.objects.filter(criado_por_id=usuario_id).aggregate(
+        total=Count('id'), novos=Count('id', filter=do_dia)
+    )
+    valores[(DIA_SALDO, CONTATOS_TOTAL)] += contatos['total']
+    valores[(dia, CONTATOS_NOVOS)] += contatos['novos']
+
+    for linha in Conversa.objects.filter(contato__criado_por_id=usuario_id).values('status').annotate(
+        total=Count('id'),
+        novas=Count('id', filter=do_dia),
+        finalizadas=Count('id', filter=Q(finalizada_em__gte=inicio, finalizada_em__lt=fim)),
+    ):
+        valores[(DIA_SALDO, CONVERSAS_TOTAL)] += linha['total']
+        valores[(DIA_SALDO, f"{CONVERSAS_STATUS}{linha['status']}")] += linha['total']
+        valores[(dia, CONVERSAS_NOVAS)] += linha['novas']
+        valores[(dia, CONVERSAS_FINALIZADAS)] += linha['finalizadas']
+
+    for linha in Interacao.objects.filter(do_dia, conversa__contato__criado_por_id=usuario_id).annotate(
+        hora=ExtractHour('criado_em')
+    ).values('remetente', 'hora').annotate(total=Count('id')):
+        for metrica in metricas_interacao(linha['remetente'], linha['hora']):
+            valores[(dia, metrica)] += linha['total']
+
+    for linha in Negocio.objects.filter(contato__criado_por_id=usuario_id).values('estagio__nome').annotate(
+        total=Count('id'), valor=Sum('valor')
+    ):
+        valores[(DIA_SALDO, f"{NEGOCIOS_ESTAGIO}{linha['estagio__nome']}")] += linha['total']
+        valores[(DIA_SALDO, NEGOCIOS_VALOR)] += linha['valor'] or 0
+
+    return valores
+
+
+def reconciliar(usuario_id, dia=None) -> int:
+    """
+    Acerta os contadores de um dono (None = sem dono) no dia e os saldos dele
+
+    As linhas do dono ficam travadas durante o cálculo: incrementos
+    concorrentes esperam e entram por cima (um desvio desses some na
+    próxima reconciliação).
+
+    Returns:
+        int: métricas corrigidas
+    """
+    dia = dia or timezone.localdate()
+
+    with transaction.atomic():
+        linhas = {
+            (linha.dia, linha.metrica): linha
+            for linha in ContadorDiario.objects.select_for_update().filter(
+                usuario_id=usuario_id, dia__in=[dia, DIA_SALDO]
+            )
+        }
+        valores = _calcular(usuario_id, dia)
+
+        corrigidas = 0
+        for chave in set(linhas) | set(valores):
+            correto = valores.get(chave, 0)
+            linha = linhas.get(chave)
+            if linha is not None and linha.valor == correto:
+                continue
+            dia_linha, metrica = chave
+            if linha is None:
+                if not correto:
+                    continue
+                try:
+                    with transaction.atomic():
+                        ContadorDiario.objects.create(
+                            usuario_id=usuario_id, dia=dia_linha, metrica=metrica, valor=correto
+                        )
+                except IntegrityError:
+                    ContadorDiario.objects.filter(
+                        usuario_id=usuario_id, dia=dia_linha, metrica=metrica
+                    ).update(valor=correto)
+            else:
+                ContadorDiario.objects.filter(pk=linha.pk).update(valor=correto)
+            corrigidas += 1
+
+    if corrigidas:
+        logger.info(f"📊 [Dashboard] {corrigidas} contadores corrigidos (dono {usuario_id}, {dia})")
+    return corrigidas
+
+
+def donos_com_dados(dia=None) -> set:
+    """Donos a reconciliar no dia: quem tem contatos, quem já tem contador e o balde sem dono"""
+    from contato.models import Contato
+
+    dia = dia or timezone.localdate()
+    donos = set(Contato.objects.order_by().values_list('criado_por', flat=True).distinct())
+    donos.update(
+        ContadorDiario.objects.filter(dia__in=[dia, DIA_SALDO]).order_by()
+        .values_list('usuario', flat=True).distinct()
+    )
+    donos.add(None)
+    return donos
+
+
+def obter(ids_usuarios, dia=None) -> Dict[str, Decimal]:
+    """Soma das métricas do dia e dos saldos para os usuários informados mais o balde sem dono"""
+    dia = dia or timezone.localdate()
+    linhas = ContadorDiario.objects.filter(
+        Q(usuario_id__in=ids_usuarios) | Q(usuario__isnull=True),
+        dia__in=[dia, DIA_SALDO],
+    ).values('metrica').annotate(total=Sum('valor'))
+    return defaultdict(Decimal, {linha['metrica']: linha['total'] for linha in linhas})
+
+
+def por_prefixo(contadores: Dict, prefixo: str) -> Dict[str, int]:
+    """{'conversas_status:entrada': 3} → {'entrada': 3}"""
+    return {
+        metrica[len(prefixo):]: int(valor)
+        for metrica, valor in contadores.items()
+        if metrica.startswith(prefixo) and valor
+    }
+
+
+def em_cache(nome: str, usuario_id, calcular):
+    """Resposta do dashboard em cache por DASHBOARD_CACHE_SEGUNDOS (por usuário)"""
+    chave = f"dashboard:{nome}:{usuario_id}"
+    dados = cache.get(chave)
+    if dados is None:
+        dados = calcular()
+        cache.set(chave, dados, timeout=settings.DASHBOARD_CACHE_SEGUNDOS)
+    return dados
@@ -4,11 +4,153 @@ import asyncio
 import subprocess
 import logging
 import tempfile
+import threading
+import time
 import os
-from typing import Tuple, Optional
+from contextlib import contextmanager
+from typing import Dict, Tuple, Optional
+
+from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
+
+# =========================
+# FILA DE CONVERSÃO
+# =========================
+# Cada conversão é um processo ffmpeg; sem limite, uma rajada de áudios
+# abriria um ffmpeg por mensagem. No máximo FFMPEG_MAX_PROCESSOS rodam no
+# host inteiro (padrão: nº de CPUs), somando todos os workers: cada vaga é
+# um arquivo em FFMPEG_VAGAS_DIR travado com flock, que o kernel solta se o
+# processo morrer. Sem fcntl (Windows) ou sem o diretório, cai para um
+# semáforo por processo.
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class FilaConversaoCheia(Exception):
+    """Nenhuma vaga de conversão liberada dentro de FFMPEG_FILA_TIMEOUT"""
+    pass
+
+
+# Formatos que o ffmpeg só lê com seek (não vão pelo stdin)
+FORMATOS_COM_SEEK = {'mp4'}
+
+INTERVALO_VAGA_MAX = 0.2  # espera máxima entre tentativas de pegar vaga no host
+
+_fila_lock = threading.Lock()
+_fila = {'pid': None, 'semaforo': None, 'limite': 0, 'em_execucao': 0, 'aguardando': 0, 'escopo': 'host'}
+
+
+def _fila_do_processo() -> Dict:
+    """Semáforo e contadores são por processo (workers fazem fork depois do import)"""
+    pid = os.getpid()
+    if _fila['pid'] != pid:
+        with _fila_lock:
+            if _fila['pid'] != pid:
+                limite = settings.FFMPEG_MAX_PROCESSOS
+                _fila.update({
+                    'semaforo': threading.BoundedSemaphore(limite),
+                    'limite': limite,
+                    'em_execucao': 0,
+                    'aguardando': 0,
+                    'escopo': 'host' if fcntl is not None else 'processo',
+                    'pid': pid,
+                })
+    return _fila
+
+
+def estatisticas_fila() -> Dict:
+    """Profundidade da fila de conversão (limite do host; em execução/aguardando deste processo)"""
+    fila = _fila_do_processo()
+    return {
+        'limite': fila['limite'],
+        'escopo': fila['escopo'],
+        'em_execucao': fila['em_execucao'],
+        'aguardando': fila['aguardando'],
+    }
+
+
+def _tentar_vaga_host(limite: int) -> Optional[int]:
+    """fd da primeira vaga livre do host (travada com flock), ou None se todas ocupadas"""
+    os.makedirs(settings.FFMPEG_VAGAS_DIR, exist_ok=True)
+    for numero in range(limite):
+        fd = os.open(os.path.join(settings.FFMPEG_VAGAS_DIR, f'vaga-{numero}.lock'), os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError:
+            os.close(fd)
+    return None
+
+
+def _adquirir_vaga(fila: Dict):
+    """Vaga de conversão (fd da vaga do host, ou True no semáforo local); None se esgotou o timeout"""
+    timeout = settings.FFMPEG_FILA_TIMEOUT
+    
+    if fila['escopo'] == 'host':
+        limite = time.monotonic() + timeout
+        intervalo = 0.01
+        try:
+            while True:
+                fd = _tentar_vaga_host(fila['limite'])
+                if fd is not None:
+                    return fd
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return None
+                time.sleep(min(intervalo, restante))
+                intervalo = min(intervalo * 2, INTERVALO_VAGA_MAX)
+        except OSError as e:
+            logger.warning(f"⚠️ FFmpeg: vagas do host indisponíveis em {settings.FFMPEG_VAGAS_DIR}, limite só por processo: {e}")
+            fila['escopo'] = 'processo'
+    
+    return True if fila['semaforo'].acquire(timeout=timeout) else None
+
+
+def _liberar_vaga(fila: Dict, vaga):
+    if vaga is True:
+        fila['semaforo'].release()
+        return
+    try:
+        fcntl.flock(vaga, fcntl.LOCK_UN)
+    finally:
+        os.close(vaga)
+
+
+@contextmanager
+def _vaga_conversao():
+    fila = _fila_do_processo()
+    
+    with _fila_lock:
+        fila['aguardando'] += 1
+        aguardando = fila['aguardando']
+    
+    if aguardando > 1:
+        logger.info(f"⏳ FFmpeg: {aguardando} conversão(ões) aguardando vaga ({fila['em_execucao']}/{fila['limite']} em execução)")
+    
+    try:
+        vaga = _adquirir_vaga(fila)
+    finally:
+        with _fila_lock:
+            fila['aguardando'] -= 1
+    
+    if vaga is None:
+        raise FilaConversaoCheia()
+    
+    with _fila_lock:
+        fila['em_execucao'] += 1
+    try:
+        yield
+    finally:
+        with _fila_lock:
+            fila['em_execucao'] -= 1
+        _liberar_vaga(fila, vaga)
+
+
 class FFmpegService:
     """Serviço para conversão de áudio usando FFmpeg"""
     
@@ -73,17 +215,20 @@ class FFmpegService:
             return "flac"
         elif input_bytes[:8] == b'#!AMR\n' or input_bytes[:6] == b'#!AMR-':
             return "amr"
+        elif input_bytes[4:8] == b'ftyp':
+            return "mp4"  # m4a/mp4 (ISO BMFF)
         else:
             return "unknown"
     
     @staticmethod
-    def convert_to_mp3(input_bytes: bytes, output_bitrate: str = "128k") -> Tuple[bool, Optional[bytes], str]:
+    def convert_to_mp3(input_bytes: bytes, output_bitrate: str = "128k", use_pipes: Optional[bool] = None) -> Tuple[bool, Optional[bytes], str]:
         """
         Converte um buffer de bytes de áudio para o formato MP3 usando FFmpeg.
         
         Args:
             input_bytes: Os bytes do arquivo de áudio de entrada
             output_bitrate: Bitrate de saída (padrão: 128k)
+            use_pipes: stdin/stdout em vez de arquivos temporários (padrão: FFMPEG_USE_PIPES)
             
         Returns:
             Tuple[success: bool, mp3_bytes: Optional[bytes], message: str]
@@ -118,77 +263,134 @@ class FFmpegService:
                 logger.error(f"❌ FFmpeg: {error_msg}")
                 return False, None, error_msg
                 
+        if use_pipes is None:
+            use_pipes = settings.FFMPEG_USE_PIPES
+        
+        try:
+            # Limita quantos ffmpeg rodam ao mesmo tempo no host
+            with _vaga_conversao():
+                # m4a/mp4 com o índice (moov) no fim precisam de entrada com seek: direto para arquivo
+                if use_pipes and audio_format not in FORMATOS_COM_SEEK:
+                    resultado = FFmpegService._convert_via_pipes(input_bytes, audio_format, output_bitrate)
+                    if resultado[0]:
+                        return resultado
+                    logger.warning("⚠️ FFmpeg: conversão por pipe falhou, tentando com arquivo temporário")
+                return FFmpegService._convert_via_arquivos(input_bytes, audio_format, output_bitrate)
+                
+        except FilaConversaoCheia:
+            error_msg = f"Fila de conversão cheia - nenhuma vaga em {settings.FFMPEG_FILA_TIMEOUT}s"
+            logger.error(f"⏳ FFmpeg: {error_msg} ({estatisticas_fila()})")
+            return False, None, error_msg
+        
+        except subprocess.TimeoutExpired:
+            error_msg = "FFmpeg timeout - conversão demorou mais que 60 segundos"
+            logger.error(f"⏰ FFmpeg: {error_msg}")
+            return False, None, error_msg
+            
+        except FileNotFoundError:
+            error_msg = "FFmpeg não encontrado. Instale o FFmpeg no sistema"
+            logger.error(f"❌ FFmpeg: {error_msg}")
+            return False, None, error_msg
+            
+        except Exception as e:
+            error_msg = f"Erro inesperado na conversão: {str(e)}"
+            logger.error(f"💥 FFmpeg: {error_msg}")
+            return False, None, error_msg
+    
+    @staticmethod
+    def _argumentos_saida(output_bitrate: str) -> list:
+        return [
+            '-acodec', 'mp3',          # Codec de áudio MP3
+            '-ab', output_bitrate,      # Bitrate
+            '-ar', '44100',            # Sample rate
+            '-ac', '2',                # Canais (estéreo)
+            '-f', 'mp3',               # Formato de saída
+        ]
+    
+    @staticmethod
+    def _resultado(returncode: int, stderr: str, mp3_bytes: Optional[bytes]) -> Tuple[bool, Optional[bytes], str]:
+        logger.info(f"🎵 FFmpeg: Return code: {returncode}")
+        if stderr:
+            logger.info(f"🎵 FFmpeg stderr: {stderr}")
+        
+        if returncode == 0:
+            logger.info(f"✅ FFmpeg: Conversão concluída. Tamanho final: {len(mp3_bytes)} bytes")
+            return True, mp3_bytes, "Conversão realizada com sucesso"
+        
+        error_msg = f"FFmpeg erro (código {returncode}): {stderr}"
+        logger.error(f"❌ FFmpeg: {error_msg}")
+        return False, None, error_msg
+    
+    @staticmethod
+    def _convert_via_pipes(input_bytes: bytes, audio_format: str, output_bitrate: str) -> Tuple[bool, Optional[bytes], str]:
+        """
+        Conversão sem disco: entrada pelo stdin e MP3 lido do stdout
+        """
+        cmd = [FFmpegService.get_ffmpeg_path()]
+        
+        # Sem extensão de arquivo o ffmpeg precisa do formato de entrada quando ele é conhecido
+        if audio_format != 'unknown':
+            cmd += ['-f', audio_format]
+        
+        cmd += ['-i', 'pipe:0']
+        cmd += FFmpegService._argumentos_saida(output_bitrate)
+        cmd += ['pipe:1']
+        
+        logger.info(f"🎵 FFmpeg: Executando comando (pipes): {' '.join(cmd)}")
+        
+        result = subprocess.run(
+            cmd,
+            input=input_bytes,
+            capture_output=True,
+            timeout=60
+        )
+        
+        return FFmpegService._resultado(
+            result.returncode,
+            result.stderr.decode('utf-8', errors='replace'),
+            result.stdout
+        )
+    
+    @staticmethod
+    def _convert_via_arquivos(input_bytes: bytes, audio_format: str, output_bitrate: str) -> Tuple[bool, Optional[bytes], str]:
+        """
+        Conversão com arquivos temporários (modo antigo, FFMPEG_USE_PIPES=False)
+        """
         # Criar arquivos temporários com extensão apropriada
         input_suffix = f'.{audio_format}' if audio_format != 'unknown' else '.ogg'  # WhatsApp geralmente usa OGG
         with tempfile.NamedTemporaryFile(delete=False, suffix=input_suffix) as input_file:
             input_file.write(input_bytes)
             input_path = input_file.name
-            
-        # Verificar se o arquivo foi criado corretamente
-        if not os.path.exists(input_path) or os.path.getsize(input_path) == 0:
-            error_msg = "Arquivo temporário de entrada não foi criado corretamente"
-            logger.error(f"❌ FFmpeg: {error_msg}")
-            return False, None, error_msg
-            
-        logger.info(f"🎵 FFmpeg: Arquivo temporário criado: {input_path} ({os.path.getsize(input_path)} bytes)")
+        
+        logger.info(f"🎵 FFmpeg: Arquivo temporário criado: {input_path} ({len(input_bytes)} bytes)")
             
         with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as output_file:
             output_path = output_file.name
         
         try:
-            # Comando FFmpeg para conversão
             cmd = [
                 FFmpegService.get_ffmpeg_path(),
                 '-i', input_path,           # Arquivo de entrada
                 '-y',                       # Sobrescrever saída se existir
-                '-acodec', 'mp3',          # Codec de áudio MP3
-                '-ab', output_bitrate,      # Bitrate
-                '-ar', '44100',            # Sample rate
-                '-ac', '2',                # Canais (estéreo)
-                '-f', 'mp3',               # Formato de saída
-                output_path                # Arquivo de saída
             ]
+            cmd += FFmpegService._argumentos_saida(output_bitrate)
+            cmd += [output_path]
             
             logger.info(f"🎵 FFmpeg: Executando comando: {' '.join(cmd)}")
             
-            # Executar comando
             result = subprocess.run(
                 cmd,
                 capture_output=True,
                 text=True,
-                timeout=60  # Aumentado para 60 segundos
+                timeout=60
             )
             
-            logger.info(f"🎵 FFmpeg: Return code: {result.returncode}")
-            if result.stderr:
-                logger.info(f"🎵 FFmpeg stderr: {result.stderr}")
-            
+            mp3_bytes = None
             if result.returncode == 0:
-                # Ler arquivo convertido
                 with open(output_path, 'rb') as f:
                     mp3_bytes = f.read()
-                
-                logger.info(f"✅ FFmpeg: Conversão concluída. Tamanho final: {len(mp3_bytes)} bytes")
-                return True, mp3_bytes, "Conversão realizada com sucesso"
-            else:
-                error_msg = f"FFmpeg erro (código {result.returncode}): {result.stderr}"
-                logger.error(f"❌ FFmpeg: {error_msg}")
-                return False, None, error_msg
-                
-        except subprocess.TimeoutExpired:
-            error_msg = "FFmpeg timeout - conversão demorou mais que 30 segundos"
-            logger.error(f"⏰ FFmpeg: {error_msg}")
-            return False, None, error_msg
             
-        except FileNotFoundError:
-            error_msg = "FFmpeg não encontrado. Instale o FFmpeg no sistema"
-            logger.error(f"❌ FFmpeg: {error_msg}")
-            return False, None, error_msg
-            
-        except Exception as e:
-            error_msg = f"Erro inesperado na conversão: {str(e)}"
-            logger.error(f"💥 FFmpeg: {error_msg}")
-            return False, None, error_msg
+            return FFmpegService._resultado(result.returncode, result.stderr, mp3_bytes)
             
         finally:
             # Limpar arquivos temporários
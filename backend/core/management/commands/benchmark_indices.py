@@ -0,0 +1,155 @@
+"""
+Benchmark dos índices das consultas quentes do CRM
+
+    python manage.py benchmark_indices
+    python manage.py benchmark_indices --contatos 5000 --mensagens 40 --repeticoes 50
+
+Popula uma massa de dados dentro de uma transação, mostra o plano (EXPLAIN)
+e o tempo médio de cada consulta com os índices atuais e com o esquema
+anterior (só os índices dos FKs), e desfaz tudo no final.
+"""
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from atendimento.models import Conversa, Interacao, STATUS_CONVERSA_ATIVOS
+from contato.models import Contato
+
+# Índices criados para as consultas abaixo (removidos para simular o "antes")
+INDICES_NOVOS = [
+    'conversa_atualizado_idx',
+    'conversa_status_atualiz_idx',
+    'conversa_ativa_unica_contato',
+    'interacao_conversa_criado_idx',
+    'interacao_criado_remet_idx',
+    'interacao_whatsapp_id_idx',
+    'contato_telefone_idx',
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def _sem_auto_now_add(model):
+    """Permite gravar criado_em retroativo no bulk_create (massa espalhada no tempo)"""
+    campo = model._meta.get_field('criado_em')
+    campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        campo.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = 'Planos e tempos das consultas quentes com e sem os índices compostos/parciais'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contatos', type=int, default=2000)
+        parser.add_argument('--mensagens', type=int, default=50, help='Mensagens por conversa')
+        parser.add_argument('--repeticoes', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                alvos = self._popular(options['contatos'], options['mensagens'])
+                consultas = self._consultas(alvos)
+
+                depois = self._medir(consultas, options['repeticoes'])
+                self._esquema_anterior()
+                antes = self._medir(consultas, options['repeticoes'])
+
+                for nome in consultas:
+                    self.stdout.write(self.style.MIGRATE_HEADING(f"\n{nome}"))
+                    self.stdout.write(f"  antes:  {antes[nome][0] * 1000:8.3f}ms")
+                    self.stdout.write(f"          {antes[nome][1]}")
+                    self.stdout.write(f"  depois: {depois[nome][0] * 1000:8.3f}ms")
+                    self.stdout.write(f"          {depois[nome][1]}")
+                raise Rollback
+        except Rollback:
+            self.stdout.write(self.style.SUCCESS('\nMassa de dados descartada (rollback)'))
+
+    def _popular(self, total_contatos, mensagens_por_conversa):
+        agora = timezone.now()
+        dono = User.objects.create(username=f'benchmark-{agora.timestamp()}')
+
+        contatos = Contato.objects.bulk_create([
+            Contato(nome=f'Contato {i}', telefone=f'5511{i:09d}', criado_por=dono)
+            for i in range(total_contatos)
+        ], batch_size=1000)
+
+        status = [s for s, _ in Conversa.STATUS_CHOICES]
+        conversas = Conversa.objects.bulk_create([
+            Conversa(contato=contato, status=random.choice(status))
+            for contato in contatos
+        ], batch_size=1000)
+
+        interacoes = []
+        for conversa in conversas:
+            inicio = agora - timedelta(days=random.randint(0, 90))
+            for j in range(mensagens_por_conversa):
+                interacoes.append(Interacao(
+                    conversa=conversa,
+                    mensagem=f'mensagem {j}',
+                    remetente='cliente' if j % 2 else 'operador',
+                    criado_em=inicio + timedelta(minutes=j),
+                    whatsapp_id=f'WA{conversa.pk}-{j}' if j % 10 == 0 else None,
+                ))
+        with _sem_auto_now_add(Interacao):
+            Interacao.objects.bulk_create(interacoes, batch_size=2000)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        self.stdout.write(
+            f"Massa: {len(contatos)} contatos, {len(conversas)} conversas, {len(interacoes)} interações "
+            f"({connection.vendor})"
+        )
+        conversa = random.choice(conversas)
+        return {'conversa': conversa, 'contato': conversa.contato, 'whatsapp_id': f'WA{conversa.pk}-0', 'agora': agora}
+
+    def _consultas(self, alvos):
+        inicio_dia = timezone.localtime(alvos['agora']).replace(hour=0, minute=0, second=0, microsecond=0)
+        return {
+            'Histórico da conversa (cursor)': lambda: Interacao.objects.filter(
+                conversa=alvos['conversa']
+            ).order_by('-criado_em', '-id')[:50],
+            'Dashboard: recebidas hoje': lambda: Interacao.objects.filter(
+                criado_em__gte=inicio_dia, criado_em__lt=inicio_dia + timedelta(days=1), remetente='cliente'
+            ).values('id'),
+            'Dedup por whatsapp_id': lambda: Interacao.objects.filter(whatsapp_id=alvos['whatsapp_id']).order_by()[:1],
+            'Conversa ativa do contato': lambda: Conversa.objects.filter(
+                contato=alvos['contato'], status__in=STATUS_CONVERSA_ATIVOS
+            ).order_by()[:1],
+            'Lista de conversas por status': lambda: Conversa.objects.filter(
+                status='atendimento'
+            ).order_by('-atualizado_em')[:20],
+            'Contato por telefone': lambda: Contato.objects.filter(telefone=alvos['contato'].telefone).order_by()[:1],
+        }
+
+    def _medir(self, consultas, repeticoes):
+        resultados = {}
+        for nome, consulta in consultas.items():
+            plano = consulta().explain().replace('\n', '\n          ')
+            inicio = time.perf_counter()
+            for _ in range(repeticoes):
+                list(consulta())
+            resultados[nome] = ((time.perf_counter() - inicio) / repeticoes, plano)
+        return resultados
+
+    def _esquema_anterior(self):
+        """Remove os índices novos e recria o índice simples do FK conversa (dentro da transação)"""
+        with connection.cursor() as cursor:
+            for indice in INDICES_NOVOS:
+                cursor.execute(f'DROP INDEX {indice}')
+            cursor.execute(
+                'CREATE INDEX benchmark_interacao_conversa_id ON atendimento_interacao (conversa_id)'
+            )
+            cursor.execute('ANALYZE')
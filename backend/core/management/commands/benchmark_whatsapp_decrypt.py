@@ -0,0 +1,123 @@
+"""
+Micro-benchmark da descriptografia de mídia do WhatsApp
+
+    python manage.py benchmark_whatsapp_decrypt
+    python manage.py benchmark_whatsapp_decrypt --tamanhos 65536 1048576 --repeticoes 20
+
+Compara, para cada tamanho de arquivo:
+- expansão HKDF original (concatenação de bytes) x expansão em cache
+- descriptografia original (fatias + cópias) x verificar_e_descriptografar
+  (tempo médio e pico de memória alocada)
+"""
+import base64
+import hashlib
+import hmac
+import os
+import time
+import tracemalloc
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from django.core.management.base import BaseCommand
+
+from core.whatsapp_decrypt import WhatsAppDecryption, _expandir_chave
+
+
+def _expandir_original(media_key: bytes, media_type: str) -> bytes:
+    """Implementação anterior (referência para o benchmark)"""
+    info = {'audio': b'WhatsApp Audio Keys', 'video': b'WhatsApp Video Keys'}.get(media_type, b'WhatsApp Audio Keys')
+    prk = hmac.new(b'\x00' * 32, media_key, hashlib.sha256).digest()
+    t = b''
+    okm = b''
+    counter = 1
+    while len(okm) < 112:
+        t = hmac.new(prk, t + info + bytes([counter]), hashlib.sha256).digest()
+        okm += t
+        counter += 1
+    return okm[:112]
+
+
+def _descriptografar_original(encrypted_data: bytes, media_key: bytes, media_type: str) -> bytes:
+    """Implementação anterior (referência para o benchmark)"""
+    expanded_key = _expandir_original(media_key, media_type)
+    iv, cipher_key, mac_key = expanded_key[:16], expanded_key[16:48], expanded_key[48:80]
+    encrypted_content = encrypted_data[:-10]
+    received_mac = encrypted_data[-10:]
+    expected_mac = hmac.new(mac_key, iv + encrypted_content, hashlib.sha256).digest()[:10]
+    assert received_mac == expected_mac
+    decryptor = Cipher(algorithms.AES(cipher_key), modes.CBC(iv), backend=default_backend()).decryptor()
+    decrypted_data = decryptor.update(encrypted_content) + decryptor.finalize()
+    return decrypted_data[:-decrypted_data[-1]]
+
+
+def _criptografar(plaintext: bytes, media_key: bytes, media_type: str) -> bytes:
+    expanded_key = _expandir_original(media_key, media_type)
+    iv, cipher_key, mac_key = expanded_key[:16], expanded_key[16:48], expanded_key[48:80]
+    padder = padding.PKCS7(128).padder()
+    encryptor = Cipher(algorithms.AES(cipher_key), modes.CBC(iv), backend=default_backend()).encryptor()
+    conteudo = encryptor.update(padder.update(plaintext) + padder.finalize()) + encryptor.finalize()
+    return conteudo + hmac.new(mac_key, iv + conteudo, hashlib.sha256).digest()[:10]
+
+
+def _medir(funcao, repeticoes):
+    resultado = None
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        resultado = None  # não contar o resultado da rodada anterior no pico
+        resultado = funcao()
+    tempo = (time.perf_counter() - inicio) / repeticoes
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return resultado, tempo, pico
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark da descriptografia de mídia do WhatsApp (HKDF em cache e caminho sem cópias)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanhos', nargs='+', type=int, default=[64 * 1024, 1024 * 1024, 16 * 1024 * 1024])
+        parser.add_argument('--repeticoes', type=int, default=10)
+
+    def handle(self, *args, **options):
+        repeticoes = options['repeticoes']
+        media_key = os.urandom(32)
+        media_key_b64 = base64.b64encode(media_key).decode()
+
+        # HKDF
+        n = 10000
+        inicio = time.perf_counter()
+        for _ in range(n):
+            original = _expandir_original(media_key, 'audio')
+        tempo_original = (time.perf_counter() - inicio) / n
+
+        _expandir_chave.cache_clear()
+        inicio = time.perf_counter()
+        for _ in range(n):
+            cache = WhatsAppDecryption._expand_media_key(media_key, 'audio')
+        tempo_cache = (time.perf_counter() - inicio) / n
+
+        assert original == cache
+        self.stdout.write(
+            f"HKDF: original {tempo_original * 1e6:.1f}µs | em cache {tempo_cache * 1e6:.1f}µs "
+            f"({tempo_original / tempo_cache:.1f}x)"
+        )
+
+        # Descriptografia
+        for tamanho in options['tamanhos']:
+            plaintext = os.urandom(tamanho)
+            encrypted = _criptografar(plaintext, media_key, 'audio')
+
+            antigo, tempo_antigo, pico_antigo = _medir(
+                lambda: _descriptografar_original(encrypted, media_key, 'audio'), repeticoes
+            )
+            novo, tempo_novo, pico_novo = _medir(
+                lambda: WhatsAppDecryption.verificar_e_descriptografar(encrypted, media_key_b64, 'audio'), repeticoes
+            )
+            assert antigo == plaintext and novo == plaintext
+
+            self.stdout.write(
+                f"{tamanho / 1024:>8.0f} KiB: original {tempo_antigo * 1000:7.2f}ms / pico {pico_antigo / tamanho:.1f}x arquivo"
+                f" | verificar_e_descriptografar {tempo_novo * 1000:7.2f}ms / pico {pico_novo / tamanho:.1f}x arquivo"
+            )
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('metrica', models.CharField(max_length=120)),
+                ('valor', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='contadores_diarios', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Contador Diário',
+                'verbose_name_plural': 'Contadores Diários',
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'dia', 'metrica'), name='unique_contador_diario'), models.UniqueConstraint(condition=models.Q(('usuario__isnull', True)), fields=('dia', 'metrica'), name='unique_contador_diario_sem_dono')],
+            },
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.contrib.auth.models import User
 
 # Create your models here.
 class ConfiguracaoSistema(models.Model):
@@ -33,3 +34,35 @@ class ConfiguracaoSistema(models.Model):
         if not self.pk and ConfiguracaoSistema.objects.exists():
             raise ValueError('Já existe uma configuração do sistema')
         super().save(*args, **kwargs)
+
+
+class ContadorDiario(models.Model):
+    """
+    Contadores dos dashboards por dono (Contato.criado_por) e dia
+
+    Mantidos pelos signals (core.contadores); saldos ficam em dia=DIA_SALDO.
+    usuario NULL é o balde dos contatos sem dono. Os dashboards somam as
+    linhas dos usuários visíveis (get_ids_visiveis) e as sem dono.
+    """
+    usuario = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, blank=True, related_name='contadores_diarios'
+    )
+    dia = models.DateField()
+    metrica = models.CharField(max_length=120)
+    valor = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.dia} {self.metrica}={self.valor} ({self.usuario_id})"
+
+    class Meta:
+        verbose_name = "Contador Diário"
+        verbose_name_plural = "Contadores Diários"
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'dia', 'metrica'], name='unique_contador_diario'),
+            # NULL não colide em índice único: balde sem dono à parte
+            models.UniqueConstraint(
+                fields=['dia', 'metrica'],
+                condition=models.Q(usuario__isnull=True),
+                name='unique_contador_diario_sem_dono'
+            ),
+        ]
@@ -0,0 +1,98 @@
+"""
+Rastreamento de campos: valores lidos do banco guardados na instância
+
+Para os signals saberem o que mudou sem outro SELECT (troca de estágio e
+valor do Negocio, status da Conversa - gatilhos, inbox e contadores do
+dashboard):
+
+    class Negocio(CamposRastreadosMixin, models.Model):
+        CAMPOS_RASTREADOS = ('estagio',)
+
+    instance.valor_anterior('estagio')        # id do estágio no banco
+    instance.campos_alterados(update_fields)  # {'estagio'} / set()
+
+O retrato é tirado no from_db, no refresh_from_db e depois de cada save
+(só dos campos gravados, com update_fields; core.upsert faz o mesmo). Fica
+numa tupla por instância, alinhada com os attnames da classe - sem dict por
+objeto. Campo adiado (only/defer) ou instância montada à mão ficam
+NAO_CARREGADO: quem precisa do valor decide se consulta o banco.
+
+pre_save e post_save ainda enxergam o retrato anterior ao save.
+"""
+
+
+class _NaoCarregado:
+    """Sentinela; sobrevive a pickle (instâncias em cache) como o mesmo objeto"""
+
+    def __reduce__(self):
+        return 'NAO_CARREGADO'
+
+    def __repr__(self):
+        return 'NAO_CARREGADO'
+
+
+NAO_CARREGADO = _NaoCarregado()
+
+
+class CamposRastreadosMixin:
+    CAMPOS_RASTREADOS = ()
+
+    @classmethod
+    def _attnames_rastreados(cls):
+        """attname de cada campo rastreado (estagio → estagio_id), calculado uma vez por classe"""
+        attnames = cls.__dict__.get('_attnames_rastreados_cache')
+        if attnames is None:
+            attnames = tuple(cls._meta.get_field(campo).attname for campo in cls.CAMPOS_RASTREADOS)
+            cls._attnames_rastreados_cache = attnames
+        return attnames
+
+    def _retratar(self, campos=None):
+        """Guarda os valores atuais dos campos rastreados (todos, ou só os listados em campos)"""
+        attnames = self._attnames_rastreados()
+        atuais = self.__dict__
+        anteriores = atuais.get('_rastreados') or (NAO_CARREGADO,) * len(attnames)
+        self._rastreados = tuple(
+            atuais.get(attname, NAO_CARREGADO)
+            if campos is None or campo in campos or attname in campos else anterior
+            for campo, attname, anterior in zip(self.CAMPOS_RASTREADOS, attnames, anteriores)
+        )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._retratar()
+        return instancia
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._retratar(fields)
+
+    def save_base(self, *args, **kwargs):
+        super().save_base(*args, **kwargs)
+        self._retratar(kwargs.get('update_fields'))
+
+    def valor_anterior(self, campo, padrao=NAO_CARREGADO):
+        """Valor do campo no banco (attname: id para FK), ou padrao se não foi carregado"""
+        rastreados = self.__dict__.get('_rastreados')
+        if rastreados is None:
+            return padrao
+        valor = rastreados[self.CAMPOS_RASTREADOS.index(campo)]
+        return padrao if valor is NAO_CARREGADO else valor
+
+    def campos_alterados(self, update_fields=None):
+        """
+        Campos rastreados com valor diferente do banco (os não carregados ficam de fora)
+        Com update_fields (kwargs do signal), só os que o save grava de fato.
+        """
+        rastreados = self.__dict__.get('_rastreados')
+        if rastreados is None:
+            return set()
+
+        alterados = set()
+        for campo, attname, anterior in zip(self.CAMPOS_RASTREADOS, self._attnames_rastreados(), rastreados):
+            if update_fields is not None and campo not in update_fields and attname not in update_fields:
+                continue
+            atual = self.__dict__.get(attname, NAO_CARREGADO)
+            if anterior is not NAO_CARREGADO and atual is not NAO_CARREGADO and atual != anterior:
+                alterados.add(campo)
+        return alterados
@@ -0,0 +1,151 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from atendimento.models import Conversa, Interacao
+from contato.models import Contato
+from core import contadores
+from negocio.models import Negocio
+
+
+def _dono_contato(contato_id):
+    """Dono do contato (None = sem dono, balde próprio nos contadores)"""
+    return Contato.objects.filter(pk=contato_id).values_list('criado_por_id', flat=True).first()
+
+
+def _dono_conversa(conversa_id):
+    return Conversa.objects.filter(pk=conversa_id).values_list('contato__criado_por_id', flat=True).first()
+
+
+def _nomes_estagios(*ids):
+    from kanban.models import Estagio
+    return dict(Estagio.objects.filter(pk__in=[i for i in ids if i]).values_list('pk', 'nome'))
+
+
+# ===== CONTATOS =====
+
+@receiver(post_save, sender=Contato)
+def contar_contato_novo(sender, instance, created, **kwargs):
+    if not created:
+        return
+    dono = instance.criado_por_id
+    dia = timezone.localdate(instance.criado_em)
+
+    def aplicar():
+        contadores.incrementar(dono, [contadores.CONTATOS_NOVOS], dia=dia)
+        contadores.incrementar(dono, [contadores.CONTATOS_TOTAL], dia=contadores.DIA_SALDO)
+    transaction.on_commit(aplicar)
+
+
+@receiver(post_delete, sender=Contato)
+def descontar_contato(sender, instance, **kwargs):
+    dono = instance.criado_por_id
+    transaction.on_commit(lambda: contadores.incrementar(
+        dono, [contadores.CONTATOS_TOTAL], dia=contadores.DIA_SALDO, valor=-1
+    ))
+
+
+# ===== CONVERSAS =====
+
+@receiver(post_save, sender=Conversa)
+def contar_conversa(sender, instance, created, update_fields=None, **kwargs):
+    contato_id = instance.contato_id
+    status = instance.status
+
+    if created:
+        dia = timezone.localdate(instance.criado_em)
+
+        def aplicar():
+            dono = _dono_contato(contato_id)
+            contadores.incrementar(dono, [contadores.CONVERSAS_NOVAS], dia=dia)
+            contadores.incrementar(
+                dono, [contadores.CONVERSAS_TOTAL, f"{contadores.CONVERSAS_STATUS}{status}"], dia=contadores.DIA_SALDO
+            )
+        transaction.on_commit(aplicar)
+        return
+
+    # Troca de status pelo retrato do mixin (sem SELECT); status não carregado fica para a reconciliação
+    if 'status' not in instance.campos_alterados(update_fields):
+        return
+    anterior = instance.valor_anterior('status')
+    finalizada_em = instance.finalizada_em
+
+    def aplicar():
+        dono = _dono_contato(contato_id)
+        contadores.incrementar(dono, [f"{contadores.CONVERSAS_STATUS}{anterior}"], dia=contadores.DIA_SALDO, valor=-1)
+        contadores.incrementar(dono, [f"{contadores.CONVERSAS_STATUS}{status}"], dia=contadores.DIA_SALDO)
+        if status == 'finalizada' and finalizada_em:
+            contadores.incrementar(dono, [contadores.CONVERSAS_FINALIZADAS], dia=timezone.localdate(finalizada_em))
+    transaction.on_commit(aplicar)
+
+
+@receiver(post_delete, sender=Conversa)
+def descontar_conversa(sender, instance, **kwargs):
+    # Dono lido agora: na exclusão em cascata o contato ainda existe nesta transação
+    dono = _dono_contato(instance.contato_id)
+    metricas = [contadores.CONVERSAS_TOTAL, f"{contadores.CONVERSAS_STATUS}{instance.status}"]
+    transaction.on_commit(lambda: contadores.incrementar(dono, metricas, dia=contadores.DIA_SALDO, valor=-1))
+
+
+# ===== INTERAÇÕES =====
+
+@receiver(post_save, sender=Interacao)
+def contar_interacao(sender, instance, created, **kwargs):
+    if not created:
+        return
+    criado_em = timezone.localtime(instance.criado_em)
+    metricas = contadores.metricas_interacao(instance.remetente, criado_em.hour)
+    transaction.on_commit(lambda: contadores.incrementar(
+        _dono_conversa(instance.conversa_id), metricas, dia=criado_em.date()
+    ))
+
+
+# ===== FUNIL DE NEGÓCIOS =====
+
+@receiver(post_save, sender=Negocio)
+def contar_negocio(sender, instance, created, update_fields=None, **kwargs):
+    contato_id = instance.contato_id
+    estagio_id = instance.estagio_id
+    valor = instance.valor or 0
+
+    if created:
+        def aplicar():
+            dono = _dono_contato(contato_id)
+            nome = _nomes_estagios(estagio_id).get(estagio_id)
+            contadores.incrementar(dono, [f"{contadores.NEGOCIOS_ESTAGIO}{nome}"], dia=contadores.DIA_SALDO)
+            contadores.incrementar(dono, [contadores.NEGOCIOS_VALOR], dia=contadores.DIA_SALDO, valor=valor)
+        transaction.on_commit(aplicar)
+        return
+
+    alterados = instance.campos_alterados(update_fields)
+    if not alterados:
+        return
+    estagio_anterior = instance.valor_anterior('estagio')
+    valor_anterior = instance.valor_anterior('valor') or 0
+
+    def aplicar():
+        dono = _dono_contato(contato_id)
+        if 'estagio' in alterados:
+            nomes = _nomes_estagios(estagio_anterior, estagio_id)
+            contadores.incrementar(
+                dono, [f"{contadores.NEGOCIOS_ESTAGIO}{nomes.get(estagio_anterior)}"], dia=contadores.DIA_SALDO, valor=-1
+            )
+            contadores.incrementar(dono, [f"{contadores.NEGOCIOS_ESTAGIO}{nomes.get(estagio_id)}"], dia=contadores.DIA_SALDO)
+        if 'valor' in alterados:
+            contadores.incrementar(
+                dono, [contadores.NEGOCIOS_VALOR], dia=contadores.DIA_SALDO, valor=valor - valor_anterior
+            )
+    transaction.on_commit(aplicar)
+
+
+@receiver(post_delete, sender=Negocio)
+def descontar_negocio(sender, instance, **kwargs):
+    dono = _dono_contato(instance.contato_id)
+    nome = _nomes_estagios(instance.estagio_id).get(instance.estagio_id)
+    valor = instance.valor or 0
+
+    def aplicar():
+        contadores.incrementar(dono, [f"{contadores.NEGOCIOS_ESTAGIO}{nome}"], dia=contadores.DIA_SALDO, valor=-1)
+        contadores.incrementar(dono, [contadores.NEGOCIOS_VALOR], dia=contadores.DIA_SALDO, valor=-valor)
+    transaction.on_commit(aplicar)
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.utils import timezone
+
+from .contadores import donos_com_dados, reconciliar
+
+
+@shared_task
+def reconciliar_contadores_task(dias_atras=0):
+    """
+    Acerta os contadores dos dashboards (core.ContadorDiario) dono a dono
+    dias_atras=1 fecha o dia anterior depois da virada
+    """
+    dia = timezone.localdate() - timedelta(days=dias_atras)
+    corrigidas = sum(reconciliar(usuario_id, dia) for usuario_id in donos_com_dados(dia))
+
+    return f"{corrigidas} contadores corrigidos em {dia}"
@@ -1,3 +1,569 @@
-from django.test import TestCase
+import base64
+import hashlib
+import hmac
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from atendimento import utils as atendimento_utils
+from atendimento.models import Conversa, Interacao
+from contato.models import Contato
+from kanban.models import Estagio, Kanban
+from negocio.models import Negocio
+from . import contadores
+from . import ffmpeg_service
+from .ffmpeg_service import FFmpegService
+from .models import ContadorDiario
+from .tasks import reconciliar_contadores_task
+from .utils import get_ids_visiveis, get_tenant_id, usuarios_visiveis
+from .whatsapp_decrypt import MacInvalido, WhatsAppDecryption, WhatsAppStreamDecryptor, _expandir_chave, chaves_midia
+
+
+INFO_HKDF = {
+    'audio': b'WhatsApp Audio Keys',
+    'image': b'WhatsApp Image Keys',
+    'video': b'WhatsApp Video Keys',
+    'document': b'WhatsApp Document Keys',
+}
+
+
+def expandir_como_antes(media_key: bytes, media_type: str) -> bytes:
+    """Referência: o laço HKDF (extract + expand) da versão anterior"""
+    prk = hmac.new(b'\x00' * 32, media_key, hashlib.sha256).digest()
+    t, okm, contador = b'', b'', 1
+    while len(okm) < 112:
+        t = hmac.new(prk, t + INFO_HKDF[media_type] + bytes([contador]), hashlib.sha256).digest()
+        okm += t
+        contador += 1
+    return okm[:112]
+
+
+def chaves_teste(media_key: bytes, media_type: str):
+    expandida = expandir_como_antes(media_key, media_type)
+    return expandida[:16], expandida[16:48], expandida[48:80]
+
+
+def criptografar_midia(conteudo: bytes, media_key: bytes, media_type: str = 'audio') -> bytes:
+    """Arquivo como o WhatsApp envia: AES-CBC(conteúdo com PKCS7) + HMAC-SHA256(iv + cifrado)[:10]"""
+    iv, cipher_key, mac_key = chaves_teste(media_key, media_type)
+    padder = padding.PKCS7(128).padder()
+    encryptor = Cipher(algorithms.AES(cipher_key), modes.CBC(iv)).encryptor()
+    cifrado = encryptor.update(padder.update(conteudo) + padder.finalize()) + encryptor.finalize()
+    return cifrado + hmac.new(mac_key, iv + cifrado, hashlib.sha256).digest()[:10]
+
+
+def descriptografar_em_memoria(arquivo: bytes, media_key: bytes, media_type: str):
+    """Referência: o decrypt_media antigo, com o arquivo inteiro em memória"""
+    iv, cipher_key, mac_key = chaves_teste(media_key, media_type)
+    conteudo, mac = arquivo[:-10], arquivo[-10:]
+    mac_valido = WhatsAppDecryption._calculate_mac(mac_key, iv + conteudo) == mac
+    decryptor = Cipher(algorithms.AES(cipher_key), modes.CBC(iv)).decryptor()
+    texto = decryptor.update(conteudo) + decryptor.finalize()
+    return WhatsAppDecryption._remove_pkcs7_padding(texto), mac_valido
+
+
+class StreamDecryptorTests(SimpleTestCase):
+    def setUp(self):
+        self.media_key = os.urandom(32)
+        self.conteudo = os.urandom(5000) + b'fim'
+        self.arquivo = criptografar_midia(self.conteudo, self.media_key, 'video')
+
+    def descriptografar_em_pedacos(self, arquivo, tamanho_pedaco):
+        decryptor = WhatsAppStreamDecryptor(self.media_key, 'video')
+        saida = b''.join(
+            decryptor.update(arquivo[i:i + tamanho_pedaco]) for i in range(0, len(arquivo), tamanho_pedaco)
+        )
+        return saida + decryptor.finalize(), decryptor
+
+    def test_qualquer_tamanho_de_pedaco_devolve_o_mesmo_que_em_memoria(self):
+        referencia, mac_valido = descriptografar_em_memoria(self.arquivo, self.media_key, 'video')
+        self.assertEqual(referencia, self.conteudo)
+        self.assertTrue(mac_valido)
+
+        # Pedaços menores que o MAC, que um bloco, desalinhados e o arquivo inteiro
+        for tamanho in (1, 7, 10, 16, 33, 4096, len(self.arquivo)):
+            with self.subTest(tamanho=tamanho):
+                saida, decryptor = self.descriptografar_em_pedacos(self.arquivo, tamanho)
+                self.assertEqual(saida, referencia)
+                self.assertTrue(decryptor.mac_valido)
+
+    def test_mac_divergente_fica_marcado_e_descriptografa_como_antes(self):
+        adulterado = self.arquivo[:-1] + bytes([self.arquivo[-1] ^ 1])
+        referencia, mac_valido = descriptografar_em_memoria(adulterado, self.media_key, 'video')
+
+        saida, decryptor = self.descriptografar_em_pedacos(adulterado, 1024)
+
+        self.assertFalse(mac_valido)
+        self.assertFalse(decryptor.mac_valido)
+        self.assertEqual(saida, referencia)
+
+    def test_conteudo_multiplo_do_bloco(self):
+        conteudo = b'x' * 64  # padding PKCS7 ocupa um bloco inteiro
+        arquivo = criptografar_midia(conteudo, self.media_key, 'video')
+
+        saida, _ = self.descriptografar_em_pedacos(arquivo, 16)
+
+        self.assertEqual(saida, conteudo)
+
+    def test_arquivo_menor_que_o_mac(self):
+        decryptor = WhatsAppStreamDecryptor(self.media_key, 'video')
+        decryptor.update(b'123')
+
+        with self.assertRaises(ValueError):
+            decryptor.finalize()
+
+    def test_decrypt_media_usa_o_mesmo_resultado(self):
+        media_key_b64 = base64.b64encode(self.media_key).decode()
+
+        self.assertEqual(WhatsAppDecryption.decrypt_media(self.arquivo, media_key_b64, 'video'), self.conteudo)
+
+
+
+class VerificarEDescriptografarTests(SimpleTestCase):
+    def setUp(self):
+        self.media_key = os.urandom(32)
+        self.media_key_b64 = base64.b64encode(self.media_key).decode()
+        self.conteudo = os.urandom(1000)
+        self.arquivo = criptografar_midia(self.conteudo, self.media_key, 'image')
+
+    def test_devolve_o_original(self):
+        saida = WhatsAppDecryption.verificar_e_descriptografar(memoryview(self.arquivo), self.media_key_b64, 'image')
+
+        self.assertEqual(saida, self.conteudo)
+
+    def test_mac_divergente_levanta_antes_de_descriptografar(self):
+        adulterado = bytearray(self.arquivo)
+        adulterado[0] ^= 1
+
+        with mock.patch('core.whatsapp_decrypt.Cipher') as cipher:
+            with self.assertRaises(MacInvalido):
+                WhatsAppDecryption.verificar_e_descriptografar(adulterado, self.media_key_b64, 'image')
+        cipher.assert_not_called()
+
+    def test_chave_de_outro_tipo_de_midia_nao_confere(self):
+        with self.assertRaises(MacInvalido):
+            WhatsAppDecryption.verificar_e_descriptografar(self.arquivo, self.media_key_b64, 'audio')
+
+    def test_arquivo_truncado(self):
+        with self.assertRaises(ValueError):
+            WhatsAppDecryption.verificar_e_descriptografar(self.arquivo[:-3], self.media_key_b64, 'image')
+
+    def test_expansao_igual_a_da_versao_anterior(self):
+        for media_type in INFO_HKDF:
+            with self.subTest(media_type=media_type):
+                self.assertEqual(chaves_midia(self.media_key, media_type), chaves_teste(self.media_key, media_type))
+
+    def test_expansao_da_chave_em_cache(self):
+        _expandir_chave.cache_clear()
+
+        chaves_midia(self.media_key, 'image')
+        chaves_midia(bytearray(self.media_key), 'image')
+        chaves_midia(self.media_key, 'video')
+
+        info = _expandir_chave.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 2))
+
+class DownloadStreamingTests(SimpleTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.media_key = os.urandom(32)
+        self.conteudo = os.urandom(200 * 1024)
+        self.arquivo = criptografar_midia(self.conteudo, self.media_key, 'video')
+
+    def baixar(self, arquivo, file_enc_sha256=None):
+        resposta = mock.Mock(status_code=200)
+        resposta.iter_content.side_effect = lambda chunk_size: (
+            arquivo[i:i + chunk_size] for i in range(0, len(arquivo), chunk_size)
+        )
+        with override_settings(MEDIA_ROOT=self.media_root), \
+                mock.patch.object(atendimento_utils, 'get_instance_config', return_value={'api_key': 'chave'}), \
+                mock.patch.object(atendimento_utils.requests, 'get', return_value=resposta) as get:
+            resultado = atendimento_utils.baixar_e_salvar_media(
+                'https://mmg.whatsapp.net/v/t62/video.enc', 'video', 'video.mp4',
+                media_key=base64.b64encode(self.media_key).decode(),
+                file_enc_sha256=file_enc_sha256,
+            )
+        salvos = [os.path.join(raiz, nome) for raiz, _, nomes in os.walk(self.media_root) for nome in nomes]
+        self.assertEqual([os.path.basename(caminho) for caminho in salvos], [resultado['filename']])
+        with open(salvos[0], 'rb') as salvo:
+            conteudo_salvo = salvo.read()
+        self.assertTrue(get.call_args.kwargs['stream'])
+        return resultado, conteudo_salvo
+
+    def test_salva_descriptografado_sem_ler_o_corpo_inteiro(self):
+        sha256 = base64.b64encode(hashlib.sha256(self.arquivo).digest()).decode()
+
+        with self.assertNoLogs('atendimento.utils', 'WARNING'):
+            resultado, salvo = self.baixar(self.arquivo, file_enc_sha256=sha256)
+
+        self.assertTrue(resultado['success'])
+        self.assertEqual(resultado['size'], len(self.conteudo))
+        self.assertEqual(salvo, self.conteudo)
+
+    def test_mac_divergente_salva_o_mesmo_que_a_versao_em_memoria(self):
+        adulterado = self.arquivo[:-1] + bytes([self.arquivo[-1] ^ 1])
+        referencia, _ = descriptografar_em_memoria(adulterado, self.media_key, 'video')
+
+        with self.assertLogs('core.whatsapp_decrypt', 'WARNING'):
+            _, salvo = self.baixar(adulterado)
+
+        self.assertEqual(salvo, referencia)
+
+    def test_file_enc_sha256_divergente_fica_no_log(self):
+        with self.assertLogs('atendimento.utils', 'WARNING'):
+            resultado, _ = self.baixar(self.arquivo, file_enc_sha256='outro')
+
+        self.assertTrue(resultado['success'])
+
+
+OGG = b'OggS' + b'\x00' * 300
+MP4 = b'\x00\x00\x00\x20ftypM4A ' + b'\x00' * 300
+
+
+class FilaFFmpegTestCase(SimpleTestCase):
+    def setUp(self):
+        vagas_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, vagas_dir, ignore_errors=True)
+        configuracao = override_settings(FFMPEG_MAX_PROCESSOS=1, FFMPEG_VAGAS_DIR=vagas_dir, FFMPEG_FILA_TIMEOUT=0)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        # Fila recriada com o limite deste teste (é por processo)
+        estado = mock.patch.dict(ffmpeg_service._fila, {'pid': None})
+        estado.start()
+        self.addCleanup(estado.stop)
+
+
+class VagasFFmpegTests(FilaFFmpegTestCase):
+    def test_vaga_do_host_ocupada_recusa_outra_conversao(self):
+        with ffmpeg_service._vaga_conversao():
+            self.assertEqual(ffmpeg_service.estatisticas_fila()['em_execucao'], 1)
+            with mock.patch.object(ffmpeg_service.subprocess, 'run') as run:
+                sucesso, _, mensagem = FFmpegService.convert_to_mp3(OGG)
+
+        self.assertFalse(sucesso)
+        self.assertIn('Fila de conversão cheia', mensagem)
+        run.assert_not_called()
+
+    def test_vaga_e_um_lock_de_arquivo_compartilhado_entre_processos(self):
+        # Outro worker (outra descrição de arquivo) segurando a única vaga do host
+        fd = ffmpeg_service._tentar_vaga_host(1)
+        self.addCleanup(os.close, fd)
+
+        with self.assertRaises(ffmpeg_service.FilaConversaoCheia):
+            with ffmpeg_service._vaga_conversao():
+                pass
+
+        ffmpeg_service.fcntl.flock(fd, ffmpeg_service.fcntl.LOCK_UN)
+        with ffmpeg_service._vaga_conversao():
+            pass
+
+    def test_vaga_liberada_mesmo_com_erro_na_conversao(self):
+        with mock.patch.object(ffmpeg_service.subprocess, 'run', side_effect=RuntimeError('boom')):
+            self.assertFalse(FFmpegService.convert_to_mp3(OGG)[0])
+
+        estatisticas = ffmpeg_service.estatisticas_fila()
+        self.assertEqual((estatisticas['em_execucao'], estatisticas['aguardando']), (0, 0))
+        with ffmpeg_service._vaga_conversao():
+            pass
+
+    def test_sem_diretorio_de_vagas_limita_por_processo(self):
+        with mock.patch.object(ffmpeg_service, '_tentar_vaga_host', side_effect=PermissionError('somente leitura')):
+            with ffmpeg_service._vaga_conversao():
+                self.assertEqual(ffmpeg_service.estatisticas_fila()['escopo'], 'processo')
+                with self.assertRaises(ffmpeg_service.FilaConversaoCheia):
+                    with ffmpeg_service._vaga_conversao():
+                        pass
+
+
+def ffmpeg_falso(codigos):
+    """subprocess.run simulado: devolve os códigos em ordem e grava o MP3 quando a saída é um arquivo"""
+    codigos = iter(codigos)
+
+    def run(cmd, **kwargs):
+        codigo = next(codigos)
+        saida = b'ID3mp3' if codigo == 0 else b''
+        if codigo == 0 and cmd[-1] != 'pipe:1':
+            with open(cmd[-1], 'wb') as arquivo:
+                arquivo.write(saida)
+        texto = kwargs.get('text')
+        return mock.Mock(returncode=codigo, stdout=saida, stderr='erro' if texto else b'erro')
+
+    return run
+
+
+@override_settings(FFMPEG_USE_PIPES=True)
+class ConversaoFFmpegTests(FilaFFmpegTestCase):
+    def test_pipe_com_falha_cai_para_arquivo_temporario(self):
+        with mock.patch.object(ffmpeg_service.subprocess, 'run', side_effect=ffmpeg_falso([1, 0])) as run:
+            sucesso, mp3, _ = FFmpegService.convert_to_mp3(OGG)
+
+        self.assertTrue(sucesso)
+        self.assertEqual(mp3, b'ID3mp3')
+        self.assertIn('pipe:0', run.call_args_list[0].args[0])
+        self.assertNotIn('pipe:0', run.call_args_list[1].args[0])
+
+    def test_pipe_ok_nao_toca_no_disco(self):
+        with mock.patch.object(ffmpeg_service.subprocess, 'run', side_effect=ffmpeg_falso([0])) as run, \
+                mock.patch.object(ffmpeg_service.tempfile, 'NamedTemporaryFile') as temporario:
+            sucesso, mp3, _ = FFmpegService.convert_to_mp3(OGG)
+
+        self.assertEqual((sucesso, mp3), (True, b'ID3mp3'))
+        self.assertEqual(run.call_args.args[0][1:5], ['-f', 'ogg', '-i', 'pipe:0'])
+        temporario.assert_not_called()
+
+    def test_mp4_vai_direto_para_arquivo(self):
+        with mock.patch.object(ffmpeg_service.subprocess, 'run', side_effect=ffmpeg_falso([0])) as run:
+            self.assertTrue(FFmpegService.convert_to_mp3(MP4)[0])
+
+        self.assertEqual(run.call_count, 1)
+        self.assertTrue(run.call_args.args[0][2].endswith('.mp4'))
+
+
+class ContadoresDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dono = User.objects.create_user('dono', password='x')
+        self.outro = User.objects.create_user('outro', password='x')
+
+    def criar_conversa(self, dono, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            contato = Contato.objects.create(nome='Fulano', criado_por=dono)
+            conversa = Conversa.objects.create(contato=contato, **kwargs)
+            Interacao.objects.create(conversa=conversa, mensagem='oi', remetente='cliente')
+            Interacao.objects.create(conversa=conversa, mensagem='olá', remetente='operador')
+        return conversa
+
+    def status(self, usuario):
+        return contadores.por_prefixo(contadores.obter([usuario.id]), contadores.CONVERSAS_STATUS)
+
+    def test_signals_contam_por_dono(self):
+        self.criar_conversa(self.dono)
+        self.criar_conversa(self.outro)
+
+        valores = contadores.obter([self.dono.id])
+
+        self.assertEqual(valores[contadores.CONTATOS_TOTAL], 1)
+        self.assertEqual(valores[contadores.CONVERSAS_NOVAS], 1)
+        self.assertEqual(valores[contadores.MENSAGENS_RECEBIDAS], 1)
+        self.assertEqual(valores[contadores.MENSAGENS_ENVIADAS], 1)
+        self.assertEqual(self.status(self.dono), {'entrada': 1})
+
+    def test_contatos_sem_dono_entram_para_todos(self):
+        self.criar_conversa(None)
+        self.criar_conversa(self.dono)
+
+        self.assertTrue(ContadorDiario.objects.filter(usuario__isnull=True).exists())
+        self.assertEqual(contadores.obter([self.dono.id])[contadores.CONTATOS_TOTAL], 2)
+        self.assertEqual(contadores.obter([self.outro.id])[contadores.CONTATOS_TOTAL], 1)
+        self.assertEqual(contadores.obter([self.outro.id])[contadores.INTERACOES], 2)
+
+    def test_troca_de_status_move_o_saldo(self):
+        conversa = self.criar_conversa(self.dono)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            conversa.status = 'finalizada'
+            conversa.finalizada_em = conversa.criado_em
+            conversa.save()
+
+        valores = contadores.obter([self.dono.id])
+        self.assertEqual(self.status(self.dono), {'finalizada': 1})
+        self.assertEqual(valores[contadores.CONVERSAS_FINALIZADAS], 1)
+
+    def test_save_sem_troca_de_status_nao_mexe_no_saldo(self):
+        conversa = self.criar_conversa(self.dono)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            conversa.prioridade = 'alta'
+            conversa.save()
+
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.status(self.dono), {'entrada': 1})
+
+    def test_update_fields_sem_status_nao_consulta_o_anterior(self):
+        conversa = self.criar_conversa(self.dono)
+        conversa.status = 'atendimento'
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as consultas:
+            conversa.save(update_fields=['prioridade'])
+
+        self.assertFalse(any('"status"' in q['sql'] and q['sql'].startswith('SELECT') for q in consultas))
+        self.assertEqual(self.status(self.dono), {'entrada': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            conversa.save(update_fields=['status'])
+        self.assertEqual(self.status(self.dono), {'atendimento': 1})
+
+    def test_troca_de_status_nao_rele_a_conversa(self):
+        conversa = Conversa.objects.get(pk=self.criar_conversa(self.dono).pk)
+        conversa.status = 'atendimento'
+
+        with self.captureOnCommitCallbacks(execute=False), CaptureQueriesContext(connection) as consultas:
+            conversa.save(update_fields=['status'])
+
+        self.assertEqual([q['sql'].split()[0] for q in consultas], ['UPDATE'])
+
+    def test_status_adiado_fica_para_a_reconciliacao(self):
+        conversa = Conversa.objects.only('prioridade').get(pk=self.criar_conversa(self.dono).pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            conversa.status = 'atendimento'
+            conversa.save(update_fields=['status'])
+        self.assertEqual(self.status(self.dono), {'entrada': 1})
+
+        reconciliar_contadores_task()
+        self.assertEqual(self.status(self.dono), {'atendimento': 1})
+
+    def test_conversa_do_upsert_ja_tem_retrato(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            contato = Contato.objects.create(nome='Fulano', criado_por=self.dono)
+            conversa, criada = Conversa.obter_ou_criar_aberta(contato)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            conversa.status = 'atendimento'
+            conversa.save()
+
+        self.assertTrue(criada)
+        self.assertEqual(self.status(self.dono), {'atendimento': 1})
+
+    def test_exclusao_desconta(self):
+        conversa = self.criar_conversa(self.dono)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            conversa.contato.delete()
+
+        valores = contadores.obter([self.dono.id])
+        self.assertEqual(valores[contadores.CONTATOS_TOTAL], 0)
+        self.assertEqual(valores[contadores.CONVERSAS_TOTAL], 0)
+
+    def test_funil_de_negocios(self):
+        conversa = self.criar_conversa(self.dono)
+        kanban = Kanban.objects.create(nome='Vendas', criado_por=self.dono)
+        lead = Estagio.objects.create(nome='Lead', kanban=kanban)
+        ganho = Estagio.objects.create(nome='Ganho', kanban=kanban)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            negocio = Negocio.objects.create(titulo='n', contato=conversa.contato, estagio=lead, valor=Decimal('10'))
+        with self.captureOnCommitCallbacks(execute=True):
+            negocio = Negocio.objects.get(pk=negocio.pk)
+            negocio.estagio = ganho
+            negocio.valor = Decimal('25')
+            negocio.save()
+
+        valores = contadores.obter([self.dono.id])
+        self.assertEqual(contadores.por_prefixo(valores, contadores.NEGOCIOS_ESTAGIO), {'Ganho': 1})
+        self.assertEqual(valores[contadores.NEGOCIOS_VALOR], Decimal('25'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            negocio.valor = Decimal('40')
+            negocio.save(update_fields=['valor'])
+        self.assertEqual(contadores.obter([self.dono.id])[contadores.NEGOCIOS_VALOR], Decimal('40'))
+
+    def test_reconciliacao_nao_mexe_no_que_os_signals_contaram(self):
+        self.criar_conversa(self.dono)
+        self.criar_conversa(None)
+
+        self.assertEqual(sum(contadores.reconciliar(dono) for dono in contadores.donos_com_dados()), 0)
+
+    def test_reconciliacao_corrige_update_em_massa(self):
+        conversa = self.criar_conversa(self.dono)
+        Conversa.objects.filter(pk=conversa.pk).update(status='perdida')
+
+        reconciliar_contadores_task()
+
+        self.assertEqual(self.status(self.dono), {'perdida': 1})
+
+    def test_dashboard_le_os_contadores(self):
+        self.criar_conversa(self.dono)
+        api = APIClient()
+        api.force_authenticate(self.dono)
+
+        resposta = api.get(reverse('contatos:dashboard_stats'), HTTP_HOST='localhost')
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.data['contatos']['total'], 1)
+        self.assertEqual(resposta.data['conversas']['por_status'], {'entrada': 1})
+        self.assertEqual(resposta.data['whatsapp']['mensagens_recebidas_hoje'], 1)
+
+
+class VisibilidadeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.chefe = User.objects.create_user('chefe', password='x')
+        self.membro = self.criar_membro('membro')
+
+    def criar_membro(self, nome, chefe=None):
+        usuario = User.objects.create_user(nome, password='x')
+        perfil = usuario.perfil_usuario.get()
+        perfil.criado_por = chefe or self.chefe
+        perfil.save()
+        return usuario
+
+    def recarregar(self, usuario):
+        """Objeto novo, como o de um request seguinte"""
+        return User.objects.get(pk=usuario.pk)
+
+    def test_equipe_enxerga_chefe_e_colegas(self):
+        colega = self.criar_membro('colega')
+
+        self.assertEqual(set(get_ids_visiveis(self.chefe)), {self.chefe.id, self.membro.id, colega.id})
+        self.assertEqual(set(get_ids_visiveis(self.membro)), {self.chefe.id, self.membro.id, colega.id})
+        self.assertEqual(get_tenant_id(self.membro), self.chefe.id)
+        self.assertEqual(get_tenant_id(self.chefe), self.chefe.id)
+
+    def test_memo_no_request_e_cache_entre_requests(self):
+        get_ids_visiveis(self.membro)
+        proximo_request = self.recarregar(self.membro)
+
+        with self.assertNumQueries(0):
+            get_ids_visiveis(self.membro)
+            get_tenant_id(self.membro)
+            get_ids_visiveis(proximo_request)
+
+    def test_novo_membro_invalida_o_cache(self):
+        get_ids_visiveis(self.recarregar(self.chefe))
+
+        novo = self.criar_membro('novo')
+
+        self.assertIn(novo.id, get_ids_visiveis(self.recarregar(self.chefe)))
+
+    def test_save_de_perfil_sem_criado_por_nao_invalida(self):
+        perfil = self.membro.perfil_usuario.get()
+        get_ids_visiveis(self.recarregar(self.membro))
+
+        perfil.aceitou_termos = True
+        perfil.save(update_fields=['aceitou_termos'])
+        proximo_request = self.recarregar(self.membro)
+
+        with self.assertNumQueries(0):
+            get_ids_visiveis(proximo_request)
+
+    def test_remover_o_chefe_invalida_o_cache(self):
+        self.assertIn(self.chefe.id, get_ids_visiveis(self.recarregar(self.membro)))
+
+        self.chefe.delete()
+
+        self.assertEqual(get_ids_visiveis(self.recarregar(self.membro)), [self.membro.id])
+
+    def test_subquery_tem_o_mesmo_conjunto_da_lista(self):
+        self.criar_membro('colega')
+        outra_equipe = self.criar_membro('de_fora', chefe=User.objects.create_user('outro_chefe', password='x'))
+
+        for usuario in (self.chefe, self.membro, outra_equipe):
+            usuario = self.recarregar(usuario)
+            self.assertEqual(
+                set(User.objects.filter(pk__in=usuarios_visiveis(usuario)).values_list('pk', flat=True)),
+                set(get_ids_visiveis(usuario))
+            )
@@ -0,0 +1,59 @@
+"""
+INSERT ... ON CONFLICT DO NOTHING para get-or-create sem corrida
+
+Com vários workers processando webhooks em paralelo, o get_or_create do
+Django (SELECT, INSERT) deixa duas transações passarem pelo SELECT vazio.
+Aqui quem decide é a constraint única: o INSERT concorrente espera o outro
+commit e vira "nada a fazer", sem abortar a transação (ao contrário do
+IntegrityError), sem lock global. Quem não inseriu relê a linha vencedora.
+
+Efeitos de um save() de criação preservados: pre_save antes do INSERT,
+post_save (created=True) só se inseriu e o retrato dos campos rastreados
+(core.rastreamento), como no save_base. Campos com lógica no save() do
+model não passam por ele: quem chama prepara a instância.
+
+Funciona no PostgreSQL e no SQLite (>= 3.35, por causa do RETURNING).
+"""
+from django.db import connections, router
+from django.db.models.signals import post_save, pre_save
+
+
+def inserir_se_ausente(instancia) -> bool:
+    """
+    Insere a instância (nova) se não violar nenhuma constraint única
+
+    Returns:
+        bool: True se inseriu (pk preenchido e post_save disparado com
+              created=True); False se outra linha já ocupa alguma chave única.
+    """
+    model = type(instancia)
+    meta = model._meta
+    using = router.db_for_write(model, instance=instancia)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+
+    pre_save.send(sender=model, instance=instancia, raw=False, using=using, update_fields=None)
+
+    campos = [campo for campo in meta.concrete_fields if not campo.primary_key or instancia.pk is not None]
+    valores = [campo.get_db_prep_save(campo.pre_save(instancia, True), connection) for campo in campos]
+
+    sql = (
+        f"INSERT INTO {qn(meta.db_table)} ({', '.join(qn(campo.column) for campo in campos)}) "
+        f"VALUES ({', '.join(['%s'] * len(campos))}) "
+        f"ON CONFLICT DO NOTHING RETURNING {qn(meta.pk.column)}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, valores)
+        linha = cursor.fetchone()
+
+    if linha is None:
+        return False
+
+    instancia.pk = linha[0]
+    instancia._state.adding = False
+    instancia._state.db = using
+    # Mesmos efeitos de um save() de criação (contadores do dashboard etc.)
+    post_save.send(sender=model, instance=instancia, created=True, update_fields=None, raw=False, using=using)
+    if hasattr(instancia, '_retratar'):
+        instancia._retratar()
+    return True
@@ -3,7 +3,10 @@ from django.utils import timezone
 from django.conf import settings
 from datetime import timedelta
 import json
+import uuid
 from django.db import transaction
+from django.db.models import Q
+from django.core.cache import cache
 from django.contrib.auth.models import User
 
 from usuario.models import PerfilUsuario
@@ -15,17 +18,34 @@ def get_user_operador(user):
         return user.operador
     return None
 
-def get_ids_visiveis(user):
+VISIBILIDADE_VERSAO_KEY = 'visibilidade:versao'
+VISIBILIDADE_TTL = 60 * 60
+
+
+def _versao_visibilidade():
+    versao = cache.get(VISIBILIDADE_VERSAO_KEY)
+    if versao is None:
+        cache.add(VISIBILIDADE_VERSAO_KEY, uuid.uuid4().hex, timeout=None)
+        versao = cache.get(VISIBILIDADE_VERSAO_KEY)
+    return versao
+
+
+def invalidar_visibilidade():
+    """Chamado pelos signals quando PerfilUsuario.criado_por muda (troca a versão de todas as chaves)"""
+    cache.set(VISIBILIDADE_VERSAO_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def _calcular_visibilidade(user):
     try:
         perfil = PerfilUsuario.objects.get(usuario=user)
     except PerfilUsuario.DoesNotExist:
-        return [user.id]
+        return {'ids': [user.id], 'tenant_id': user.id, 'perfil': False}
 
     subordinados = PerfilUsuario.objects.filter(criado_por=user)
 
-    if perfil.criado_por:
-        colegas = User.objects.filter(perfil_usuario__criado_por=perfil.criado_por)
-        chefe = [perfil.criado_por.id]
+    if perfil.criado_por_id:
+        colegas = User.objects.filter(perfil_usuario__criado_por=perfil.criado_por_id)
+        chefe = [perfil.criado_por_id]
     else:
         colegas = User.objects.none()
         chefe = []
@@ -37,4 +57,57 @@ def get_ids_visiveis(user):
             [user.id]
     )
 
-    return list(set(ids_visiveis))
\ No newline at end of file
+    return {
+        'ids': list(set(ids_visiveis)),
+        'tenant_id': perfil.criado_por_id or user.id,
+        'perfil': True,
+    }
+
+
+def _visibilidade(user):
+    """
+    Memoizada no próprio objeto user (vive só durante o request) e
+    cacheada por usuário entre requests, com versão trocada pelos signals
+    """
+    memo = getattr(user, '_visibilidade', None)
+    if memo is not None:
+        return memo
+
+    chave = f"visibilidade:{_versao_visibilidade()}:{user.id}"
+    memo = cache.get(chave)
+    if memo is None:
+        memo = _calcular_visibilidade(user)
+        cache.set(chave, memo, timeout=VISIBILIDADE_TTL)
+
+    user._visibilidade = memo
+    return memo
+
+
+def get_ids_visiveis(user):
+    """IDs dos usuários cujos dados o user enxerga (ele, chefe, colegas e subordinados)"""
+    return list(_visibilidade(user)['ids'])
+
+
+def get_tenant_id(user):
+    """ID do chefe da equipe do user (o próprio user se ele for o chefe)"""
+    return _visibilidade(user)['tenant_id']
+
+
+def tenant_do_usuario(usuario_id):
+    """get_tenant_id a partir só do id (ex.: dono de um contato), com o mesmo cache"""
+    return get_tenant_id(User(pk=usuario_id))
+
+
+def usuarios_visiveis(user):
+    """
+    Mesmo conjunto de get_ids_visiveis como subquery (filtro no banco, sem IN (...) crescente):
+        Contato.objects.filter(criado_por__in=usuarios_visiveis(user))
+    """
+    visibilidade = _visibilidade(user)
+    if not visibilidade['perfil']:
+        return User.objects.filter(pk=user.id).values('pk')
+
+    equipe = {visibilidade['tenant_id'], user.id}
+    return User.objects.filter(
+        Q(pk__in=equipe) | Q(perfil_usuario__criado_por__in=equipe)
+    ).values('pk')
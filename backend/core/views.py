@@ -9,12 +9,14 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 
-from django.db.models import Count
-from atendimento.models import Conversa, Interacao, TarefaAtendimento
+from django.db.models import Count, Q
+from atendimento.models import Conversa, TarefaAtendimento
 from contato.models import Contato, Operador
 from contato.serializers import ContatoSerializer
 from atendimento.views import verificar_status_instancia
 from core.models import ConfiguracaoSistema
+from core.ffmpeg_service import estatisticas_fila
+from core import contadores
 from django.http import JsonResponse
 from usuario.models import PlanoUsuario, PerfilUsuario
 from core.utils import get_ids_visiveis
@@ -24,43 +26,45 @@ from rest_framework.exceptions import ValidationError
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def dashboard_stats(request):
-    """API: Estatísticas do dashboard"""
-    hoje = timezone.now().date()
+    """API: Estatísticas do dashboard (contadores diários + cache curto)"""
+    return Response(contadores.em_cache('stats', request.user.id, lambda: _calcular_dashboard_stats(request.user)))
+
+
+def _calcular_dashboard_stats(user):
+    ids_visiveis = get_ids_visiveis(user)
+    valores = contadores.obter(ids_visiveis)
+    por_status = contadores.por_prefixo(valores, contadores.CONVERSAS_STATUS)
+
+    tarefas = TarefaAtendimento.objects.filter(criado_por__user__id__in=ids_visiveis).aggregate(
+        pendentes=Count('id', filter=Q(status='pendente')),
+        vencidas=Count('id', filter=Q(
+            data_vencimento__lt=timezone.now(),
+            status__in=['pendente', 'em_andamento']
+        )),
+    )
 
     stats = {
         'contatos': {
-            'total': Contato.objects.count(),
-            'novos_hoje': Contato.objects.filter(criado_em__date=hoje).count(),
+            'total': int(valores[contadores.CONTATOS_TOTAL]),
+            'novos_hoje': int(valores[contadores.CONTATOS_NOVOS]),
         },
         'conversas': {
-            'total': Conversa.objects.count(),
-            'ativas': Conversa.objects.filter(status__in=['entrada', 'atendimento']).count(),
-            'hoje': Conversa.objects.filter(criado_em__date=hoje).count(),
-            'por_status': dict(Conversa.objects.values_list('status').annotate(Count('id'))),
+            'total': int(valores[contadores.CONVERSAS_TOTAL]),
+            'ativas': por_status.get('entrada', 0) + por_status.get('atendimento', 0),
+            'hoje': int(valores[contadores.CONVERSAS_NOVAS]),
+            'por_status': por_status,
         },
         'interacoes': {
-            'hoje': Interacao.objects.filter(criado_em__date=hoje).count(),
-        },
-        'tarefas': {
-            'pendentes': TarefaAtendimento.objects.filter(status='pendente').count(),
-            'vencidas': TarefaAtendimento.objects.filter(
-                data_vencimento__lt=timezone.now(),
-                status__in=['pendente', 'em_andamento']
-            ).count(),
+            'hoje': int(valores[contadores.INTERACOES]),
         },
+        'tarefas': tarefas,
         'whatsapp': {
-            'mensagens_enviadas_hoje': Interacao.objects.filter(
-                criado_em__date=hoje,
-                remetente='operador'
-            ).count(),
-            'mensagens_recebidas_hoje': Interacao.objects.filter(
-                criado_em__date=hoje,
-                remetente='cliente'
-            ).count()
+            'mensagens_enviadas_hoje': int(valores[contadores.MENSAGENS_ENVIADAS]),
+            'mensagens_recebidas_hoje': int(valores[contadores.MENSAGENS_RECEBIDAS]),
         }
     }
 
-    return Response(stats)
+    return stats
 
 
 # ===== ENDPOINTS PARA INTEGRAÇÃO N8N =====
@@ -77,24 +81,15 @@ def webhook_n8n_lead(request):
         origem = data.get('origem', 'whatsapp')
 
         # Buscar ou criar contato
-        contato, created = Contato.objects.get_or_create(
-            telefone=numero,
-            defaults={
-                'nome': nome,
-                'observacoes': f'Interesse: {tipo_interesse}'
-            },
-            criado_por=request.user
+        contato, created = Contato.obter_ou_criar(
+            numero,
+            criado_por=request.user,
+            nome=nome,
+            observacoes=f'Interesse: {tipo_interesse}'
         )
 
         # Criar conversa se não existir
-        conversa, conv_created = Conversa.objects.get_or_create(
-            contato=contato,
-            status__in=['entrada', 'atendimento'],
-            defaults={
-                'status': 'entrada',
-                'origem': origem
-            }
-        )
+        conversa, conv_created = Conversa.obter_ou_criar_aberta(contato, status='entrada', origem=origem)
 
         return Response({
             'success': True,
@@ -120,7 +115,9 @@ def api_contato_por_telefone(request):
         return Response({'error': 'Parâmetro numero é obrigatório'}, status=400)
 
     try:
-        contato = Contato.objects.get(telefone=numero)
+        contato = Contato.por_telefone(numero).order_by('pk').first()
+        if contato is None:
+            raise Contato.DoesNotExist
         serializer = ContatoSerializer(contato)
 
         conversa_ativa = Conversa.objects.filter(
@@ -166,6 +163,7 @@ def health_check(request):
                 'connected': status_whatsapp.get('connected', False),
                 'status': status_whatsapp.get('status', 'unknown')
             },
+            'ffmpeg': estatisticas_fila(),
             'services': {
                 'backend': 'online',
                 'evolution_api': 'https://evo.loomiecrm.com',
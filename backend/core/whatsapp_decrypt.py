@@ -5,22 +5,123 @@ Baseado na especificação do WhatsApp Web Protocol
 import base64
 import hashlib
 import hmac
+from functools import lru_cache
+from typing import Tuple, Union
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 import logging
 
 logger = logging.getLogger(__name__)
 
+MAC_SIZE = 10
+BLOCK_SIZE = 16
+
+# Info strings para diferentes tipos de mídia
+INFO_MAP = {
+    'audio': b'WhatsApp Audio Keys',
+    'image': b'WhatsApp Image Keys',
+    'video': b'WhatsApp Video Keys',
+    'document': b'WhatsApp Document Keys'
+}
+
+
+class MacInvalido(ValueError):
+    """MAC do arquivo não confere com a mediaKey (arquivo corrompido ou chave errada)"""
+    pass
+
+
+@lru_cache(maxsize=512)
+def _expandir_chave(media_key: bytes, media_type: str) -> bytes:
+    """
+    HKDF-SHA256 da mediaKey (112 bytes: IV + AES key + MAC key + refKey)
+
+    Em cache: a mesma mídia é reprocessada (reentregas, encaminhamentos,
+    retries de download) e o stream decryptor expande a chave a cada arquivo.
+    """
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=112,
+        salt=b'\x00' * 32,  # Salt vazio de 32 bytes
+        info=INFO_MAP.get(media_type, INFO_MAP['audio']),
+        backend=default_backend()
+    ).derive(media_key)
+
+
+def chaves_midia(media_key: bytes, media_type: str) -> Tuple[bytes, bytes, bytes]:
+    """(iv, chave AES, chave do MAC) da mídia"""
+    expanded_key = _expandir_chave(bytes(media_key), media_type)
+    return expanded_key[:16], expanded_key[16:48], expanded_key[48:80]
+
+
 class WhatsAppDecryption:
     """
     Classe para descriptografar arquivos de mídia do WhatsApp
     usando mediaKey e outros parâmetros de segurança
     """
     
+    @staticmethod
+    def verificar_e_descriptografar(encrypted_data: Union[bytes, bytearray, memoryview], media_key: str, media_type: str = 'audio') -> bytearray:
+        """
+        Confere o MAC antes de descriptografar (falha rápido em arquivo corrompido)
+        
+        Sem cópias intermediárias: conteúdo e MAC são fatias de memoryview, o
+        AES escreve direto num bytearray pré-alocado e o padding é removido
+        encurtando esse mesmo buffer.
+        
+        Args:
+            encrypted_data: Dados criptografados baixados
+            media_key: Chave de mídia em base64 do payload
+            media_type: Tipo de mídia (audio, image, video, document)
+            
+        Returns:
+            bytearray: Dados descriptografados
+            
+        Raises:
+            MacInvalido: MAC não confere (nada é descriptografado)
+            ValueError: arquivo truncado ou padding inválido
+        """
+        dados = memoryview(encrypted_data)
+        
+        if len(dados) < MAC_SIZE + BLOCK_SIZE or (len(dados) - MAC_SIZE) % BLOCK_SIZE:
+            raise ValueError(f"Tamanho inválido para mídia criptografada: {len(dados)} bytes")
+        
+        conteudo = dados[:-MAC_SIZE]
+        iv, cipher_key, mac_key = chaves_midia(base64.b64decode(media_key), media_type)
+        
+        # MAC = HMAC-SHA256(iv + conteúdo criptografado)[:10]
+        mac = hmac.new(mac_key, iv, hashlib.sha256)
+        mac.update(conteudo)
+        if not hmac.compare_digest(mac.digest()[:MAC_SIZE], dados[-MAC_SIZE:]):
+            raise MacInvalido("MAC não confere - arquivo corrompido ou mediaKey errada")
+        
+        decryptor = Cipher(
+            algorithms.AES(cipher_key),
+            modes.CBC(iv),
+            backend=default_backend()
+        ).decryptor()
+        
+        saida = bytearray(len(conteudo) + BLOCK_SIZE - 1)
+        tamanho = decryptor.update_into(conteudo, saida)
+        final = decryptor.finalize()
+        saida[tamanho:tamanho + len(final)] = final
+        tamanho += len(final)
+        
+        # Remover padding PKCS7 (encurtando o buffer, sem copiar)
+        padding_length = saida[tamanho - 1]
+        if not 0 < padding_length <= BLOCK_SIZE or saida[tamanho - padding_length:tamanho] != bytes([padding_length]) * padding_length:
+            raise ValueError("Padding PKCS7 inválido")
+        del saida[tamanho - padding_length:]
+        
+        logger.debug(f"✅ Descriptografia {media_type} concluída: {len(saida)} bytes")
+        return saida
+    
     @staticmethod
     def decrypt_media(encrypted_data: bytes, media_key: str, media_type: str = 'audio') -> bytes:
         """
-        Descriptografa dados de mídia do WhatsApp
+        Descriptografa dados de mídia do WhatsApp (modo tolerante: MAC
+        divergente só gera aviso - prefira verificar_e_descriptografar)
         
         Args:
             encrypted_data: Dados criptografados baixados
@@ -31,58 +132,18 @@ class WhatsAppDecryption:
             bytes: Dados descriptografados
         """
         try:
-            logger.info(f"🔐 Iniciando descriptografia {media_type}")
-            logger.info(f"🔑 MediaKey recebida: {media_key[:20]}...")
-            logger.info(f"📦 Dados criptografados: {len(encrypted_data)} bytes")
-            
-            # Decodificar mediaKey de base64
-            media_key_bytes = base64.b64decode(media_key)
-            logger.info(f"🔑 MediaKey decodificada: {len(media_key_bytes)} bytes")
-            
-            # Expandir a chave usando HKDF (HMAC-based Key Derivation Function)
-            expanded_key = WhatsAppDecryption._expand_media_key(media_key_bytes, media_type)
-            
-            # Extrair IV (16 bytes) e chave AES (32 bytes)
-            iv = expanded_key[:16]
-            cipher_key = expanded_key[16:48]
-            mac_key = expanded_key[48:80]
-            
-            logger.info(f"🔐 IV: {len(iv)} bytes")
-            logger.info(f"🔐 Cipher key: {len(cipher_key)} bytes") 
-            logger.info(f"🔐 MAC key: {len(mac_key)} bytes")
+            logger.debug(f"🔐 Descriptografando {media_type}: {len(encrypted_data)} bytes")
             
             # Verificar integridade (MAC está nos últimos 10 bytes)
-            if len(encrypted_data) < 10:
+            if len(encrypted_data) < MAC_SIZE:
                 raise ValueError("Arquivo muito pequeno para conter MAC")
-                
-            encrypted_content = encrypted_data[:-10]
-            received_mac = encrypted_data[-10:]
-            
-            # Calcular MAC esperado
-            expected_mac = WhatsAppDecryption._calculate_mac(mac_key, iv + encrypted_content)
-            
-            if received_mac != expected_mac:
-                logger.warning("⚠️ MAC não confere - arquivo pode estar corrompido")
-                # Continuar mesmo assim para tentar descriptografar
             
-            # Descriptografar usando AES-CBC
-            cipher = Cipher(
-                algorithms.AES(cipher_key),
-                modes.CBC(iv),
-                backend=default_backend()
-            )
-            decryptor = cipher.decryptor()
+            # Mesmo pipeline do download em streaming, numa única passada
+            # (memoryview evita as cópias de encrypted_data[:-10] e iv + conteúdo)
+            decryptor = WhatsAppStreamDecryptor(base64.b64decode(media_key), media_type)
+            decrypted_data = decryptor.update(memoryview(encrypted_data)) + decryptor.finalize()
             
-            decrypted_data = decryptor.update(encrypted_content) + decryptor.finalize()
-            
-            # Remover padding PKCS7
-            decrypted_data = WhatsAppDecryption._remove_pkcs7_padding(decrypted_data)
-            
-            logger.info(f"✅ Descriptografia concluída: {len(decrypted_data)} bytes")
-            
-            # Verificar se é um arquivo OGG válido
-            if media_type == 'audio' and decrypted_data.startswith(b'OggS'):
-                logger.info("🎵 Arquivo OGG descriptografado válido!")
+            logger.debug(f"✅ Descriptografia concluída: {len(decrypted_data)} bytes")
             
             return decrypted_data
             
@@ -95,32 +156,7 @@ class WhatsAppDecryption:
         """
         Expande a mediaKey usando HKDF conforme especificação WhatsApp
         """
-        # Info strings para diferentes tipos de mídia
-        info_map = {
-            'audio': b'WhatsApp Audio Keys',
-            'image': b'WhatsApp Image Keys', 
-            'video': b'WhatsApp Video Keys',
-            'document': b'WhatsApp Document Keys'
-        }
-        
-        info = info_map.get(media_type, b'WhatsApp Audio Keys')
-        
-        # HKDF Extract
-        salt = b'\x00' * 32  # Salt vazio de 32 bytes
-        prk = hmac.new(salt, media_key, hashlib.sha256).digest()
-        
-        # HKDF Expand - gerar 112 bytes (IV + AES key + MAC key + refKey)
-        output_length = 112
-        t = b''
-        okm = b''
-        counter = 1
-        
-        while len(okm) < output_length:
-            t = hmac.new(prk, t + info + bytes([counter]), hashlib.sha256).digest()
-            okm += t
-            counter += 1
-            
-        return okm[:output_length]
+        return _expandir_chave(bytes(media_key), media_type)
     
     @staticmethod
     def _calculate_mac(mac_key: bytes, data: bytes) -> bytes:
@@ -128,7 +164,7 @@ class WhatsAppDecryption:
         Calcula MAC usando HMAC-SHA256 e retorna os primeiros 10 bytes
         """
         mac = hmac.new(mac_key, data, hashlib.sha256).digest()
-        return mac[:10]
+        return mac[:MAC_SIZE]
     
     @staticmethod
     def _remove_pkcs7_padding(data: bytes) -> bytes:
@@ -141,14 +177,87 @@ class WhatsAppDecryption:
         padding_length = data[-1]
         
         # Verificar se o padding é válido
-        if padding_length > 16 or padding_length == 0:
+        if padding_length > BLOCK_SIZE or padding_length == 0:
             logger.warning("⚠️ Padding PKCS7 inválido - retornando dados sem remoção")
             return data
             
         # Verificar se todos os bytes de padding são iguais
-        for i in range(padding_length):
-            if data[-(i+1)] != padding_length:
-                logger.warning("⚠️ Padding PKCS7 inconsistente - retornando dados sem remoção")
-                return data
+        if data[-padding_length:] != bytes([padding_length]) * padding_length:
+            logger.warning("⚠️ Padding PKCS7 inconsistente - retornando dados sem remoção")
+            return data
                 
-        return data[:-padding_length]
\ No newline at end of file
+        return data[:-padding_length]
+
+
+class WhatsAppStreamDecryptor:
+    """
+    Descriptografia incremental de mídia do WhatsApp
+
+    Recebe o arquivo criptografado em pedaços (na ordem do download) e devolve
+    o conteúdo descriptografado à medida que chega. HMAC e AES-CBC são
+    alimentados incrementalmente, então a memória usada não depende do tamanho
+    do arquivo: só ficam retidos os 10 bytes finais (MAC) e o último bloco
+    descriptografado (padding PKCS7).
+
+    Uso:
+        decryptor = WhatsAppStreamDecryptor(media_key_bytes, 'video')
+        for chunk in response.iter_content(64 * 1024):
+            destino.write(decryptor.update(chunk))
+        destino.write(decryptor.finalize())
+    """
+
+    MAC_SIZE = MAC_SIZE
+    BLOCK_SIZE = BLOCK_SIZE
+
+    def __init__(self, media_key: bytes, media_type: str = 'audio'):
+        # IV (16 bytes), chave AES (32 bytes) e chave do MAC (32 bytes)
+        iv, cipher_key, mac_key = chaves_midia(media_key, media_type)
+
+        # MAC = HMAC-SHA256(iv + conteúdo criptografado)[:10]
+        self._hmac = hmac.new(mac_key, iv, hashlib.sha256)
+        self._decryptor = Cipher(
+            algorithms.AES(cipher_key),
+            modes.CBC(iv),
+            backend=default_backend()
+        ).decryptor()
+
+        self._cauda = b''       # últimos bytes recebidos (podem ser o MAC)
+        self._pendente = b''    # último bloco descriptografado (pode ter padding)
+        self.mac_valido = None
+
+    def update(self, chunk) -> bytes:
+        """Processa mais um pedaço do arquivo criptografado"""
+        dados = memoryview(self._cauda + chunk) if self._cauda else memoryview(chunk)
+
+        if len(dados) <= self.MAC_SIZE:
+            self._cauda = bytes(dados)
+            return b''
+
+        conteudo = dados[:-self.MAC_SIZE]
+        self._cauda = bytes(dados[-self.MAC_SIZE:])
+
+        self._hmac.update(conteudo)
+        texto = self._pendente + self._decryptor.update(conteudo)
+
+        # Segurar o último bloco até o fim: só ele pode conter padding
+        self._pendente = texto[-self.BLOCK_SIZE:]
+        return texto[:-self.BLOCK_SIZE]
+
+    def finalize(self) -> bytes:
+        """Confere o MAC e devolve o restante do conteúdo (sem padding)"""
+        if len(self._cauda) < self.MAC_SIZE:
+            raise ValueError("Arquivo muito pequeno para conter MAC")
+
+        self.mac_valido = hmac.compare_digest(
+            self._hmac.digest()[:self.MAC_SIZE],
+            self._cauda
+        )
+        if not self.mac_valido:
+            logger.warning("⚠️ MAC não confere - arquivo pode estar corrompido")
+            # Continuar mesmo assim para tentar descriptografar
+
+        texto = self._pendente + self._decryptor.finalize()
+        self._pendente = b''
+
+        # Remover padding PKCS7
+        return WhatsAppDecryption._remove_pkcs7_padding(texto)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class GatilhoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gatilho'
+
+    def ready(self):
+        import gatilho.signals
@@ -0,0 +1,118 @@
+"""
+Índice em memória (por processo) dos Gatilhos ativos
+Chave (tenant, evento, estagio_origem, estagio_destino) → gatilhos, e estágio → tenant do kanban
+
+Mesmo esquema do message_translator.routing_cache: cada processo guarda sua
+cópia, a versão fica no cache compartilhado e os signals de Gatilho/Estagio
+trocam a versão. O save de um Negócio vira uma busca em dicionário, sem query.
+
+Tenant do negócio = tenant do dono do kanban do estágio. Gatilhos sem
+criado_por (anteriores ao campo) continuam valendo para todos os tenants.
+"""
+import uuid
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+VERSAO_KEY = 'gatilho:indice:versao'
+GLOBAL = None  # tenant dos gatilhos sem dono
+
+_lock = threading.Lock()
+_indice = {
+    'versao': None,
+    'regras': {},
+    'tenant_por_estagio': {},
+}
+
+
+def _versao_atual() -> Optional[str]:
+    try:
+        versao = cache.get(VERSAO_KEY)
+        if versao is None:
+            cache.add(VERSAO_KEY, uuid.uuid4().hex, timeout=None)
+            versao = cache.get(VERSAO_KEY)
+        return versao
+    except Exception as e:
+        logger.warning(f"⚠️ [Gatilhos] Cache indisponível, recarregando do banco: {e}")
+        return None
+
+
+def chave_regra(gatilho):
+    """Chave do gatilho no índice, ou None se ele nunca dispara (estágio obrigatório vazio)"""
+    evento = gatilho.evento
+    if evento == 'negocio_criado_em_x_estagio':
+        if not gatilho.estagio_origem_id:
+            return None
+        return evento, gatilho.estagio_origem_id, None
+    if evento == 'negocio_estagio_trocado_de_x_para_y':
+        if not (gatilho.estagio_origem_id and gatilho.estagio_destino_id):
+            return None
+        return evento, gatilho.estagio_origem_id, gatilho.estagio_destino_id
+    return evento, None, None
+
+
+def _carregar(versao):
+    from core.utils import tenant_do_usuario
+    from kanban.models import Estagio
+    from .models import Gatilho
+
+    regras = {}
+    for gatilho in Gatilho.objects.filter(ativo=True).order_by('pk'):
+        chave = chave_regra(gatilho)
+        if chave is None:
+            continue
+        tenant = tenant_do_usuario(gatilho.criado_por_id) if gatilho.criado_por_id else GLOBAL
+        regras.setdefault((tenant,) + chave, []).append(gatilho)
+
+    tenant_por_estagio = {
+        estagio_id: tenant_do_usuario(dono_id) if dono_id else GLOBAL
+        for estagio_id, dono_id in Estagio.objects.values_list('pk', 'kanban__criado_por_id')
+    }
+
+    return {
+        'versao': versao,
+        'regras': regras,
+        'tenant_por_estagio': tenant_por_estagio,
+    }
+
+
+def _indice_atual() -> Dict:
+    global _indice
+
+    versao = _versao_atual()
+    if versao is None or _indice['versao'] != versao:
+        with _lock:
+            if versao is None or _indice['versao'] != versao:
+                _indice = _carregar(versao)
+                logger.debug(f"🔄 [Gatilhos] Índice recarregado (versão {versao})")
+    return _indice
+
+
+def invalidar():
+    """Troca a versão: todos os processos recarregam na próxima consulta"""
+    try:
+        cache.set(VERSAO_KEY, uuid.uuid4().hex, timeout=None)
+    except Exception as e:
+        logger.warning(f"⚠️ [Gatilhos] Erro ao invalidar cache: {e}")
+    _indice['versao'] = None
+
+
+def gatilhos_para(estagio_id, evento: str, origem_id=None, destino_id=None) -> List:
+    """
+    Gatilhos ativos para o evento num negócio que está no estágio informado
+    (os do tenant do kanban e os globais, em ordem de criação)
+    """
+    indice = _indice_atual()
+    regras = indice['regras']
+    if not regras:
+        return []
+
+    tenant = indice['tenant_por_estagio'].get(estagio_id, GLOBAL)
+    encontrados = regras.get((tenant, evento, origem_id, destino_id), [])
+    if tenant is not GLOBAL:
+        encontrados = encontrados + regras.get((GLOBAL, evento, origem_id, destino_id), [])
+    return sorted(encontrados, key=lambda g: g.pk)
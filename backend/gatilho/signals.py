@@ -0,0 +1,27 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from gatilho.models import Gatilho
+from gatilho import indice
+from kanban.models import Estagio
+from usuario.models import PerfilUsuario
+
+
+@receiver(post_save, sender=Gatilho)
+@receiver(post_delete, sender=Gatilho)
+@receiver(post_save, sender=Estagio)
+@receiver(post_delete, sender=Estagio)
+def invalidar_indice_gatilhos(sender, instance, **kwargs):
+    """Gatilhos e estágios (estágio → tenant do kanban) trocam a versão do índice, depois do commit"""
+    transaction.on_commit(indice.invalidar)
+
+
+@receiver(post_save, sender=PerfilUsuario)
+@receiver(post_delete, sender=PerfilUsuario)
+@receiver(post_delete, sender=User)
+def invalidar_indice_equipe(sender, instance, created=False, update_fields=None, **kwargs):
+    # O tenant de cada gatilho/estágio é o chefe da equipe do dono (mesma regra de core.utils)
+    if update_fields is not None and 'criado_por' not in update_fields and not created:
+        return
+    transaction.on_commit(indice.invalidar)
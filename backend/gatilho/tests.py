@@ -1,3 +1,142 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from contato.models import Contato
+from kanban.models import Estagio, Kanban
+from negocio.models import Negocio
+from . import indice
+from .models import Gatilho
+
+
+class IndiceGatilhosTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        indice._indice['versao'] = None
+        self.chefe = User.objects.create_user('chefe', password='x')
+        self.membro = User.objects.create_user('membro', password='x')
+        self.outro = User.objects.create_user('outro', password='x')
+        perfil = self.membro.perfil_usuario.get()
+        perfil.criado_por = self.chefe
+        perfil.save()
+
+        self.a, self.b = self.estagios(self.membro, 'A', 'B')
+        [self.c] = self.estagios(self.outro, 'C')
+        [self.sem_dono] = self.estagios(None, 'D')
+
+    def estagios(self, dono, *nomes):
+        kanban = Kanban.objects.create(nome=f'Funil {nomes[0]}', criado_por=dono)
+        return [Estagio.objects.create(nome=nome, kanban=kanban) for nome in nomes]
+
+    def gatilho(self, evento, dono=None, origem=None, destino=None, ativo=True):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Gatilho.objects.create(
+                nome=evento, evento=evento, acao='criar_tarefa', ativo=ativo,
+                estagio_origem=origem, estagio_destino=destino, criado_por=dono,
+            )
+
+
+class IndiceGatilhosTests(IndiceGatilhosTestCase):
+    def test_gatilho_da_equipe_vale_para_o_kanban_de_qualquer_membro(self):
+        do_chefe = self.gatilho('negocio_criado', dono=self.chefe)
+
+        self.assertEqual(indice.gatilhos_para(self.a.pk, 'negocio_criado'), [do_chefe])
+        self.assertEqual(indice.gatilhos_para(self.c.pk, 'negocio_criado'), [])
+
+    def test_gatilho_global_vale_para_todos_em_ordem_de_criacao(self):
+        global_ = self.gatilho('negocio_criado')
+        do_membro = self.gatilho('negocio_criado', dono=self.membro)
+
+        self.assertEqual(indice.gatilhos_para(self.a.pk, 'negocio_criado'), [global_, do_membro])
+        self.assertEqual(indice.gatilhos_para(self.c.pk, 'negocio_criado'), [global_])
+        self.assertEqual(indice.gatilhos_para(self.sem_dono.pk, 'negocio_criado'), [global_])
+
+    def test_chave_por_par_de_estagios(self):
+        de_a_para_b = self.gatilho('negocio_estagio_trocado_de_x_para_y', self.membro, self.a, self.b)
+        evento = 'negocio_estagio_trocado_de_x_para_y'
+
+        self.assertEqual(indice.gatilhos_para(self.b.pk, evento, self.a.pk, self.b.pk), [de_a_para_b])
+        self.assertEqual(indice.gatilhos_para(self.a.pk, evento, self.b.pk, self.a.pk), [])
+
+    def test_inativos_e_sem_estagio_obrigatorio_ficam_fora(self):
+        self.gatilho('negocio_criado', dono=self.membro, ativo=False)
+        self.gatilho('negocio_criado_em_x_estagio', dono=self.membro)
+
+        self.assertEqual(indice.gatilhos_para(self.a.pk, 'negocio_criado'), [])
+        self.assertEqual(indice.gatilhos_para(self.a.pk, 'negocio_criado_em_x_estagio'), [])
+
+    def test_consulta_com_indice_carregado_nao_vai_ao_banco(self):
+        self.gatilho('negocio_criado', dono=self.membro)
+        indice.gatilhos_para(self.a.pk, 'negocio_criado')
+
+        with self.assertNumQueries(0):
+            indice.gatilhos_para(self.a.pk, 'negocio_criado')
+
+    def test_novo_gatilho_entra_so_depois_do_commit(self):
+        indice.gatilhos_para(self.a.pk, 'negocio_criado')
+
+        with self.captureOnCommitCallbacks(execute=False):
+            Gatilho.objects.create(nome='x', evento='negocio_criado', acao='criar_tarefa', criado_por=self.membro)
+        self.assertEqual(indice.gatilhos_para(self.a.pk, 'negocio_criado'), [])
+
+        novo = self.gatilho('negocio_criado', dono=self.membro)
+        self.assertIn(novo, indice.gatilhos_para(self.a.pk, 'negocio_criado'))
+
+    def test_troca_de_equipe_muda_o_tenant(self):
+        do_outro = self.gatilho('negocio_criado', dono=self.outro)
+        self.assertEqual(indice.gatilhos_para(self.a.pk, 'negocio_criado'), [])
+
+        perfil = self.membro.perfil_usuario.get()
+        perfil.criado_por = self.outro
+        with self.captureOnCommitCallbacks(execute=True):
+            perfil.save(update_fields=['criado_por'])
+
+        self.assertEqual(indice.gatilhos_para(self.a.pk, 'negocio_criado'), [do_outro])
+
+
+class AcionamentoGatilhosNegocioTests(IndiceGatilhosTestCase):
+    def setUp(self):
+        super().setUp()
+        self.contato = Contato.objects.create(nome='Fulano', telefone='11999999999', criado_por=self.membro)
+        executar = mock.patch('negocio.signals.executar_acao_gatilho')
+        self.executar = executar.start()
+        self.addCleanup(executar.stop)
+
+    def disparados(self):
+        disparados = [chamada.args[0] for chamada in self.executar.call_args_list]
+        self.executar.reset_mock()
+        return disparados
+
+    def test_criacao_dispara_os_do_tenant_e_os_do_estagio(self):
+        criado = self.gatilho('negocio_criado', dono=self.membro)
+        no_estagio = self.gatilho('negocio_criado_em_x_estagio', self.membro, self.a)
+        self.gatilho('negocio_criado_em_x_estagio', self.membro, self.b)
+        self.gatilho('negocio_criado', dono=self.outro)
+
+        Negocio.objects.create(titulo='Venda', contato=self.contato, estagio=self.a)
+
+        self.assertEqual(self.disparados(), [criado, no_estagio])
+
+    def test_troca_de_estagio_dispara_uma_vez(self):
+        trocado = self.gatilho('negocio_estagio_trocado', dono=self.membro)
+        de_a_para_b = self.gatilho('negocio_estagio_trocado_de_x_para_y', self.membro, self.a, self.b)
+        self.gatilho('negocio_estagio_trocado_de_x_para_y', self.membro, self.b, self.a)
+        negocio = Negocio.objects.create(titulo='Venda', contato=self.contato, estagio=self.a)
+
+        negocio.estagio = self.b
+        negocio.save()
+        self.assertEqual(self.disparados(), [trocado, de_a_para_b])
+
+        negocio.save()
+        self.assertEqual(self.disparados(), [])
+
+    def test_save_sem_o_estagio_nao_consulta_nem_dispara(self):
+        self.gatilho('negocio_estagio_trocado', dono=self.membro)
+        negocio = Negocio.objects.create(titulo='Venda', contato=self.contato, estagio=self.a)
+        negocio.estagio = self.b
+
+        negocio.save(update_fields=['titulo'])
+
+        self.assertEqual(self.disparados(), [])
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import CanalConfig, MensagemLog, RegrasRoteamento, WebhookCustomizado
+from .models import CanalConfig, MensagemLog, MensagemProcessada, RegrasRoteamento, WebhookCustomizado
 
 
 @admin.register(CanalConfig)
@@ -63,6 +63,15 @@ class MensagemLogAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(MensagemProcessada)
+class MensagemProcessadaAdmin(admin.ModelAdmin):
+    list_display = ['external_id', 'canal_chave', 'criado_em']
+    list_filter = ['canal_chave']
+    search_fields = ['external_id']
+    readonly_fields = ['criado_em']
+    date_hierarchy = 'criado_em'
+
+
 @admin.register(RegrasRoteamento)
 class RegrasRoteamentoAdmin(admin.ModelAdmin):
     list_display = ['nome', 'ativo', 'prioridade', 'criado_por', 'criado_em']
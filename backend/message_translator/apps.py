@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MessageTranslatorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'message_translator'
+
+    def ready(self):
+        import message_translator.signals
@@ -0,0 +1,124 @@
+"""
+Deduplicação de mensagens de entrada (idempotência)
+Chave: (canal, external_id) - Redis com TTL na frente, constraint única no banco atrás
+
+Fluxo (ReservaMensagem):
+    1. reservar_mensagem() antes da tradução, com o external_id lido do
+       payload bruto: SET NX 'processando' no Redis com TTL curto
+       (MESSAGE_DEDUP_PROCESSANDO_TTL) e consulta ao banco.
+    2. confirmar() dentro da transação que grava a Interação: insere o
+       MensagemProcessada. Se a transação não comita, a mensagem não conta
+       como processada; depois do commit a chave no Redis vira 'processada'
+       com o TTL longo (MESSAGE_DEDUP_TTL).
+    3. Falha tratada: liberar() apaga a reserva na hora. Worker que morre no
+       meio: a reserva expira sozinha e a reentrega é processada.
+
+Mensagens enviadas pelo CRM: registrar_envio() confirma o external_id
+devolvido pelo canal, e o eco 'fromMe' cai como duplicata no passo 1.
+"""
+import logging
+from typing import Optional
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from .models import MensagemProcessada
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'mt:dedup'
+PROCESSANDO = 'processando'
+PROCESSADA = 'processada'
+
+
+def chave_canal(channel_id: Optional[int], channel_type: str) -> str:
+    """
+    Chave do canal para deduplicação: ID do CanalConfig quando conhecido,
+    senão o tipo do canal
+    """
+    return str(channel_id) if channel_id else (channel_type or 'desconhecido')
+
+
+def _cache_key(canal_chave: str, external_id: str) -> str:
+    return f"{CACHE_PREFIX}:{canal_chave}:{external_id}"
+
+
+class ReservaMensagem:
+    """Reserva de uma mensagem de entrada; duplicada=True quando já foi (ou está sendo) processada"""
+
+    def __init__(self, canal_chave: str, external_id: str, duplicada: bool = False):
+        self.canal_chave = canal_chave
+        self.external_id = external_id
+        self.duplicada = duplicada
+
+    def confirmar(self) -> bool:
+        """
+        Marca como processada na transação corrente (chamar dentro do atomic da gravação)
+
+        Returns:
+            bool: False se outro worker já confirmou a mesma mensagem
+        """
+        if not self.external_id:
+            return True
+
+        try:
+            with transaction.atomic():
+                MensagemProcessada.objects.create(canal_chave=self.canal_chave, external_id=self.external_id)
+        except IntegrityError:
+            return False
+
+        chave = _cache_key(self.canal_chave, self.external_id)
+        transaction.on_commit(lambda: _marcar_processada(chave))
+        return True
+
+    def liberar(self):
+        """Desfaz a reserva (processamento falhou antes de gravar): a reentrega tenta de novo"""
+        if not self.external_id or self.duplicada:
+            return
+        try:
+            cache.delete(_cache_key(self.canal_chave, self.external_id))
+        except Exception as e:
+            logger.warning(f"⚠️ [DEDUP] Erro ao limpar cache: {e}")
+
+
+def _marcar_processada(chave: str):
+    try:
+        cache.set(chave, PROCESSADA, timeout=settings.MESSAGE_DEDUP_TTL)
+    except Exception as e:
+        logger.warning(f"⚠️ [DEDUP] Erro ao gravar cache: {e}")
+
+
+def reservar_mensagem(canal_chave: str, external_id: str) -> ReservaMensagem:
+    """
+    Reserva a mensagem para processamento (antes de traduzir/baixar mídia)
+
+    Returns:
+        ReservaMensagem: duplicada=True se já processada ou em processamento em outro worker
+    """
+    if not external_id:
+        return ReservaMensagem(canal_chave, external_id)
+
+    chave = _cache_key(canal_chave, external_id)
+
+    # 1️⃣ Caminho rápido: SET NX no Redis; a reserva expira se o worker morrer
+    try:
+        if not cache.add(chave, PROCESSANDO, timeout=settings.MESSAGE_DEDUP_PROCESSANDO_TTL):
+            return ReservaMensagem(canal_chave, external_id, duplicada=True)
+    except Exception as e:
+        logger.warning(f"⚠️ [DEDUP] Cache indisponível, usando apenas o banco: {e}")
+
+    # 2️⃣ Registro definitivo (Redis expirado ou sem Redis)
+    if MensagemProcessada.objects.filter(canal_chave=canal_chave, external_id=external_id).exists():
+        _marcar_processada(chave)
+        return ReservaMensagem(canal_chave, external_id, duplicada=True)
+
+    return ReservaMensagem(canal_chave, external_id)
+
+
+def registrar_envio(canal_chave: str, external_id: str):
+    """
+    Marca como processada uma mensagem enviada pelo CRM: o eco 'fromMe' que o
+    canal devolve pelo webhook é descartado como duplicata
+    (chamar dentro do atomic que grava a Interação de saída)
+    """
+    ReservaMensagem(canal_chave, external_id).confirmar()
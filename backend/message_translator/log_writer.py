@@ -0,0 +1,137 @@
+"""
+Gravação em lote (write-behind) do MensagemLog
+
+Os webhooks síncronos montam o MensagemLog já com o status final e entregam
+aqui: uma thread por processo junta os registros e grava com bulk_create a
+cada MESSAGE_LOG_BATCH_SIZE registros ou MESSAGE_LOG_FLUSH_MS milissegundos.
+
+A fila é limitada (MESSAGE_LOG_BUFFER_MAX); cheia, o registro é gravado na
+hora (fallback síncrono). No encerramento a fila é esvaziada (atexit no
+gunicorn, signals worker_shutdown/worker_process_shutdown no Celery), mas o
+que estiver na fila se perde se o processo morrer sem encerrar (SIGKILL, OOM):
+por isso o write-behind é opcional e vem desligado.
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from typing import Dict, List
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_recursos = {'pid': None, 'fila': None, 'thread': None}
+
+
+def _recursos_do_processo() -> Dict:
+    """
+    Fila e thread de gravação são criadas por processo
+    (workers Celery/gunicorn fazem fork depois do import do módulo)
+    """
+    pid = os.getpid()
+    if _recursos['pid'] != pid:
+        with _lock:
+            if _recursos['pid'] != pid:
+                fila = queue.Queue(maxsize=settings.MESSAGE_LOG_BUFFER_MAX)
+                thread = threading.Thread(
+                    target=_loop,
+                    args=(fila,),
+                    name='mensagem-log-writer',
+                    daemon=True
+                )
+                _recursos['fila'] = fila
+                _recursos['thread'] = thread
+                _recursos['pid'] = pid
+                thread.start()
+    return _recursos
+
+
+def _gravar(lote: List):
+    """Grava um lote com bulk_create; se o lote falhar, tenta registro a registro"""
+    from .models import MensagemLog
+
+    close_old_connections()
+    try:
+        MensagemLog.objects.bulk_create(
+            lote,
+            batch_size=settings.MESSAGE_LOG_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        logger.debug(f"💾 [LogWriter] {len(lote)} log(s) gravado(s)")
+    except Exception as e:
+        logger.error(f"❌ [LogWriter] Erro no bulk_create ({len(lote)} logs), gravando um a um: {e}")
+        for log in lote:
+            try:
+                log.save()
+            except Exception as e:
+                logger.error(f"❌ [LogWriter] Log {log.message_id} perdido: {e}")
+
+
+def _coletar_lote(fila: queue.Queue, primeiro) -> List:
+    """Junta registros até completar o lote ou estourar o intervalo de flush"""
+    lote = [primeiro]
+    prazo = time.monotonic() + settings.MESSAGE_LOG_FLUSH_MS / 1000
+
+    while len(lote) < settings.MESSAGE_LOG_BATCH_SIZE:
+        restante = prazo - time.monotonic()
+        if restante <= 0:
+            break
+        try:
+            lote.append(fila.get(timeout=restante))
+        except queue.Empty:
+            break
+
+    return lote
+
+
+def _loop(fila: queue.Queue):
+    while True:
+        lote = _coletar_lote(fila, fila.get())
+        try:
+            _gravar(lote)
+        except Exception as e:
+            logger.error(f"❌ [LogWriter] Erro inesperado: {e}", exc_info=True)
+        finally:
+            for _ in lote:
+                fila.task_done()
+
+
+def registrar(log):
+    """
+    Agenda a gravação de um MensagemLog (ainda não salvo)
+
+    Com MESSAGE_LOG_WRITE_BEHIND=False, ou com a fila cheia, grava na hora.
+    """
+    if not settings.MESSAGE_LOG_WRITE_BEHIND:
+        log.save()
+        return
+
+    try:
+        _recursos_do_processo()['fila'].put_nowait(log)
+    except queue.Full:
+        logger.warning(f"⚠️ [LogWriter] Fila cheia, gravando {log.message_id} de forma síncrona")
+        log.save()
+
+
+def flush(timeout: float = 10):
+    """Espera a fila esvaziar (usado no encerramento do processo), por no máximo timeout segundos"""
+    if _recursos['pid'] != os.getpid():
+        return
+
+    fila = _recursos['fila']
+    prazo = time.monotonic() + timeout
+    with fila.all_tasks_done:
+        while fila.unfinished_tasks:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                logger.error(f"❌ [LogWriter] {fila.unfinished_tasks} log(s) não gravado(s) no encerramento")
+                return
+            fila.all_tasks_done.wait(restante)
+
+
+atexit.register(flush)
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_translator', '0004_alter_canalconfig_destinos_alter_canalconfig_tipo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MensagemProcessada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('canal_chave', models.CharField(help_text='ID do CanalConfig ou tipo do canal', max_length=50)),
+                ('external_id', models.CharField(help_text='ID da mensagem no canal original', max_length=255)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Mensagem Processada',
+                'verbose_name_plural': 'Mensagens Processadas',
+                'indexes': [models.Index(fields=['criado_em'], name='message_tra_criado__2739dd_idx')],
+                'constraints': [models.UniqueConstraint(fields=('canal_chave', 'external_id'), name='unique_mensagem_processada_por_canal')],
+            },
+        ),
+    ]
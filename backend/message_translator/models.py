@@ -176,16 +176,22 @@ class WebhookCustomizado(models.Model):
         return f"{status} {self.nome} → {self.url}"
     
     def incrementar_enviado(self):
-        """Incrementa contador de enviados"""
-        self.total_enviados += 1
+        """Incrementa contador de enviados (atômico - vários workers disparam em paralelo)"""
         self.ultima_execucao = timezone.now()
-        self.save(update_fields=['total_enviados', 'ultima_execucao'])
+        WebhookCustomizado.objects.filter(pk=self.pk).update(
+            total_enviados=models.F('total_enviados') + 1,
+            ultima_execucao=self.ultima_execucao
+        )
+        self.total_enviados += 1
     
     def incrementar_erro(self):
-        """Incrementa contador de erros"""
-        self.total_erros += 1
+        """Incrementa contador de erros (atômico - vários workers disparam em paralelo)"""
         self.ultima_execucao = timezone.now()
-        self.save(update_fields=['total_erros', 'ultima_execucao'])
+        WebhookCustomizado.objects.filter(pk=self.pk).update(
+            total_erros=models.F('total_erros') + 1,
+            ultima_execucao=self.ultima_execucao
+        )
+        self.total_erros += 1
 
 
 class MensagemLog(models.Model):
@@ -271,6 +277,36 @@ class MensagemLog(models.Model):
         return f"{self.direcao} - {self.message_id} ({self.status})"
 
 
+class MensagemProcessada(models.Model):
+    """
+    Registro de idempotência das mensagens de entrada
+    
+    A Evolution reenvia 'messages.upsert' em caso de timeout. A chave
+    (canal, external_id) garante que cada mensagem do WhatsApp gere uma única
+    Interação e um único disparo de webhooks. O Redis é o caminho rápido;
+    esta tabela (com constraint única) é a garantia definitiva.
+    """
+    canal_chave = models.CharField(max_length=50, help_text="ID do CanalConfig ou tipo do canal")
+    external_id = models.CharField(max_length=255, help_text="ID da mensagem no canal original")
+    criado_em = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Mensagem Processada"
+        verbose_name_plural = "Mensagens Processadas"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['canal_chave', 'external_id'],
+                name='unique_mensagem_processada_por_canal'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['criado_em']),
+        ]
+    
+    def __str__(self):
+        return f"{self.canal_chave}:{self.external_id}"
+
+
 class RegrasRoteamento(models.Model):
     """
     Regras de roteamento dinâmico de mensagens
@@ -6,36 +6,81 @@ import requests
 import logging
 from typing import Dict, List, Any, Optional
 from django.conf import settings
+from django.db import transaction
+from atendimento.envio import PRIORIDADE_OPERADOR, EnvioAdiado, config_do_canal, requisitar
 from .models import CanalConfig
 from .schemas import LoomieMessage
+from . import routing_cache
+from .dedup import ReservaMensagem, chave_canal, reservar_mensagem, registrar_envio
+from .webhook_fanout import (
+    requisitar_webhook,
+    get_executor,
+    circuito_aberto,
+    registrar_sucesso,
+    registrar_falha,
+)
 
 logger = logging.getLogger(__name__)
 
 
-def processar_mensagem_entrada(loomie_message: LoomieMessage, canal: Optional[CanalConfig] = None) -> Dict:
+def reservar_entrada(translator, canal_tipo: str, canal: Optional[CanalConfig], payload: Dict) -> ReservaMensagem:
+    """
+    Reserva a mensagem pelo ID do payload bruto, antes de traduzir
+    (reentrega duplicada não baixa/descriptografa mídia de novo)
+    """
+    canal_chave = chave_canal(canal.pk if canal else None, canal_tipo)
+    return reservar_mensagem(canal_chave, translator.extrair_external_id(payload))
+
+
+def processar_mensagem_entrada(loomie_message: LoomieMessage, canal: Optional[CanalConfig] = None,
+                               reserva: Optional[ReservaMensagem] = None) -> Dict:
     """
     Processa mensagem de entrada e roteia para destinos configurados
     
     Fluxo Simplificado:
     1. Recebe mensagem em formato Loomie
-    2. Salva no CRM (Interação)
-    3. Dispara Webhooks Customizados (n8n, Make.com, etc)
-    4. Retorna resultado
+    2. Descarta duplicatas (mesmo external_id no mesmo canal)
+    3. Salva no CRM (Interação)
+    4. Dispara Webhooks Customizados (n8n, Make.com, etc)
+    5. Retorna resultado
+    
+    reserva: feita por quem chama antes da tradução (ver dedup); sem ela,
+    a reserva é feita aqui pelo external_id da mensagem traduzida.
     
     NOTA: n8n e outras integrações são feitas via Webhooks Customizados,
           não há mais lógica separada para cada integração.
     """
     resultados = {
         'success': True,
+        'duplicada': False,
         'destinos_enviados': [],
         'erros': []
     }
     
     logger.info(f"� [ENTRADA] Processando mensagem: {loomie_message.message_id}")
     
-    # 1️⃣ SEMPRE salvar no CRM
+    # 🔁 Idempotência: reentregas da Evolution não geram trabalho de novo
+    if reserva is None:
+        canal_chave = chave_canal(canal.pk if canal else loomie_message.channel_id, loomie_message.channel_type)
+        reserva = reservar_mensagem(canal_chave, loomie_message.external_id)
+    if reserva.duplicada:
+        logger.info(f"⏭️ [ENTRADA] Mensagem duplicada ignorada: {reserva.canal_chave}:{reserva.external_id}")
+        resultados['duplicada'] = True
+        return resultados
+    
+    # 1️⃣ SEMPRE salvar no CRM - na mesma transação do registro de idempotência
     try:
-        sucesso = enviar_para_crm(loomie_message)
+        with transaction.atomic():
+            if not reserva.confirmar():
+                logger.info(f"⏭️ [ENTRADA] Mensagem já gravada por outro worker: {reserva.canal_chave}:{reserva.external_id}")
+                resultados['duplicada'] = True
+                return resultados
+            
+            sucesso = enviar_para_crm(loomie_message)
+            if not sucesso:
+                # Nada fica gravado, nem o registro de idempotência
+                transaction.set_rollback(True)
+        
         if sucesso:
             resultados['destinos_enviados'].append('crm')
             logger.info(f"✅ Salvo no CRM")
@@ -47,6 +92,10 @@ def processar_mensagem_entrada(loomie_message: LoomieMessage, canal: Optional[Ca
         resultados['erros'].append(erro_msg)
         logger.error(f"❌ {erro_msg}")
     
+    # Nada foi gravado: liberar a reserva para que a reentrega possa tentar de novo
+    if 'crm' not in resultados['destinos_enviados']:
+        reserva.liberar()
+    
     # 2️⃣ Processar webhooks customizados (n8n, Make.com, etc)
     try:
         webhooks_enviados = processar_webhooks_customizados(loomie_message, direcao='entrada')
@@ -62,6 +111,20 @@ def processar_mensagem_entrada(loomie_message: LoomieMessage, canal: Optional[Ca
     return resultados
 
 
+def _obter_contato(telefone: str, nome: str):
+    """
+    Contato pelo telefone em qualquer formato (chave E.164, uma busca no índice)
+    Sem contato de nenhum dono, cria um sem dono com upsert (seguro entre workers).
+    Returns: (contato, criado)
+    """
+    from contato.models import Contato
+
+    contato = Contato.por_telefone(telefone).order_by('pk').first()
+    if contato:
+        return contato, False
+    return Contato.obter_ou_criar(telefone, nome=nome)
+
+
 def enviar_para_crm(loomie_message: LoomieMessage) -> bool:
     """
     🔥 Envia mensagem para o CRM (cria Interação) COM SUPORTE COMPLETO A MÍDIAS
@@ -69,7 +132,6 @@ def enviar_para_crm(loomie_message: LoomieMessage) -> bool:
     Usa a mesma lógica do atendimento/views.py que já funciona
     """
     try:
-        from contato.models import Contato
         from atendimento.models import Conversa, Interacao
         from django.utils import timezone
         
@@ -90,19 +152,13 @@ def enviar_para_crm(loomie_message: LoomieMessage) -> bool:
         logger.info(f"📱 [CRM] Telefone do contato: {telefone_contato}, from_me={from_me}")
         
         # Buscar/criar contato
-        contato, created = Contato.objects.get_or_create(
-            telefone=telefone_contato,
-            defaults={'nome': loomie_message.sender_name or 'Usuário'}
-        )
+        contato, created = _obter_contato(telefone_contato, loomie_message.sender_name or 'Usuário')
         
         if created:
             logger.info(f"👤 [CRM] Novo contato criado: {contato.nome} ({contato.telefone})")
         
         # Buscar/criar conversa
-        conversa, created = Conversa.objects.get_or_create(
-            contato=contato,
-            defaults={'status': 'entrada'}
-        )
+        conversa, created = Conversa.obter_ou_criar_aberta(contato, reaproveitar=True, status='entrada')
         
         if created:
             logger.info(f"💬 [CRM] Nova conversa criada: ID {conversa.id}")
@@ -142,6 +198,9 @@ def enviar_para_crm(loomie_message: LoomieMessage) -> bool:
         media_size = None
         media_duration = None
         
+        media_status = None
+        midia_pendente = loomie_message.get_metadata('midia_pendente', False)
+        
         if loomie_message.media:
             media = loomie_message.media[0]
             media_url = media.url  # URL local já processada pelo tradutor
@@ -149,6 +208,11 @@ def enviar_para_crm(loomie_message: LoomieMessage) -> bool:
             media_size = media.tamanho
             media_duration = media.duracao
             
+            # ⏳ Mídia ainda não baixada: placeholder até o worker de mídia terminar
+            if midia_pendente:
+                media_url = None
+                media_status = 'pendente'
+            
             logger.info(f"📦 [CRM] Dados da mídia: URL={media_url}, Nome={media_filename}, Tamanho={media_size}")
         
         # ⭐ DETERMINAR REMETENTE: cliente ou operador?
@@ -173,11 +237,28 @@ def enviar_para_crm(loomie_message: LoomieMessage) -> bool:
             media_url=media_url,
             media_filename=media_filename,
             media_size=media_size,
-            media_duration=media_duration
+            media_duration=media_duration,
+            media_status=media_status
         )
         
         logger.info(f"✅ [CRM] Interação criada: ID {interacao.id}, Tipo: {tipo_mensagem}, Remetente: {remetente}")
         
+        if media_status == 'pendente':
+            from atendimento.media_store import guardar_base64_pendente
+            from .tasks import processar_midia_pendente_task
+            from .translators import WhatsAppTranslator
+            
+            # Pelo broker vai só o descritor (url, mediaKey, mimetype...); base64 inline fica no storage
+            descritor, base64_data = WhatsAppTranslator.descritor_midia(
+                loomie_message.get_metadata('whatsapp_raw') or {}
+            ) or ({}, '')
+            if base64_data:
+                descritor['base64_storage'] = guardar_base64_pendente(interacao.id, base64_data)
+            transaction.on_commit(
+                lambda: processar_midia_pendente_task.delay(interacao.id, descritor)
+            )
+            logger.info(f"⏳ [CRM] Mídia da Interação {interacao.id} enviada para a fila 'media'")
+        
         # Atualizar timestamp da conversa
         conversa.atualizado_em = timezone.now()
         if conversa.status == 'finalizada':
@@ -233,7 +314,8 @@ def enviar_para_canal(canal_nome: str, loomie_message: LoomieMessage) -> bool:
         return False
 
 
-def enviar_mensagem_saida(loomie_message: LoomieMessage, canal: CanalConfig, payload: Dict) -> Dict:
+def enviar_mensagem_saida(loomie_message: LoomieMessage, canal: CanalConfig, payload: Dict,
+                          prioridade: str = PRIORIDADE_OPERADOR) -> Dict:
     """
     Envia mensagem de saída para o canal externo (WhatsApp, Telegram, etc)
     E cria Interação no CRM com remetente='operador'
@@ -242,6 +324,7 @@ def enviar_mensagem_saida(loomie_message: LoomieMessage, canal: CanalConfig, pay
         loomie_message: Mensagem no formato Loomie
         canal: Configuração do canal
         payload: Payload já traduzido para o formato do canal
+        prioridade: fila do limite de envio da instância (operador na frente dos automáticos)
     
     Returns:
         Dict com success, external_id, error, interacao_id
@@ -249,7 +332,7 @@ def enviar_mensagem_saida(loomie_message: LoomieMessage, canal: CanalConfig, pay
     try:
         # 1️⃣ ENVIAR PARA O CANAL EXTERNO
         if canal.tipo == 'whatsapp' or canal.tipo == 'evo':
-            resultado = enviar_whatsapp_evo(canal, payload)
+            resultado = enviar_whatsapp_evo(canal, payload, prioridade)
         
         elif canal.tipo == 'telegram':
             resultado = enviar_telegram(canal, payload)
@@ -265,7 +348,7 @@ def enviar_mensagem_saida(loomie_message: LoomieMessage, canal: CanalConfig, pay
         # 2️⃣ SE ENVIOU COM SUCESSO, CRIAR INTERAÇÃO NO CRM
         if resultado.get('success'):
             try:
-                from contato.models import Contato, Operador
+                from contato.models import Operador
                 from atendimento.models import Conversa, Interacao
                 from django.utils import timezone
                 
@@ -275,18 +358,14 @@ def enviar_mensagem_saida(loomie_message: LoomieMessage, canal: CanalConfig, pay
                 recipient = loomie_message.recipient.replace('whatsapp:', '').replace('evo:', '').replace('telegram:', '').replace('instagram:', '')
                 
                 # 🔧 Buscar ou CRIAR contato e conversa (para mensagens enviadas via n8n)
-                contato, contato_created = Contato.objects.get_or_create(
-                    telefone=recipient,
-                    defaults={'nome': recipient}  # Se não existir, usa o telefone como nome
-                )
+                contato, contato_created = _obter_contato(recipient, recipient)  # Se não existir, usa o telefone como nome
                 
                 if contato_created:
                     logger.info(f"👤 [CRM SAÍDA] Novo contato criado: {contato.telefone}")
                 
                 # Buscar ou criar conversa
-                conversa, conversa_created = Conversa.objects.get_or_create(
-                    contato=contato,
-                    defaults={'status': 'atendimento'}  # Conversa já inicia em atendimento
+                conversa, conversa_created = Conversa.obter_ou_criar_aberta(
+                    contato, reaproveitar=True, status='atendimento'  # Conversa já inicia em atendimento
                 )
                 
                 if conversa_created:
@@ -335,22 +414,29 @@ def enviar_mensagem_saida(loomie_message: LoomieMessage, canal: CanalConfig, pay
                             media_duration = media.duracao
                         
                         # ✅ CRIAR INTERAÇÃO DE SAÍDA
-                        interacao = Interacao.objects.create(
-                            conversa=conversa,
-                            mensagem=texto_mensagem,
-                            remetente='operador',  # ⭐ Mensagem enviada pelo operador
-                            tipo=tipo_mensagem,
-                            whatsapp_id=resultado.get('external_id'),
-                            media_url=media_url,
-                            media_filename=media_filename,
-                            media_size=media_size,
-                            media_duration=media_duration,
-                            operador=operador
-                        )
-                        
-                        # Atualizar timestamp da conversa
-                        conversa.atualizado_em = timezone.now()
-                        conversa.save()
+                        # (mesma transação do registro de idempotência: o eco 'fromMe' desta
+                        # mensagem volta pelo webhook e não deve gerar outra Interação)
+                        with transaction.atomic():
+                            interacao = Interacao.objects.create(
+                                conversa=conversa,
+                                mensagem=texto_mensagem,
+                                remetente='operador',  # ⭐ Mensagem enviada pelo operador
+                                tipo=tipo_mensagem,
+                                whatsapp_id=resultado.get('external_id'),
+                                status_entrega='enviada',
+                                status_entrega_em=timezone.now(),
+                                media_url=media_url,
+                                media_filename=media_filename,
+                                media_size=media_size,
+                                media_duration=media_duration,
+                                operador=operador
+                            )
+                            
+                            # Atualizar timestamp da conversa
+                            conversa.atualizado_em = timezone.now()
+                            conversa.save()
+                            
+                            registrar_envio(chave_canal(canal.pk, canal.tipo), resultado.get('external_id'))
                         
                         logger.info(f"✅ [CRM SAÍDA] Interação criada: ID {interacao.pk}, Tipo: {tipo_mensagem}, Operador: {operador.user.username if operador else 'N/A'}")
                         
@@ -371,37 +457,24 @@ def enviar_mensagem_saida(loomie_message: LoomieMessage, canal: CanalConfig, pay
         }
 
 
-def enviar_whatsapp_evo(canal: CanalConfig, payload: Dict) -> Dict:
+def enviar_whatsapp_evo(canal: CanalConfig, payload: Dict, prioridade: str = PRIORIDADE_OPERADOR) -> Dict:
     """
-    Envia mensagem via Evolution API (WhatsApp)
+    Envia mensagem via Evolution API (WhatsApp), pelo despachante atendimento.envio
     """
     try:
-        credenciais = canal.credenciais
-        base_url = credenciais.get('base_url')
-        api_key = credenciais.get('api_key')
-        instance = credenciais.get('instance')
+        config = config_do_canal(canal)
         
-        if not all([base_url, api_key, instance]):
+        if not config:
             return {
                 'success': False,
                 'error': 'Credenciais incompletas para Evolution API'
             }
         
-        # URL do endpoint
-        url = f"{base_url}/message/sendText/{instance}"
-        
-        # Headers
-        headers = {
-            'Content-Type': 'application/json',
-            'apikey': api_key
-        }
-        
         # 🔍 DEBUG: Mostrar request completa
-        logger.info(f"📤 [Evolution API] URL: {url}")
-        logger.info(f"📤 [Evolution API] Headers: apikey={api_key[:10]}...")
+        logger.info(f"📤 [Evolution API] Instância: {config['instance_name']} ({prioridade})")
         logger.info(f"📤 [Evolution API] Payload: {payload}")
         
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
+        response = requisitar(config, '/message/sendText', payload, prioridade, timeout=15)
         
         # 🔍 DEBUG: Mostrar response
         logger.info(f"📥 [Evolution API] Status: {response.status_code}")
@@ -416,6 +489,14 @@ def enviar_whatsapp_evo(canal: CanalConfig, payload: Dict) -> Dict:
             'external_id': result.get('key', {}).get('id', '')
         }
     
+    except EnvioAdiado as e:
+        logger.warning(f"⏳ [Evolution API] {e}")
+        return {
+            'success': False,
+            'error': str(e),
+            'adiado': e.espera
+        }
+    
     except requests.RequestException as e:
         logger.error(f"❌ [Evolution API] Erro: {e}")
         if hasattr(e, 'response') and e.response is not None:
@@ -477,99 +558,84 @@ def enviar_para_webhook_customizado(webhook, loomie_data: Dict, tentativa: int =
     Returns:
         bool: True se enviado com sucesso, False caso contrário
     """
-    from datetime import datetime
-    from .models import WebhookCustomizado
+    # Verificar se webhook está ativo
+    if not webhook.ativo:
+        logger.warning(f"⚠️ Webhook '{webhook.nome}' está inativo")
+        return False
     
-    try:
-        # Verificar se webhook está ativo
-        if not webhook.ativo:
-            logger.warning(f"⚠️ Webhook '{webhook.nome}' está inativo")
-            return False
-        
-        # Preparar headers
-        headers = {'Content-Type': 'application/json'}
-        if webhook.headers:
-            headers.update(webhook.headers)
-        
-        # Mapear método HTTP
-        metodo_map = {
-            'POST': requests.post,
-            'PUT': requests.put,
-            'PATCH': requests.patch
-        }
-        metodo_func = metodo_map.get(webhook.metodo_http, requests.post)
-        
-        # Log de envio
-        logger.info(f"📤 [Webhook Customizado] Enviando para '{webhook.nome}' (tentativa {tentativa}/{webhook.max_tentativas})")
-        logger.info(f"📤 [Webhook Customizado] URL: {webhook.url}")
-        logger.info(f"📤 [Webhook Customizado] Método: {webhook.metodo_http}")
-        
-        # Fazer request
-        response = metodo_func(
-            webhook.url,
-            json=loomie_data,
-            headers=headers,
-            timeout=webhook.timeout
-        )
-        
-        # Verificar resposta
-        response.raise_for_status()
-        
-        # Log de sucesso
-        logger.info(f"✅ [Webhook Customizado] '{webhook.nome}' - Status: {response.status_code}")
-        
-        # Atualizar estatísticas
-        webhook.incrementar_enviado()
-        webhook.ultima_execucao = datetime.now()
-        webhook.save(update_fields=['total_enviados', 'ultima_execucao'])
-        
-        return True
+    # Circuit breaker: destino em cool-down não recebe requisição agora
+    if circuito_aberto(webhook.pk):
+        logger.warning(f"🚫 [Webhook Customizado] '{webhook.nome}' com circuito aberto - envio adiado")
+        _agendar_retry(webhook, loomie_data, tentativa, countdown=settings.WEBHOOK_CIRCUIT_COOLDOWN)
+        return False
     
-    except requests.Timeout as e:
-        logger.error(f"⏱️ [Webhook Customizado] '{webhook.nome}' - Timeout após {webhook.timeout}s")
-        return _handle_webhook_error(webhook, loomie_data, tentativa, f"Timeout: {str(e)}")
+    logger.info(f"📤 [Webhook Customizado] Enviando para '{webhook.nome}' (tentativa {tentativa}/{webhook.max_tentativas})")
+    logger.info(f"📤 [Webhook Customizado] URL: {webhook.url} - Método: {webhook.metodo_http}")
     
-    except requests.RequestException as e:
-        error_msg = f"Erro HTTP: {str(e)}"
-        if hasattr(e, 'response') and e.response is not None:
-            error_msg += f" - Status: {e.response.status_code}"
-            logger.error(f"❌ [Webhook Customizado] '{webhook.nome}' - {error_msg}")
-            logger.error(f"❌ Response body: {e.response.text[:200]}")
-        else:
-            logger.error(f"❌ [Webhook Customizado] '{webhook.nome}' - {error_msg}")
-        
-        return _handle_webhook_error(webhook, loomie_data, tentativa, error_msg)
+    sucesso, error_msg = requisitar_webhook(webhook, loomie_data)
+    return _finalizar_envio(webhook, loomie_data, tentativa, sucesso, error_msg)
+
+
+def _finalizar_envio(webhook, loomie_data: Dict, tentativa: int, sucesso: bool, error_msg: str) -> bool:
+    """
+    Atualiza estatísticas e circuit breaker após a requisição
+    (roda na thread principal - é aqui que o banco é tocado)
+    """
+    if sucesso:
+        logger.info(f"✅ [Webhook Customizado] '{webhook.nome}' - enviado")
+        registrar_sucesso(webhook.pk)
+        webhook.incrementar_enviado()
+        return True
     
-    except Exception as e:
-        logger.error(f"❌ [Webhook Customizado] '{webhook.nome}' - Erro inesperado: {str(e)}")
-        return _handle_webhook_error(webhook, loomie_data, tentativa, f"Erro: {str(e)}")
+    logger.error(f"❌ [Webhook Customizado] '{webhook.nome}' - {error_msg}")
+    return _handle_webhook_error(webhook, loomie_data, tentativa, error_msg)
 
 
 def _handle_webhook_error(webhook, loomie_data: Dict, tentativa: int, error_msg: str) -> bool:
     """
     Lida com erro de webhook (retry logic)
-    """
-    from datetime import datetime
     
+    O retry não bloqueia mais a thread: vai para a fila do Celery com backoff exponencial
+    """
     # Incrementar contador de erros
     webhook.incrementar_erro()
-    webhook.ultima_execucao = datetime.now()
-    webhook.save(update_fields=['total_erros', 'ultima_execucao'])
     
-    # Verificar se deve tentar novamente
-    if webhook.retry_em_falha and tentativa < webhook.max_tentativas:
-        logger.info(f"🔄 [Webhook Customizado] Tentando novamente '{webhook.nome}'...")
-        import time
-        time.sleep(2 ** tentativa)  # Exponential backoff: 2s, 4s, 8s...
-        return enviar_para_webhook_customizado(webhook, loomie_data, tentativa + 1)
+    if registrar_falha(webhook.pk):
+        logger.warning(
+            f"🚫 [Webhook Customizado] '{webhook.nome}' - circuito aberto por "
+            f"{settings.WEBHOOK_CIRCUIT_COOLDOWN}s após {settings.WEBHOOK_CIRCUIT_FALHAS} falhas seguidas"
+        )
+    
+    _agendar_retry(webhook, loomie_data, tentativa, countdown=2 ** tentativa)  # Exponential backoff: 2s, 4s, 8s...
     
     return False
 
 
+def _agendar_retry(webhook, loomie_data: Dict, tentativa: int, countdown: int):
+    """
+    Agenda nova tentativa na fila (se o webhook permitir e ainda houver tentativas)
+    """
+    if not (webhook.retry_em_falha and tentativa < webhook.max_tentativas):
+        return
+    
+    try:
+        from .tasks import reenviar_webhook_customizado_task
+        reenviar_webhook_customizado_task.apply_async(
+            args=[webhook.pk, loomie_data, tentativa + 1],
+            countdown=countdown
+        )
+        logger.info(f"🔄 [Webhook Customizado] Nova tentativa de '{webhook.nome}' agendada em {countdown}s")
+    except Exception as e:
+        logger.error(f"❌ [Webhook Customizado] Erro ao agendar retry de '{webhook.nome}': {e}")
+
+
 def processar_webhooks_customizados(loomie_message: LoomieMessage, direcao: str = 'entrada') -> List[str]:
     """
     Processa webhooks customizados com base em filtros
     
+    Todos os webhooks que passam nos filtros são disparados em paralelo,
+    reaproveitando as conexões do pool (webhook_fanout)
+    
     Args:
         loomie_message: Mensagem em formato Loomie
         direcao: 'entrada' ou 'saida'
@@ -577,46 +643,47 @@ def processar_webhooks_customizados(loomie_message: LoomieMessage, direcao: str
     Returns:
         List[str]: Lista de webhooks que receberam a mensagem com sucesso
     """
-    from .models import WebhookCustomizado
-    
     webhooks_enviados = []
     
     try:
-        # Buscar webhooks ativos
-        webhooks = WebhookCustomizado.objects.filter(ativo=True)
+        # Webhooks ativos que aceitam este canal/direção (cache de roteamento, sem query)
+        selecionados = routing_cache.get_webhooks(loomie_message.channel_type, direcao)
         
-        if not webhooks.exists():
-            logger.debug("Nenhum webhook customizado configurado")
+        if not selecionados:
+            logger.debug("Nenhum webhook customizado configurado para este canal/direção")
             return webhooks_enviados
         
-        logger.info(f"🔍 Verificando {webhooks.count()} webhook(s) customizado(s)")
+        logger.info(f"🔍 {len(selecionados)} webhook(s) customizado(s) para {loomie_message.channel_type}/{direcao}")
         
-        for webhook in webhooks:
-            # Aplicar filtro de canal
-            if webhook.filtro_canal != 'todos' and webhook.filtro_canal != loomie_message.channel_type:
-                logger.debug(f"⏭️ Webhook '{webhook.nome}' - Canal filtrado ({webhook.filtro_canal} != {loomie_message.channel_type})")
-                continue
-            
-            # Aplicar filtro de direção
-            if webhook.filtro_direcao == 'entrada' and direcao != 'entrada':
-                logger.debug(f"⏭️ Webhook '{webhook.nome}' - Direção filtrada (espera entrada, recebeu {direcao})")
-                continue
-            elif webhook.filtro_direcao == 'saida' and direcao != 'saida':
-                logger.debug(f"⏭️ Webhook '{webhook.nome}' - Direção filtrada (espera saída, recebeu {direcao})")
-                continue
-            
-            # Webhook passou pelos filtros, enviar
-            logger.info(f"✅ Webhook '{webhook.nome}' passou nos filtros, enviando...")
-            
-            # Converter LoomieMessage para dict (garantir tipo correto)
-            if hasattr(loomie_message, 'to_dict'):
-                loomie_data: Dict = loomie_message.to_dict()
+        # Converter LoomieMessage para dict (garantir tipo correto)
+        if hasattr(loomie_message, 'to_dict'):
+            loomie_data: Dict = loomie_message.to_dict()
+        else:
+            loomie_data: Dict = loomie_message  # type: ignore
+        
+        # Circuito aberto: não entra no fan-out, vai direto para a fila de retry
+        disparar = []
+        for webhook in selecionados:
+            if circuito_aberto(webhook.pk):
+                logger.warning(f"🚫 Webhook '{webhook.nome}' com circuito aberto - envio adiado")
+                _agendar_retry(webhook, loomie_data, 1, countdown=settings.WEBHOOK_CIRCUIT_COOLDOWN)
             else:
-                loomie_data: Dict = loomie_message  # type: ignore
-            
-            sucesso = enviar_para_webhook_customizado(webhook, loomie_data)
+                disparar.append(webhook)
+        
+        # Fan-out paralelo: só HTTP nas threads, banco na thread principal
+        executor = get_executor()
+        futuros = [
+            (webhook, executor.submit(requisitar_webhook, webhook, loomie_data))
+            for webhook in disparar
+        ]
+        
+        for webhook, futuro in futuros:
+            try:
+                sucesso, error_msg = futuro.result()
+            except Exception as e:
+                sucesso, error_msg = False, f"Erro: {str(e)}"
             
-            if sucesso:
+            if _finalizar_envio(webhook, loomie_data, 1, sucesso, error_msg):
                 webhooks_enviados.append(f"webhook:{webhook.nome}")
         
         logger.info(f"📊 Webhooks customizados: {len(webhooks_enviados)} enviado(s) com sucesso")
@@ -0,0 +1,130 @@
+"""
+Cache em memória (por processo) das tabelas de roteamento
+CanalConfig ativos (por ID, instância e tipo de saída) e WebhookCustomizado ativos por (filtro_canal, filtro_direcao)
+
+Cada processo guarda sua cópia; a versão fica no cache compartilhado (Redis).
+Os signals de post_save/post_delete trocam a versão e todos os processos
+recarregam na próxima mensagem. Hot path: zero queries no banco.
+"""
+import uuid
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+VERSAO_KEY = 'mt:routing:versao'
+
+_lock = threading.Lock()
+_tabelas = {
+    'versao': None,
+    'canais_evo_por_instancia': {},
+    'canais_por_id': {},
+    'canais_saida_por_tipo': {},
+    'webhooks_por_filtro': {},
+}
+
+
+def _versao_atual() -> Optional[str]:
+    try:
+        versao = cache.get(VERSAO_KEY)
+        if versao is None:
+            cache.add(VERSAO_KEY, uuid.uuid4().hex, timeout=None)
+            versao = cache.get(VERSAO_KEY)
+        return versao
+    except Exception as e:
+        logger.warning(f"⚠️ [Roteamento] Cache indisponível, recarregando do banco: {e}")
+        return None
+
+
+def _carregar(versao):
+    from .models import CanalConfig, WebhookCustomizado
+
+    canais_evo = {}
+    canais_por_id = {}
+    canais_saida = {}
+    # Meta.ordering (prioridade, nome): o primeiro de cada tipo é o canal de saída
+    for canal in CanalConfig.objects.filter(ativo=True):
+        canais_por_id[canal.pk] = canal
+        if canal.envia_saida:
+            canais_saida.setdefault(canal.tipo, canal)
+        instance = (canal.credenciais or {}).get('instance')
+        if canal.tipo == 'evo' and instance:
+            if instance in canais_evo:
+                logger.warning(
+                    f"⚠️ [Roteamento] Instância '{instance}' em mais de um canal ativo: "
+                    f"usando '{canais_evo[instance].nome}', ignorando '{canal.nome}'"
+                )
+                continue
+            canais_evo[instance] = canal
+
+    webhooks_por_filtro = {}
+    for webhook in WebhookCustomizado.objects.filter(ativo=True):
+        webhooks_por_filtro.setdefault((webhook.filtro_canal, webhook.filtro_direcao), []).append(webhook)
+
+    return {
+        'versao': versao,
+        'canais_evo_por_instancia': canais_evo,
+        'canais_por_id': canais_por_id,
+        'canais_saida_por_tipo': canais_saida,
+        'webhooks_por_filtro': webhooks_por_filtro,
+    }
+
+
+def _tabelas_atuais() -> Dict:
+    global _tabelas
+
+    versao = _versao_atual()
+    if versao is None or _tabelas['versao'] != versao:
+        with _lock:
+            if versao is None or _tabelas['versao'] != versao:
+                _tabelas = _carregar(versao)
+                logger.debug(f"🔄 [Roteamento] Tabelas recarregadas (versão {versao})")
+    return _tabelas
+
+
+def invalidar():
+    """Troca a versão: todos os processos recarregam na próxima consulta"""
+    try:
+        cache.set(VERSAO_KEY, uuid.uuid4().hex, timeout=None)
+    except Exception as e:
+        logger.warning(f"⚠️ [Roteamento] Erro ao invalidar cache: {e}")
+    _tabelas['versao'] = None
+
+
+def get_canal_evo(instance: str):
+    """
+    CanalConfig ativo do tipo 'evo' pelo nome da instância (ou None)
+    Instância repetida em canais ativos: vale o de maior prioridade (aviso no log ao carregar).
+    """
+    return _tabelas_atuais()['canais_evo_por_instancia'].get(instance)
+
+
+def get_canal(canal_id):
+    """CanalConfig ativo pelo ID (ou None)"""
+    try:
+        return _tabelas_atuais()['canais_por_id'].get(int(canal_id))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_canal_saida(tipo: str):
+    """Primeiro CanalConfig ativo do tipo que envia mensagens de saída (ou None)"""
+    return _tabelas_atuais()['canais_saida_por_tipo'].get(tipo)
+
+
+def get_webhooks(channel_type: str, direcao: str) -> List:
+    """
+    WebhookCustomizado ativos que aceitam o canal e a direção informados
+    (na mesma ordem do Meta.ordering: nome)
+    """
+    por_filtro = _tabelas_atuais()['webhooks_por_filtro']
+
+    webhooks = set()
+    for filtro_canal in ('todos', channel_type):
+        for filtro_direcao in ('ambas', direcao):
+            webhooks.update(por_filtro.get((filtro_canal, filtro_direcao), []))
+
+    return sorted(webhooks, key=lambda w: w.nome)
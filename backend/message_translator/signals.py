@@ -0,0 +1,25 @@
+from celery.signals import worker_process_shutdown, worker_shutdown
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from message_translator.models import CanalConfig, WebhookCustomizado
+from message_translator import routing_cache, log_writer
+
+
+@receiver(post_save, sender=CanalConfig)
+@receiver(post_delete, sender=CanalConfig)
+@receiver(post_save, sender=WebhookCustomizado)
+@receiver(post_delete, sender=WebhookCustomizado)
+def invalidar_cache_roteamento(sender, instance, **kwargs):
+    """
+    Qualquer alteração em canais/webhooks troca a versão das tabelas de roteamento
+    Só depois do commit: antes disso outro processo recarregaria a versão antiga do banco.
+    """
+    transaction.on_commit(routing_cache.invalidar)
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def gravar_logs_pendentes(**kwargs):
+    """Filhos do prefork saem com os._exit (sem atexit): esvazia a fila do write-behind antes"""
+    log_writer.flush()
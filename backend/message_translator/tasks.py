@@ -0,0 +1,205 @@
+"""
+Tasks Celery do Message Translator
+Processamento assíncrono das mensagens de entrada (modo fila)
+"""
+import time
+import logging
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from .models import MensagemLog, MensagemProcessada, WebhookCustomizado
+from .translators import get_translator, WhatsAppTranslator
+from .router import processar_mensagem_entrada, reservar_entrada, enviar_para_webhook_customizado
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def processar_mensagem_entrada_task(log_id, canal_tipo):
+    """
+    Processa uma mensagem de entrada enfileirada pelo webhook
+
+    O webhook só grava o MensagemLog como 'recebida' e enfileira esta task.
+    Aqui acontece o trabalho pesado: tradução (download/descriptografia de mídia),
+    gravação no CRM e disparo dos webhooks customizados.
+
+    Fluxo do status: recebida → processando → enviada/erro
+    """
+    inicio = time.time()
+
+    try:
+        log = MensagemLog.objects.select_related('canal_origem').get(pk=log_id)
+    except MensagemLog.DoesNotExist:
+        logger.error(f"❌ [FILA] MensagemLog {log_id} não encontrado")
+        return {'success': False, 'error': 'Log não encontrado'}
+
+    if log.status != 'recebida':
+        logger.info(f"⏭️ [FILA] Log {log_id} já processado (status={log.status})")
+        return {'success': True, 'message_id': log.message_id, 'ignorada': True}
+
+    log.status = 'processando'
+    log.save(update_fields=['status'])
+
+    try:
+        canal = log.canal_origem
+
+        # Reentrega descartada antes da tradução (download/descriptografia de mídia)
+        translator = get_translator(canal_tipo)
+        reserva = reservar_entrada(translator, canal_tipo, canal, log.payload_original)
+        if reserva.duplicada:
+            logger.info(f"⏭️ [FILA] Mensagem duplicada ignorada: {reserva.canal_chave}:{reserva.external_id}")
+            log.status = 'enviada'
+            log.processado_em = timezone.now()
+            log.tempo_processamento = time.time() - inicio
+            log.save(update_fields=['status', 'processado_em', 'tempo_processamento'])
+            return {'success': True, 'message_id': log.message_id, 'duplicada': True}
+
+        # Traduzir para formato Loomie (mantendo o ID gerado no webhook)
+        try:
+            loomie_message = translator.to_loomie(log.payload_original)
+        except Exception:
+            reserva.liberar()
+            raise
+        loomie_message.message_id = log.message_id
+
+        if canal:
+            loomie_message.channel_id = canal.pk
+
+        # Processar e rotear
+        resultado = processar_mensagem_entrada(loomie_message, canal, reserva)
+
+        tempo_total = time.time() - inicio
+        log.status = 'enviada'
+        log.payload_loomie = loomie_message.to_dict()
+        log.remetente = loomie_message.sender
+        log.destinatario = loomie_message.recipient
+        log.processado_em = timezone.now()
+        log.tempo_processamento = tempo_total
+        log.save(update_fields=[
+            'status', 'payload_loomie', 'remetente', 'destinatario',
+            'processado_em', 'tempo_processamento'
+        ])
+
+        logger.info(f"✅ [FILA] Mensagem {log.message_id} processada em {tempo_total:.2f}s")
+
+        return {
+            'success': True,
+            'message_id': log.message_id,
+            'destinos_enviados': resultado.get('destinos_enviados', [])
+        }
+
+    except Exception as e:
+        logger.error(f"❌ [FILA] Erro ao processar mensagem {log.message_id}: {e}", exc_info=True)
+
+        log.status = 'erro'
+        log.erro_mensagem = str(e)
+        log.processado_em = timezone.now()
+        log.tempo_processamento = time.time() - inicio
+        log.save(update_fields=['status', 'erro_mensagem', 'processado_em', 'tempo_processamento'])
+
+        return {'success': False, 'message_id': log.message_id, 'error': str(e)}
+
+
+@shared_task
+def limpar_mensagens_processadas():
+    """
+    Remove registros de idempotência antigos (reentregas só acontecem em minutos/horas)
+    """
+    limite = timezone.now() - timedelta(days=settings.MESSAGE_DEDUP_RETENCAO_DIAS)
+    removidos, _ = MensagemProcessada.objects.filter(criado_em__lt=limite).delete()
+
+    return f"{removidos} registros de idempotência removidos"
+
+
+@shared_task
+def reenviar_webhook_customizado_task(webhook_id, loomie_data, tentativa):
+    """
+    Nova tentativa de envio para um webhook customizado (agendada com backoff)
+    """
+    try:
+        webhook = WebhookCustomizado.objects.get(pk=webhook_id)
+    except WebhookCustomizado.DoesNotExist:
+        return {'success': False, 'error': 'Webhook não encontrado'}
+
+    sucesso = enviar_para_webhook_customizado(webhook, loomie_data, tentativa=tentativa)
+
+    return {'success': sucesso, 'webhook': webhook.nome, 'tentativa': tentativa}
+
+
+@shared_task(acks_late=True)
+def processar_midia_pendente_task(interacao_id, descritor):
+    """
+    Worker de mídia (fila 'media'): baixa, descriptografa e converte a mídia
+    de uma Interação criada com media_status='pendente' e preenche
+    media_url, media_filename, media_size e media_duration
+
+    descritor: WhatsAppTranslator.descritor_midia (tipo, url, mediaKey,
+    mimetype...) e, se a mídia veio inline, base64_storage com o nome do
+    arquivo guardado em atendimento.media_store
+    """
+    from atendimento import media_store
+    from atendimento.models import Interacao
+    from atendimento.media_processor import WhatsAppMediaProcessor
+
+    message_data = dict(descritor or {})
+    base64_data = ''
+    if 'tipo' not in message_data:
+        # Enfileirada com o payload bruto (versão anterior)
+        message_data, base64_data = WhatsAppTranslator.descritor_midia(message_data) or ({}, '')
+
+    tipo = message_data.pop('tipo', None)
+    nome_base64 = message_data.pop('base64_storage', None)
+    if not tipo:
+        Interacao.objects.filter(pk=interacao_id).update(media_status='erro')
+        logger.error(f"❌ [MÍDIA] Interação {interacao_id}: mídia não encontrada no payload")
+        return {'success': False, 'error': 'Mídia não encontrada no payload'}
+
+    if nome_base64:
+        base64_data = media_store.ler_base64_pendente(nome_base64)
+    inicio = time.time()
+
+    try:
+        result = WhatsAppMediaProcessor.process_media(
+            message_data=message_data,
+            tipo_mensagem=tipo,
+            base64_data=base64_data
+        )
+    finally:
+        media_store.apagar_pendente(nome_base64)
+
+    if not result['success']:
+        Interacao.objects.filter(pk=interacao_id).update(media_status='erro')
+        logger.error(f"❌ [MÍDIA] Interação {interacao_id}: {result.get('error')}")
+        return {'success': False, 'error': result.get('error')}
+
+    campos = {
+        'media_url': result.get('media_local_path'),
+        'media_filename': result.get('filename'),
+        'media_status': 'processada',
+    }
+    if result.get('size'):
+        campos['media_size'] = result['size']
+    duracao = result.get('duration') or message_data.get('seconds')
+    if duracao:
+        campos['media_duration'] = duracao
+
+    Interacao.objects.filter(pk=interacao_id).update(**campos)
+
+    logger.info(f"✅ [MÍDIA] Interação {interacao_id}: {tipo} processado em {time.time() - inicio:.2f}s")
+
+    return {'success': True, 'interacao_id': interacao_id, 'media_url': campos['media_url']}
+
+
+@shared_task
+def limpar_midias_pendentes():
+    """
+    Remove base64 inline guardado para o worker de mídia cuja tarefa nunca rodou
+    """
+    from atendimento import media_store
+
+    removidos = media_store.limpar_pendentes_antigos(timezone.now() - timedelta(days=1))
+
+    return f"{removidos} mídias pendentes removidas"
@@ -1,3 +1,539 @@
-from django.test import TestCase
+import queue
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+
+from celery.signals import worker_process_shutdown
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from atendimento import media_store
+from atendimento.media_processor import WhatsAppMediaProcessor
+from atendimento.models import Interacao
+from . import log_writer, router, routing_cache, tasks, webhook_fanout
+from .dedup import reservar_mensagem
+from .models import CanalConfig, MensagemLog, MensagemProcessada, WebhookCustomizado
+from .schemas import LoomieMessage
+from .translators import EvoTranslator
+
+URL_EVOLUTION = '/translator/evolution-webhook/'
+
+
+def payload_evolution(external_id, texto='oi', from_me=False, instancia='inst1'):
+    return {
+        "event": "messages.upsert",
+        "instance": instancia,
+        "data": {
+            "key": {"id": external_id, "remoteJid": "5511999999999@s.whatsapp.net", "fromMe": from_me},
+            "pushName": "Fulano",
+            "message": {"conversation": texto},
+            "messageTimestamp": 1700000000,
+        },
+    }
+
+
+class WebhookTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.canal = CanalConfig.objects.create(nome='WhatsApp', tipo='evo', credenciais={'instance': 'inst1'})
+
+    def postar(self, payload):
+        return self.client.post(URL_EVOLUTION, payload, content_type='application/json', HTTP_HOST='localhost')
+
+
+@override_settings(MESSAGE_TRANSLATOR_ASYNC=True)
+class ModoFilaWebhookTests(WebhookTestCase):
+    def test_responde_202_sem_tocar_no_crm(self):
+        with mock.patch.object(tasks.processar_mensagem_entrada_task, 'delay') as delay:
+            resposta = self.postar(payload_evolution('ABC'))
+
+        self.assertEqual(resposta.status_code, 202)
+        log = MensagemLog.objects.get(message_id=resposta.json()['message_id'])
+        self.assertEqual(log.status, 'recebida')
+        self.assertEqual(log.canal_origem, self.canal)
+        delay.assert_called_once_with(log.pk, 'evo')
+        self.assertFalse(Interacao.objects.exists())
+
+    def test_worker_grava_no_crm_e_fecha_o_log(self):
+        with mock.patch.object(tasks.processar_mensagem_entrada_task, 'delay') as delay:
+            self.postar(payload_evolution('ABC', texto='quero um orçamento'))
+        log_id, canal_tipo = delay.call_args.args
+
+        resultado = tasks.processar_mensagem_entrada_task(log_id, canal_tipo)
+
+        self.assertTrue(resultado['success'])
+        log = MensagemLog.objects.get(pk=log_id)
+        self.assertEqual(log.status, 'enviada')
+        self.assertIsNotNone(log.processado_em)
+        self.assertEqual(Interacao.objects.get().mensagem, 'quero um orçamento')
+
+    def test_task_reentregue_pelo_broker_nao_reprocessa(self):
+        with mock.patch.object(tasks.processar_mensagem_entrada_task, 'delay') as delay:
+            self.postar(payload_evolution('ABC'))
+        log_id, canal_tipo = delay.call_args.args
+        tasks.processar_mensagem_entrada_task(log_id, canal_tipo)
+
+        resultado = tasks.processar_mensagem_entrada_task(log_id, canal_tipo)
+
+        self.assertTrue(resultado.get('ignorada'))
+        self.assertEqual(Interacao.objects.count(), 1)
+
+    def test_erro_na_traducao_fica_no_log(self):
+        with mock.patch.object(tasks.processar_mensagem_entrada_task, 'delay') as delay:
+            self.postar(payload_evolution('ABC'))
+        log_id, _ = delay.call_args.args
+
+        resultado = tasks.processar_mensagem_entrada_task(log_id, 'canal_inexistente')
+
+        self.assertFalse(resultado['success'])
+        log = MensagemLog.objects.get(pk=log_id)
+        self.assertEqual(log.status, 'erro')
+        self.assertTrue(log.erro_mensagem)
+
+    def test_sem_data_e_400_antes_de_enfileirar(self):
+        payload = payload_evolution('ABC')
+        payload['data'] = None
+
+        with mock.patch.object(tasks.processar_mensagem_entrada_task, 'delay') as delay:
+            resposta = self.postar(payload)
+
+        self.assertEqual(resposta.status_code, 400)
+        delay.assert_not_called()
+
+
+@override_settings(MESSAGE_TRANSLATOR_ASYNC=False)
+class DeduplicacaoEntradaTests(WebhookTestCase):
+    def test_reentrega_nao_traduz_nem_grava_de_novo(self):
+        self.assertEqual(self.postar(payload_evolution('ABC')).status_code, 200)
+
+        with mock.patch.object(EvoTranslator, 'to_loomie') as to_loomie:
+            resposta = self.postar(payload_evolution('ABC'))
+
+        self.assertTrue(resposta.json().get('duplicada'))
+        to_loomie.assert_not_called()
+        self.assertEqual(Interacao.objects.count(), 1)
+        self.assertEqual(MensagemProcessada.objects.filter(external_id='ABC').count(), 1)
+
+    def test_registro_no_banco_vale_sem_cache(self):
+        self.postar(payload_evolution('ABC'))
+        cache.clear()
+
+        with mock.patch.object(EvoTranslator, 'to_loomie') as to_loomie:
+            self.assertTrue(self.postar(payload_evolution('ABC')).json().get('duplicada'))
+        to_loomie.assert_not_called()
+
+    def test_falha_no_crm_libera_a_reserva(self):
+        with mock.patch.object(router, 'enviar_para_crm', return_value=False):
+            self.postar(payload_evolution('ABC'))
+
+        self.assertFalse(MensagemProcessada.objects.filter(external_id='ABC').exists())
+        self.assertIsNone(cache.get(f'mt:dedup:{self.canal.pk}:ABC'))
+
+        self.postar(payload_evolution('ABC'))
+        self.assertEqual(Interacao.objects.count(), 1)
+
+    def test_reserva_de_worker_morto_expira_e_a_reentrega_processa(self):
+        reservar_mensagem(str(self.canal.pk), 'ABC')
+        self.assertTrue(self.postar(payload_evolution('ABC')).json().get('duplicada'))
+
+        cache.delete(f'mt:dedup:{self.canal.pk}:ABC')  # TTL da reserva 'processando' expirou
+
+        self.assertFalse(self.postar(payload_evolution('ABC')).json().get('duplicada'))
+        self.assertEqual(Interacao.objects.count(), 1)
+
+    def test_reserva_em_andamento_bloqueia_outro_worker(self):
+        reserva = reservar_mensagem('1', 'XYZ')
+
+        self.assertFalse(reserva.duplicada)
+        self.assertTrue(reservar_mensagem('1', 'XYZ').duplicada)
+        self.assertFalse(reservar_mensagem('2', 'XYZ').duplicada)
+
+    def test_sem_external_id_nao_deduplica(self):
+        self.assertFalse(reservar_mensagem('1', '').duplicada)
+        self.assertFalse(reservar_mensagem('1', '').duplicada)
+
+
+@override_settings(MESSAGE_TRANSLATOR_ASYNC=False)
+class EcoEnvioTests(WebhookTestCase):
+    def enviar(self, external_id):
+        mensagem = LoomieMessage(
+            channel_type='evo',
+            channel_id=self.canal.pk,
+            sender='system:crm',
+            recipient='5511999999999',
+            content_type='text',
+            text='oi',
+        )
+        resposta_evolution = {'success': True, 'external_id': external_id}
+        with mock.patch.object(router, 'enviar_whatsapp_evo', return_value=resposta_evolution):
+            with self.captureOnCommitCallbacks(execute=True):
+                return router.enviar_mensagem_saida(mensagem, self.canal, {})
+
+    def test_eco_from_me_do_envio_nao_vira_outra_interacao(self):
+        resultado = self.enviar('ENVIO1')
+        self.assertIn('interacao_id', resultado)
+
+        with mock.patch.object(EvoTranslator, 'to_loomie') as to_loomie:
+            resposta = self.postar(payload_evolution('ENVIO1', from_me=True))
+
+        self.assertTrue(resposta.json().get('duplicada'))
+        to_loomie.assert_not_called()
+        self.assertEqual(Interacao.objects.filter(whatsapp_id='ENVIO1').count(), 1)
+
+    def test_eco_cai_no_banco_mesmo_sem_cache(self):
+        self.enviar('ENVIO1')
+        cache.clear()
+
+        self.assertTrue(self.postar(payload_evolution('ENVIO1', from_me=True)).json().get('duplicada'))
+        self.assertEqual(Interacao.objects.count(), 1)
+
+    def test_from_me_enviado_fora_do_crm_continua_registrado(self):
+        self.enviar('ENVIO1')
+
+        resposta = self.postar(payload_evolution('CELULAR1', texto='mandei pelo celular', from_me=True))
+
+        self.assertFalse(resposta.json().get('duplicada'))
+        self.assertEqual(Interacao.objects.count(), 2)
+
+
+class StatusEntregaWebhookTests(WebhookTestCase):
+    def test_messages_update_grava_status_de_entrega(self):
+        self.postar(payload_evolution('ABC', from_me=True))
+        Interacao.objects.update(status_entrega='enviada')
+
+        resposta = self.postar({
+            "event": "messages.update",
+            "instance": "inst1",
+            "data": [{"keyId": "ABC", "status": "DELIVERY_ACK"}, {"keyId": "OUTRA", "status": "READ"}],
+        })
+
+        self.assertEqual(resposta.json(), {'success': True, 'atualizadas': 1})
+        self.assertEqual(Interacao.objects.get().status_entrega, 'entregue')
+
+
+class SessaoFalsa:
+    """Responde 200, ou levanta erro para as URLs em `falhar`"""
+
+    def __init__(self, falhar=()):
+        self.falhar = set(falhar)
+        self.urls = []
+
+    def request(self, metodo, url, **kwargs):
+        self.urls.append(url)
+        if url in self.falhar:
+            raise requests.ConnectionError('conexão recusada')
+        return mock.Mock(raise_for_status=mock.Mock())
+
+
+@override_settings(WEBHOOK_CIRCUIT_FALHAS=2, WEBHOOK_CIRCUIT_COOLDOWN=60)
+class FanoutWebhooksTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.mensagem = LoomieMessage(channel_type='evo', sender='evo:5511999999999', text='oi')
+        self.ok = WebhookCustomizado.objects.create(nome='ok', url='http://ok.test', max_tentativas=3)
+        self.fora = WebhookCustomizado.objects.create(nome='fora', url='http://fora.test', max_tentativas=3)
+
+    def disparar(self, sessao):
+        with mock.patch.object(webhook_fanout, 'get_sessao', return_value=sessao), \
+                mock.patch.object(tasks.reenviar_webhook_customizado_task, 'apply_async') as apply_async:
+            enviados = router.processar_webhooks_customizados(self.mensagem, direcao='entrada')
+        return enviados, apply_async
+
+    def test_destino_fora_do_ar_nao_impede_os_outros(self):
+        enviados, apply_async = self.disparar(SessaoFalsa(falhar={'http://fora.test'}))
+
+        self.assertEqual(enviados, ['webhook:ok'])
+        self.ok.refresh_from_db()
+        self.fora.refresh_from_db()
+        self.assertEqual((self.ok.total_enviados, self.ok.total_erros), (1, 0))
+        self.assertEqual((self.fora.total_enviados, self.fora.total_erros), (0, 1))
+        # Retry vai para a fila com backoff, sem dormir na thread
+        apply_async.assert_called_once_with(args=[self.fora.pk, self.mensagem.to_dict(), 2], countdown=2)
+
+    def test_circuito_abre_depois_de_falhas_seguidas(self):
+        sessao = SessaoFalsa(falhar={'http://fora.test'})
+        self.disparar(sessao)
+        self.disparar(sessao)
+        sessao.urls.clear()
+
+        enviados, apply_async = self.disparar(sessao)
+
+        self.assertEqual(enviados, ['webhook:ok'])
+        self.assertNotIn('http://fora.test', sessao.urls)
+        apply_async.assert_called_once_with(args=[self.fora.pk, self.mensagem.to_dict(), 2], countdown=60)
+
+    def test_sucesso_zera_as_falhas_seguidas(self):
+        self.disparar(SessaoFalsa(falhar={'http://fora.test'}))
+        self.disparar(SessaoFalsa())
+        self.disparar(SessaoFalsa(falhar={'http://fora.test'}))
+
+        self.assertFalse(webhook_fanout.circuito_aberto(self.fora.pk))
+
+    def test_ultima_tentativa_nao_agenda_outra(self):
+        with mock.patch.object(webhook_fanout, 'get_sessao', return_value=SessaoFalsa(falhar={'http://fora.test'})), \
+                mock.patch.object(tasks.reenviar_webhook_customizado_task, 'apply_async') as apply_async:
+            resultado = tasks.reenviar_webhook_customizado_task(self.fora.pk, self.mensagem.to_dict(), 3)
+
+        self.assertFalse(resultado['success'])
+        apply_async.assert_not_called()
+
+
+class CacheRoteamentoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        routing_cache.invalidar()
+
+    def criar_canal(self, nome, prioridade, **kwargs):
+        return CanalConfig.objects.create(
+            nome=nome, tipo='evo', prioridade=prioridade, credenciais={'instance': 'inst1'}, **kwargs
+        )
+
+    def test_instancia_repetida_usa_o_canal_de_maior_prioridade(self):
+        self.criar_canal('b-secundario', 2)
+        principal = self.criar_canal('z-principal', 1)
+        routing_cache.invalidar()
+
+        with self.assertLogs('message_translator.routing_cache', 'WARNING'):
+            self.assertEqual(routing_cache.get_canal_evo('inst1'), principal)
+        self.assertEqual(routing_cache.get_canal_saida('evo'), principal)
+
+    def test_consulta_sem_mudanca_nao_vai_ao_banco(self):
+        canal = self.criar_canal('principal', 1)
+        routing_cache.invalidar()
+        routing_cache.get_canal(canal.pk)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(routing_cache.get_canal(canal.pk), canal)
+            self.assertEqual(routing_cache.get_canal(str(canal.pk)), canal)
+            self.assertEqual(routing_cache.get_canal_evo('inst1'), canal)
+
+    def test_versao_trocada_por_outro_processo_recarrega(self):
+        canal = self.criar_canal('principal', 1)
+        routing_cache.invalidar()
+        self.assertEqual(routing_cache.get_canal_evo('inst1'), canal)
+
+        # Outro processo alterou o canal: só a versão no cache compartilhado muda
+        CanalConfig.objects.filter(pk=canal.pk).update(credenciais={'instance': 'inst2'})
+        self.assertEqual(routing_cache.get_canal_evo('inst1'), canal)
+        cache.set(routing_cache.VERSAO_KEY, 'outra-versao', timeout=None)
+
+        self.assertIsNone(routing_cache.get_canal_evo('inst1'))
+        self.assertEqual(routing_cache.get_canal_evo('inst2'), canal)
+
+    def test_invalida_so_depois_do_commit(self):
+        canal = self.criar_canal('principal', 1)
+        routing_cache.invalidar()
+        self.assertEqual(routing_cache.get_canal_evo('inst1'), canal)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            canal.ativo = False
+            canal.save()
+            self.assertEqual(routing_cache.get_canal_evo('inst1'), canal)
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertIsNone(routing_cache.get_canal_evo('inst1'))
+
+    def test_sem_cache_compartilhado_le_do_banco(self):
+        canal = self.criar_canal('principal', 1)
+
+        with mock.patch.object(routing_cache.cache, 'get', side_effect=ConnectionError('redis fora')):
+            self.assertEqual(routing_cache.get_canal_evo('inst1'), canal)
+
+    def test_webhooks_por_canal_e_direcao(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            todos = WebhookCustomizado.objects.create(nome='a', url='http://a.test', filtro_canal='todos', filtro_direcao='ambas')
+            evo_entrada = WebhookCustomizado.objects.create(nome='b', url='http://b.test', filtro_canal='evo', filtro_direcao='entrada')
+            WebhookCustomizado.objects.create(nome='c', url='http://c.test', filtro_canal='telegram', filtro_direcao='ambas')
+
+        self.assertEqual(routing_cache.get_webhooks('evo', 'entrada'), [todos, evo_entrada])
+        self.assertEqual(routing_cache.get_webhooks('evo', 'saida'), [todos])
+
+
+def novo_log(message_id):
+    return MensagemLog(message_id=message_id, direcao='entrada', status='enviada', payload_original={})
+
+
+class LogWriterTests(TestCase):
+    def test_desligado_grava_na_hora(self):
+        log = novo_log('m1')
+        log_writer.registrar(log)
+
+        self.assertTrue(MensagemLog.objects.filter(message_id='m1').exists())
+
+    @override_settings(MESSAGE_LOG_WRITE_BEHIND=True)
+    def test_fila_cheia_grava_na_hora(self):
+        fila = mock.Mock(put_nowait=mock.Mock(side_effect=queue.Full))
+        with mock.patch.object(log_writer, '_recursos_do_processo', return_value={'fila': fila}):
+            log_writer.registrar(novo_log('m1'))
+
+        self.assertTrue(MensagemLog.objects.filter(message_id='m1').exists())
+
+    def test_lote_com_falha_grava_um_a_um(self):
+        ruim = novo_log('ruim')
+        lote = [novo_log('m1'), ruim, novo_log('m2')]
+
+        with mock.patch.object(log_writer, 'close_old_connections'), \
+                mock.patch.object(MensagemLog.objects, 'bulk_create', side_effect=Exception('lote recusado')), \
+                mock.patch.object(ruim, 'save', side_effect=Exception('registro inválido')):
+            log_writer._gravar(lote)
+
+        self.assertEqual(set(MensagemLog.objects.values_list('message_id', flat=True)), {'m1', 'm2'})
+
+
+@override_settings(MESSAGE_LOG_WRITE_BEHIND=True, MESSAGE_LOG_BATCH_SIZE=2, MESSAGE_LOG_FLUSH_MS=20)
+class LogWriterFlushTests(TestCase):
+    """A thread de gravação é simulada (_gravar): ela usaria outra conexão, fora da transação do teste"""
+
+    def test_flush_espera_a_fila_esvaziar(self):
+        gravados = []
+        with mock.patch.object(log_writer, '_gravar', side_effect=lambda lote: gravados.extend(lote)):
+            for i in range(5):
+                log_writer.registrar(novo_log(f'm{i}'))
+            log_writer.flush(timeout=5)
+
+        self.assertEqual([log.message_id for log in gravados], [f'm{i}' for i in range(5)])
+
+    def test_flush_com_gravacao_travada_respeita_o_timeout(self):
+        liberar = threading.Event()
+        with mock.patch.object(log_writer, '_gravar', side_effect=lambda lote: liberar.wait(5)):
+            log_writer.registrar(novo_log('m1'))
+
+            with self.assertLogs('message_translator.log_writer', 'ERROR'):
+                log_writer.flush(timeout=0.1)
+
+            liberar.set()
+            log_writer.flush(timeout=5)
+
+        self.assertEqual(log_writer._recursos['fila'].unfinished_tasks, 0)
+
+    def test_erro_na_gravacao_nao_derruba_a_thread(self):
+        gravados = []
+
+        def gravar(lote):
+            if lote[0].message_id == 'quebra':
+                raise RuntimeError('banco fora')
+            gravados.extend(lote)
+
+        with mock.patch.object(log_writer, '_gravar', side_effect=gravar):
+            log_writer.registrar(novo_log('quebra'))
+            log_writer.flush(timeout=5)
+            log_writer.registrar(novo_log('m1'))
+            log_writer.flush(timeout=5)
+
+        self.assertEqual([log.message_id for log in gravados], ['m1'])
+
+    def test_encerramento_do_worker_esvazia_a_fila(self):
+        with mock.patch.object(log_writer, 'flush') as flush:
+            worker_process_shutdown.send(sender=None, pid=1, exitcode=0)
+
+        flush.assert_called_once_with()
+
+
+IMAGEM = {
+    'url': 'https://mmg.whatsapp.net/o1/v/t62/imagem.enc',
+    'mediaKey': 'Y2hhdmU=',
+    'fileEncSha256': 'aGFzaA==',
+    'mimetype': 'image/jpeg',
+    'fileLength': '2048',
+    'caption': 'orçamento',
+    'jpegThumbnail': 'A' * 10000,
+}
+
+
+def payload_imagem(external_id, base64_inline=None):
+    payload = payload_evolution(external_id)
+    payload['data']['message'] = {'imageMessage': dict(IMAGEM)}
+    if base64_inline:
+        payload['data']['base64'] = base64_inline
+    return payload
+
+
+@override_settings(MESSAGE_TRANSLATOR_ASYNC=False, MEDIA_PROCESSING_ASYNC=True)
+class MidiaPendenteTests(WebhookTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        configuracao = override_settings(MEDIA_ROOT=media_root)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def receber(self, payload):
+        with mock.patch.object(tasks.processar_midia_pendente_task, 'delay') as delay, \
+                mock.patch.object(WhatsAppMediaProcessor, 'process_media') as process_media:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.postar(payload)
+        process_media.assert_not_called()
+        delay.assert_called_once()
+        return delay.call_args.args
+
+    def test_interacao_criada_na_hora_e_so_o_descritor_vai_pelo_broker(self):
+        interacao_id, descritor = self.receber(payload_imagem('IMG1'))
+
+        interacao = Interacao.objects.get(pk=interacao_id)
+        self.assertEqual(interacao.media_status, 'pendente')
+        self.assertIsNone(interacao.media_url)
+        self.assertEqual(descritor, {
+            'url': IMAGEM['url'],
+            'mediaKey': IMAGEM['mediaKey'],
+            'fileEncSha256': IMAGEM['fileEncSha256'],
+            'mimetype': 'image/jpeg',
+            'fileLength': '2048',
+            'tipo': 'imagem',
+        })
+
+    def test_base64_inline_fica_no_storage_e_e_apagado_pelo_worker(self):
+        interacao_id, descritor = self.receber(payload_imagem('IMG1', base64_inline='QUJD'))
+        nome = descritor['base64_storage']
+        self.assertTrue(default_storage.exists(nome))
+
+        resultado_midia = {'success': True, 'media_local_path': '/media/x.jpg', 'filename': 'x.jpg', 'size': 3}
+        with mock.patch.object(WhatsAppMediaProcessor, 'process_media', return_value=resultado_midia) as process_media:
+            tasks.processar_midia_pendente_task(interacao_id, descritor)
+
+        self.assertEqual(process_media.call_args.kwargs['base64_data'], 'QUJD')
+        self.assertNotIn('tipo', process_media.call_args.kwargs['message_data'])
+        self.assertFalse(default_storage.exists(nome))
+        interacao = Interacao.objects.get(pk=interacao_id)
+        self.assertEqual((interacao.media_status, interacao.media_url, interacao.media_size), ('processada', '/media/x.jpg', 3))
+
+    def test_falha_no_worker_marca_erro_e_apaga_o_pendente(self):
+        interacao_id, descritor = self.receber(payload_imagem('IMG1', base64_inline='QUJD'))
+
+        with mock.patch.object(WhatsAppMediaProcessor, 'process_media', side_effect=RuntimeError('ffmpeg')):
+            with self.assertRaises(RuntimeError):
+                tasks.processar_midia_pendente_task(interacao_id, descritor)
+        self.assertFalse(default_storage.exists(descritor['base64_storage']))
+
+        with mock.patch.object(WhatsAppMediaProcessor, 'process_media', return_value={'success': False, 'error': 'HTTP 410'}):
+            tasks.processar_midia_pendente_task(interacao_id, {'tipo': 'imagem', 'url': IMAGEM['url']})
+        self.assertEqual(Interacao.objects.get(pk=interacao_id).media_status, 'erro')
+
+    def test_tarefa_antiga_com_payload_bruto_continua_aceita(self):
+        interacao_id, _ = self.receber(payload_imagem('IMG1'))
+
+        resultado_midia = {'success': True, 'media_local_path': '/media/x.jpg', 'filename': 'x.jpg'}
+        with mock.patch.object(WhatsAppMediaProcessor, 'process_media', return_value=resultado_midia) as process_media:
+            tasks.processar_midia_pendente_task(interacao_id, payload_imagem('IMG1', base64_inline='QUJD'))
+
+        self.assertEqual(process_media.call_args.kwargs['tipo_mensagem'], 'imagem')
+        self.assertEqual(process_media.call_args.kwargs['base64_data'], 'QUJD')
+        self.assertEqual(process_media.call_args.kwargs['message_data']['url'], IMAGEM['url'])
+        self.assertEqual(Interacao.objects.get(pk=interacao_id).media_status, 'processada')
+
+    def test_pendente_sem_tarefa_e_limpo_depois_de_um_dia(self):
+        antigo = media_store.guardar_base64_pendente(1, 'QUJD')
+        recente = media_store.guardar_base64_pendente(2, 'QUJD')
+
+        ontem = timezone.now() - timedelta(days=1, minutes=1)
+        with mock.patch.object(default_storage, 'get_modified_time', side_effect=lambda nome: ontem if nome == antigo else timezone.now()):
+            tasks.limpar_midias_pendentes()
+
+        self.assertFalse(default_storage.exists(antigo))
+        self.assertTrue(default_storage.exists(recente))
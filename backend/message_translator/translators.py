@@ -3,8 +3,9 @@ Tradutores específicos para cada canal
 Convertem formato do canal ↔ formato Loomie
 """
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 from datetime import datetime
+from django.conf import settings
 from .schemas import LoomieMessage, LoomieMedia
 import logging
 
@@ -29,6 +30,13 @@ class BaseTranslator(ABC):
         Converte formato Loomie para payload do canal
         """
         pass
+    
+    def extrair_external_id(self, payload: Dict[str, Any]) -> str:
+        """
+        ID da mensagem no canal, lido direto do payload bruto (sem traduzir)
+        Chave da deduplicação antes de qualquer download de mídia; '' = sem deduplicação
+        """
+        return ''
 
 
 class WhatsAppTranslator(BaseTranslator):
@@ -45,13 +53,7 @@ class WhatsAppTranslator(BaseTranslator):
         2. Evolution API com wrapper: {"event": "...", "data": {"key": {...}}}
         """
         try:
-            # 🔧 SUPORTE DUPLO: Evolution pode enviar com ou sem wrapper "data"
-            if 'data' in payload and 'event' in payload:
-                # Formato: {"event": "messages.upsert", "data": {...}}
-                data = payload.get('data', {})
-            else:
-                # Formato direto: {"key": {...}, "message": {...}}
-                data = payload
+            data = self._extrair_data(payload)
             
             key = data.get('key', {})
             message_data = data.get('message', {})
@@ -113,7 +115,8 @@ class WhatsAppTranslator(BaseTranslator):
                 # Evolution envia base64 dentro da mensagem OU no data.base64
                 base64_img = data.get('base64', '') or img.get('base64', '')
                 
-                media_result = self._processar_midia_whatsapp(
+                media_result = self._processar_ou_adiar_midia(
+                    loomie_msg,
                     message_data=img,
                     tipo='imagem',
                     base64_data=base64_img
@@ -136,7 +139,8 @@ class WhatsAppTranslator(BaseTranslator):
                 # 🔥 PROCESSAR MÍDIA
                 base64_video = data.get('base64', '') or video.get('base64', '')
                 
-                media_result = self._processar_midia_whatsapp(
+                media_result = self._processar_ou_adiar_midia(
+                    loomie_msg,
                     message_data=video,
                     tipo='video',
                     base64_data=base64_video
@@ -164,7 +168,8 @@ class WhatsAppTranslator(BaseTranslator):
                 # 🔥 PROCESSAR MÍDIA
                 base64_audio = data.get('base64', '') or audio.get('base64', '')
                 
-                media_result = self._processar_midia_whatsapp(
+                media_result = self._processar_ou_adiar_midia(
+                    loomie_msg,
                     message_data=audio,
                     tipo='audio',
                     base64_data=base64_audio
@@ -189,7 +194,8 @@ class WhatsAppTranslator(BaseTranslator):
                 loomie_msg.content_type = 'media'
                 
                 # 🔥 PROCESSAR MÍDIA
-                media_result = self._processar_midia_whatsapp(
+                media_result = self._processar_ou_adiar_midia(
+                    loomie_msg,
                     message_data=doc,
                     tipo='documento',
                     base64_data=data.get('base64', '')
@@ -287,6 +293,79 @@ class WhatsAppTranslator(BaseTranslator):
             logger.error(f"Erro ao converter Loomie para WhatsApp: {e}")
             raise
     
+    # Campo da mensagem Evolution -> tipo da Interacao
+    CAMPOS_MIDIA = {
+        'imageMessage': 'imagem',
+        'videoMessage': 'video',
+        'audioMessage': 'audio',
+        'documentMessage': 'documento',
+    }
+    
+    # Campos de imageMessage/audioMessage/... lidos pelo WhatsAppMediaProcessor
+    CAMPOS_DESCRITOR_MIDIA = ('url', 'mediaKey', 'fileEncSha256', 'mimetype', 'fileLength', 'seconds')
+    
+    def extrair_external_id(self, payload: Dict[str, Any]) -> str:
+        return self._extrair_data(payload).get('key', {}).get('id', '')
+    
+    @staticmethod
+    def _extrair_data(payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        🔧 SUPORTE DUPLO: Evolution pode enviar com ou sem wrapper "data"
+        """
+        if 'data' in payload and 'event' in payload:
+            # Formato: {"event": "messages.upsert", "data": {...}}
+            return payload.get('data', {})
+        # Formato direto: {"key": {...}, "message": {...}}
+        return payload
+    
+    @classmethod
+    def localizar_midia(cls, payload: Dict[str, Any]) -> Optional[Tuple[str, Dict, str]]:
+        """
+        Encontra a mídia no payload original (usado pelo worker de mídia)
+        
+        Returns:
+            (tipo, message_data, base64) ou None se a mensagem não tem mídia
+        """
+        data = cls._extrair_data(payload)
+        message_data = data.get('message', {})
+        
+        for campo, tipo in cls.CAMPOS_MIDIA.items():
+            if campo in message_data:
+                midia = message_data[campo]
+                return tipo, midia, data.get('base64', '') or midia.get('base64', '')
+        
+        return None
+    
+    @classmethod
+    def descritor_midia(cls, payload: Dict[str, Any]) -> Optional[Tuple[Dict, str]]:
+        """
+        Só os campos que o worker de mídia usa (vão pelo broker, não o payload inteiro)
+        
+        Returns:
+            (descritor com 'tipo', base64 inline ou '') ou None se a mensagem não tem mídia
+        """
+        midia = cls.localizar_midia(payload)
+        if not midia:
+            return None
+        
+        tipo, message_data, base64_data = midia
+        descritor = {campo: message_data[campo] for campo in cls.CAMPOS_DESCRITOR_MIDIA if message_data.get(campo) is not None}
+        descritor['tipo'] = tipo
+        return descritor, base64_data
+    
+    def _processar_ou_adiar_midia(self, loomie_msg: LoomieMessage, message_data: Dict, tipo: str, base64_data: str = '') -> Dict:
+        """
+        Com MEDIA_PROCESSING_ASYNC a mídia não é processada aqui: a mensagem é
+        marcada como 'midia_pendente' e o CRM cria a Interação na hora, deixando
+        download/descriptografia/conversão para a fila 'media' do Celery
+        """
+        if settings.MEDIA_PROCESSING_ASYNC:
+            logger.info(f"⏳ {tipo} adiado para o worker de mídia")
+            loomie_msg.set_metadata('midia_pendente', True)
+            return {'url_local': None, 'filename': None, 'size': None}
+        
+        return self._processar_midia_whatsapp(message_data, tipo, base64_data)
+    
     def _processar_midia_whatsapp(self, message_data: Dict, tipo: str, base64_data: str = '') -> Dict:
         """
         🔥 PROCESSA MÍDIA DO WHATSAPP: Baixa + Descriptografa + Salva localmente
@@ -334,6 +413,9 @@ class N8nTranslator(BaseTranslator):
     Tradutor para n8n (webhook format)
     """
     
+    def extrair_external_id(self, payload: Dict[str, Any]) -> str:
+        return payload.get('id', '')
+    
     def to_loomie(self, payload: Dict[str, Any]) -> LoomieMessage:
         """
         Converte webhook n8n para Loomie
@@ -369,6 +451,9 @@ class TelegramTranslator(BaseTranslator):
     Tradutor para Telegram
     """
     
+    def extrair_external_id(self, payload: Dict[str, Any]) -> str:
+        return str(payload.get('message', {}).get('message_id', ''))
+    
     def to_loomie(self, payload: Dict[str, Any]) -> LoomieMessage:
         """
         Converte mensagem Telegram para Loomie
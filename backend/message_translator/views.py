@@ -5,15 +5,19 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import api_view, action, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
+from atendimento.envio import PRIORIDADE_AUTOMATICA, extrair_status_evolution, registrar_status_entrega
 import time
+import uuid
 import logging
 
 from .models import CanalConfig, MensagemLog, RegrasRoteamento, WebhookCustomizado
 from .schemas import LoomieMessage
 from .translators import get_translator
-from .router import processar_mensagem_entrada, enviar_mensagem_saida
+from . import routing_cache, log_writer
+from .router import processar_mensagem_entrada, reservar_entrada, enviar_mensagem_saida
 from .serializers import (
     CanalConfigSerializer,
     MensagemLogSerializer,
@@ -24,6 +28,34 @@ from .serializers import (
 logger = logging.getLogger(__name__)
 
 
+def _enfileirar_mensagem_entrada(canal_tipo, canal, payload):
+    """
+    📥 Modo fila: grava o MensagemLog como 'recebida' e enfileira o processamento
+
+    Nada de tradução, download de mídia ou escrita no CRM aqui - isso fica
+    com o worker Celery (processar_mensagem_entrada_task).
+    """
+    from .tasks import processar_mensagem_entrada_task
+
+    log = MensagemLog.objects.create(
+        message_id=f"loomie_{uuid.uuid4().hex}",
+        direcao='entrada',
+        status='recebida',
+        canal_origem=canal,
+        payload_original=payload
+    )
+
+    processar_mensagem_entrada_task.delay(log.pk, canal_tipo)
+
+    logger.info(f"📥 Mensagem {log.message_id} enfileirada para processamento")
+
+    return Response({
+        'success': True,
+        'message_id': log.message_id,
+        'status': log.status
+    }, status=status.HTTP_202_ACCEPTED)
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])  # 🔓 Webhook público (Evolution API precisa acessar)
 def webhook_entrada(request):
@@ -40,6 +72,8 @@ def webhook_entrada(request):
         "canal_id": 1,              // ID do CanalConfig (opcional)
         "payload": { ... }          // Payload original do canal
     }
+    
+    Com MESSAGE_TRANSLATOR_ASYNC=True responde 202 e processa no Celery
     """
     inicio = time.time()
     
@@ -54,26 +88,38 @@ def webhook_entrada(request):
                 'error': 'canal_tipo e payload são obrigatórios'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Buscar config do canal
+        # Buscar config do canal (cache de roteamento, sem query)
         canal = None
         if canal_id:
-            try:
-                canal = CanalConfig.objects.get(id=canal_id, ativo=True)
-            except CanalConfig.DoesNotExist:
+            canal = routing_cache.get_canal(canal_id)
+            if not canal:
                 return Response({
                     'success': False,
                     'error': f'Canal {canal_id} não encontrado ou inativo'
                 }, status=status.HTTP_404_NOT_FOUND)
         
-        # Traduzir para formato Loomie
+        # 📥 Modo fila: responder imediatamente e processar no worker
+        if settings.MESSAGE_TRANSLATOR_ASYNC:
+            get_translator(canal_tipo)  # Validar tipo de canal antes de enfileirar
+            return _enfileirar_mensagem_entrada(canal_tipo, canal, payload)
+        
+        # Traduzir para formato Loomie (reentrega descartada antes, pelo ID do payload bruto)
         translator = get_translator(canal_tipo)
-        loomie_message = translator.to_loomie(payload)
+        reserva = reservar_entrada(translator, canal_tipo, canal, payload)
+        if reserva.duplicada:
+            logger.info(f"⏭️ Mensagem duplicada ignorada: {reserva.canal_chave}:{reserva.external_id}")
+            return Response({'success': True, 'duplicada': True})
+        try:
+            loomie_message = translator.to_loomie(payload)
+        except Exception:
+            reserva.liberar()
+            raise
         
         if canal:
             loomie_message.channel_id = canal.id
         
-        # Criar log inicial
-        log = MensagemLog.objects.create(
+        # Log montado em memória: gravado uma única vez, já com o status final
+        log = MensagemLog(
             message_id=loomie_message.message_id,
             direcao='entrada',
             status='processando',
@@ -85,14 +131,14 @@ def webhook_entrada(request):
         )
         
         # Processar e rotear
-        resultado = processar_mensagem_entrada(loomie_message, canal)
+        resultado = processar_mensagem_entrada(loomie_message, canal, reserva)
         
         # Atualizar log
         tempo_total = time.time() - inicio
         log.status = 'enviada'
         log.processado_em = timezone.now()
         log.tempo_processamento = tempo_total
-        log.save()
+        log_writer.registrar(log)
         
         logger.info(f"✅ Mensagem {loomie_message.message_id} processada em {tempo_total:.2f}s")
         
@@ -109,7 +155,9 @@ def webhook_entrada(request):
         if 'log' in locals():
             log.status = 'erro'
             log.erro_mensagem = str(e)
-            log.save()
+            log.processado_em = timezone.now()
+            log.tempo_processamento = time.time() - inicio
+            log_writer.registrar(log)
         
         return Response({
             'success': False,
@@ -126,6 +174,8 @@ def webhook_evolution(request):
     POST /translator/evolution-webhook/
     
     Recebe payloads direto da Evolution e processa
+    
+    Com MESSAGE_TRANSLATOR_ASYNC=True responde 202 e processa no Celery
     """
     inicio = time.time()
     
@@ -144,33 +194,55 @@ def webhook_evolution(request):
         instance = request.data.get('instance')
         data = request.data.get('data')
         
+        # ✔️ Confirmações de entrega/leitura das mensagens enviadas
+        if event in ('messages.update', 'MESSAGES_UPDATE'):
+            atualizadas = sum(
+                registrar_status_entrega(whatsapp_id, status_entrega)
+                for whatsapp_id, status_entrega in extrair_status_evolution(data)
+            )
+            return Response({'success': True, 'atualizadas': atualizadas})
+        
         # Filtrar apenas mensagens recebidas E mensagens enviadas
         if event not in ['messages.upsert', 'SEND_MESSAGE']:
             logger.debug(f"⏭️ Evento ignorado: {event}")
             return Response({'success': True, 'message': 'Evento ignorado'})
         
-        # Buscar canal pelo nome da instância
-        try:
-            canal = CanalConfig.objects.get(
-                credenciais__instance=instance,
-                tipo='evo',
-                ativo=True
-            )
+        # Buscar canal pelo nome da instância (cache de roteamento, sem query)
+        canal = routing_cache.get_canal_evo(instance)
+        if canal:
             logger.info(f"✅ Canal encontrado: {canal.nome} (ID: {canal.pk})")
-        except CanalConfig.DoesNotExist:
+        else:
             logger.error(f"❌ Instância {instance} não encontrada no banco")
             return Response({
                 'success': False,
                 'error': f'Instância {instance} não configurada'
             }, status=status.HTTP_404_NOT_FOUND)
         
-        # Traduzir para formato Loomie
+        if not data:
+            return Response({
+                'success': False,
+                'error': 'data é obrigatório'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # 📥 Modo fila: responder imediatamente e processar no worker
+        if settings.MESSAGE_TRANSLATOR_ASYNC:
+            return _enfileirar_mensagem_entrada('evo', canal, data)
+        
+        # Traduzir para formato Loomie (reentrega descartada antes, pelo ID do payload bruto)
         translator = get_translator('evo')
-        loomie_message = translator.to_loomie(data)
+        reserva = reservar_entrada(translator, 'evo', canal, data)
+        if reserva.duplicada:
+            logger.info(f"⏭️ Mensagem duplicada ignorada: {reserva.canal_chave}:{reserva.external_id}")
+            return Response({'success': True, 'duplicada': True})
+        try:
+            loomie_message = translator.to_loomie(data)
+        except Exception:
+            reserva.liberar()
+            raise
         loomie_message.channel_id = canal.pk
         
-        # Criar log inicial
-        log = MensagemLog.objects.create(
+        # Log montado em memória: gravado uma única vez, já com o status final
+        log = MensagemLog(
             message_id=loomie_message.message_id,
             direcao='entrada',
             status='processando',
@@ -182,14 +254,14 @@ def webhook_evolution(request):
         )
         
         # Processar e rotear
-        resultado = processar_mensagem_entrada(loomie_message, canal)
+        resultado = processar_mensagem_entrada(loomie_message, canal, reserva)
         
         # Atualizar log
         tempo_total = time.time() - inicio
         log.status = 'enviada'
         log.processado_em = timezone.now()
         log.tempo_processamento = tempo_total
-        log.save()
+        log_writer.registrar(log)
         
         logger.info(f"✅ Mensagem {loomie_message.message_id} processada em {tempo_total:.2f}s")
         
@@ -205,7 +277,9 @@ def webhook_evolution(request):
         if 'log' in locals():
             log.status = 'erro'
             log.erro_mensagem = str(e)
-            log.save()
+            log.processado_em = timezone.now()
+            log.tempo_processamento = time.time() - inicio
+            log_writer.registrar(log)
         
         return Response({
             'success': False,
@@ -260,27 +334,12 @@ def webhook_saida(request):
         # Buscar canal configurado
         canal_tipo = loomie_message.channel_type
         
-        # 🔧 Evolution API (não oficial)
-        if canal_tipo in ['evo', 'evolution']:
-            canal = CanalConfig.objects.filter(
-                tipo='evo',
-                ativo=True,
-                envia_saida=True
-            ).first()
-        # 🔧 WhatsApp Business API (oficial) - FUTURO
-        elif canal_tipo == 'whatsapp':
-            canal = CanalConfig.objects.filter(
-                tipo='whatsapp',
-                ativo=True,
-                envia_saida=True
-            ).first()
-        # Outros canais
-        else:
-            canal = CanalConfig.objects.filter(
-                tipo=canal_tipo,
-                ativo=True,
-                envia_saida=True
-            ).first()
+        # 🔧 Evolution API (não oficial) usa o tipo 'evo'
+        if canal_tipo == 'evolution':
+            canal_tipo = 'evo'
+        
+        # Cache de roteamento (sem query)
+        canal = routing_cache.get_canal_saida(canal_tipo)
         
         if not canal:
             return Response({
@@ -292,8 +351,8 @@ def webhook_saida(request):
         translator = get_translator(loomie_message.channel_type)
         payload_canal = translator.from_loomie(loomie_message)
         
-        # Criar log
-        log = MensagemLog.objects.create(
+        # Log montado em memória: gravado uma única vez, já com o status final
+        log = MensagemLog(
             message_id=loomie_message.message_id,
             direcao='saida',
             status='processando',
@@ -304,8 +363,8 @@ def webhook_saida(request):
             destinatario=loomie_message.recipient
         )
         
-        # Enviar
-        resultado = enviar_mensagem_saida(loomie_message, canal, payload_canal)
+        # Enviar (N8N/automações: atrás das respostas do operador no limite da instância)
+        resultado = enviar_mensagem_saida(loomie_message, canal, payload_canal, PRIORIDADE_AUTOMATICA)
         
         # ✨ PROCESSAR WEBHOOKS CUSTOMIZADOS DE SAÍDA
         if resultado.get('success'):
@@ -326,7 +385,7 @@ def webhook_saida(request):
         log.tempo_processamento = tempo_total
         if not resultado.get('success'):
             log.erro_mensagem = resultado.get('error', '')
-        log.save()
+        log_writer.registrar(log)
         
         return Response({
             'success': resultado.get('success'),
@@ -341,7 +400,9 @@ def webhook_saida(request):
         if 'log' in locals():
             log.status = 'erro'
             log.erro_mensagem = str(e)
-            log.save()
+            log.processado_em = timezone.now()
+            log.tempo_processamento = time.time() - inicio
+            log_writer.registrar(log)
         
         return Response({
             'success': False,
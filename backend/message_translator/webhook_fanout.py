@@ -0,0 +1,141 @@
+"""
+Motor de fan-out dos Webhooks Customizados
+Envio paralelo com pool de conexões keep-alive e circuit breaker por destino
+"""
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_recursos = {'pid': None, 'sessao': None, 'executor': None}
+
+
+def _recursos_do_processo() -> Dict:
+    """
+    Sessão HTTP e pool de threads são criados por processo
+    (workers Celery/gunicorn fazem fork depois do import do módulo)
+    """
+    pid = os.getpid()
+    if _recursos['pid'] != pid:
+        with _lock:
+            if _recursos['pid'] != pid:
+                sessao = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=settings.WEBHOOK_FANOUT_WORKERS,
+                    pool_maxsize=settings.WEBHOOK_FANOUT_WORKERS,
+                )
+                sessao.mount('http://', adapter)
+                sessao.mount('https://', adapter)
+
+                _recursos['sessao'] = sessao
+                _recursos['executor'] = ThreadPoolExecutor(
+                    max_workers=settings.WEBHOOK_FANOUT_WORKERS,
+                    thread_name_prefix='webhook-fanout'
+                )
+                _recursos['pid'] = pid
+    return _recursos
+
+
+def get_sessao() -> requests.Session:
+    """Sessão HTTP compartilhada (conexões keep-alive reaproveitadas)"""
+    return _recursos_do_processo()['sessao']
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Pool de threads usado para disparar os webhooks em paralelo"""
+    return _recursos_do_processo()['executor']
+
+
+def requisitar_webhook(webhook, loomie_data: Dict) -> Tuple[bool, str]:
+    """
+    Executa apenas a requisição HTTP (seguro para rodar fora da thread principal,
+    não toca no banco)
+
+    Returns:
+        Tuple[sucesso: bool, erro: str]
+    """
+    headers = {'Content-Type': 'application/json'}
+    if webhook.headers:
+        headers.update(webhook.headers)
+
+    try:
+        response = get_sessao().request(
+            webhook.metodo_http or 'POST',
+            webhook.url,
+            json=loomie_data,
+            headers=headers,
+            timeout=webhook.timeout
+        )
+        response.raise_for_status()
+        return True, ''
+
+    except requests.Timeout as e:
+        return False, f"Timeout após {webhook.timeout}s: {str(e)}"
+
+    except requests.RequestException as e:
+        error_msg = f"Erro HTTP: {str(e)}"
+        if getattr(e, 'response', None) is not None:
+            error_msg += f" - Status: {e.response.status_code} - Body: {e.response.text[:200]}"
+        return False, error_msg
+
+    except Exception as e:
+        return False, f"Erro: {str(e)}"
+
+
+# =========================
+# CIRCUIT BREAKER
+# =========================
+
+def _chave_falhas(webhook_id) -> str:
+    return f"mt:webhook:{webhook_id}:falhas"
+
+
+def _chave_aberto(webhook_id) -> str:
+    return f"mt:webhook:{webhook_id}:circuito_aberto"
+
+
+def circuito_aberto(webhook_id) -> bool:
+    """True se o destino está em cool-down e deve ser pulado"""
+    try:
+        return bool(cache.get(_chave_aberto(webhook_id)))
+    except Exception:
+        return False
+
+
+def registrar_sucesso(webhook_id):
+    """Zera o contador de falhas consecutivas"""
+    try:
+        cache.delete(_chave_falhas(webhook_id))
+    except Exception:
+        pass
+
+
+def registrar_falha(webhook_id) -> bool:
+    """
+    Conta uma falha consecutiva e abre o circuito ao atingir o limite
+
+    Returns:
+        bool: True se o circuito foi aberto agora
+    """
+    try:
+        chave = _chave_falhas(webhook_id)
+        cache.add(chave, 0, timeout=settings.WEBHOOK_CIRCUIT_COOLDOWN * 10)
+        falhas = cache.incr(chave)
+
+        if falhas >= settings.WEBHOOK_CIRCUIT_FALHAS:
+            cache.set(_chave_aberto(webhook_id), 1, timeout=settings.WEBHOOK_CIRCUIT_COOLDOWN)
+            cache.delete(chave)
+            return True
+    except Exception as e:
+        logger.warning(f"⚠️ [Circuit Breaker] Cache indisponível: {e}")
+
+    return False
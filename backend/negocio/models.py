@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
 from django.db import models
 from decimal import Decimal
+from core.rastreamento import CamposRastreadosMixin
 
 class Comentario(models.Model):
     criado_por = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -13,7 +14,7 @@ class Comentario(models.Model):
     class Meta:
         ordering = ['-criado_em']
 
-class Negocio(models.Model):
+class Negocio(CamposRastreadosMixin, models.Model):
     ORIGEM_CHOICES = [
         ('inbound', 'Inbound'),
         ('outbound', 'Outbound'),
@@ -37,6 +38,9 @@ class Negocio(models.Model):
 
     atributos_personalizados = models.ManyToManyField('atributo.AtributoPersonalizavel', related_name='negocios', blank=True)
 
+    # Troca de estágio e de valor detectadas nos signals (gatilhos, contadores do dashboard) sem reler o negócio
+    CAMPOS_RASTREADOS = ('estagio', 'valor')
+
     def __str__(self):
         return f"{self.titulo} - {self.contato.nome}"
 
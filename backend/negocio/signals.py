@@ -1,50 +1,54 @@
 from django.db.models.signals import pre_save, post_save
 from django.dispatch import receiver
 from negocio.models import Negocio
-from gatilho.models import Gatilho
+from core.rastreamento import NAO_CARREGADO
+from gatilho import indice
 from gatilho.utils import executar_acao_gatilho
 from django.db.models.signals import pre_delete, m2m_changed
 from atributo.models import PresetAtributos, AtributoPersonalizavel
 
 @receiver(pre_save, sender=Negocio)
-def detectar_troca_estagio(sender, instance, **kwargs):
+def detectar_troca_estagio(sender, instance, update_fields=None, **kwargs):
+    instance._estagio_trocado = None
     if not instance.pk:
         return
-
-    try:
-        antigo = Negocio.objects.get(pk=instance.pk)
-    except Negocio.DoesNotExist:
+    # save(update_fields=[...]) sem o estágio (ex.: comentário atualizando atualizado_em)
+    if update_fields is not None and 'estagio' not in update_fields and 'estagio_id' not in update_fields:
         return
 
-    if antigo.estagio != instance.estagio:
-        instance._estagio_trocado = (antigo.estagio, instance.estagio)
+    antigo_estagio_id = instance.valor_anterior('estagio')
+    if antigo_estagio_id is NAO_CARREGADO:
+        # Só instância montada à mão ou com o estágio adiado: aí lê do banco
+        antigo_estagio_id = Negocio.objects.filter(pk=instance.pk).values_list('estagio_id', flat=True).first()
+        if antigo_estagio_id is None:
+            return
+
+    if antigo_estagio_id != instance.estagio_id:
+        instance._estagio_trocado = (antigo_estagio_id, instance.estagio_id)
 
 @receiver(post_save, sender=Negocio)
 def acionar_gatilhos_negocio(sender, instance, created, **kwargs):
-    gatilhos = Gatilho.objects.filter(ativo=True)
+    """Gatilhos do tenant pelo índice em memória (gatilho.indice); save sem criação nem troca de estágio sai direto"""
+    trocado = getattr(instance, '_estagio_trocado', None)
+    instance._estagio_trocado = None
+    if not created and not trocado:
+        return
 
-    for g in gatilhos:
+    if created:
+        gatilhos = (
+            indice.gatilhos_para(instance.estagio_id, 'negocio_criado') +
+            indice.gatilhos_para(instance.estagio_id, 'negocio_criado_em_x_estagio', instance.estagio_id)
+        )
+    else:
+        origem, destino = trocado
+        gatilhos = (
+            indice.gatilhos_para(destino, 'negocio_estagio_trocado') +
+            indice.gatilhos_para(destino, 'negocio_estagio_trocado_de_x_para_y', origem, destino)
+        )
+
+    for g in sorted(gatilhos, key=lambda g: g.pk):
         try:
-
-            if g.evento == 'negocio_criado' and created:
-                executar_acao_gatilho(g, instance)
-
-            elif g.evento == 'negocio_criado_em_x_estagio' and created:
-                if g.estagio_origem and instance.estagio == g.estagio_origem:
-                    executar_acao_gatilho(g, instance)
-
-            elif g.evento == 'negocio_estagio_trocado' and hasattr(instance, "_estagio_trocado"):
-                origem, destino = instance._estagio_trocado
-                executar_acao_gatilho(g, instance)
-
-            elif g.evento == 'negocio_estagio_trocado_de_x_para_y' and hasattr(instance, "_estagio_trocado"):
-                origem, destino = instance._estagio_trocado
-                if (
-                    g.estagio_origem and g.estagio_destino and
-                    origem == g.estagio_origem and destino == g.estagio_destino
-                ):
-                    executar_acao_gatilho(g, instance)
-
+            executar_acao_gatilho(g, instance)
         except Exception as e:
             print(f"❌ Erro ao executar gatilho '{g.nome}' para negócio {instance.pk}: {e}")
 
@@ -1,3 +1,123 @@
+import pickle
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from contato.models import Contato
+from core.rastreamento import NAO_CARREGADO
+from gatilho import indice
+from gatilho.models import Gatilho
+from kanban.models import Estagio, Kanban
+from .models import Negocio
+
+
+class NegocioBaseTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dono = User.objects.create_user('dono', password='x')
+        kanban = Kanban.objects.create(nome='Vendas', criado_por=self.dono)
+        self.lead = Estagio.objects.create(nome='Lead', kanban=kanban)
+        self.ganho = Estagio.objects.create(nome='Ganho', kanban=kanban)
+        contato = Contato.objects.create(nome='Fulano', criado_por=self.dono)
+        self.negocio = Negocio.objects.create(titulo='n', contato=contato, estagio=self.lead, valor=Decimal('10'))
+
+
+class CamposRastreadosTests(NegocioBaseTestCase):
+    def test_retrato_do_banco(self):
+        negocio = Negocio.objects.get(pk=self.negocio.pk)
+
+        self.assertEqual(negocio.valor_anterior('estagio'), self.lead.pk)
+        self.assertEqual(negocio.campos_alterados(), set())
+
+        negocio.estagio = self.ganho
+        negocio.valor = Decimal('10.00')
+        self.assertEqual(negocio.campos_alterados(), {'estagio'})
+        self.assertEqual(negocio.valor_anterior('estagio'), self.lead.pk)
+
+    def test_save_atualiza_o_retrato(self):
+        negocio = Negocio.objects.get(pk=self.negocio.pk)
+        negocio.estagio = self.ganho
+        negocio.save()
+
+        self.assertEqual(negocio.valor_anterior('estagio'), self.ganho.pk)
+        self.assertEqual(negocio.campos_alterados(), set())
+
+    def test_update_fields_limita_o_que_mudou(self):
+        negocio = Negocio.objects.get(pk=self.negocio.pk)
+        negocio.estagio = self.ganho
+        negocio.valor = Decimal('30')
+
+        self.assertEqual(negocio.campos_alterados(['valor']), {'valor'})
+
+        negocio.save(update_fields=['valor'])
+        # O estágio não foi gravado: continua pendente
+        self.assertEqual(negocio.campos_alterados(), {'estagio'})
+
+    def test_campo_adiado_fica_nao_carregado(self):
+        negocio = Negocio.objects.only('titulo').get(pk=self.negocio.pk)
+
+        self.assertIs(negocio.valor_anterior('estagio'), NAO_CARREGADO)
+        self.assertIsNone(negocio.valor_anterior('estagio', None))
+
+        negocio.estagio = self.ganho
+        self.assertEqual(negocio.campos_alterados(), set())
+
+    def test_refresh_from_db_retrata_os_campos_relidos(self):
+        negocio = Negocio.objects.only('titulo').get(pk=self.negocio.pk)
+
+        negocio.refresh_from_db(fields=['estagio'])
+
+        self.assertEqual(negocio.valor_anterior('estagio'), self.lead.pk)
+        self.assertIs(negocio.valor_anterior('valor'), NAO_CARREGADO)
+
+    def test_instancia_montada_a_mao(self):
+        negocio = Negocio(pk=self.negocio.pk, estagio=self.ganho)
+
+        self.assertIs(negocio.valor_anterior('estagio'), NAO_CARREGADO)
+        self.assertEqual(negocio.campos_alterados(), set())
+
+    def test_retrato_sobrevive_a_pickle(self):
+        negocio = pickle.loads(pickle.dumps(Negocio.objects.only('titulo').get(pk=self.negocio.pk)))
+
+        self.assertIs(negocio.valor_anterior('estagio'), NAO_CARREGADO)
+
+
+class TrocaEstagioTests(NegocioBaseTestCase):
+    def test_troca_de_estagio_e_um_unico_update(self):
+        negocio = Negocio.objects.get(pk=self.negocio.pk)
+        indice.gatilhos_para(self.ganho.pk, 'negocio_estagio_trocado')
+
+        negocio.estagio = self.ganho
+        with self.assertNumQueries(1):
+            negocio.save()
+
+        self.assertEqual(negocio._estagio_trocado, None)
+
+    def test_gatilho_de_x_para_y_dispara_uma_vez(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            gatilho = Gatilho.objects.create(
+                nome='Ganhou', evento='negocio_estagio_trocado_de_x_para_y', acao='criar_tarefa',
+                estagio_origem=self.lead, estagio_destino=self.ganho, criado_por=self.dono,
+            )
+        negocio = Negocio.objects.get(pk=self.negocio.pk)
+
+        with mock.patch('negocio.signals.executar_acao_gatilho') as executar:
+            negocio.estagio = self.ganho
+            negocio.save()
+            negocio.titulo = 'outro título'
+            negocio.save()
+
+        executar.assert_called_once_with(gatilho, negocio)
+
+    def test_estagio_nao_carregado_le_do_banco(self):
+        negocio = Negocio.objects.only('titulo').get(pk=self.negocio.pk)
+
+        with mock.patch('negocio.signals.executar_acao_gatilho'), \
+                mock.patch.object(indice, 'gatilhos_para', return_value=[]) as gatilhos_para:
+            negocio.estagio = self.ganho
+            negocio.save(update_fields=['estagio'])
+
+        gatilhos_para.assert_any_call(self.ganho.pk, 'negocio_estagio_trocado_de_x_para_y', self.lead.pk, self.ganho.pk)
@@ -4,9 +4,10 @@ from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from django.db.models import Count, Sum, Q
 from django.shortcuts import get_object_or_404
 from contato.models import Contato
+from core import contadores
+from core.utils import get_ids_visiveis
 from .models import Negocio
 from .serializers import NegocioSerializer, ComentarioSerializer
 from rest_framework.exceptions import NotFound
@@ -82,15 +83,16 @@ class FunilStatsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        leads_por_estagio = {}
-        for item in Negocio.objects.values('estagio__nome').annotate(count=Count('id')):
-            leads_por_estagio[item['estagio__nome']] = item['count']
+        return Response(contadores.em_cache('funil', request.user.id, lambda: self._calcular(request.user)))
 
-        stats = {
-            'leads_por_estagio': leads_por_estagio,
-            'valor_total': Negocio.objects.aggregate(total=Sum('valor'))['total'] or 0,
+    def _calcular(self, user):
+        """Funil a partir dos contadores diários (core.contadores)"""
+        valores = contadores.obter(get_ids_visiveis(user))
+
+        return {
+            'leads_por_estagio': contadores.por_prefixo(valores, contadores.NEGOCIOS_ESTAGIO),
+            'valor_total': valores[contadores.NEGOCIOS_VALOR],
         }
-        return Response(stats)
 
 class ComentarioCreateView(generics.CreateAPIView):
     serializer_class = ComentarioSerializer
@@ -118,9 +120,7 @@ def buscar_negocio_por_telefone(request):
         return Response([], status=status.HTTP_200_OK)
 
     try:
-        contato = Contato.objects.filter(
-            Q(telefone=telefone) | Q(whatsapp_id=telefone)
-        ).first()
+        contato = Contato.por_telefone(telefone).order_by('pk').first()
 
         if not contato:
             return Response([], status=status.HTTP_200_OK)
@@ -4,7 +4,7 @@ from rest_framework.response import Response
 from oauth2_provider.contrib.rest_framework import OAuth2Authentication
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.conf import settings
 from contato.models import Contato, Operador
 from atendimento.models import Conversa, Interacao
@@ -453,9 +453,23 @@ def conversation_status_endpoint(request, conversation_id):
                 'received': new_status
             }, status=400)
         
+        # Uma conversa em aberto por contato (conversa_ativa_unica_contato)
+        if conversa.bloqueia_reabertura(new_status):
+            return Response({
+                'success': False,
+                'error': 'O contato já tem outra conversa em aberto'
+            }, status=400)
+        
         old_status = conversa.status
         conversa.status = new_status
-        conversa.save()
+        try:
+            with transaction.atomic():
+                conversa.save()
+        except IntegrityError:
+            return Response({
+                'success': False,
+                'error': 'O contato já tem outra conversa em aberto'
+            }, status=400)
         
         response_data = {
             'success': True,
@@ -2,6 +2,8 @@ from celery import shared_task
 from django.core.mail import send_mail
 from django.conf import settings
 from atendimento.views import enviar_mensagem_whatsapp
+from atendimento.envio import PRIORIDADE_AUTOMATICA
+import random
 import requests
 from django.utils import timezone
 
@@ -58,20 +60,35 @@ def enviar_email_task(destinatario, assunto, mensagem, link_webhook_n8n="", prec
     return {"success": success}
 
 
-@shared_task
-def enviar_whatsapp_task(destinatario, mensagem, link_webhook_n8n="", precisar_enviar=True, codigo=None):
+@shared_task(bind=True, max_retries=None)
+def enviar_whatsapp_task(self, destinatario, mensagem, link_webhook_n8n="", precisar_enviar=True, codigo=None):
+    """
+    Envio automático (gatilhos): prioridade abaixo do operador no limite da instância.
+    Sem token, a tarefa se reagenda em vez de segurar o worker da fila 'envio'.
+    """
     success = False
 
     if precisar_enviar:
         try:
             result = enviar_mensagem_whatsapp(
                 numero=destinatario,
-                mensagem=mensagem
+                mensagem=mensagem,
+                prioridade=PRIORIDADE_AUTOMATICA,
+                bloquear=False
             )
-            print(f"📱 WhatsApp enviado para {destinatario}: {mensagem}")
-            success = True
         except Exception as e:
-            print(f"❌ Erro ao enviar WhatsApp para {destinatario}: {e}")
+            result = {"success": False, "error": str(e)}
+
+        if result.get("adiado") is not None:
+            # Espalha as tarefas adiadas pela janela do balde (evita todas voltarem juntas)
+            janela = settings.ENVIO_RAJADA / settings.ENVIO_TAXA_POR_SEGUNDO
+            raise self.retry(countdown=result["adiado"] + random.uniform(0, janela))
+
+        success = result.get("success", False)
+        if success:
+            print(f"📱 WhatsApp enviado para {destinatario}: {mensagem}")
+        else:
+            print(f"❌ Erro ao enviar WhatsApp para {destinatario}: {result.get('error')}")
     else:
         print(f"⚠️ WhatsApp NÃO enviado (precisar_enviar=False) para {destinatario}")
 
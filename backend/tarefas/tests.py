@@ -1,3 +1,36 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from celery.exceptions import Retry
+from django.test import TestCase, override_settings
+
+from atendimento.envio import PRIORIDADE_AUTOMATICA
+from . import tasks
+
+
+@override_settings(ENVIO_TAXA_POR_SEGUNDO=2, ENVIO_RAJADA=4)
+class EnviarWhatsappTaskTests(TestCase):
+    def test_envia_com_prioridade_automatica_sem_bloquear(self):
+        with mock.patch.object(tasks, 'enviar_mensagem_whatsapp', return_value={'success': True}) as enviar:
+            resultado = tasks.enviar_whatsapp_task('5511999999999', 'oi')
+
+        self.assertEqual(resultado, {'success': True})
+        enviar.assert_called_once_with(
+            numero='5511999999999', mensagem='oi', prioridade=PRIORIDADE_AUTOMATICA, bloquear=False
+        )
+
+    def test_sem_token_reagenda_dentro_da_janela_do_balde(self):
+        with mock.patch.object(tasks, 'enviar_mensagem_whatsapp', return_value={'success': False, 'adiado': 0.5}), \
+                mock.patch.object(tasks.enviar_whatsapp_task, 'retry', side_effect=Retry()) as retry:
+            with self.assertRaises(Retry):
+                tasks.enviar_whatsapp_task('5511999999999', 'oi')
+
+        countdown = retry.call_args.kwargs['countdown']
+        self.assertTrue(0.5 <= countdown <= 0.5 + 2)
+
+    def test_falha_do_envio_nao_reagenda(self):
+        with mock.patch.object(tasks, 'enviar_mensagem_whatsapp', return_value={'success': False, 'error': 'HTTP 500'}), \
+                mock.patch.object(tasks.enviar_whatsapp_task, 'retry') as retry:
+            resultado = tasks.enviar_whatsapp_task('5511999999999', 'oi')
+
+        self.assertEqual(resultado, {'success': False})
+        retry.assert_not_called()
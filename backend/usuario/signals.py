@@ -1,10 +1,11 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from usuario.models import User
 from plano.models import Plano
 from usuario.models import PlanoUsuario, PerfilUsuario
 from django.utils import timezone
 from datetime import timedelta
+from core.utils import invalidar_visibilidade
 
 @receiver(post_save, sender=User)
 def criar_plano_free_para_usuario_criar_perfil_usuario(sender, instance, created, **kwargs):
@@ -35,3 +36,17 @@ def criar_plano_free_para_usuario_criar_perfil_usuario(sender, instance, created
                 vence_em=timezone.now() + timedelta(days=7),
             )
 
+
+
+@receiver(post_save, sender=PerfilUsuario)
+def invalidar_visibilidade_perfil(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'criado_por' not in update_fields and not created:
+        return
+    invalidar_visibilidade()
+
+
+@receiver(post_delete, sender=PerfilUsuario)
+@receiver(post_delete, sender=User)
+def invalidar_visibilidade_remocao(sender, instance, **kwargs):
+    # Remover o chefe zera criado_por dos perfis via UPDATE (SET_NULL), sem post_save
+    invalidar_visibilidade()
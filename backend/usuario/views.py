@@ -4,7 +4,7 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from contato.models import Contato
-from core.utils import get_ids_visiveis
+from core.utils import usuarios_visiveis
 from kanban.models import Kanban
 from usuario.models import PlanoUsuario, PerfilUsuario
 
@@ -117,13 +117,13 @@ def uso_plano(request):
 
         plano = plano_user.plano
 
-        usuarios_inclusos = User.objects.filter(perfil_usuario__criado_por__id__in=get_ids_visiveis(request.user)).count()
+        usuarios_inclusos = User.objects.filter(perfil_usuario__criado_por__in=usuarios_visiveis(request.user)).count()
         limite_usuarios = plano.usuarios_inclusos
 
-        pipelines_inclusos = Kanban.objects.filter(criado_por__id__in=get_ids_visiveis(request.user)).count()
+        pipelines_inclusos = Kanban.objects.filter(criado_por__in=usuarios_visiveis(request.user)).count()
         limite_pipelines = plano.pipelines_inclusos
 
-        contatos_inclusos = Contato.objects.filter(criado_por__id__in=get_ids_visiveis(request.user)).count()
+        contatos_inclusos = Contato.objects.filter(criado_por__in=usuarios_visiveis(request.user)).count()
         limite_contatos = plano.contatos_inclusos
 
         return Response({